@@ -0,0 +1,308 @@
+﻿import asyncio
+
+import grpc
+
+from protos import mapb_pb2 as mapb
+from protos import mapb_pb2_grpc as mapb_grpc
+from protos import stpb_pb2 as stpb
+from protos import stpb_pb2_grpc as stpb_grpc
+from params import params
+from client.main import CHANGE_OPS, KVError, Topology, Unavailable, check, file_chunks
+from client.cache import NearCache
+from client.retry import BUSY_ERRORS, Deadline, RetryPolicy
+from common.pool import AsyncChannelPool
+
+
+class AsyncWatch:
+    """AsyncClient.watch 返回的异步迭代器, 语义同 Watch"""
+
+    def __init__(self, client: "AsyncClient", key: str, prefix: bool, cursor: str):
+        self.client = client
+        self.key = key
+        self.prefix = prefix
+        self.cursor = cursor
+        self._cancelled = False
+        self._call = None
+
+    async def __aiter__(self):
+        client = self.client
+        attempt = 0
+        error = ""
+        while not self._cancelled and not client._closed:
+            target = ""
+            try:
+                target = await client._current()
+                stub = stpb_grpc.storagementServiceStub(client.pool.get(target))
+                self._call = stub.watch(stpb.StWatchRequest(key=self.key, prefix=self.prefix, cursor=self.cursor,
+                                                            cli_id=client.cli_id))
+                try:
+                    async for event in self._call:
+                        self.cursor = event.cursor
+                        attempt = 0
+                        if event.op in CHANGE_OPS or event.reset:
+                            yield event
+                finally:
+                    self._call.cancel()
+            except grpc.RpcError as e:
+                if self._cancelled:
+                    return
+                error = e.details() or e.code().name
+                if not client.retry.retryable(e):
+                    raise Unavailable(error) from e
+                if e.code() == grpc.StatusCode.UNAVAILABLE and target:
+                    client.topology.drop(target)
+                    if client.target == target:
+                        client.target = ""
+            if attempt >= client.retry.attempts:
+                raise Unavailable(f"多次重试后仍失败: {error}")
+            await asyncio.sleep(client.retry.backoff(attempt))
+            attempt += 1
+
+    def cancel(self):
+        self._cancelled = True
+        if self._call is not None:
+            self._call.cancel()
+
+
+class AsyncClient:
+    """Client 的 asyncio 版本, 接口相同, 只能在创建它的事件循环中使用"""
+
+    def __init__(self, manager: str = params.MANAGER_IP + params.MANAGER_PORT, target: str = "",
+                 retry: RetryPolicy | None = None, topology_ttl: float = 30.0,
+                 compression: grpc.Compression | None = None, near_cache: int = 0, watch_topology: bool = False):
+        self.manager = manager
+        self.target = target
+        self.retry = retry or RetryPolicy()
+        self.topology = Topology(topology_ttl)
+        self.pool = AsyncChannelPool(compression)
+        self.cli_id = 0
+        self.cache = NearCache(near_cache) if near_cache > 0 else None
+        self._watcher: asyncio.Task | None = None
+        self.watch_topology = watch_topology
+        self._follower: asyncio.Task | None = None
+        self._closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _manager(self) -> mapb_grpc.manageServiceStub:
+        return mapb_grpc.manageServiceStub(self.pool.get(self.manager))
+
+    async def connect(self) -> "AsyncClient":
+        try:
+            info = await self._manager().connect(mapb.Empty(), timeout=self.retry.timeout)
+        except grpc.RpcError as e:
+            raise Unavailable(f"连接管理服务器失败: {e.details() or e.code().name}") from e
+        if not info.errno:
+            raise Unavailable(info.errmes)
+        self.cli_id = info.cli_id
+        if not self.target:
+            self.target = info.ip + info.port
+        return self
+
+    async def close(self):
+        self._closed = True
+        for task in (self._watcher, self._follower):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        if self.cli_id:
+            try:
+                await self._manager().disconnect(mapb.CliId(cli_id=self.cli_id), timeout=self.retry.timeout)
+            except grpc.RpcError:
+                pass
+            self.cli_id = 0
+        await self.pool.close()
+
+    async def refresh(self) -> list[str]:
+        try:
+            resp = await self._manager().topology(mapb.Empty(), timeout=self.retry.timeout)
+        except grpc.RpcError as e:
+            raise Unavailable(f"获取集群拓扑失败: {e.details() or e.code().name}") from e
+        self.topology.update(resp)
+        return self.topology.targets()
+
+    async def nodes(self) -> list[str]:
+        if self.topology.stale():
+            return await self.refresh()
+        return self.topology.targets()
+
+    async def use(self, target: str = "") -> str:
+        if not target:
+            await self.nodes()
+            target = self.topology.pick(exclude={self.target})
+            if target is None:
+                raise Unavailable("目前暂无键值服务器")
+        if self.cli_id:
+            resp = await self._manager().changeServer(mapb.CliChange(cli_id=self.cli_id, api=target),
+                                                      timeout=self.retry.timeout)
+            if not resp.errno:
+                raise KVError(resp.errmes)
+        self.target = target
+        return target
+
+    async def _current(self) -> str:
+        if self.watch_topology and self._follower is None and not self._closed:
+            self._follower = asyncio.create_task(self._follow())
+        if not self.target:
+            await self.nodes()
+            target = self.topology.pick()
+            if target is None:
+                raise Unavailable("目前暂无键值服务器")
+            self.target = self.target or target
+        return self.target
+
+    async def _retry(self, attempt_fn):
+        """attempt_fn(stub, timeout) 为协程函数, 执行一次调用并返回带 errno/errmes 的响应"""
+        deadline = Deadline(self.retry.timeout)
+        error = ""
+        for attempt in range(self.retry.attempts):
+            target = await self._current()
+            try:
+                resp = await attempt_fn(stpb_grpc.storagementServiceStub(self.pool.get(target)), deadline.remaining())
+            except grpc.RpcError as e:
+                error = e.details() or e.code().name
+                if not self.retry.retryable(e):
+                    raise Unavailable(error) from e
+                if e.code() == grpc.StatusCode.UNAVAILABLE:
+                    self.topology.drop(target)
+                    if self.target == target:
+                        self.target = ""
+            else:
+                if resp.errno or resp.errmes not in BUSY_ERRORS:
+                    return resp
+                error = resp.errmes
+            delay = min(self.retry.backoff(attempt), deadline.remaining())
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        raise Unavailable(f"多次重试后仍失败: {error}")
+
+    async def _follow(self):
+        attempt = 0
+        while not self._closed:
+            try:
+                async for event in self._manager().watchTopology(mapb.Empty()):
+                    removed = self.topology.update(event)
+                    self.topology.pushed = True
+                    attempt = 0
+                    if self.target in removed:
+                        self.target = ""
+            except grpc.RpcError:
+                pass
+            finally:
+                self.topology.pushed = False
+            await asyncio.sleep(self.retry.backoff(attempt))
+            attempt = min(attempt + 1, 10)
+
+    async def _watch(self):
+        attempt = 0
+        while not self._closed:
+            target = ""
+            try:
+                target = await self._current()
+                stub = stpb_grpc.storagementServiceStub(self.pool.get(target))
+                async for msg in stub.invalidations(stpb.StInvalidateRequest(cli_id=self.cli_id)):
+                    if msg.reset:
+                        self.cache.reset(active=True)
+                        attempt = 0
+                    else:
+                        self.cache.invalidate(msg.keys)
+            except grpc.RpcError as e:
+                if e.code() == grpc.StatusCode.UNAVAILABLE and target:
+                    self.topology.drop(target)
+                    if self.target == target:
+                        self.target = ""
+            except KVError:
+                pass
+            finally:
+                self.cache.reset(active=False)
+            await asyncio.sleep(self.retry.backoff(attempt))
+            attempt = min(attempt + 1, 10)
+
+    def watch(self, key: str, prefix: bool = False, cursor: str = "") -> AsyncWatch:
+        return AsyncWatch(self, key, prefix, cursor)
+
+    async def get(self, key: str) -> str:
+        epoch = 0
+        if self.cache is not None:
+            if self._watcher is None and not self._closed:
+                self._watcher = asyncio.create_task(self._watch())
+            value, ok = self.cache.get(key)
+            if ok:
+                return value
+            epoch = self.cache.epoch
+        req = stpb.StRequest(cli_id=self.cli_id, key=key)
+        value = check(await self._retry(lambda stub, timeout: stub.getdata(req, timeout=timeout))).value
+        if self.cache is not None:
+            self.cache.fill(key, value, epoch)
+        return value
+
+    async def get_version(self, key: str) -> tuple[str, int]:
+        req = stpb.StRequest(cli_id=self.cli_id, key=key)
+        resp = check(await self._retry(lambda stub, timeout: stub.getdata(req, timeout=timeout)))
+        return resp.value, resp.version
+
+    async def put(self, key: str, value: str):
+        await self._mutate("putdata", stpb.StKV(cli_id=self.cli_id, key=key, value=value))
+
+    async def put_if_version(self, key: str, value: str, version: int):
+        if version <= 0:
+            raise ValueError("version 必须为 get_version 返回的正整数")
+        await self._mutate("putdata", stpb.StKV(cli_id=self.cli_id, key=key, value=value, expect=version))
+
+    async def put_if_absent(self, key: str, value: str):
+        await self._mutate("putdata", stpb.StKV(cli_id=self.cli_id, key=key, value=value, absent=True))
+
+    async def delete(self, key: str):
+        await self._mutate("deldata", stpb.StRequest(cli_id=self.cli_id, key=key))
+
+    async def delete_if_version(self, key: str, version: int):
+        if version <= 0:
+            raise ValueError("version 必须为 get_version 返回的正整数")
+        await self._mutate("deldata", stpb.StRequest(cli_id=self.cli_id, key=key, expect=version))
+
+    async def _mutate(self, method: str, req):
+        try:
+            check(await self._retry(lambda stub, timeout: getattr(stub, method)(req, timeout=timeout)))
+        finally:
+            if self.cache is not None:
+                self.cache.invalidate([req.key])
+
+    async def put_stream(self, key: str, f, size: int = -1):
+        start = f.tell()
+        if size < 0:
+            size = f.seek(0, 2) - start
+
+        async def attempt(stub, timeout):
+            f.seek(start)
+            return await stub.putstream(file_chunks(self.cli_id, key, f, size), timeout=timeout)
+
+        try:
+            check(await self._retry(attempt))
+        finally:
+            if self.cache is not None:
+                self.cache.invalidate([key])
+
+    async def get_stream(self, key: str, f) -> int:
+        start = f.tell()
+        req = stpb.StRequest(cli_id=self.cli_id, key=key)
+
+        async def attempt(stub, timeout):
+            f.seek(start)
+            f.truncate()
+            written = 0
+            async for chunk in stub.getstream(req, timeout=timeout):
+                if not chunk.errno:
+                    return chunk
+                f.write(chunk.data)
+                written += len(chunk.data)
+            return stpb.StChunk(key=key, size=written, errno=True)
+
+        return check(await self._retry(attempt)).size
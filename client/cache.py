@@ -0,0 +1,50 @@
+﻿from collections import OrderedDict
+from threading import Lock
+
+
+class NearCache:
+    """客户端进程内的近端缓存, LRU 淘汰
+
+    只有失效通知订阅有效(active)时才读写缓存。每次失效都会使 epoch 加一, 读请求发出前记下 epoch,
+    返回时若期间发生过失效则不写入缓存, 避免把已失效的旧值放回缓存
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.m: OrderedDict[str, str] = OrderedDict()
+        self.epoch = 0
+        self.active = False
+        self.hits = 0
+        self.misses = 0
+        self.mu = Lock()
+
+    def get(self, key: str) -> tuple[str, bool]:
+        with self.mu:
+            if self.active and key in self.m:
+                self.m.move_to_end(key)
+                self.hits += 1
+                return self.m[key], True
+            self.misses += 1
+            return "", False
+
+    def fill(self, key: str, value: str, epoch: int):
+        with self.mu:
+            if not self.active or epoch != self.epoch:
+                return
+            self.m[key] = value
+            self.m.move_to_end(key)
+            if len(self.m) > self.maxsize:
+                self.m.popitem(last=False)
+
+    def invalidate(self, keys):
+        with self.mu:
+            self.epoch += 1
+            for key in keys:
+                self.m.pop(key, None)
+
+    def reset(self, active: bool):
+        """清空缓存; 订阅建立时 active=True, 订阅中断时 active=False 停止使用缓存"""
+        with self.mu:
+            self.epoch += 1
+            self.m.clear()
+            self.active = active
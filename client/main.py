@@ -0,0 +1,443 @@
+﻿import random
+import threading
+import time
+from threading import Lock
+
+import grpc
+
+from protos import mapb_pb2 as mapb
+from protos import mapb_pb2_grpc as mapb_grpc
+from protos import stpb_pb2 as stpb
+from protos import stpb_pb2_grpc as stpb_grpc
+from params import params
+from client.cache import NearCache
+from client.retry import BUSY_ERRORS, Deadline, RetryPolicy
+from common.pool import ChannelPool
+
+NOT_FOUND = "未找到键值"
+VERSION_CONFLICT = "版本不匹配"
+
+
+class KVError(Exception):
+    """存储节点返回 errno=false, 异常消息为 errmes"""
+
+
+class KeyNotFound(KVError):
+    pass
+
+
+class VersionConflict(KVError):
+    """条件写入的条件不满足: 键已提交的版本与期望的不同, 或 put_if_absent 时键已存在"""
+
+
+class Unavailable(KVError):
+    """没有可用的存储节点, 或重试用尽/截止时间已到仍未完成调用"""
+
+
+class Topology:
+    """缓存管理服务器返回的存储节点列表, 过期或全部节点失联后重新获取
+
+    订阅了管理服务器的拓扑推送(pushed)时列表随推送更新, 不再按 ttl 过期
+    """
+
+    def __init__(self, ttl: float = 30.0):
+        self.ttl = ttl
+        self.nodes: dict[int, str] = {}  # server_id -> ip:port
+        self.epoch = 0
+        self.fetched = 0.0
+        self.pushed = False
+        self.mu = Lock()
+
+    def stale(self) -> bool:
+        with self.mu:
+            return not self.nodes or (not self.pushed and time.monotonic() - self.fetched > self.ttl)
+
+    def update(self, resp: mapb.Topology | mapb.TopologyEvent) -> set[str]:
+        """替换为 resp 中的节点列表(不含引导中的节点), 返回被移除的节点地址"""
+        with self.mu:
+            old = set(self.nodes.values())
+            self.nodes = {n.server_id: n.ip + n.port for n in resp.nodes if not n.joining}
+            self.epoch = resp.epoch
+            self.fetched = time.monotonic()
+            return old - set(self.nodes.values())
+
+    def drop(self, target: str):
+        with self.mu:
+            self.nodes = {sid: t for sid, t in self.nodes.items() if t != target}
+
+    def targets(self) -> list[str]:
+        with self.mu:
+            return list(self.nodes.values())
+
+    def pick(self, exclude=()) -> str | None:
+        targets = self.targets()
+        candidates = [t for t in targets if t not in exclude] or targets
+        return random.choice(candidates) if candidates else None
+
+
+def check(resp):
+    if resp.errno:
+        return resp
+    if resp.errmes == NOT_FOUND:
+        raise KeyNotFound(resp.errmes)
+    if resp.errmes == VERSION_CONFLICT:
+        raise VersionConflict(resp.errmes)
+    raise KVError(resp.errmes)
+
+
+def file_chunks(client_id: int, key: str, f, size: int):
+    """从 f 的当前位置读出 size 字节, 切分为 StChunk, 第一块携带键名与总大小"""
+    data = f.read(min(size, params.CHUNK_SIZE))
+    yield stpb.StChunk(cli_id=client_id, key=key, size=size, data=data)
+    left = size - len(data)
+    while left > 0 and (data := f.read(min(left, params.CHUNK_SIZE))):
+        left -= len(data)
+        yield stpb.StChunk(data=data)
+
+
+# watch 中需要交给调用方的事件, 其余(start/progress)只用于更新 cursor
+CHANGE_OPS = frozenset({"put", "del"})
+
+
+class Watch:
+    """Client.watch 返回的事件迭代器, 流中断后从最后收到的 cursor 续传
+
+    续传时节点无法提供中间的事件(节点重启、换了节点或落后太多)会产出一条 op="start", reset=true 的事件,
+    调用方应重新读取所关心键的当前值。cursor 属性可保存下来, 供之后新建的 watch 续传
+    """
+
+    def __init__(self, client: "Client", key: str, prefix: bool, cursor: str):
+        self.client = client
+        self.key = key
+        self.prefix = prefix
+        self.cursor = cursor
+        self._cancelled = threading.Event()
+        self._call = None
+
+    def __iter__(self):
+        client = self.client
+        attempt = 0
+        error = ""
+        while not self._cancelled.is_set() and not client._closed.is_set():
+            target = ""
+            try:
+                target = client._current()
+                stub = stpb_grpc.storagementServiceStub(client.pool.get(target))
+                self._call = stub.watch(stpb.StWatchRequest(key=self.key, prefix=self.prefix, cursor=self.cursor,
+                                                            cli_id=client.cli_id))
+                try:
+                    for event in self._call:
+                        self.cursor = event.cursor
+                        attempt = 0
+                        if event.op in CHANGE_OPS or event.reset:
+                            yield event
+                finally:
+                    # 调用方提前结束迭代时关闭流
+                    self._call.cancel()
+            except grpc.RpcError as e:
+                if self._cancelled.is_set():
+                    return
+                error = e.details() or e.code().name
+                if not client.retry.retryable(e):
+                    raise Unavailable(error) from e
+                if e.code() == grpc.StatusCode.UNAVAILABLE and target:
+                    client._failover(target)
+            if attempt >= client.retry.attempts:
+                raise Unavailable(f"多次重试后仍失败: {error}")
+            self._cancelled.wait(client.retry.backoff(attempt))
+            attempt += 1
+
+    def cancel(self):
+        self._cancelled.set()
+        if self._call is not None:
+            self._call.cancel()
+
+
+class Client:
+    """键值存储的同步客户端, 可被多个线程共用
+
+    连接按地址复用; 调用失败时按 RetryPolicy 退避重试, 所用节点不可用时根据缓存的集群拓扑换到其他节点。
+    near_cache > 0 时开启至多缓存该数量键值的近端缓存, 由存储节点推送的失效通知保持一致。
+    watch_topology 为 True 时订阅管理服务器的拓扑推送, 所用节点下线后下一次调用直接换到其他节点, 不必先失败一次;
+    同步模式的管理服务器每个订阅占用一个工作线程且限制了订阅数, 默认关闭, 订阅被拒绝时退避重试并照常按 topology_ttl 拉取
+    """
+
+    def __init__(self, manager: str = params.MANAGER_IP + params.MANAGER_PORT, target: str = "",
+                 retry: RetryPolicy | None = None, topology_ttl: float = 30.0,
+                 compression: grpc.Compression | None = None, near_cache: int = 0, watch_topology: bool = False):
+        self.manager = manager
+        self.target = target  # 当前使用的存储节点, 为空时从拓扑中选取
+        self.retry = retry or RetryPolicy()
+        self.topology = Topology(topology_ttl)
+        self.pool = ChannelPool(compression)
+        self.cli_id = 0
+        self.mu = Lock()
+        self.cache = NearCache(near_cache) if near_cache > 0 else None
+        self._closed = threading.Event()
+        self._watcher: threading.Thread | None = None
+        self._stream = None
+        self.watch_topology = watch_topology
+        self._follower: threading.Thread | None = None
+        self._topology_stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _manager(self) -> mapb_grpc.manageServiceStub:
+        return mapb_grpc.manageServiceStub(self.pool.get(self.manager))
+
+    def connect(self) -> "Client":
+        """向管理服务器注册, 取得客户端 ID, 未指定节点时使用管理服务器分配的节点"""
+        try:
+            info = self._manager().connect(mapb.Empty(), timeout=self.retry.timeout)
+        except grpc.RpcError as e:
+            raise Unavailable(f"连接管理服务器失败: {e.details() or e.code().name}") from e
+        if not info.errno:
+            raise Unavailable(info.errmes)
+        self.cli_id = info.cli_id
+        if not self.target:
+            self.target = info.ip + info.port
+        return self
+
+    def close(self):
+        self._closed.set()
+        for stream in (self._stream, self._topology_stream):
+            if stream is not None:
+                stream.cancel()
+        for thread in (self._watcher, self._follower):
+            if thread is not None:
+                thread.join()
+        if self.cli_id:
+            try:
+                self._manager().disconnect(mapb.CliId(cli_id=self.cli_id), timeout=self.retry.timeout)
+            except grpc.RpcError:
+                pass
+            self.cli_id = 0
+        self.pool.close()
+
+    def refresh(self) -> list[str]:
+        """从管理服务器重新获取存储节点列表"""
+        try:
+            resp = self._manager().topology(mapb.Empty(), timeout=self.retry.timeout)
+        except grpc.RpcError as e:
+            raise Unavailable(f"获取集群拓扑失败: {e.details() or e.code().name}") from e
+        self.topology.update(resp)
+        return self.topology.targets()
+
+    def nodes(self) -> list[str]:
+        if self.topology.stale():
+            return self.refresh()
+        return self.topology.targets()
+
+    def use(self, target: str = "") -> str:
+        """切换到指定的存储节点, 为空时随机选择另一个节点; 已注册时同时告知管理服务器"""
+        if not target:
+            self.nodes()
+            target = self.topology.pick(exclude={self.target})
+            if target is None:
+                raise Unavailable("目前暂无键值服务器")
+        if self.cli_id:
+            resp = self._manager().changeServer(mapb.CliChange(cli_id=self.cli_id, api=target),
+                                                timeout=self.retry.timeout)
+            if not resp.errno:
+                raise KVError(resp.errmes)
+        with self.mu:
+            self.target = target
+        return target
+
+    def stub(self) -> stpb_grpc.storagementServiceStub:
+        """当前节点的 stub, 供需要直接调用 RPC 的场景使用"""
+        return stpb_grpc.storagementServiceStub(self.pool.get(self._current()))
+
+    def _current(self) -> str:
+        if self.watch_topology:
+            self._start_follow()
+        with self.mu:
+            if self.target:
+                return self.target
+        self.nodes()
+        target = self.topology.pick()
+        if target is None:
+            raise Unavailable("目前暂无键值服务器")
+        with self.mu:
+            if not self.target:
+                self.target = target
+            return self.target
+
+    def _failover(self, target: str):
+        # 不关闭该节点的连接, 其他线程可能仍有在途请求; gRPC 会在节点恢复后自动重连
+        self.topology.drop(target)
+        with self.mu:
+            if self.target == target:
+                self.target = ""
+
+    def _retry(self, attempt_fn):
+        """attempt_fn(stub, timeout) 执行一次调用并返回带 errno/errmes 的响应"""
+        deadline = Deadline(self.retry.timeout)
+        error = ""
+        for attempt in range(self.retry.attempts):
+            target = self._current()
+            try:
+                resp = attempt_fn(stpb_grpc.storagementServiceStub(self.pool.get(target)), deadline.remaining())
+            except grpc.RpcError as e:
+                error = e.details() or e.code().name
+                if not self.retry.retryable(e):
+                    raise Unavailable(error) from e
+                if e.code() == grpc.StatusCode.UNAVAILABLE:
+                    self._failover(target)
+            else:
+                if resp.errno or resp.errmes not in BUSY_ERRORS:
+                    return resp
+                error = resp.errmes
+            delay = min(self.retry.backoff(attempt), deadline.remaining())
+            if delay <= 0:
+                break
+            time.sleep(delay)
+        raise Unavailable(f"多次重试后仍失败: {error}")
+
+    def _watch(self):
+        """后台线程: 订阅当前节点的失效通知, 中断时停用近端缓存并退避后重新订阅"""
+        attempt = 0
+        while not self._closed.is_set():
+            target = ""
+            try:
+                target = self._current()
+                stub = stpb_grpc.storagementServiceStub(self.pool.get(target))
+                self._stream = stub.invalidations(stpb.StInvalidateRequest(cli_id=self.cli_id))
+                for msg in self._stream:
+                    if msg.reset:
+                        self.cache.reset(active=True)
+                        attempt = 0
+                    else:
+                        self.cache.invalidate(msg.keys)
+            except grpc.RpcError as e:
+                if e.code() == grpc.StatusCode.UNAVAILABLE and target:
+                    self._failover(target)
+            except KVError:
+                pass
+            self.cache.reset(active=False)
+            self._closed.wait(self.retry.backoff(attempt))
+            attempt = min(attempt + 1, 10)
+
+    def _follow(self):
+        """后台线程: 订阅管理服务器的拓扑推送, 当前节点被移除时清空 target, 下一次调用换到其他节点"""
+        attempt = 0
+        while not self._closed.is_set():
+            try:
+                self._topology_stream = self._manager().watchTopology(mapb.Empty())
+                for event in self._topology_stream:
+                    removed = self.topology.update(event)
+                    self.topology.pushed = True
+                    attempt = 0
+                    with self.mu:
+                        if self.target in removed:
+                            self.target = ""
+            except grpc.RpcError:
+                pass
+            self.topology.pushed = False
+            self._closed.wait(self.retry.backoff(attempt))
+            attempt = min(attempt + 1, 10)
+
+    def _start_follow(self):
+        with self.mu:
+            if self._follower is not None or self._closed.is_set():
+                return
+            self._follower = threading.Thread(target=self._follow, name="topology", daemon=True)
+        self._follower.start()
+
+    def _start_watch(self):
+        with self.mu:
+            if self._watcher is not None or self._closed.is_set():
+                return
+            self._watcher = threading.Thread(target=self._watch, name="near-cache", daemon=True)
+        self._watcher.start()
+
+    def watch(self, key: str, prefix: bool = False, cursor: str = "") -> Watch:
+        """订阅 key(prefix 为 True 时为所有以 key 开头的键)已提交的写入与删除, cursor 为空时从当前开始"""
+        return Watch(self, key, prefix, cursor)
+
+    def get(self, key: str) -> str:
+        epoch = 0
+        if self.cache is not None:
+            self._start_watch()
+            value, ok = self.cache.get(key)
+            if ok:
+                return value
+            epoch = self.cache.epoch
+        req = stpb.StRequest(cli_id=self.cli_id, key=key)
+        value = check(self._retry(lambda stub, timeout: stub.getdata(req, timeout=timeout))).value
+        if self.cache is not None:
+            self.cache.fill(key, value, epoch)
+        return value
+
+    def get_version(self, key: str) -> tuple[str, int]:
+        """读取键值与其已提交的版本号, 用于之后的条件写入; 不使用近端缓存"""
+        req = stpb.StRequest(cli_id=self.cli_id, key=key)
+        resp = check(self._retry(lambda stub, timeout: stub.getdata(req, timeout=timeout)))
+        return resp.value, resp.version
+
+    def put(self, key: str, value: str):
+        self._mutate("putdata", stpb.StKV(cli_id=self.cli_id, key=key, value=value))
+
+    def put_if_version(self, key: str, value: str, version: int):
+        """键已提交的版本为 version 时才写入, 否则抛出 VersionConflict"""
+        if version <= 0:
+            raise ValueError("version 必须为 get_version 返回的正整数")
+        self._mutate("putdata", stpb.StKV(cli_id=self.cli_id, key=key, value=value, expect=version))
+
+    def put_if_absent(self, key: str, value: str):
+        """键不存在时才写入, 否则抛出 VersionConflict"""
+        self._mutate("putdata", stpb.StKV(cli_id=self.cli_id, key=key, value=value, absent=True))
+
+    def delete(self, key: str):
+        self._mutate("deldata", stpb.StRequest(cli_id=self.cli_id, key=key))
+
+    def delete_if_version(self, key: str, version: int):
+        """键已提交的版本为 version 时才删除, 否则抛出 VersionConflict"""
+        if version <= 0:
+            raise ValueError("version 必须为 get_version 返回的正整数")
+        self._mutate("deldata", stpb.StRequest(cli_id=self.cli_id, key=key, expect=version))
+
+    def _mutate(self, method: str, req):
+        try:
+            check(self._retry(lambda stub, timeout: getattr(stub, method)(req, timeout=timeout)))
+        finally:
+            if self.cache is not None:
+                self.cache.invalidate([req.key])
+
+    def put_stream(self, key: str, f, size: int = -1):
+        """分块上传可 seek 的二进制文件 f 从当前位置起的 size 字节(默认到文件末尾), 重试时从头重新发送"""
+        start = f.tell()
+        if size < 0:
+            size = f.seek(0, 2) - start
+
+        def attempt(stub, timeout):
+            f.seek(start)
+            return stub.putstream(file_chunks(self.cli_id, key, f, size), timeout=timeout)
+
+        try:
+            check(self._retry(attempt))
+        finally:
+            if self.cache is not None:
+                self.cache.invalidate([key])
+
+    def get_stream(self, key: str, f) -> int:
+        """分块下载键值写入可 seek 的二进制文件 f, 返回写入的字节数"""
+        start = f.tell()
+        req = stpb.StRequest(cli_id=self.cli_id, key=key)
+
+        def attempt(stub, timeout):
+            f.seek(start)
+            f.truncate()
+            written = 0
+            for chunk in stub.getstream(req, timeout=timeout):
+                if not chunk.errno:
+                    return chunk
+                f.write(chunk.data)
+                written += len(chunk.data)
+            return stpb.StChunk(key=key, size=written, errno=True)
+
+        return check(self._retry(attempt)).size
@@ -0,0 +1,42 @@
+﻿import random
+import time
+
+import grpc
+
+# 换一个节点或稍后重试可能成功的状态码; DEADLINE_EXCEEDED 表示总截止时间已到, 不再重试
+RETRYABLE_CODES = frozenset({grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.RESOURCE_EXHAUSTED})
+# 存储节点返回的暂时性错误: 键正被两阶段提交独占
+BUSY_ERRORS = frozenset({"该值被另一进程占有", "无法获取锁"})
+
+
+class RetryPolicy:
+    """指数退避加随机抖动, 一次操作的所有尝试共用 timeout 秒的截止时间"""
+
+    def __init__(self, attempts: int = 5, initial: float = 0.05, maximum: float = 1.0, multiplier: float = 2.0,
+                 jitter: float = 0.2, timeout: float = 10.0, codes=RETRYABLE_CODES):
+        self.attempts = attempts
+        self.initial = initial
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.timeout = timeout
+        self.codes = codes
+
+    def backoff(self, attempt: int) -> float:
+        """第 attempt 次(从 0 开始)失败后的等待时间"""
+        delay = min(self.initial * self.multiplier ** attempt, self.maximum)
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def retryable(self, error: grpc.RpcError) -> bool:
+        return error.code() in self.codes
+
+
+class Deadline:
+    def __init__(self, timeout: float):
+        self.expires = time.monotonic() + timeout
+
+    def remaining(self) -> float:
+        return max(self.expires - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
@@ -0,0 +1,254 @@
+﻿import lzma
+import zlib
+from abc import ABC, abstractmethod
+
+import grpc
+
+# 压缩后的值以 MAGIC + 1字节codec标记 开头, 未压缩的值原样保存
+MAGIC = b"\x00KVC"
+HEADER = len(MAGIC) + 1
+RAW_TAG = 0
+
+
+class Codec(ABC):
+    """值压缩算法接口, 子类需提供唯一的 name 与 tag"""
+    name = ""
+    tag = RAW_TAG
+
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        ...
+
+    @abstractmethod
+    def decompress(self, data: bytes) -> bytes:
+        ...
+
+    @abstractmethod
+    def compressobj(self):
+        """返回带 compress/flush 方法的流式压缩对象"""
+
+    @abstractmethod
+    def decompressobj(self):
+        """返回带 decompress 方法的流式解压对象"""
+
+
+CODECS: dict[str, type[Codec]] = {}
+_TAGS: dict[int, type[Codec]] = {}
+
+
+def register_codec(cls: type[Codec]) -> type[Codec]:
+    if cls.tag == RAW_TAG or cls.tag in _TAGS and _TAGS[cls.tag] is not cls:
+        raise ValueError(f"codec标记{cls.tag} 无效或已被占用")
+    CODECS[cls.name] = cls
+    _TAGS[cls.tag] = cls
+    return cls
+
+
+@register_codec
+class ZlibCodec(Codec):
+    name = "zlib"
+    tag = 1
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+    def compressobj(self):
+        return zlib.compressobj(self.level)
+
+    def decompressobj(self):
+        return zlib.decompressobj()
+
+
+@register_codec
+class LzmaCodec(Codec):
+    name = "lzma"
+    tag = 2
+
+    def __init__(self, preset: int = 6):
+        self.preset = preset
+
+    def compress(self, data: bytes) -> bytes:
+        return lzma.compress(data, preset=self.preset)
+
+    def decompress(self, data: bytes) -> bytes:
+        return lzma.decompress(data)
+
+    def compressobj(self):
+        return lzma.LZMACompressor(preset=self.preset)
+
+    def decompressobj(self):
+        return lzma.LZMADecompressor()
+
+
+class ValueCodec:
+    """按值大小选择压缩算法: tiers 为 (最小字节数, codec) 列表,
+    取不超过值大小的最大阈值对应的 codec, 压缩无收益时保存原值
+    """
+
+    def __init__(self, tiers: list[tuple[int, Codec]] | None = None):
+        self.tiers = sorted(tiers or [], key=lambda t: t[0], reverse=True)
+        self._decoders: dict[int, Codec] = {}
+
+    def pick(self, size: int) -> Codec | None:
+        for threshold, codec in self.tiers:
+            if size >= threshold:
+                return codec
+        return None
+
+    def encode(self, data: bytes) -> bytes:
+        codec = self.pick(len(data))
+        if codec is not None:
+            packed = codec.compress(data)
+            if len(packed) + HEADER < len(data):
+                return MAGIC + bytes([codec.tag]) + packed
+        if data.startswith(MAGIC):
+            # 原值恰好以 MAGIC 开头时加上 RAW 标记, 避免被误判为压缩数据
+            return MAGIC + bytes([RAW_TAG]) + data
+        return data
+
+    def decode(self, data: bytes) -> bytes:
+        if not data.startswith(MAGIC):
+            return data
+        tag = data[len(MAGIC)]
+        if tag == RAW_TAG:
+            return data[HEADER:]
+        return self._decoder(tag).decompress(data[HEADER:])
+
+    def encoder(self, size: int) -> "StreamEncoder":
+        """分块写入时使用, size 为值的总字节数, 用于选择压缩算法"""
+        return StreamEncoder(self.pick(size))
+
+    def decoder(self) -> "StreamDecoder":
+        return StreamDecoder(self)
+
+    def _decoder(self, tag: int) -> Codec:
+        codec = self._decoders.get(tag)
+        if codec is None:
+            if tag not in _TAGS:
+                raise ValueError(f"未知的压缩标记 {tag}")
+            codec = _TAGS[tag]()
+            self._decoders[tag] = codec
+        return codec
+
+
+class StreamEncoder:
+    """流式编码, 输出格式与 ValueCodec.encode 一致"""
+
+    def __init__(self, codec: Codec | None):
+        self.obj = codec.compressobj() if codec is not None else None
+        self.head = MAGIC + bytes([codec.tag]) if codec is not None else b""
+        self.started = codec is not None
+
+    def update(self, data: bytes) -> bytes:
+        if self.obj is not None:
+            return self._emit(self.obj.compress(data))
+        if self.started:
+            return data
+        # 未压缩时需先收集足够字节判断原值是否以 MAGIC 开头
+        self.head += data
+        if len(self.head) < len(MAGIC):
+            return b""
+        return self._start_raw()
+
+    def flush(self) -> bytes:
+        if self.obj is not None:
+            return self._emit(self.obj.flush())
+        if self.started:
+            return b""
+        return self._start_raw()
+
+    def _emit(self, out: bytes) -> bytes:
+        if self.head:
+            out, self.head = self.head + out, b""
+        return out
+
+    def _start_raw(self) -> bytes:
+        self.started = True
+        head, self.head = self.head, b""
+        if head.startswith(MAGIC):
+            return MAGIC + bytes([RAW_TAG]) + head
+        return head
+
+
+class StreamDecoder:
+    """流式解码, 可解码 ValueCodec.encode 或 StreamEncoder 的输出"""
+
+    def __init__(self, owner: ValueCodec):
+        self.owner = owner
+        self.head = b""
+        self.obj = None
+        self.raw = None  # None 表示尚未确定数据格式
+
+    def update(self, data: bytes) -> bytes:
+        if self.raw is None:
+            self.head += data
+            if not self._detect():
+                return b""
+            data, self.head = self.head, b""
+        if self.raw:
+            return data
+        return self.obj.decompress(data)
+
+    def flush(self) -> bytes:
+        if self.raw is None:
+            # 数据过短, 只可能是未压缩的原值
+            self.raw = True
+            head, self.head = self.head, b""
+            return head
+        if not self.raw and hasattr(self.obj, "flush"):
+            return self.obj.flush()
+        return b""
+
+    def _detect(self) -> bool:
+        head = self.head
+        if len(head) < len(MAGIC):
+            if MAGIC.startswith(head):
+                return False
+            self.raw = True
+            return True
+        if not head.startswith(MAGIC):
+            self.raw = True
+            return True
+        if len(head) < HEADER:
+            return False
+        tag = head[len(MAGIC)]
+        self.head = head[HEADER:]
+        if tag == RAW_TAG:
+            self.raw = True
+        else:
+            self.raw = False
+            self.obj = self.owner._decoder(tag).decompressobj()
+        return True
+
+
+def parse_tiers(spec: str) -> list[tuple[int, Codec]]:
+    """解析形如 "zlib:1024,lzma:1048576" 的压缩配置, 空字符串表示不压缩"""
+    tiers = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, threshold = item.partition(":")
+        if name not in CODECS:
+            raise ValueError(f"不支持的压缩算法 {name}")
+        tiers.append((int(threshold or 0), CODECS[name]()))
+    return tiers
+
+
+GRPC_COMPRESSION = {
+    "none": grpc.Compression.NoCompression,
+    "gzip": grpc.Compression.Gzip,
+    "deflate": grpc.Compression.Deflate,
+}
+
+
+def grpc_compression(name: str) -> grpc.Compression:
+    if name not in GRPC_COMPRESSION:
+        raise ValueError(f"不支持的gRPC压缩算法 {name}")
+    return GRPC_COMPRESSION[name]
@@ -0,0 +1,117 @@
+﻿from contextlib import ExitStack
+
+import grpc
+
+
+class Call:
+    """一次 RPC 调用的信息, 由拦截器传给各个 hook"""
+
+    def __init__(self, method: str, request, context):
+        self.method = method  # 完整方法名, 如 /stpb.storagementService/getdata
+        self.op = method.rsplit("/", 1)[-1]
+        self.request = request  # 客户端流调用时为 None
+        self.context = context
+        self.response = None
+        self.error: BaseException | None = None
+
+
+def _run(hooks, call: Call):
+    """依次进入各 hook(上下文管理器工厂), 返回用于退出的 ExitStack"""
+    stack = ExitStack()
+    for hook in hooks:
+        stack.enter_context(hook(call))
+    return stack
+
+
+class HookInterceptor(grpc.ServerInterceptor):
+    """在每个处理函数外层运行 hook 的同步拦截器
+
+    hook 是接收 Call 的上下文管理器工厂, 处理函数抛出的异常记录在 call.error
+    """
+
+    def __init__(self, *hooks):
+        self.hooks = hooks
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None:
+            return None
+        method = handler_call_details.method
+        hooks = self.hooks
+
+        def wrap_unary(behavior, streaming_request):
+            def wrapper(request, context):
+                call = Call(method, None if streaming_request else request, context)
+                with _run(hooks, call):
+                    try:
+                        call.response = behavior(request, context)
+                    except BaseException as e:
+                        call.error = e
+                        raise
+                    return call.response
+            return wrapper
+
+        def wrap_stream(behavior, streaming_request):
+            def wrapper(request, context):
+                call = Call(method, None if streaming_request else request, context)
+                with _run(hooks, call):
+                    try:
+                        yield from behavior(request, context)
+                    except BaseException as e:
+                        call.error = e
+                        raise
+            return wrapper
+
+        return _rebuild(handler, wrap_unary, wrap_stream)
+
+
+class AsyncHookInterceptor(grpc.aio.ServerInterceptor):
+    """grpc.aio 版本的 HookInterceptor, hook 与同步版本通用"""
+
+    def __init__(self, *hooks):
+        self.hooks = hooks
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None:
+            return None
+        method = handler_call_details.method
+        hooks = self.hooks
+
+        def wrap_unary(behavior, streaming_request):
+            async def wrapper(request, context):
+                call = Call(method, None if streaming_request else request, context)
+                with _run(hooks, call):
+                    try:
+                        call.response = await behavior(request, context)
+                    except BaseException as e:
+                        call.error = e
+                        raise
+                    return call.response
+            return wrapper
+
+        def wrap_stream(behavior, streaming_request):
+            async def wrapper(request, context):
+                call = Call(method, None if streaming_request else request, context)
+                with _run(hooks, call):
+                    try:
+                        async for response in behavior(request, context):
+                            yield response
+                    except BaseException as e:
+                        call.error = e
+                        raise
+            return wrapper
+
+        return _rebuild(handler, wrap_unary, wrap_stream)
+
+
+def _rebuild(handler, wrap_unary, wrap_stream):
+    kwargs = dict(request_deserializer=handler.request_deserializer,
+                  response_serializer=handler.response_serializer)
+    if handler.unary_unary:
+        return grpc.unary_unary_rpc_method_handler(wrap_unary(handler.unary_unary, False), **kwargs)
+    if handler.unary_stream:
+        return grpc.unary_stream_rpc_method_handler(wrap_stream(handler.unary_stream, False), **kwargs)
+    if handler.stream_unary:
+        return grpc.stream_unary_rpc_method_handler(wrap_unary(handler.stream_unary, True), **kwargs)
+    return grpc.stream_stream_rpc_method_handler(wrap_stream(handler.stream_stream, True), **kwargs)
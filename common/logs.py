@@ -0,0 +1,150 @@
+﻿import atexit
+import contextvars
+import json
+import logging
+import queue
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from threading import Lock
+
+from common.interceptors import Call
+
+# 当前 RPC 的方法名, 由 access_hook 设置, 供采样过滤器按操作采样
+current_op: contextvars.ContextVar[str] = contextvars.ContextVar("current_op", default="")
+
+FORMAT = "[%(levelname)s] - %(message)s"
+
+# logger 名 -> 仍在运行的后台写日志线程; 从这里取出即视为已停止, 不会重复 stop
+_listeners: dict[str, list[QueueListener]] = {}
+_listeners_mu = Lock()
+
+
+class LazyQueueHandler(QueueHandler):
+    """不在调用线程中格式化消息, 参数原样放入队列, 由后台线程格式化并写文件"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class SampleFilter(logging.Filter):
+    """按操作采样 INFO 及以下级别的日志, WARNING 及以上全部保留
+
+    rates 为 操作名 -> 保留比例, 比例 0.01 表示每 100 条保留 1 条;
+    操作名取自当前 RPC 方法名, 不在 RPC 中时取记录日志的函数名
+    """
+
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self.every = {op: max(1, round(1 / rate)) if rate > 0 else 0 for op, rate in rates.items()}
+        self.counts: dict[str, int] = {}
+        self.mu = Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        op = current_op.get() or record.funcName
+        every = self.every.get(op)
+        if every is None:
+            return True
+        if every == 0:
+            return False
+        with self.mu:
+            n = self.counts.get(op, 0)
+            self.counts[op] = n + 1
+        return n % every == 0
+
+
+class JsonFormatter(logging.Formatter):
+    """结构化日志(访问日志、span 等), 每条记录输出一行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = getattr(record, "entry", None)
+        if entry is None:
+            entry = {"level": record.levelname, "msg": record.getMessage()}
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def parse_rates(spec: str) -> dict[str, float]:
+    """解析形如 "live=0.01,getdata=0.1" 的采样配置"""
+    rates = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        op, _, rate = item.partition("=")
+        rates[op.strip()] = float(rate)
+    return rates
+
+
+def setup_logger(name: str, path: str, sample: dict[str, float] | None = None,
+                 formatter: logging.Formatter | None = None) -> logging.Logger:
+    """创建写入 path 的异步 logger: 调用方只把记录放入队列, 格式化与写文件在后台线程完成"""
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    fh = logging.FileHandler(path, mode='w', encoding='utf-8')
+    fh.setFormatter(formatter or logging.Formatter(FORMAT))
+    q = queue.SimpleQueue()
+    listener = QueueListener(q, fh)
+    listener.start()
+    with _listeners_mu:
+        _listeners.setdefault(name, []).append(listener)
+    logger.addHandler(LazyQueueHandler(q))
+    if sample:
+        logger.addFilter(SampleFilter(sample))
+    return logger
+
+
+def _stop_listeners(name: str):
+    # 已停止的 listener 再次 stop 会出错, 进程退出时可能已被 close_logger 停止
+    with _listeners_mu:
+        listeners = _listeners.pop(name, [])
+    for listener in listeners:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+@atexit.register
+def _stop_all():
+    with _listeners_mu:
+        names = list(_listeners)
+    for name in names:
+        _stop_listeners(name)
+
+
+def close_logger(logger: logging.Logger):
+    """停止后台写日志线程并关闭文件, 保证队列中的日志全部写出"""
+    _stop_listeners(logger.name)
+    for handler in logger.handlers[:]:
+        handler.close()
+        logger.removeHandler(handler)
+
+
+def access_hook(access_logger: logging.Logger | None = None):
+    """为每个 RPC 设置 current_op, 并可选地输出一行结构化访问日志"""
+
+    @contextmanager
+    def hook(call: Call):
+        token = current_op.set(call.op)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if access_logger is not None and access_logger.isEnabledFor(logging.INFO):
+                entry = {
+                    "ts": round(time.time(), 3),
+                    "op": call.op,
+                    "peer": call.context.peer() if call.context is not None else "",
+                    "key": getattr(call.request, "key", ""),
+                    "ms": round((time.perf_counter() - start) * 1000, 3),
+                    "ok": call.error is None and getattr(call.response, "errno", True),
+                }
+                if call.error is not None:
+                    entry["error"] = type(call.error).__name__
+                # entry 字段在后台线程中由 JsonFormatter 序列化
+                access_logger.info("access", extra={"entry": entry})
+            current_op.reset(token)
+
+    return hook
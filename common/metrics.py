@@ -0,0 +1,259 @@
+﻿import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+
+from common.interceptors import Call
+
+QUANTILES = (0.5, 0.95, 0.99, 0.999)
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0.0
+        self.mu = Lock()
+
+    def inc(self, n: float = 1):
+        with self.mu:
+            self.value += n
+
+    def snapshot(self) -> dict:
+        return {"value": self.value}
+
+    def load(self, data: dict):
+        self.inc(data["value"])
+
+
+class Gauge(Counter):
+    def set(self, value: float):
+        with self.mu:
+            self.value = value
+
+    def dec(self, n: float = 1):
+        self.inc(-n)
+
+
+class Histogram:
+    """对数线性分桶的直方图(HDR 风格)
+
+    以 unit 为精度把观测值取整, 每个 2 的幂区间再细分为 2**(SUB_BITS-1) 个桶,
+    相对误差不超过 1/2**(SUB_BITS-1), 桶数随量程对数增长; 默认精度 1 微秒
+    """
+    SUB_BITS = 6
+
+    def __init__(self, unit: float = 1e-6):
+        self.unit = unit
+        self.buckets: dict[int, int] = {}
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.mu = Lock()
+
+    @classmethod
+    def index(cls, v: int) -> int:
+        if v < (1 << cls.SUB_BITS):
+            return v
+        e = v.bit_length() - cls.SUB_BITS
+        half = 1 << (cls.SUB_BITS - 1)
+        return e * half + (v >> e)
+
+    @classmethod
+    def bounds(cls, idx: int) -> tuple[int, int]:
+        """桶 idx 覆盖的取整后数值范围 [low, high]"""
+        if idx < (1 << cls.SUB_BITS):
+            return idx, idx
+        half = 1 << (cls.SUB_BITS - 1)
+        e = idx // half - 1
+        m = idx - e * half
+        return m << e, ((m + 1) << e) - 1
+
+    def observe(self, value: float):
+        idx = self.index(max(0, int(value / self.unit)))
+        with self.mu:
+            self.buckets[idx] = self.buckets.get(idx, 0) + 1
+            self.count += 1
+            self.sum += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def percentile(self, q: float) -> float:
+        with self.mu:
+            if self.count == 0:
+                return 0.0
+            rank = q * self.count
+            seen = 0
+            for idx in sorted(self.buckets):
+                seen += self.buckets[idx]
+                if seen >= rank:
+                    low, high = self.bounds(idx)
+                    value = (low + high) / 2 * self.unit
+                    return min(max(value, self.min), self.max)
+            return self.max
+
+    def snapshot(self) -> dict:
+        data = {q: self.percentile(q) for q in QUANTILES}
+        with self.mu:
+            return {
+                "count": self.count, "sum": self.sum, "min": self.min, "max": self.max, "unit": self.unit,
+                "quantiles": {str(q): v for q, v in data.items()},
+                "buckets": {str(k): v for k, v in self.buckets.items()},
+            }
+
+    def load(self, data: dict):
+        """合并另一个直方图的快照(例如其他 worker 进程的统计)"""
+        with self.mu:
+            for k, v in data["buckets"].items():
+                self.buckets[int(k)] = self.buckets.get(int(k), 0) + v
+            self.count += data["count"]
+            self.sum += data["sum"]
+            for attr, pick in (("min", min), ("max", max)):
+                other = data[attr]
+                if other is not None:
+                    mine = getattr(self, attr)
+                    setattr(self, attr, other if mine is None else pick(mine, other))
+
+
+_TYPES = {"counter": Counter, "gauge": Gauge, "histogram": Histogram}
+
+
+class Registry:
+    """按 名称+标签 管理指标, 可导出 JSON 快照与 Prometheus 文本格式"""
+
+    def __init__(self):
+        self.families: dict[str, dict] = {}
+        self.mu = Lock()
+
+    def _get(self, kind: str, name: str, help: str, labels: dict):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self.mu:
+            family = self.families.get(name)
+            if family is None:
+                family = {"type": kind, "help": help, "series": {}}
+                self.families[name] = family
+            elif family["type"] != kind:
+                raise ValueError(f"指标{name} 已注册为{family['type']}")
+            metric = family["series"].get(key)
+            if metric is None:
+                metric = _TYPES[kind]()
+                family["series"][key] = metric
+            return metric
+
+    def counter(self, name: str, help: str = "", **labels) -> Counter:
+        return self._get("counter", name, help, labels)
+
+    def gauge(self, name: str, help: str = "", **labels) -> Gauge:
+        return self._get("gauge", name, help, labels)
+
+    def histogram(self, name: str, help: str = "", **labels) -> Histogram:
+        return self._get("histogram", name, help, labels)
+
+    def snapshot(self) -> dict:
+        with self.mu:
+            families = {name: (f["type"], f["help"], list(f["series"].items())) for name, f in self.families.items()}
+        return {
+            name: {"type": kind, "help": help,
+                   "series": [dict(labels=dict(key), **metric.snapshot()) for key, metric in series]}
+            for name, (kind, help, series) in families.items()
+        }
+
+    def load(self, snapshot: dict):
+        """把快照累加到本注册表中"""
+        for name, family in snapshot.items():
+            for series in family["series"]:
+                labels = series["labels"]
+                self._get(family["type"], name, family["help"], labels).load(series)
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), ensure_ascii=False)
+
+    def prometheus(self) -> str:
+        lines = []
+        for name, family in sorted(self.snapshot().items()):
+            kind = "summary" if family["type"] == "histogram" else family["type"]
+            if family["help"]:
+                lines.append(f"# HELP {name} {_escape(family['help'], quote=False)}")
+            lines.append(f"# TYPE {name} {kind}")
+            for series in family["series"]:
+                labels = series["labels"]
+                if family["type"] != "histogram":
+                    lines.append(f"{name}{_labels(labels)} {series['value']}")
+                    continue
+                for q, v in series["quantiles"].items():
+                    lines.append(f"{name}{_labels(dict(labels, quantile=q))} {v}")
+                lines.append(f"{name}_sum{_labels(labels)} {series['sum']}")
+                lines.append(f"{name}_count{_labels(labels)} {series['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    body = ",".join(f'{k}="{_escape(str(v))}"' for k, v in sorted(labels.items()))
+    return "{" + body + "}"
+
+
+def _escape(text: str, quote: bool = True) -> str:
+    """文本格式要求标签值转义反斜杠、双引号与换行, HELP 只转义反斜杠与换行"""
+    text = text.replace("\\", "\\\\").replace("\n", "\\n")
+    return text.replace('"', '\\"') if quote else text
+
+
+# 进程内默认注册表
+REGISTRY = Registry()
+
+
+def metrics_hook(registry: Registry = REGISTRY):
+    """统计每个 RPC 的调用次数、失败次数、并发数与延迟"""
+
+    @contextmanager
+    def hook(call: Call):
+        inflight = registry.gauge("rpc_in_flight", "正在处理的请求数", method=call.op)
+        inflight.inc()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            inflight.dec()
+            registry.histogram("rpc_latency_seconds", "RPC 处理耗时", method=call.op).observe(time.perf_counter() - start)
+            registry.counter("rpc_requests_total", "RPC 调用次数", method=call.op).inc()
+            if call.error is not None or not getattr(call.response, "errno", True):
+                registry.counter("rpc_errors_total", "失败的 RPC 次数", method=call.op).inc()
+
+    return hook
+
+
+def serve_prometheus(port: int, render=None, host: str = "") -> ThreadingHTTPServer:
+    """在后台线程中以 Prometheus 文本格式暴露 /metrics, render 默认导出 REGISTRY"""
+    render = render or REGISTRY.prometheus
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
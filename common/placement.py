@@ -0,0 +1,110 @@
+﻿import bisect
+import hashlib
+import time
+from threading import Lock
+
+import grpc
+
+from protos import mapb_pb2 as mapb
+from protos import mapb_pb2_grpc as mapb_grpc
+from params import params
+
+
+def _hash(data: str) -> int:
+    # 不能使用内置 hash(), 其结果在不同进程间不一致
+    return int.from_bytes(hashlib.md5(data.encode()).digest()[:8], "big")
+
+
+class ClusterMap:
+    """管理服务器发布的集群视图: 在线的存储节点与键的放置规则, epoch 随成员变更递增
+
+    键按一致性哈希放置, 从键的位置顺时针遇到的前 replicas 个不同节点保存其副本, 第一个为主副本,
+    负责协调该键的写入; replicas 为 0 时每个节点都保存全部键值, 主副本仍按哈希环确定。
+    引导中(joining)的节点已经是副本, 接收新的写入, 但还不用于读取
+    """
+
+    def __init__(self, nodes: dict[int, str] | None = None, epoch: int = 0, replicas: int = 0,
+                 vnodes: int = params.VNODES, joining: set[int] | None = None):
+        self.nodes = dict(nodes or {})  # server_id -> ip:port
+        self.joining = set(joining or ())
+        self.epoch = epoch
+        self.replicas = replicas
+        self.vnodes = vnodes
+        ring = sorted((_hash(f"{sid}#{i}"), sid) for sid in self.nodes for i in range(vnodes))
+        self.points = [point for point, _ in ring]
+        self.sids = [sid for _, sid in ring]
+
+    @classmethod
+    def from_proto(cls, resp: mapb.Topology | mapb.TopologyEvent) -> "ClusterMap":
+        return cls({n.server_id: n.ip + n.port for n in resp.nodes}, resp.epoch, resp.replicas,
+                   resp.vnodes or params.VNODES, {n.server_id for n in resp.nodes if n.joining})
+
+    def owners(self, key: str) -> list[int]:
+        """保存该键副本的节点, 第一个为主副本"""
+        want = len(self.nodes) if self.replicas <= 0 else min(self.replicas, len(self.nodes))
+        owners: list[int] = []
+        start = bisect.bisect(self.points, _hash(key))
+        for i in range(len(self.sids)):
+            sid = self.sids[(start + i) % len(self.sids)]
+            if sid not in owners:
+                owners.append(sid)
+                if len(owners) == want:
+                    break
+        return owners
+
+    def targets(self, key: str) -> dict[int, str]:
+        """保存该键副本的节点地址, 按 owners 的顺序"""
+        return {sid: self.nodes[sid] for sid in self.owners(key)}
+
+
+def majority(values: list[str]) -> tuple[str, bool]:
+    """多数表决, 超过半数的副本返回相同值时才认为达成一致"""
+    counts: dict[str, int] = {}
+    for v in values:
+        counts[v] = counts.get(v, 0) + 1
+    if not counts:
+        return "", False
+    value, cnt = max(counts.items(), key=lambda item: item[1])
+    return value, cnt > len(values) // 2
+
+
+class ClusterView:
+    """存储节点缓存的 ClusterMap, 超过 ttl 秒后在下一次使用时向管理服务器重新拉取
+
+    不订阅 watchTopology: 每个订阅都会占用管理服务器的一个工作线程; 拉取失败时沿用最后一次的视图
+    """
+
+    def __init__(self, manager: str, pool, logger, ttl: float = params.CLUSTER_MAP_TTL):
+        self.manager = manager
+        self.pool = pool
+        self.logger = logger
+        self.ttl = ttl
+        self.map = ClusterMap()
+        self.fetched = 0.0
+        self.mu = Lock()
+        self.closed = False
+
+    def refresh(self) -> ClusterMap:
+        if self.closed:
+            return self.map
+        try:
+            stub = mapb_grpc.manageServiceStub(self.pool.get(self.manager))
+            resp = stub.topology(mapb.Empty(), timeout=params.RPC_TIMEOUT)
+        except grpc.RpcError as e:
+            self.logger.error("获取集群视图失败 %s", e.details() or e.code().name)
+            return self.map
+        cluster = ClusterMap.from_proto(resp)
+        with self.mu:
+            # 并发拉取时保留 epoch 较新的结果
+            if cluster.epoch >= self.map.epoch:
+                self.map = cluster
+            self.fetched = time.monotonic()
+            return self.map
+
+    def get(self) -> ClusterMap:
+        if time.monotonic() - self.fetched > self.ttl:
+            return self.refresh()
+        return self.map
+
+    def close(self):
+        self.closed = True
@@ -0,0 +1,224 @@
+﻿import asyncio
+import time
+from contextlib import nullcontext
+from threading import Lock
+
+import grpc
+
+from params import params
+from common.tracing import traced_aio_channel, traced_channel
+
+LEADER_KEY = "x-manager-leader"  # 管理服务器组中非 leader 成员拒绝请求时, trailing metadata 中的 leader 地址
+
+
+def leader_hint(error: grpc.RpcError) -> str | None:
+    """请求被非 leader 成员拒绝时返回它给出的 leader 地址(选举中为空串), 其他错误返回 None"""
+    if error.code() != grpc.StatusCode.FAILED_PRECONDITION:
+        return None
+    for key, value in error.trailing_metadata() or ():
+        if key == LEADER_KEY:
+            return value
+    return None
+
+
+class LeaderChannel:
+    """逗号分隔的管理服务器组地址: 请求发往当前 leader, 被拒绝时切换到给出的地址, 不可达时依次尝试其他成员
+
+    只有一元调用自动重试; 流式调用出错时记下新的 leader 后照常抛出, 由调用方重新发起
+    """
+
+    def __init__(self, pool, targets: list[str]):
+        self.pool = pool
+        self.targets = targets
+        self.leader = targets[0]
+
+    def _redirect(self, error: grpc.RpcError) -> float | None:
+        """根据错误切换 leader, 返回重试前的等待秒数, 不应重试时返回 None"""
+        hint = leader_hint(error)
+        if hint:
+            self.leader = hint
+            return 0.0
+        if hint is None and error.code() != grpc.StatusCode.UNAVAILABLE:
+            return None
+        # 选举中或当前节点不可达, 稍后尝试下一个成员
+        i = self.targets.index(self.leader) if self.leader in self.targets else -1
+        self.leader = self.targets[(i + 1) % len(self.targets)]
+        return params.LEADER_RETRY_DELAY
+
+    def _channel(self):
+        return self.pool.get(self.leader)
+
+    def unary_unary(self, method, *args, **kwargs):
+        def call(request, *a, **kw):
+            for attempt in range(params.LEADER_RETRIES):
+                try:
+                    return self._channel().unary_unary(method, *args, **kwargs)(request, *a, **kw)
+                except grpc.RpcError as e:
+                    delay = self._redirect(e)
+                    if delay is None or attempt == params.LEADER_RETRIES - 1:
+                        raise
+                    time.sleep(delay)
+        return call
+
+    def unary_stream(self, method, *args, **kwargs):
+        def call(request, *a, **kw):
+            return _LeaderStream(self, self._channel().unary_stream(method, *args, **kwargs)(request, *a, **kw))
+        return call
+
+    def stream_unary(self, method, *args, **kwargs):
+        def call(request_iterator, *a, **kw):
+            try:
+                return self._channel().stream_unary(method, *args, **kwargs)(request_iterator, *a, **kw)
+            except grpc.RpcError as e:
+                self._redirect(e)
+                raise
+        return call
+
+    def stream_stream(self, method, *args, **kwargs):
+        def call(request_iterator, *a, **kw):
+            return _LeaderStream(self, self._channel().stream_stream(method, *args, **kwargs)(request_iterator, *a, **kw))
+        return call
+
+    def close(self):
+        # 各成员的连接属于连接池, 由连接池关闭
+        pass
+
+
+class _LeaderStream:
+    """流式调用的响应迭代器, 出错时更新 LeaderChannel 的 leader"""
+
+    def __init__(self, channel: LeaderChannel, call):
+        self.channel = channel
+        self.call = call
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.call)
+        except grpc.RpcError as e:
+            self.channel._redirect(e)
+            raise
+
+    def __getattr__(self, name):
+        return getattr(self.call, name)
+
+
+class AsyncLeaderChannel(LeaderChannel):
+    """grpc.aio 版本的 LeaderChannel"""
+
+    def unary_unary(self, method, *args, **kwargs):
+        async def call(request, *a, **kw):
+            for attempt in range(params.LEADER_RETRIES):
+                try:
+                    return await self._channel().unary_unary(method, *args, **kwargs)(request, *a, **kw)
+                except grpc.RpcError as e:
+                    delay = self._redirect(e)
+                    if delay is None or attempt == params.LEADER_RETRIES - 1:
+                        raise
+                    await asyncio.sleep(delay)
+        return call
+
+    def unary_stream(self, method, *args, **kwargs):
+        async def call(request, *a, **kw):
+            try:
+                async for response in self._channel().unary_stream(method, *args, **kwargs)(request, *a, **kw):
+                    yield response
+            except grpc.RpcError as e:
+                self._redirect(e)
+                raise
+        return call
+
+    def stream_unary(self, method, *args, **kwargs):
+        async def call(request_iterator, *a, **kw):
+            try:
+                return await self._channel().stream_unary(method, *args, **kwargs)(request_iterator, *a, **kw)
+            except grpc.RpcError as e:
+                self._redirect(e)
+                raise
+        return call
+
+    def stream_stream(self, method, *args, **kwargs):
+        async def call(request_iterator, *a, **kw):
+            try:
+                async for response in self._channel().stream_stream(method, *args, **kwargs)(request_iterator, *a, **kw):
+                    yield response
+            except grpc.RpcError as e:
+                self._redirect(e)
+                raise
+        return call
+
+    async def close(self):
+        pass
+
+
+class ChannelPool:
+    """按目标地址复用 gRPC 连接, 线程安全
+
+    gRPC channel 自带断线重连, 同一地址只需一个; 节点下线或确认失联时调用 discard 关闭。
+    逗号分隔的多个地址表示管理服务器组, 返回跟随 leader 的 LeaderChannel
+    """
+
+    def __init__(self, compression: grpc.Compression | None = None):
+        self.compression = compression
+        self.channels: dict[str, grpc.Channel] = {}
+        self.mu = Lock()
+
+    def get(self, target: str) -> grpc.Channel:
+        with self.mu:
+            ch = self.channels.get(target)
+            if ch is None:
+                if "," in target:
+                    ch = LeaderChannel(self, target.split(","))
+                else:
+                    ch = traced_channel(target, compression=self.compression)
+                self.channels[target] = ch
+            return ch
+
+    def channel(self, target: str):
+        """兼容原有的 with self._channel(target) as ch 写法, 退出时不关闭连接"""
+        return nullcontext(self.get(target))
+
+    def discard(self, target: str):
+        with self.mu:
+            ch = self.channels.pop(target, None)
+        if ch is not None:
+            ch.close()
+
+    def close(self):
+        with self.mu:
+            channels, self.channels = self.channels, {}
+        for ch in channels.values():
+            ch.close()
+
+
+class AsyncChannelPool:
+    """grpc.aio 版本的 ChannelPool, 只能在创建连接的事件循环中使用"""
+
+    def __init__(self, compression: grpc.Compression | None = None):
+        self.compression = compression
+        self.channels: dict[str, grpc.aio.Channel] = {}
+
+    def get(self, target: str) -> grpc.aio.Channel:
+        ch = self.channels.get(target)
+        if ch is None:
+            if "," in target:
+                ch = AsyncLeaderChannel(self, target.split(","))
+            else:
+                ch = traced_aio_channel(target, compression=self.compression)
+            self.channels[target] = ch
+        return ch
+
+    def channel(self, target: str):
+        return nullcontext(self.get(target))
+
+    async def discard(self, target: str):
+        ch = self.channels.pop(target, None)
+        if ch is not None:
+            await ch.close()
+
+    async def close(self):
+        channels, self.channels = self.channels, {}
+        for ch in channels.values():
+            await ch.close()
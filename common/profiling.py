@@ -0,0 +1,165 @@
+﻿import asyncio
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+from common.interceptors import Call
+from common.metrics import REGISTRY, Registry
+
+# 同一进程同时只能有一个 cProfile 处于开启状态(3.12 起 cProfile 对所有线程生效)
+_busy = Lock()
+
+MODES = ("cprofile", "sample")
+# profile RPC 单次采集的最长时间(秒)
+MAX_SECONDS = 60.0
+
+
+class ProfileBusy(Exception):
+    pass
+
+
+def run_cprofile(seconds: float, top: int = 40) -> tuple[str, bytes]:
+    """开启 cProfile 采集 seconds 秒, 返回按累计耗时排序的文本与可由 pstats 加载的原始数据"""
+    if not _busy.acquire(blocking=False):
+        raise ProfileBusy("已有正在进行的性能分析")
+    try:
+        prof = cProfile.Profile()
+        prof.enable()
+        time.sleep(seconds)
+        prof.disable()
+    finally:
+        _busy.release()
+    prof.create_stats()
+    return format_pstats(prof.stats, top), marshal.dumps(prof.stats)
+
+
+def format_pstats(raw: dict, top: int = 40) -> str:
+    stream = io.StringIO()
+    stats = pstats.Stats(stream=stream)
+    stats.stats = raw
+    stats.get_top_level_stats()
+    stats.strip_dirs().sort_stats("cumulative").print_stats(top)
+    return stream.getvalue()
+
+
+def merge_pstats(raws: list[bytes]) -> dict:
+    """合并多个进程的 cProfile 原始数据"""
+    merged: dict = {}
+    for raw in raws:
+        for func, (cc, nc, tt, ct, callers) in marshal.loads(raw).items():
+            if func in merged:
+                old = merged[func]
+                callers = pstats.add_callers(old[4], callers)
+                cc, nc, tt, ct = cc + old[0], nc + old[1], tt + old[2], ct + old[3]
+            merged[func] = (cc, nc, tt, ct, callers)
+    return merged
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_qualname}"
+
+
+def run_sampler(seconds: float, interval: float = 0.01) -> tuple[str, int]:
+    """每隔 interval 秒采样一次所有线程的调用栈, 返回折叠栈格式(每行 "栈;帧 次数")与采样次数
+
+    折叠栈可直接交给 flamegraph.pl / speedscope 生成火焰图
+    """
+    if not _busy.acquire(blocking=False):
+        raise ProfileBusy("已有正在进行的性能分析")
+    me = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    counts: dict[str, int] = {}
+    samples = 0
+    try:
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                line = ";".join(reversed(stack))
+                counts[line] = counts.get(line, 0) + 1
+            samples += 1
+            time.sleep(interval)
+    finally:
+        _busy.release()
+    return collapse(counts), samples
+
+
+def collapse(counts: dict[str, int]) -> str:
+    return "".join(f"{stack} {n}\n" for stack, n in sorted(counts.items(), key=lambda kv: -kv[1]))
+
+
+def merge_collapsed(texts: list[str]) -> str:
+    counts: dict[str, int] = {}
+    for text in texts:
+        for line in text.splitlines():
+            stack, _, n = line.rpartition(" ")
+            if stack:
+                counts[stack] = counts.get(stack, 0) + int(n)
+    return collapse(counts)
+
+
+def profile(mode: str, seconds: float, interval: float = 0.01, top: int = 40) -> tuple[str, bytes]:
+    """按 mode 采集 seconds 秒, 返回 (文本结果, cProfile 原始数据或空)"""
+    if mode == "cprofile":
+        return run_cprofile(seconds, top)
+    if mode == "sample":
+        text, _ = run_sampler(seconds, interval)
+        return text, b""
+    raise ValueError(f"未知的分析模式 {mode}, 可选 {', '.join(MODES)}")
+
+
+def handle(request, response_cls):
+    """profile RPC 的公共实现, request 含 mode/seconds/interval/top, 未指定时使用默认值
+
+    采集期间占用一个工作线程, 请求的时长超过 MAX_SECONDS 时按 MAX_SECONDS 采集
+    """
+    seconds = request.seconds or 5.0
+    interval = request.interval or 0.01
+    # 写成 not x > 0 以同时拒绝 NaN
+    if not seconds > 0 or not interval > 0:
+        return response_cls(errno=False, errmes="采集时长与采样间隔必须为正数")
+    try:
+        text, raw = profile(request.mode or "cprofile", min(seconds, MAX_SECONDS),
+                            min(interval, MAX_SECONDS), request.top or 40)
+    except (ProfileBusy, ValueError) as e:
+        return response_cls(errno=False, errmes=str(e))
+    return response_cls(errno=True, text=text, raw=raw)
+
+
+def cpu_hook(registry: Registry = REGISTRY):
+    """常开的处理函数 CPU 耗时统计, 与 rpc_latency_seconds 的墙钟耗时对照可区分计算与等待
+
+    CPU 时间按线程统计, aio 模式下一个协程的耗时会混入同一事件循环中其他协程, 因此只统计同步处理函数
+    """
+
+    @contextmanager
+    def hook(call: Call):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            yield
+            return
+        start = time.thread_time()
+        try:
+            yield
+        finally:
+            registry.counter("rpc_cpu_seconds_total", "处理函数占用的 CPU 时间",
+                             method=call.op).inc(time.thread_time() - start)
+
+    return hook
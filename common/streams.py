@@ -0,0 +1,32 @@
+﻿from threading import Lock
+
+import grpc
+
+
+class StreamLimit:
+    """限制同时存在的订阅流数量
+
+    同步 gRPC 服务中每个订阅流在整个生命周期内占用一个工作线程, 不加限制时订阅者会耗尽线程池,
+    使普通请求(包括两阶段提交)得不到处理; aio 服务的订阅不占用线程, 不受此限制
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.mu = Lock()
+
+    def acquire(self) -> bool:
+        with self.mu:
+            if self.active >= self.limit:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self.mu:
+            self.active -= 1
+
+    def enter(self, context, name: str):
+        """在流式处理函数开头调用, 超过上限时以 RESOURCE_EXHAUSTED 结束本次调用, 客户端按退避重试"""
+        if not self.acquire():
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, f"{name} 订阅数已达上限 {self.limit}")
@@ -0,0 +1,260 @@
+﻿import contextvars
+import logging
+import os
+import random
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from threading import Lock
+
+import grpc
+
+from common.interceptors import Call
+
+# trace/span ID 通过 gRPC 元数据在各跳之间传递
+TRACE_HEADER = "x-trace-id"
+SPAN_HEADER = "x-span-id"
+
+
+class Span:
+    def __init__(self, name: str, service: str, trace_id: str, parent_id: str = "", **tags):
+        self.name = name
+        self.service = service
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.tags = tags
+        self.error = ""
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self.ms = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+            "name": self.name, "service": self.service, "start": round(self.start, 6),
+            "ms": round(self.ms, 3), "tags": self.tags, "error": self.error,
+        }
+
+
+# 当前线程/协程所在的 span, 为 None 表示本次请求不追踪
+current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """收集结束的 span: 保存在内存环形缓冲区中供 RPC 查询, 可选地同时写入文件"""
+
+    def __init__(self, capacity: int = 4096):
+        self.spans: deque[dict] = deque(maxlen=capacity)
+        self.sink: logging.Logger | None = None
+        self.sample = 0.0  # 没有上游 trace 时新建 trace 的比例
+        self.mu = Lock()
+
+    def configure(self, capacity: int | None = None, sample: float | None = None, sink: logging.Logger | None = None):
+        if capacity is not None:
+            with self.mu:
+                self.spans = deque(self.spans, maxlen=capacity)
+        if sample is not None:
+            self.sample = sample
+        if sink is not None:
+            self.sink = sink
+
+    def sampled(self) -> bool:
+        return self.sample > 0 and random.random() < self.sample
+
+    def start(self, name: str, service: str = "", trace_id: str = "", parent_id: str = "", **tags) -> Span:
+        """开始一个 span, 未指定 trace_id 时作为当前 span 的子 span, 没有当前 span 则新建 trace"""
+        parent = current_span.get()
+        if not trace_id:
+            if parent is not None:
+                trace_id, parent_id = parent.trace_id, parent.span_id
+            else:
+                trace_id = os.urandom(16).hex()
+        if not service and parent is not None:
+            service = parent.service
+        return Span(name, service, trace_id, parent_id, **tags)
+
+    def finish(self, span: Span):
+        span.ms = (time.perf_counter() - span._t0) * 1000
+        record = span.to_dict()
+        with self.mu:
+            self.spans.append(record)
+        if self.sink is not None:
+            self.sink.info("span", extra={"entry": record})
+
+    @contextmanager
+    def span(self, name: str, service: str = "", trace_id: str = "", parent_id: str = "", **tags):
+        span = self.start(name, service, trace_id, parent_id, **tags)
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            current_span.reset(token)
+            self.finish(span)
+
+    @contextmanager
+    def child(self, name: str, **tags):
+        """仅在已处于追踪中时才记录的子 span, 未追踪的请求几乎没有额外开销"""
+        if current_span.get() is None:
+            yield None
+            return
+        with self.span(name, **tags) as span:
+            yield span
+
+    def query(self, trace_id: str = "", limit: int = 0) -> list[dict]:
+        with self.mu:
+            spans = list(self.spans)
+        if trace_id:
+            spans = [s for s in spans if s["trace_id"] == trace_id]
+        if limit > 0:
+            spans = spans[-limit:]
+        return spans
+
+
+# 进程内默认 tracer
+TRACER = Tracer()
+
+
+def tracing_hook(service: str, tracer: Tracer = TRACER):
+    """为每个 RPC 记录一个服务端 span, 上游带有 trace 元数据时接续该 trace, 否则按比例采样"""
+
+    @contextmanager
+    def hook(call: Call):
+        metadata = dict(call.context.invocation_metadata()) if call.context is not None else {}
+        trace_id = metadata.get(TRACE_HEADER, "")
+        if not trace_id and not tracer.sampled():
+            yield
+            return
+        tags = {"kind": "server", "peer": call.context.peer() if call.context is not None else ""}
+        key = getattr(call.request, "key", "")
+        if key:
+            tags["key"] = key
+        span = tracer.start(call.op, service, trace_id or os.urandom(16).hex(), metadata.get(SPAN_HEADER, ""), **tags)
+        token = current_span.set(span)
+        try:
+            yield
+        finally:
+            if call.error is not None:
+                span.error = type(call.error).__name__
+            elif not getattr(call.response, "errno", True):
+                span.error = getattr(call.response, "errmes", "") or "errno=false"
+            current_span.reset(token)
+            tracer.finish(span)
+
+    return hook
+
+
+def _outgoing(metadata, span: Span) -> list[tuple[str, str]]:
+    pairs = [(k, v) for k, v in (metadata or ()) if k not in (TRACE_HEADER, SPAN_HEADER)]
+    pairs.append((TRACE_HEADER, span.trace_id))
+    pairs.append((SPAN_HEADER, span.span_id))
+    return pairs
+
+
+class _Details(namedtuple("_Details", ("method", "timeout", "metadata", "credentials",
+                                       "wait_for_ready", "compression")),
+               grpc.ClientCallDetails):
+    pass
+
+
+class TraceClientInterceptor(grpc.UnaryUnaryClientInterceptor, grpc.UnaryStreamClientInterceptor,
+                             grpc.StreamUnaryClientInterceptor, grpc.StreamStreamClientInterceptor):
+    """在追踪中的请求发出时附加 trace 元数据, 一元响应的调用额外记录客户端 span(含网络耗时)"""
+
+    def __init__(self, target: str, tracer: Tracer = TRACER):
+        self.target = target
+        self.tracer = tracer
+
+    def _details(self, details, span: Span) -> _Details:
+        return _Details(details.method, details.timeout, _outgoing(details.metadata, span), details.credentials,
+                        details.wait_for_ready, details.compression)
+
+    def _unary(self, continuation, details, request):
+        if current_span.get() is None:
+            return continuation(details, request)
+        op = details.method.rsplit("/", 1)[-1]
+        with self.tracer.span(op, kind="client", target=self.target) as span:
+            outcome = continuation(self._details(details, span), request)
+            # .future() 发起的调用此时可能尚未完成, 只记录已完成调用的错误
+            if outcome.done() and outcome.exception() is not None:
+                span.error = outcome.code().name
+            return outcome
+
+    def _stream(self, continuation, details, request):
+        span = current_span.get()
+        if span is None:
+            return continuation(details, request)
+        return continuation(self._details(details, span), request)
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        return self._unary(continuation, client_call_details, request)
+
+    def intercept_stream_unary(self, continuation, client_call_details, request_iterator):
+        return self._unary(continuation, client_call_details, request_iterator)
+
+    def intercept_unary_stream(self, continuation, client_call_details, request):
+        return self._stream(continuation, client_call_details, request)
+
+    def intercept_stream_stream(self, continuation, client_call_details, request_iterator):
+        return self._stream(continuation, client_call_details, request_iterator)
+
+
+class AsyncTraceClientInterceptor(grpc.aio.UnaryUnaryClientInterceptor, grpc.aio.StreamUnaryClientInterceptor):
+    """grpc.aio 版本的 TraceClientInterceptor"""
+
+    def __init__(self, target: str, tracer: Tracer = TRACER):
+        self.target = target
+        self.tracer = tracer
+
+    def _details(self, details, span: Span) -> grpc.aio.ClientCallDetails:
+        return grpc.aio.ClientCallDetails(details.method, details.timeout,
+                                          grpc.aio.Metadata(*_outgoing(details.metadata, span)),
+                                          details.credentials, details.wait_for_ready)
+
+    async def _unary(self, continuation, details, request):
+        if current_span.get() is None:
+            return await continuation(details, request)
+        method = details.method.decode() if isinstance(details.method, bytes) else details.method
+        with self.tracer.span(method.rsplit("/", 1)[-1], kind="client", target=self.target):
+            call = await continuation(self._details(details, current_span.get()), request)
+            await call
+            return call
+
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        return await self._unary(continuation, client_call_details, request)
+
+    async def intercept_stream_unary(self, continuation, client_call_details, request_iterator):
+        return await self._unary(continuation, client_call_details, request_iterator)
+
+
+def traced_channel(target: str, compression: grpc.Compression | None = None) -> grpc.Channel:
+    return grpc.intercept_channel(grpc.insecure_channel(target, compression=compression),
+                                  TraceClientInterceptor(target))
+
+
+def traced_aio_channel(target: str, compression: grpc.Compression | None = None) -> grpc.aio.Channel:
+    return grpc.aio.insecure_channel(target, compression=compression,
+                                     interceptors=[AsyncTraceClientInterceptor(target)])
+
+
+def format_tree(spans: list[dict]) -> str:
+    """按父子关系缩进输出同一 trace 的 span"""
+    ids = {s["span_id"] for s in spans}
+    children: dict[str, list[dict]] = {}
+    for s in spans:
+        parent = s["parent_id"] if s["parent_id"] in ids else ""
+        children.setdefault(parent, []).append(s)
+    lines = []
+
+    def walk(parent: str, depth: int):
+        for s in sorted(children.get(parent, []), key=lambda s: s["start"]):
+            extra = " ".join(f"{k}={v}" for k, v in s["tags"].items() if k not in ("kind", "peer"))
+            error = f" 错误: {s['error']}" if s["error"] else ""
+            lines.append(f"{'  ' * depth}{s['service']} {s['name']} {s['ms']:.3f}ms {extra}{error}".rstrip())
+            walk(s["span_id"], depth + 1)
+
+    walk("", 0)
+    return "\n".join(lines)
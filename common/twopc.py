@@ -0,0 +1,39 @@
+﻿import threading
+import time
+from contextlib import contextmanager
+
+from common.metrics import REGISTRY
+from common.tracing import TRACER
+
+
+@contextmanager
+def phase(op: str, name: str, key: str):
+    """统计两阶段提交某一阶段的耗时, 处于追踪中时同时记录该阶段的 span"""
+    start = time.perf_counter()
+    try:
+        with TRACER.child(name, op=op, key=key):
+            yield
+    finally:
+        REGISTRY.histogram("twopc_phase_seconds", "两阶段提交各阶段耗时",
+                           op=op, phase=name).observe(time.perf_counter() - start)
+
+
+def observe(sid: int, method: str, start: float):
+    REGISTRY.histogram("node_rpc_seconds", "向各存储服务器发起的 RPC 耗时",
+                       node=sid, method=method).observe(time.perf_counter() - start)
+
+
+def rounds(op: str, result: str):
+    REGISTRY.counter("twopc_rounds_total", "两阶段提交轮数", op=op, result=result).inc()
+
+
+_stamp_mu = threading.Lock()
+_last_stamp = 0
+
+
+def stamp() -> int:
+    """协调者为一轮写入分配的版本号: 纳秒时间戳, 同一进程内严格递增"""
+    global _last_stamp
+    with _stamp_mu:
+        _last_stamp = max(time.time_ns(), _last_stamp + 1)
+        return _last_stamp
@@ -0,0 +1,138 @@
+﻿import json
+import os
+import threading
+
+from protos import stpb_pb2 as stpb
+from params import params
+from common.metrics import REGISTRY
+
+TX_RECOVERED = REGISTRY.counter("twopc_recovered_total", "协调者重启后重新驱动完成的事务数")
+
+
+class TxLog:
+    """两阶段提交协调者的决议日志
+
+    发出准备请求前记录事务与参与者(begin), 发出第二阶段前记录决议(decide), 两者都落盘后才继续;
+    第二阶段送达后记录结束(end)。重启时未结束的事务按日志中的决议提交, 没有决议的按回滚处理(presumed abort),
+    每个参与者只收到一个批量的 resolve 请求。path 为空时不记录
+    """
+
+    def __init__(self, path: str, logger, interval: float = params.HINT_INTERVAL):
+        self.path = path
+        self.logger = logger
+        self.interval = interval
+        self.txs: dict[str, dict] = {}  # 未结束的事务, commit 为 None 表示还没有决议
+        self.records = 0  # 日志文件中的记录数, 超过 TXLOG_COMPACT 且没有未结束的事务时清空
+        self.mu = threading.Lock()
+        self.stop = threading.Event()
+        self.thread: threading.Thread | None = None
+        self.file = None  # 第一次写入时打开
+        if path:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # 写到一半时崩溃的最后一行
+                    self.records += 1
+                    self._replay(record)
+        except FileNotFoundError:
+            return
+        if self.txs:
+            self.logger.info("决议日志中有%s个未完成的事务", len(self.txs))
+
+    def _replay(self, record: dict):
+        tx = record["tx"]
+        if record["op"] == "begin":
+            self.txs[tx] = {"tx": tx, "participants": record["participants"], "key": record["key"],
+                            "batch": record["batch"], "delete": record["delete"], "commit": None}
+        elif record["op"] == "decide" and tx in self.txs:
+            self.txs[tx]["commit"] = record["commit"]
+        elif record["op"] == "end":
+            self.txs.pop(tx, None)
+
+    def _append(self, record: dict, sync: bool):
+        with self.mu:
+            self._replay(record)
+            if not self.path:
+                return
+            if self.file is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self.file = open(self.path, "a", encoding="utf-8")
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.file.flush()
+            if sync:
+                os.fsync(self.file.fileno())
+            self.records += 1
+            if not self.txs and self.records >= params.TXLOG_COMPACT:
+                self.file.truncate(0)
+                self.records = 0
+
+    def begin(self, tx: str, participants: dict[int, str], key: str = "", batch: str = "", delete: bool = False):
+        self._append({"tx": tx, "op": "begin", "participants": {str(sid): t for sid, t in participants.items()},
+                      "key": key, "batch": batch, "delete": delete}, sync=True)
+
+    def decide(self, tx: str, commit: bool):
+        self._append({"tx": tx, "op": "decide", "commit": commit}, sync=True)
+
+    def end(self, tx: str):
+        # 丢失 end 只会在重启后多补发一次决议, 不需要落盘
+        self._append({"tx": tx, "op": "end"}, sync=False)
+
+    def pending(self) -> list[dict]:
+        with self.mu:
+            return [dict(tx) for tx in self.txs.values()]
+
+    def recover(self, fanout) -> int:
+        """向参与者补发未结束事务的决议, fanout 与协调者的 _fanout 相同; 返回完成的事务数"""
+        txs = self.pending()
+        if not txs:
+            return 0
+        targets: dict[int, str] = {}
+        requests: dict[int, stpb.StResolve] = {}
+        for tx in txs:
+            for sid, target in tx["participants"].items():
+                targets[int(sid)] = target
+                requests.setdefault(int(sid), stpb.StResolve()).decisions.add(
+                    key=tx["key"], batch=tx["batch"], delete=tx["delete"], commit=tx["commit"] is True, tx=tx["tx"])
+        results = fanout(targets, "resolve", requests)
+        done = {sid for sid, resp in results.items() if resp is not None and resp.errno}
+        resolved = 0
+        for tx in txs:
+            if all(int(sid) in done for sid in tx["participants"]):
+                self.end(tx["tx"])
+                resolved += 1
+        TX_RECOVERED.inc(resolved)
+        self.logger.info("重新驱动%s个未完成的事务, 完成%s个, 提交%s个", len(txs), resolved,
+                         sum(tx["commit"] is True for tx in txs))
+        return resolved
+
+    def start(self, fanout):
+        """立即恢复一次, 仍有参与者不可达时在后台每隔 interval 秒重试"""
+        self.recover(fanout)
+        if self.pending() and self.thread is None:
+            self.thread = threading.Thread(target=self._run, args=(fanout,), name="txlog", daemon=True)
+            self.thread.start()
+
+    def _run(self, fanout):
+        while self.pending() and not self.stop.wait(self.interval):
+            try:
+                self.recover(fanout)
+            except Exception as e:
+                self.logger.error("重新驱动事务时发生错误 %s", e)
+
+    def close(self):
+        self.stop.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.mu:
+            self.path = ""
+            if self.file is not None:
+                self.file.close()
+                self.file = None
@@ -0,0 +1,148 @@
+﻿import argparse
+import sys
+import time
+from collections import deque
+from concurrent import futures
+
+import grpc
+
+from protos import mapb_pb2 as mapb
+from protos import mapb_pb2_grpc as mapb_grpc
+from protos import stpb_pb2 as stpb
+from protos import stpb_pb2_grpc as stpb_grpc
+from params import params
+
+# 命令名 -> 参数个数, 语法与交互模式相同
+COMMANDS = {"GET": 1, "PUT": 2, "DEL": 1}
+
+
+def parse(line: str):
+    """解析一行命令, 空行与 # 开头的注释返回 None, 格式错误时抛出 ValueError"""
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    # PUT 的值可以包含空格
+    args = line.split(maxsplit=2)
+    cmd = args[0].upper()
+    if cmd not in COMMANDS:
+        raise ValueError(f"无效命令 {args[0]}")
+    if len(args) - 1 != COMMANDS[cmd]:
+        raise ValueError("不正确的参数个数")
+    return cmd, args[1:]
+
+
+def request(cmd: str, args: list[str], client_id: int):
+    if cmd == "GET":
+        return "getdata", stpb.StRequest(cli_id=client_id, key=args[0])
+    if cmd == "PUT":
+        return "putdata", stpb.StKV(cli_id=client_id, key=args[0], value=args[1])
+    return "deldata", stpb.StRequest(cli_id=client_id, key=args[0])
+
+
+def format_result(cmd: str, resp) -> tuple[bool, str]:
+    if not resp.errno:
+        return False, resp.errmes
+    if cmd == "GET":
+        return True, resp.value
+    return True, "OK"
+
+
+class _Done:
+    """已有结果的占位 future, 用于格式错误的行, 使输出仍按输入顺序排列"""
+
+    def __init__(self, error: str):
+        self.error = error
+
+    def result(self):
+        raise ValueError(self.error)
+
+
+def run(lines, stub, client_id: int = 0, window: int = 64, mode: str = "pipeline", out=sys.stdout) -> tuple[int, int]:
+    """按输入顺序输出每条命令的结果, 返回 (命令数, 失败数)
+
+    pipeline 模式在同一连接上用 .future() 连续发出请求, 最多 window 个同时在途;
+    thread 模式用 window 个线程各自发起阻塞调用。两种模式都不必等待上一条命令返回,
+    但同一个键的命令仍按输入顺序执行: 发出前先等待该键之前的命令完成
+    """
+    pool = futures.ThreadPoolExecutor(max_workers=window) if mode == "thread" else None
+    pending: deque = deque()
+    inflight: dict[str, int] = {}
+    total = failed = 0
+
+    def emit():
+        nonlocal failed
+        lineno, cmd, key, future = pending.popleft()
+        if key is not None:
+            inflight[key] -= 1
+            if not inflight[key]:
+                del inflight[key]
+        try:
+            ok, text = format_result(cmd, future.result())
+        except grpc.RpcError as e:
+            ok, text = False, e.details() or str(e.code())
+        except ValueError as e:
+            ok, text = False, str(e)
+        if not ok:
+            failed += 1
+        out.write(f"{lineno}\t{'OK' if ok else 'ERR'}\t{text}\n")
+
+    try:
+        for lineno, line in enumerate(lines, 1):
+            try:
+                parsed = parse(line)
+            except ValueError as e:
+                parsed = None
+                pending.append((lineno, "", None, _Done(str(e))))
+                total += 1
+            if parsed is not None:
+                cmd, args = parsed
+                key = args[0]
+                while key in inflight:
+                    emit()
+                method, req = request(cmd, args, client_id)
+                rpc = getattr(stub, method)
+                future = pool.submit(rpc, req) if pool is not None else rpc.future(req)
+                inflight[key] = inflight.get(key, 0) + 1
+                pending.append((lineno, cmd, key, future))
+                total += 1
+            while len(pending) >= window:
+                emit()
+        while pending:
+            emit()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        out.flush()
+    return total, failed
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("file", nargs="?", default="-", help="命令文件, 每行一条 get/put/del 命令, 默认从标准输入读取")
+    parser.add_argument("--mode", choices=("pipeline", "thread"), default="pipeline",
+                        help="pipeline: 单连接异步发送; thread: 多线程并发")
+    parser.add_argument("--window", type=int, default=64, help="同时在途的最大请求数")
+    parser.add_argument("--target", type=str, default="", help="存储节点地址, 默认向管理服务器申请")
+    parser.add_argument("--manager", type=str, default=params.MANAGER_IP + params.MANAGER_PORT, help="管理服务器地址")
+
+
+def main(args: argparse.Namespace) -> int:
+    client_id = 0
+    target = args.target
+    with grpc.insecure_channel(args.manager) as ma_chan:
+        ma_stub = mapb_grpc.manageServiceStub(ma_chan)
+        if not target:
+            info = ma_stub.connect(mapb.Empty())
+            if not info.errno:
+                print(info.errmes, file=sys.stderr)
+                return 1
+            client_id, target = info.cli_id, info.ip + info.port
+        try:
+            src = sys.stdin if args.file == "-" else open(args.file, encoding="utf-8")
+            start = time.perf_counter()
+            with src, grpc.insecure_channel(target) as ch:
+                total, failed = run(src, stpb_grpc.storagementServiceStub(ch), client_id, args.window, args.mode)
+        finally:
+            if client_id:
+                ma_stub.disconnect(mapb.CliId(cli_id=client_id))
+    print(f"共 {total} 条命令, 失败 {failed} 条, 耗时 {time.perf_counter() - start:.3f} 秒", file=sys.stderr)
+    return 1 if failed else 0
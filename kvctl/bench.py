@@ -0,0 +1,367 @@
+﻿import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import random
+import shutil
+import string
+import tempfile
+import threading
+import time
+from concurrent import futures
+
+import grpc
+
+from protos import mapb_pb2 as mapb
+from protos import mapb_pb2_grpc as mapb_grpc
+from protos import stpb_pb2 as stpb
+from protos import stpb_pb2_grpc as stpb_grpc
+from params import params
+from common.metrics import QUANTILES, Histogram
+from server.main import ManageService
+from storage.main import StoreService
+
+OPS = ("read", "update", "delete")
+
+
+class ZipfianGenerator:
+    """YCSB 的 Zipfian 分布 (Gray et al., "Quickly Generating Billion-Record Synthetic Databases")
+
+    0 号元素最热; scrambled=True 时再用 FNV 哈希打散, 热点键不再集中在编号靠前的键上
+    """
+
+    def __init__(self, n: int, theta: float = 0.99, scrambled: bool = True):
+        self.n = n
+        self.theta = theta
+        self.scrambled = scrambled
+        self.zetan = sum(1 / (i + 1) ** theta for i in range(n))
+        zeta2 = 1 + 0.5 ** theta
+        self.alpha = 1 / (1 - theta)
+        self.eta = (1 - (2 / n) ** (1 - theta)) / (1 - zeta2 / self.zetan)
+        self.half = 0.5 ** theta
+
+    def next(self, rng: random.Random) -> int:
+        u = rng.random()
+        uz = u * self.zetan
+        if uz < 1:
+            item = 0
+        elif uz < 1 + self.half:
+            item = 1
+        else:
+            item = min(self.n - 1, int(self.n * (self.eta * u - self.eta + 1) ** self.alpha))
+        return _fnv(item) % self.n if self.scrambled else item
+
+
+class UniformGenerator:
+    def __init__(self, n: int):
+        self.n = n
+
+    def next(self, rng: random.Random) -> int:
+        return rng.randrange(self.n)
+
+
+def _fnv(v: int) -> int:
+    h = 0xCBF29CE484222325
+    for _ in range(8):
+        h = ((h ^ (v & 0xFF)) * 0x100000001B3) & 0xFFFFFFFFFFFFFFFF
+        v >>= 8
+    return h
+
+
+class Workload:
+    """一次压测的负载配置: 键数量、键分布、各操作比例与值大小"""
+
+    def __init__(self, keys: int, read: float, delete: float = 0.0, dist: str = "zipfian", theta: float = 0.99,
+                 value_size: tuple[int, int] = (100, 100), seed: int = 0):
+        if dist == "zipfian":
+            self.chooser = ZipfianGenerator(keys, theta)
+        elif dist == "uniform":
+            self.chooser = UniformGenerator(keys)
+        else:
+            raise ValueError(f"未知的键分布 {dist}")
+        self.keys = keys
+        self.read = read
+        self.delete = delete
+        self.value_size = value_size
+        self.seed = seed
+        # 预先生成一段随机文本, 取不同长度的切片作为值, 避免压测时生成随机数据的开销
+        rng = random.Random(seed)
+        self.pool = "".join(rng.choices(string.ascii_letters + string.digits, k=max(value_size) * 2))
+
+    @staticmethod
+    def key(i: int) -> str:
+        return f"user{i:010d}"
+
+    def value(self, rng: random.Random) -> str:
+        size = rng.randint(*self.value_size)
+        start = rng.randrange(len(self.pool) - size + 1)
+        return self.pool[start:start + size]
+
+    def next(self, rng: random.Random) -> tuple[str, str, str]:
+        """返回 (操作, 键, 值), 读与删除操作的值为空"""
+        key = self.key(self.chooser.next(rng))
+        r = rng.random()
+        if r < self.read:
+            return "read", key, ""
+        if r < self.read + self.delete:
+            return "delete", key, ""
+        return "update", key, self.value(rng)
+
+
+class Recorder:
+    """按操作类型统计延迟与失败次数"""
+
+    def __init__(self):
+        self.latency = {op: Histogram() for op in OPS}
+        self.errors = {op: 0 for op in OPS}
+        self.mu = threading.Lock()
+
+    def record(self, op: str, seconds: float, ok: bool):
+        self.latency[op].observe(seconds)
+        if not ok:
+            with self.mu:
+                self.errors[op] += 1
+
+    def report(self, elapsed: float) -> dict:
+        total = Histogram()
+        result = {"elapsed": elapsed, "ops": {}}
+        for op in OPS:
+            hist = self.latency[op]
+            if hist.count == 0:
+                continue
+            total.load(hist.snapshot())
+            result["ops"][op] = _summary(hist, elapsed, self.errors[op])
+        result["total"] = _summary(total, elapsed, sum(self.errors.values()))
+        return result
+
+
+def _summary(hist: Histogram, elapsed: float, errors: int) -> dict:
+    return {
+        "count": hist.count, "errors": errors, "throughput": hist.count / elapsed if elapsed else 0.0,
+        "mean_ms": hist.sum / hist.count * 1000 if hist.count else 0.0, "max_ms": (hist.max or 0) * 1000,
+        **{_qname(q): hist.percentile(q) * 1000 for q in QUANTILES},
+    }
+
+
+def _qname(q: float) -> str:
+    return f"p{q * 100:g}_ms"
+
+
+class LocalCluster:
+    """在当前进程中启动一个管理节点和 nodes 个存储节点(与 tests/conftest.py 的做法相同), 用于可重复的本地压测"""
+
+    def __init__(self, nodes: int, cache: int = 100, threads: int = 16):
+        self.nodes = nodes
+        self.cache = cache
+        self.threads = threads
+        self.servers: list[grpc.Server] = []
+        self.storages: list[str] = []
+        self.stores: list[StoreService] = []
+        self.datapath = ""
+        self.manager_addr = ""
+        self.manage = None
+
+    def __enter__(self):
+        # 压测时不输出 INFO 日志, 避免日志开销掩盖服务本身的耗时
+        logger = logging.getLogger("bench.cluster")
+        logger.setLevel(logging.WARNING)
+        self.datapath = tempfile.mkdtemp(prefix="kvbench_")
+        self.manage = ManageService(logger, interval_seconds=1)
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=self.threads))
+        mapb_grpc.add_manageServiceServicer_to_server(self.manage, server)
+        self.manager_addr = f"localhost:{server.add_insecure_port('localhost:0')}"
+        server.start()
+        self.servers.append(server)
+        for _ in range(self.nodes):
+            server = grpc.server(futures.ThreadPoolExecutor(max_workers=self.threads))
+            port = f":{server.add_insecure_port('localhost:0')}"
+            sid = self.manage.online(mapb.SerRequest(ip="localhost", port=port), None).server_id
+            datapath = os.path.join(self.datapath, f"storage_{sid}/")
+            os.makedirs(datapath)
+            store = StoreService(sid, datapath, logger, self.cache, self.manager_addr)
+            stpb_grpc.add_storagementServiceServicer_to_server(store, server)
+            server.start()
+            self.servers.append(server)
+            self.stores.append(store)
+            self.storages.append(f"localhost{port}")
+        return self
+
+    def __exit__(self, *exc):
+        for server in reversed(self.servers):
+            server.stop(None).wait()
+        for store in self.stores:
+            store.close()
+        self.manage.stop()
+        shutil.rmtree(self.datapath, ignore_errors=True)
+
+
+def _call(stub, op: str, key: str, value: str):
+    if op == "read":
+        resp = stub.getdata(stpb.StRequest(key=key))
+        # 读到不存在的键不算失败
+        return resp.errno or resp.errmes == "未找到键值"
+    if op == "update":
+        return stub.putdata(stpb.StKV(key=key, value=value)).errno
+    return stub.deldata(stpb.StRequest(key=key)).errno
+
+
+def _quota(total: int, workers: int, i: int) -> int:
+    return total // workers + (1 if i < total % workers else 0)
+
+
+def load(workload: Workload, targets: list[str], concurrency: int):
+    """预先写入全部键, 使读操作能读到数据"""
+    def worker(i: int):
+        rng = random.Random(workload.seed + i)
+        with grpc.insecure_channel(targets[i % len(targets)]) as ch:
+            stub = stpb_grpc.storagementServiceStub(ch)
+            for k in range(i, workload.keys, concurrency):
+                stub.putdata(stpb.StKV(key=workload.key(k), value=workload.value(rng)))
+
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+
+
+def run_threads(workload: Workload, targets: list[str], concurrency: int, ops: int, duration: float) -> dict:
+    recorder = Recorder()
+    deadline = time.monotonic() + duration if duration else None
+
+    def worker(i: int):
+        rng = random.Random(workload.seed * 7919 + i)
+        with grpc.insecure_channel(targets[i % len(targets)]) as ch:
+            stub = stpb_grpc.storagementServiceStub(ch)
+            remaining = _quota(ops, concurrency, i) if ops else None
+            while (remaining is None or remaining > 0) and (deadline is None or time.monotonic() < deadline):
+                op, key, value = workload.next(rng)
+                start = time.perf_counter()
+                try:
+                    ok = _call(stub, op, key, value)
+                except grpc.RpcError:
+                    ok = False
+                recorder.record(op, time.perf_counter() - start, ok)
+                if remaining is not None:
+                    remaining -= 1
+
+    start = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    return recorder.report(time.perf_counter() - start)
+
+
+async def _call_async(stub, op: str, key: str, value: str):
+    if op == "read":
+        resp = await stub.getdata(stpb.StRequest(key=key))
+        return resp.errno or resp.errmes == "未找到键值"
+    if op == "update":
+        return (await stub.putdata(stpb.StKV(key=key, value=value))).errno
+    return (await stub.deldata(stpb.StRequest(key=key))).errno
+
+
+async def run_async(workload: Workload, targets: list[str], concurrency: int, ops: int, duration: float) -> dict:
+    """单线程事件循环中并发 concurrency 个协程, 每个存储节点共用一个 grpc.aio 连接"""
+    recorder = Recorder()
+    deadline = time.monotonic() + duration if duration else None
+    channels = [grpc.aio.insecure_channel(target) for target in targets]
+    stubs = [stpb_grpc.storagementServiceStub(ch) for ch in channels]
+
+    async def worker(i: int):
+        rng = random.Random(workload.seed * 7919 + i)
+        stub = stubs[i % len(stubs)]
+        remaining = _quota(ops, concurrency, i) if ops else None
+        while (remaining is None or remaining > 0) and (deadline is None or time.monotonic() < deadline):
+            op, key, value = workload.next(rng)
+            start = time.perf_counter()
+            try:
+                ok = await _call_async(stub, op, key, value)
+            except grpc.RpcError:
+                ok = False
+            recorder.record(op, time.perf_counter() - start, ok)
+            if remaining is not None:
+                remaining -= 1
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    finally:
+        for ch in channels:
+            await ch.close()
+    return recorder.report(time.perf_counter() - start)
+
+
+def discover(manager: str, count: int) -> list[str]:
+    """像交互式客户端一样向管理服务器申请存储节点, 返回去重后的地址"""
+    targets = []
+    with grpc.insecure_channel(manager) as ch:
+        stub = mapb_grpc.manageServiceStub(ch)
+        for _ in range(count):
+            info = stub.connect(mapb.Empty())
+            if not info.errno:
+                raise RuntimeError(info.errmes)
+            targets.append(info.ip + info.port)
+            stub.disconnect(mapb.CliId(cli_id=info.cli_id))
+    return sorted(set(targets))
+
+
+def format_report(report: dict) -> str:
+    cols = ["count", "errors", "throughput"] + [_qname(q) for q in QUANTILES] + ["max_ms"]
+    header = f"{'操作':<8}" + "".join(f"{c:>14}" for c in cols)
+    lines = [f"耗时 {report['elapsed']:.2f} 秒", header]
+    rows = list(report["ops"].items()) + [("total", report["total"])]
+    for op, row in rows:
+        cells = "".join(f"{row[c]:>14}" if isinstance(row[c], int) else f"{row[c]:>14.3f}" for c in cols)
+        lines.append(f"{op:<8}{cells}")
+    return "\n".join(lines)
+
+
+def parse_size(spec: str) -> tuple[int, int]:
+    low, _, high = spec.partition("-")
+    return int(low), int(high or low)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--keys", type=int, default=1000, help="键的数量")
+    parser.add_argument("--read", type=float, default=0.95, help="读操作比例, 其余为写操作")
+    parser.add_argument("--delete", type=float, default=0.0, help="删除操作比例")
+    parser.add_argument("--dist", choices=("zipfian", "uniform"), default="zipfian", help="键的访问分布")
+    parser.add_argument("--theta", type=float, default=0.99, help="Zipfian 分布的偏斜参数")
+    parser.add_argument("--value-size", type=parse_size, default=(100, 100), help="值的字节数, 如 100 或 100-1000")
+    parser.add_argument("--ops", type=int, default=10000, help="操作总数, 为 0 时按 --duration 运行")
+    parser.add_argument("--duration", type=float, default=0.0, help="运行秒数, 与 --ops 同时指定时先到者为准")
+    parser.add_argument("--concurrency", type=int, default=16, help="并发的线程或协程数")
+    parser.add_argument("--mode", choices=("thread", "async"), default="thread", help="使用线程池或 asyncio 发起请求")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子, 相同种子产生相同的请求序列")
+    parser.add_argument("--no-load", action="store_true", help="跳过预先写入全部键的阶段")
+    parser.add_argument("--local", type=int, default=0, help="在进程内启动 1 个管理节点与 N 个存储节点进行压测")
+    parser.add_argument("--targets", type=str, default="", help="逗号分隔的存储节点地址, 默认向管理服务器申请")
+    parser.add_argument("--manager", type=str, default=params.MANAGER_IP + params.MANAGER_PORT, help="管理服务器地址")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+
+
+def run(args: argparse.Namespace) -> dict:
+    workload = Workload(args.keys, args.read, args.delete, args.dist, args.theta, args.value_size, args.seed)
+    if not args.ops and not args.duration:
+        raise ValueError("--ops 与 --duration 至少指定一个")
+    with LocalCluster(args.local) if args.local else contextlib.nullcontext() as cluster:
+        if cluster is not None:
+            targets = cluster.storages
+        elif args.targets:
+            targets = args.targets.split(",")
+        else:
+            targets = discover(args.manager, args.concurrency)
+        if not args.no_load:
+            load(workload, targets, args.concurrency)
+        if args.mode == "async":
+            report = asyncio.run(run_async(workload, targets, args.concurrency, args.ops, args.duration))
+        else:
+            report = run_threads(workload, targets, args.concurrency, args.ops, args.duration)
+    report["targets"] = targets
+    print(json.dumps(report, ensure_ascii=False, indent=2) if args.json else format_report(report))
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="YCSB 风格的压测工具")
+    add_arguments(parser)
+    run(parser.parse_args())
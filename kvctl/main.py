@@ -1,48 +1,65 @@
-﻿import grpc
+﻿import argparse
+import grpc
+import json
 import signal
 import sys
-import time
 
 from protos import mapb_pb2 as mapb
 from protos import mapb_pb2_grpc as mapb_grpc
 from protos import stpb_pb2 as stpb
-from protos import stpb_pb2_grpc as stpb_grpc
 from params import params
-
-
-def reconnect(ma_stub, client_id: int):
-    for _ in range(10):
-        try:
-            resp = ma_stub.changeServerRandom(mapb.CliId(cli_id=client_id))
-            if resp.errno:
-                api = resp.api
-                if not api:
-                    continue
-                # api expected to be like 'host:port'
-                return grpc.insecure_channel(api)
-        except Exception:
-            # ignore and retry
-            time.sleep(0.2)
-            continue
-    raise RuntimeError("无法连接至服务器")
-
-def shell(ma_stub, ma_chan, st_stub, st_chan, client_id):
+from client.main import Client, KVError
+from common.tracing import TRACER, current_span, format_tree
+from kvctl import batch, bench, transfer, watch
+
+
+def show_spans(trace_id: str):
+    # 管理服务器会一并收集各存储服务器上该 trace 的 span
+    with grpc.insecure_channel(params.MANAGER_IP + params.MANAGER_PORT) as ch:
+        resp = mapb_grpc.manageServiceStub(ch).spans(mapb.SpanRequest(trace_id=trace_id))
+    spans = {s["span_id"]: s for s in json.loads(resp.json) + TRACER.query(trace_id)}
+    if not spans:
+        print('未找到该trace的记录')
+        return
+    print(format_tree(list(spans.values())))
+
+def run_profile(st_stub, args: list[str]):
+    # profile <manage|store> [cprofile|sample] [seconds] [path]
+    target = args[0].lower()
+    mode = args[1].lower() if len(args) > 1 else "cprofile"
+    seconds = float(args[2]) if len(args) > 2 else 5.0
+    path = args[3] if len(args) > 3 else ""
+    print(f'正在采集 {seconds} 秒...')
+    if target == 'manage':
+        with grpc.insecure_channel(params.MANAGER_IP + params.MANAGER_PORT) as ch:
+            resp = mapb_grpc.manageServiceStub(ch).profile(mapb.ProfileRequest(mode=mode, seconds=seconds))
+    elif target == 'store':
+        resp = st_stub.profile(stpb.StProfileRequest(mode=mode, seconds=seconds))
+    else:
+        print('只能分析 manage 或 store')
+        return
+    if not resp.errno:
+        print(resp.errmes)
+        return
+    if path:
+        # cProfile 结果保存为 pstats 文件, 采样结果保存为折叠栈文本
+        with open(path, 'wb') as f:
+            f.write(resp.raw or resp.text.encode())
+        print(f'已保存至 {path}')
+    else:
+        print(resp.text)
+
+def shell(client: Client):
     def handle_sig(signum, frame):
         print('接收到中断信号，正在退出...')
-        try:
-            ma_stub.disconnect(mapb.CliId(cli_id=client_id))
-            ma_chan.close()
-        except Exception:
-            pass
-        try:
-            st_chan.close()
-        except Exception:
-            pass
+        client.close()
         sys.exit(0)
 
     signal.signal(signal.SIGINT, handle_sig)
     signal.signal(signal.SIGTERM, handle_sig)
 
+    tracing = False
+    last_trace = ""
     print("开始输入命令")
     while True:
         try:
@@ -60,134 +77,136 @@ def shell(ma_stub, ma_chan, st_stub, st_chan, client_id):
             print('使用 get [key] 来获取key对应的键值')
             print('使用 put [key] [value] 来上传键值对')
             print('使用 del [key] 来删除key对应的键值')
+            print('使用 putfile [key] [path] 分块上传文件内容作为键值')
+            print('使用 getfile [key] [path] 分块下载键值并保存到文件')
             print('使用 change <api> 更改存储服务器, 不指定api时随机分配')
+            print('使用 trace on|off 开关请求追踪, 开启后每条命令输出 trace_id')
+            print('使用 spans <trace_id> 查看一次请求在各节点的耗时, 不指定时查看上一条命令')
+            print('使用 profile <manage|store> [cprofile|sample] [seconds] [path] 对运行中的节点进行性能分析')
             print('使用 exit 结束运行')
             continue
 
-        def call_with_reconnect(rpc_func, request):
-            nonlocal st_chan, st_stub
-            try:
-                return rpc_func(request)
-            except Exception as e:
-                # try reconnect
-                try:
-                    try:
-                        st_chan.close()
-                    except Exception:
-                        pass
-                    st_chan = reconnect(ma_stub, client_id)
-                    st_stub = stpb_grpc.storagementServiceStub(st_chan)
-                except Exception as re:
-                    raise re
-            # if still failed, raise
-            try:
-                return rpc_func(request)
-            except Exception:
-                raise RuntimeError('RPC failed after reconnect')
-
+        token = None
+        if tracing and cmd not in ('TRACE', 'SPANS', 'PROFILE'):
+            span = TRACER.start(cmd.lower(), service="kvctl")
+            token = current_span.set(span)
         try:
             if cmd == 'GET':
                 if len(args) != 2:
                     print('不正确的参数个数')
                     continue
-                key = args[1]
-                resp = call_with_reconnect(lambda r: st_stub.getdata(r), stpb.StRequest(cli_id=client_id, key=key))
-                if not resp.errno:
-                    print(resp.errmes)
-                else:
-                    print(resp.value)
+                print(client.get(args[1]))
 
             elif cmd == 'PUT':
                 if len(args) != 3:
                     print('不正确的参数个数')
                     continue
-                key, value = args[1], args[2]
-                resp = call_with_reconnect(lambda r: st_stub.putdata(r), stpb.StKV(cli_id=client_id, key=key, value=value))
-                if not resp.errno:
-                    print(resp.errmes)
-                else:
-                    print('上传成功')
+                client.put(args[1], args[2])
+                print('上传成功')
 
             elif cmd == 'DEL':
                 if len(args) != 2:
                     print('不正确的参数个数')
                     continue
-                key = args[1]
-                resp = call_with_reconnect(lambda r: st_stub.deldata(r), stpb.StRequest(cli_id=client_id, key=key))
-                if not resp.errno:
-                    print(resp.errmes)
-                else:
-                    print('删除成功')
+                client.delete(args[1])
+                print('删除成功')
+
+            elif cmd == 'PUTFILE':
+                if len(args) != 3:
+                    print('不正确的参数个数')
+                    continue
+                key, path = args[1], args[2]
+                with open(path, 'rb') as f:
+                    client.put_stream(key, f)
+                print('上传成功')
+
+            elif cmd == 'GETFILE':
+                if len(args) != 3:
+                    print('不正确的参数个数')
+                    continue
+                key, path = args[1], args[2]
+                with open(path, 'wb') as f:
+                    written = client.get_stream(key, f)
+                print(f'已保存 {written} 字节至 {path}')
 
             elif cmd == 'CHANGE':
-                if len(args) == 1:
-                    # random change
-                    resp = ma_stub.changeServerRandom(mapb.CliId(cli_id=client_id))
-                    if not resp.errno:
-                        print(resp.errmes)
-                    else:
-                        api = resp.api
-                        st_chan.close()
-                        st_chan = grpc.insecure_channel(api)
-                        st_stub = stpb_grpc.storagementServiceStub(st_chan)
-                        print('切换成功')
-                elif len(args) == 2:
-                    api = args[1]
-                    resp = ma_stub.changeServer(mapb.CliChange(cli_id=client_id, api=api))
-                    if not resp.errno:
-                        print(resp.errmes)
-                    else:
-                        st_chan.close()
-                        st_chan = grpc.insecure_channel(api)
-                        st_stub = stpb_grpc.storagementServiceStub(st_chan)
-                        print('切换成功')
-                else:
+                if len(args) > 2:
+                    print('不正确的参数个数')
+                    continue
+                client.use(args[1] if len(args) == 2 else "")
+                print('切换成功')
+
+            elif cmd == 'TRACE':
+                if len(args) != 2 or args[1].lower() not in ('on', 'off'):
                     print('不正确的参数个数')
+                    continue
+                tracing = args[1].lower() == 'on'
+                print('已开启追踪' if tracing else '已关闭追踪')
+
+            elif cmd == 'SPANS':
+                if len(args) > 2:
+                    print('不正确的参数个数')
+                    continue
+                trace_id = args[1] if len(args) == 2 else last_trace
+                if not trace_id:
+                    print('没有可查看的trace')
+                    continue
+                show_spans(trace_id)
+
+            elif cmd == 'PROFILE':
+                if not 2 <= len(args) <= 5:
+                    print('不正确的参数个数')
+                    continue
+                run_profile(client.stub(), args[1:])
 
             else:
                 print('无效命令')
 
+        except KVError as e:
+            print(e)
         except Exception as e:
             print('发生错误:', e)
+        finally:
+            if token is not None:
+                current_span.reset(token)
+                TRACER.finish(span)
+                last_trace = span.trace_id
+                print(f'trace_id: {span.trace_id} ({span.ms:.3f}ms)')
 
 def main():
-    manage_target = params.MANAGER_IP + params.MANAGER_PORT
-    ma_chan = grpc.insecure_channel(manage_target)
-    ma_stub = mapb_grpc.manageServiceStub(ma_chan)
+    parser = argparse.ArgumentParser(description="键值存储命令行, 不带子命令时进入交互模式")
+    parser.add_argument("--near-cache", type=int, default=0, help="交互模式下开启近端缓存, 指定最多缓存的键值数")
+    sub = parser.add_subparsers(dest="command")
+    bench.add_arguments(sub.add_parser("bench", help="YCSB 风格的压测, 输出吞吐量与延迟分位数"))
+    batch.add_arguments(sub.add_parser("batch", help="从文件或标准输入批量执行命令, 按输入顺序输出结果"))
+    transfer.add_import_arguments(sub.add_parser("import", help="从 jsonl/csv/bin 文件批量导入键值, 不是整体原子的, 失败时可能已部分提交"))
+    transfer.add_export_arguments(sub.add_parser("export", help="把存储节点的一致性快照导出为 jsonl/csv/bin 文件"))
+    watch.add_arguments(sub.add_parser("watch", help="监听键或键前缀已提交的写入与删除, 每个事件输出一行 JSON"))
+    args = parser.parse_args()
+    if args.command == "bench":
+        bench.run(args)
+        return
+    if args.command == "batch":
+        sys.exit(batch.main(args))
+    if args.command == "import":
+        sys.exit(transfer.import_main(args))
+    if args.command == "export":
+        sys.exit(transfer.export_main(args))
+    if args.command == "watch":
+        sys.exit(watch.main(args))
+
+    client = Client(near_cache=args.near_cache)
     try:
-        info = ma_stub.connect(mapb.Empty())
-    except Exception as e:
+        client.connect()
+    except KVError as e:
         print('连接管理服务器时发生错误:', e)
         return
-    finally:
-        ma_chan.close()
-
-    if not info.errno:
-        print(info.errmes)
-        return
-
-    client_id = info.cli_id
-    print(f"已连接至管理服务器, 客户端ID为 {client_id}")
-    ip = info.ip
-    port = info.port
-
-    storage_target = ip + port
-    print(f"连接至存储服务器 {storage_target}")
-    st_chan = grpc.insecure_channel(storage_target)
-    st_stub = stpb_grpc.storagementServiceStub(st_chan)
-
-    shell(ma_stub, ma_chan, st_stub, st_chan, client_id)
-
+    print(f"已连接至管理服务器, 客户端ID为 {client.cli_id}")
+    print(f"连接至存储服务器 {client.target}")
     try:
-        ma_stub.disconnect(mapb.CliId(cli_id=client_id))
-        ma_chan.close()
-    except Exception:
-        pass
-
-    try:
-        st_chan.close()
-    except Exception:
-        pass
+        shell(client)
+    finally:
+        client.close()
 
 
 if __name__ == '__main__':
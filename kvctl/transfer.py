@@ -0,0 +1,268 @@
+﻿import argparse
+import csv
+import json
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import zlib
+from concurrent import futures
+from contextlib import contextmanager
+
+import grpc
+
+from protos import mapb_pb2 as mapb
+from protos import mapb_pb2_grpc as mapb_grpc
+from protos import stpb_pb2 as stpb
+from protos import stpb_pb2_grpc as stpb_grpc
+from params import params
+
+FORMATS = ("jsonl", "csv", "bin")
+# 二进制格式: 魔数后接若干条记录, 每条为大端 4 字节键长、4 字节值长, 再接 UTF-8 编码的键与值
+MAGIC = b"KVB1"
+_LENGTHS = struct.Struct(">II")
+
+
+def guess_format(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        return "csv"
+    if ext in (".bin", ".kvb"):
+        return "bin"
+    return "jsonl"
+
+
+def open_file(path: str, fmt: str, mode: str):
+    """按格式以文本或二进制方式打开文件, "-" 表示标准输入/输出"""
+    if path == "-":
+        std = sys.stdin if mode == "r" else sys.stdout
+        return open(std.fileno(), mode + ("b" if fmt == "bin" else ""), closefd=False,
+                    **({} if fmt == "bin" else {"encoding": "utf-8", "newline": ""}))
+    if fmt == "bin":
+        return open(path, mode + "b")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def read_records(f, fmt: str):
+    """逐条读出 (键, 值), 格式错误时抛出 ValueError"""
+    if fmt == "jsonl":
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                yield str(record["key"]), str(record["value"])
+            except (json.JSONDecodeError, KeyError, TypeError) as e:
+                raise ValueError(f"第{lineno}行格式错误: {e}")
+    elif fmt == "csv":
+        for lineno, row in enumerate(csv.reader(f), 1):
+            if not row:
+                continue
+            if len(row) != 2:
+                raise ValueError(f"第{lineno}行应为 key,value 两列")
+            yield row[0], row[1]
+    else:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("不是 KVB1 格式的文件")
+        while header := f.read(_LENGTHS.size):
+            if len(header) != _LENGTHS.size:
+                raise ValueError("文件被截断")
+            klen, vlen = _LENGTHS.unpack(header)
+            data = f.read(klen + vlen)
+            if len(data) != klen + vlen:
+                raise ValueError("文件被截断")
+            try:
+                key, value = data[:klen].decode(), data[klen:].decode()
+            except UnicodeDecodeError:
+                raise ValueError("记录不是 UTF-8 编码, 只能导入文本键值")
+            yield key, value
+
+
+class Writer:
+    def __init__(self, f, fmt: str):
+        self.f = f
+        self.fmt = fmt
+        self.csv = csv.writer(f) if fmt == "csv" else None
+        if fmt == "bin":
+            f.write(MAGIC)
+
+    def write(self, key: str, value: str):
+        if self.fmt == "jsonl":
+            self.f.write(json.dumps({"key": key, "value": value}, ensure_ascii=False) + "\n")
+        elif self.fmt == "csv":
+            self.csv.writerow((key, value))
+        else:
+            k, v = key.encode(), value.encode()
+            self.f.write(_LENGTHS.pack(len(k), len(v)) + k + v)
+
+
+def _put(q: queue.Queue, item, dead: threading.Event) -> bool:
+    # 导入流已失败时不再阻塞在满队列上
+    while not dead.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def import_records(records, stub, client_id: int = 0, parallel: int = 4,
+                   batch: int = params.IMPORT_BATCH) -> tuple[int, int, list[str]]:
+    """按 crc32(key) 把记录分到 parallel 条 importdata 流并行导入, 返回 (成功数, 失败数, 错误信息)
+
+    同一个键总是进入同一条流, 文件中重复出现的键以最后一次为准
+    每个批次在存储节点上按主副本拆分, 各主副本的部分分别原子提交, 一个批次可能部分提交; 错误信息逐个列出未提交的部分
+    """
+    queues = [queue.Queue(maxsize=4) for _ in range(parallel)]
+    dead = [threading.Event() for _ in range(parallel)]
+    results: list = [None] * parallel
+
+    def batches(q: queue.Queue):
+        while (item := q.get()) is not None:
+            yield item
+
+    def worker(i: int):
+        try:
+            results[i] = stub.importdata(batches(queues[i]))
+        except grpc.RpcError as e:
+            results[i] = e
+            dead[i].set()
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(parallel)]
+    for t in threads:
+        t.start()
+    pending: list[list] = [[] for _ in range(parallel)]
+    sizes = [0] * parallel
+    dropped = 0
+
+    def flush(i: int):
+        nonlocal dropped
+        if pending[i] and not _put(queues[i], stpb.StKVBatch(kvs=pending[i], cli_id=client_id), dead[i]):
+            dropped += len(pending[i])
+        pending[i], sizes[i] = [], 0
+
+    try:
+        for key, value in records:
+            i = zlib.crc32(key.encode()) % parallel
+            pending[i].append(stpb.StKV(key=key, value=value))
+            sizes[i] += len(key) + len(value)
+            if len(pending[i]) >= batch or sizes[i] >= params.BATCH_BYTES:
+                flush(i)
+        for i in range(parallel):
+            flush(i)
+    finally:
+        for i in range(parallel):
+            _put(queues[i], None, dead[i])
+        for t in threads:
+            t.join()
+
+    imported, failed, errors = 0, dropped, []
+    for resp in results:
+        if isinstance(resp, grpc.RpcError):
+            errors.append(resp.details() or str(resp.code()))
+            continue
+        imported += resp.imported
+        failed += resp.failed
+        for f in resp.failures:
+            who = f"主副本{f.primary}" if f.primary else "存储节点"
+            errors.append(f"{who} 的 {len(f.keys)} 个键值未提交 (首个键 {f.keys[0]!r}): {f.errmes}"
+                          if f.keys else f"{who}: {f.errmes}")
+        if resp.errmes and not resp.failures:
+            errors.append(resp.errmes)
+    return imported, failed, errors
+
+
+def export_records(stub, writer: Writer, client_id: int = 0, parallel: int = 4) -> int:
+    """在存储节点上建立快照, 用 parallel 条 exportdata 流并行读出快照的各部分, 返回导出的键值数"""
+    snap = stub.snapshot(stpb.StSnapshot())
+    if not snap.errno:
+        raise RuntimeError(snap.errmes)
+    mu = threading.Lock()
+
+    def worker(part: int) -> int:
+        count = 0
+        req = stpb.StExportRequest(cli_id=client_id, snapshot=snap.id, part=part, parts=parallel)
+        for batch in stub.exportdata(req):
+            if not batch.errno:
+                raise RuntimeError(batch.errmes)
+            with mu:
+                for kv in batch.kvs:
+                    writer.write(kv.key, kv.value)
+            count += len(batch.kvs)
+        return count
+
+    try:
+        with futures.ThreadPoolExecutor(max_workers=parallel) as pool:
+            return sum(pool.map(worker, range(parallel)))
+    finally:
+        stub.dropSnapshot(stpb.StSnapshot(id=snap.id))
+
+
+def _add_common(parser: argparse.ArgumentParser):
+    parser.add_argument("--format", choices=FORMATS, default="", help="文件格式, 默认按扩展名判断(.csv/.bin, 其余为 jsonl)")
+    parser.add_argument("--parallel", type=int, default=4, help="并行的数据流条数")
+    parser.add_argument("--target", type=str, default="", help="存储节点地址, 默认向管理服务器申请")
+    parser.add_argument("--manager", type=str, default=params.MANAGER_IP + params.MANAGER_PORT, help="管理服务器地址")
+
+
+def add_import_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("file", help="导入文件, - 表示标准输入")
+    parser.add_argument("--batch", type=int, default=params.IMPORT_BATCH, help="每批键值数, 每批按主副本拆分后分别原子提交, 可能部分提交")
+    _add_common(parser)
+
+
+def add_export_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("file", help="导出文件, - 表示标准输出")
+    _add_common(parser)
+
+
+@contextmanager
+def _storage(args: argparse.Namespace):
+    """连接存储节点, 返回 (stub, 客户端 ID), 未指定 --target 时由管理服务器分配"""
+    client_id = 0
+    target = args.target
+    with grpc.insecure_channel(args.manager) as ma_chan:
+        ma_stub = mapb_grpc.manageServiceStub(ma_chan)
+        if not target:
+            info = ma_stub.connect(mapb.Empty())
+            if not info.errno:
+                raise RuntimeError(info.errmes)
+            client_id, target = info.cli_id, info.ip + info.port
+        try:
+            with grpc.insecure_channel(target) as ch:
+                yield stpb_grpc.storagementServiceStub(ch), client_id
+        finally:
+            if client_id:
+                ma_stub.disconnect(mapb.CliId(cli_id=client_id))
+
+
+def import_main(args: argparse.Namespace) -> int:
+    fmt = args.format or guess_format(args.file)
+    start = time.perf_counter()
+    try:
+        with _storage(args) as (stub, client_id), open_file(args.file, fmt, "r") as f:
+            imported, failed, errors = import_records(read_records(f, fmt), stub, client_id,
+                                                      args.parallel, args.batch)
+    except (RuntimeError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    for errmes in errors:
+        print(errmes, file=sys.stderr)
+    print(f"导入 {imported} 个键值, 失败 {failed} 个, 耗时 {time.perf_counter() - start:.3f} 秒", file=sys.stderr)
+    return 1 if failed or errors else 0
+
+
+def export_main(args: argparse.Namespace) -> int:
+    fmt = args.format or guess_format(args.file)
+    start = time.perf_counter()
+    try:
+        with _storage(args) as (stub, client_id), open_file(args.file, fmt, "w") as f:
+            count = export_records(stub, Writer(f, fmt), client_id, args.parallel)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(f"导出 {count} 个键值, 耗时 {time.perf_counter() - start:.3f} 秒", file=sys.stderr)
+    return 0
@@ -0,0 +1,45 @@
+﻿import argparse
+import json
+import sys
+
+from params import params
+from client.main import Client, KVError
+
+
+def event_record(event) -> dict:
+    """把 watch 事件转换为输出的一行 JSON, 需要重新读取全量状态时 op 为 reset"""
+    if event.reset:
+        return {"op": "reset", "cursor": event.cursor}
+    record = {"seq": event.seq, "op": event.op, "key": event.key}
+    if event.has_value:
+        record["value"] = event.value
+    record["cursor"] = event.cursor
+    return record
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("key", help="要监听的键, 带 --prefix 时为键名前缀")
+    parser.add_argument("--prefix", action="store_true", help="监听所有以 key 开头的键")
+    parser.add_argument("--cursor", type=str, default="", help="从上次输出的 cursor 之后续传, 默认从当前开始")
+    parser.add_argument("--count", type=int, default=0, help="输出该数量的事件后退出, 默认一直监听")
+    parser.add_argument("--target", type=str, default="", help="存储节点地址, 默认向管理服务器申请")
+    parser.add_argument("--manager", type=str, default=params.MANAGER_IP + params.MANAGER_PORT, help="管理服务器地址")
+
+
+def main(args: argparse.Namespace) -> int:
+    """每个事件输出一行 JSON 到标准输出, 断线后自动按 cursor 续传"""
+    try:
+        with Client(args.manager, args.target) as client:
+            client.connect()
+            count = 0
+            for event in client.watch(args.key, args.prefix, args.cursor):
+                print(json.dumps(event_record(event), ensure_ascii=False), flush=True)
+                count += 1
+                if count == args.count:
+                    break
+    except KVError as e:
+        print(e, file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
@@ -1,2 +1,51 @@
 ﻿MANAGER_PORT = ":9999"
-MANAGER_IP = "localhost"
\ No newline at end of file
+MANAGER_IP = "localhost"
+
+# 存储节点的值压缩配置, 形如 "zlib:1024,lzma:1048576", 为空表示不压缩
+VALUE_COMPRESSION = ""
+# 节点间gRPC消息压缩算法: none / gzip / deflate
+GRPC_COMPRESSION = "none"
+# 分块传输大值时每块的字节数
+CHUNK_SIZE = 64 * 1024
+# 日志采样配置, 操作名=保留比例, 心跳等高频操作默认只保留 1%
+LOG_SAMPLE = "live=0.01"
+# 没有上游 trace 的请求开始追踪的比例, 0 表示只追踪客户端主动发起的 trace
+TRACE_SAMPLE = 0.0
+# 批量导入/导出时每批的键值数与字节数上限(字节数需低于 gRPC 默认 4MB 的消息上限)
+IMPORT_BATCH = 500
+BATCH_BYTES = 1024 * 1024
+# 每个存储节点保留的已提交变更条数, watch 断线后只能从仍保留的位置续传
+WATCH_LOG = 65536
+# 每个键保存的副本数, 0 表示每个存储节点都保存全部键值
+REPLICAS = 0
+# 一致性哈希环上每个存储节点的虚拟节点数
+VNODES = 64
+# 存储节点缓存的集群视图的有效期(秒), 过期后在下一次请求时向管理服务器重新拉取
+CLUSTER_MAP_TTL = 1.0
+# 存储节点向各副本并行发起调用(准备、提交、读取表决)的线程数, 由所有请求共用
+FANOUT_THREADS = 32
+# 节点间一元 RPC 的默认超时(秒), 避免对端卡住时长期占用工作线程与锁
+RPC_TIMEOUT = 10.0
+# 同步模式的管理服务器同时服务的 watchTopology 订阅数上限, 每个订阅占用一个工作线程(共 16 个)
+MAX_TOPOLOGY_WATCHERS = 4
+# 同步模式的存储节点(每个 worker)同时服务的订阅流(失效通知与 watch)数上限, 每个订阅占用一个工作线程(共 16 个)
+MAX_STREAMS = 8
+# 分块传输(maPutstream)整个流的超时(秒), 大值需要比一元 RPC 更长的时间
+STREAM_TIMEOUT = 300.0
+# 存储节点检查成员变更并迁移键值的间隔(秒)与迁移限速(字节/秒, 0 表示不限速)
+REBALANCE_INTERVAL = 5.0
+REBALANCE_RATE = 8 * 1024 * 1024
+# 存储节点与其他副本比较 Merkle 树的间隔(秒, 0 表示关闭反熵)与树的深度(叶子数为 2 的 depth 次方)
+ANTI_ENTROPY_INTERVAL = 30.0
+MERKLE_DEPTH = 10
+# 存储节点检查暂时不可达的副本是否恢复并补发提示(hinted handoff)的间隔(秒)
+HINT_INTERVAL = 1.0
+# 管理服务器组: leader 的心跳间隔(秒), 选举超时(秒, 实际在 1~2 倍之间随机), 应用多少条日志后生成快照
+RAFT_HEARTBEAT = 0.1
+RAFT_ELECTION_TIMEOUT = 0.5
+RAFT_SNAPSHOT_EVERY = 1000
+# 连接管理服务器组时寻找 leader 的重试次数与选举期间的重试间隔(秒)
+LEADER_RETRIES = 20
+LEADER_RETRY_DELAY = 0.2
+# 两阶段提交协调者的决议日志累计多少条记录、且没有未完成的事务时清空
+TXLOG_COMPACT = 10000
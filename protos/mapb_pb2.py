@@ -24,7 +24,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nmapb.proto\x12\x04mapb\"&\n\x05\x45mpty\x12\r\n\x05\x65rrno\x18\x03 \x01(\x08\x12\x0e\n\x06\x65rrmes\x18\x04 \x01(\t\"&\n\nSerRequest\x12\n\n\x02ip\x18\x01 \x01(\t\x12\x0c\n\x04port\x18\x02 \x01(\t\"9\n\x07Request\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\x11\n\tserver_id\x18\x02 \x01(\x05\x12\x0e\n\x06\x63li_id\x18\x03 \x01(\x05\"8\n\x08Response\x12\r\n\x05value\x18\x01 \x01(\t\x12\r\n\x05\x65rrno\x18\x03 \x01(\x08\x12\x0e\n\x06\x65rrmes\x18\x04 \x01(\t\"R\n\x07\x43liInfo\x12\x0e\n\x06\x63li_id\x18\x01 \x01(\x05\x12\n\n\x02ip\x18\x02 \x01(\t\x12\x0c\n\x04port\x18\x03 \x01(\t\x12\r\n\x05\x65rrno\x18\x04 \x01(\x08\x12\x0e\n\x06\x65rrmes\x18\x05 \x01(\t\"\x17\n\x05\x43liId\x12\x0e\n\x06\x63li_id\x18\x01 \x01(\x05\";\n\x07SerInfo\x12\x11\n\tserver_id\x18\x01 \x01(\x05\x12\r\n\x05\x65rrno\x18\x03 \x01(\x08\x12\x0e\n\x06\x65rrmes\x18\x04 \x01(\t\"3\n\x02KV\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\t\x12\x11\n\tserver_id\x18\x03 \x01(\x05\"(\n\tCliChange\x12\x0e\n\x06\x63li_id\x18\x01 \x01(\x05\x12\x0b\n\x03\x61pi\x18\x02 \x01(\t\"8\n\nChangeInfo\x12\x0b\n\x03\x61pi\x18\x01 \x01(\t\x12\r\n\x05\x65rrno\x18\x02 \x01(\x08\x12\x0e\n\x06\x65rrmes\x18\x03 \x01(\t2\x80\x03\n\rmanageService\x12%\n\x07\x63onnect\x12\x0b.mapb.Empty\x1a\r.mapb.CliInfo\x12,\n\x0c\x63hangeServer\x12\x0f.mapb.CliChange\x1a\x0b.mapb.Empty\x12\x33\n\x12\x63hangeServerRandom\x12\x0b.mapb.CliId\x1a\x10.mapb.ChangeInfo\x12&\n\ndisconnect\x12\x0b.mapb.CliId\x1a\x0b.mapb.Empty\x12)\n\x06online\x12\x10.mapb.SerRequest\x1a\r.mapb.SerInfo\x12%\n\x07offline\x12\r.mapb.SerInfo\x1a\x0b.mapb.Empty\x12$\n\x03Get\x12\r.mapb.Request\x1a\x0e.mapb.Response\x12\x1f\n\x03Put\x12\x08.mapb.KV\x1a\x0e.mapb.Response\x12$\n\x03\x44\x65l\x12\r.mapb.Request\x1a\x0e.mapb.ResponseB\x10Z\x0e../manageprotob\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nmapb.proto\x12\x04mapb\"&\n\x05\x45mpty\x12\r\n\x05\x65rrno\x18\x03 \x01(\x08\x12\x0e\n\x06\x65rrmes\x18\x04 \x01(\t\"J\n\nSerRequest\x12\n\n\x02ip\x18\x01 \x01(\t\x12\x0c\n\x04port\x18\x02 \x01(\t\x12\x0f\n\x07joining\x18\x03 \x01(\x08\x12\x11\n\tserver_id\x18\x04 \x01(\x05\"9\n\x07Request\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\x11\n\tserver_id\x18\x02 \x01(\x05\x12\x0e\n\x06\x63li_id\x18\x03 \x01(\x05\"8\n\x08Response\x12\r\n\x05value\x18\x01 \x01(\t\x12\r\n\x05\x65rrno\x18\x03 \x01(\x08\x12\x0e\n\x06\x65rrmes\x18\x04 \x01(\t\"R\n\x07\x43liInfo\x12\x0e\n\x06\x63li_id\x18\x01 \x01(\x05\x12\n\n\x02ip\x18\x02 \x01(\t\x12\x0c\n\x04port\x18\x03 \x01(\t\x12\r\n\x05\x65rrno\x18\x04 \x01(\x08\x12\x0e\n\x06\x65rrmes\x18\x05 \x01(\t\"\x17\n\x05\x43liId\x12\x0e\n\x06\x63li_id\x18\x01 \x01(\x05\";\n\x07SerInfo\x12\x11\n\tserver_id\x18\x01 \x01(\x05\x12\r\n\x05\x65rrno\x18\x03 \x01(\x08\x12\x0e\n\x06\x65rrmes\x18\x04 \x01(\t\"3\n\x02KV\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\t\x12\x11\n\tserver_id\x18\x03 \x01(\x05\"3\n\x07KVBatch\x12\x15\n\x03kvs\x18\x01 \x03(\x0b\x32\x08.mapb.KV\x12\x11\n\tserver_id\x18\x02 \x01(\x05\"E\n\x07KVChunk\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\x0c\n\x04\x64\x61ta\x18\x02 \x01(\x0c\x12\x11\n\tserver_id\x18\x03 \x01(\x05\x12\x0c\n\x04size\x18\x04 \x01(\x03\")\n\x05Stats\x12\x0c\n\x04json\x18\x01 \x01(\t\x12\x12\n\nprometheus\x18\x02 \x01(\t\"=\n\x0bSpanRequest\x12\x10\n\x08trace_id\x18\x01 \x01(\t\x12\r\n\x05limit\x18\x02 \x01(\x05\x12\r\n\x05local\x18\x03 \x01(\x08\"\x15\n\x05Spans\x12\x0c\n\x04json\x18\x01 \x01(\t\"N\n\x0eProfileRequest\x12\x0c\n\x04mode\x18\x01 \x01(\t\x12\x0f\n\x07seconds\x18\x02 \x01(\x01\x12\x10\n\x08interval\x18\x03 \x01(\x01\x12\x0b\n\x03top\x18\x04 \x01(\x05\"C\n\x07Profile\x12\r\n\x05\x65rrno\x18\x01 \x01(\x08\x12\x0e\n\x06\x65rrmes\x18\x02 \x01(\t\x12\x0c\n\x04text\x18\x03 \x01(\t\x12\x0b\n\x03raw\x18\x04 \x01(\x0c\"D\n\x04Node\x12\x11\n\tserver_id\x18\x01 \x01(\x05\x12\n\n\x02ip\x18\x02 \x01(\t\x12\x0c\n\x04port\x18\x03 \x01(\t\x12\x0f\n\x07joining\x18\x04 \x01(\x08\"V\n\x08Topology\x12\x19\n\x05nodes\x18\x01 \x03(\x0b\x32\n.mapb.Node\x12\r\n\x05\x65poch\x18\x02 \x01(\x03\x12\x10\n\x08replicas\x18\x03 \x01(\x05\x12\x0e\n\x06vnodes\x18\x04 \x01(\x05\"\x85\x01\n\rTopologyEvent\x12\r\n\x05\x65poch\x18\x01 \x01(\x03\x12\x0e\n\x06\x63hange\x18\x02 \x01(\t\x12\x18\n\x04node\x18\x03 \x01(\x0b\x32\n.mapb.Node\x12\x19\n\x05nodes\x18\x04 \x03(\x0b\x32\n.mapb.Node\x12\x10\n\x08replicas\x18\x05 \x01(\x05\x12\x0e\n\x06vnodes\x18\x06 \x01(\x05\"(\n\tCliChange\x12\x0e\n\x06\x63li_id\x18\x01 \x01(\x05\x12\x0b\n\x03\x61pi\x18\x02 \x01(\t\"8\n\nChangeInfo\x12\x0b\n\x03\x61pi\x18\x01 \x01(\t\x12\r\n\x05\x65rrno\x18\x02 \x01(\x08\x12\x0e\n\x06\x65rrmes\x18\x03 \x01(\t\"R\n\x08RaftVote\x12\x0c\n\x04term\x18\x01 \x01(\x03\x12\x11\n\tcandidate\x18\x02 \x01(\x05\x12\x12\n\nlast_index\x18\x03 \x01(\x03\x12\x11\n\tlast_term\x18\x04 \x01(\x03\".\n\rRaftVoteReply\x12\x0c\n\x04term\x18\x01 \x01(\x03\x12\x0f\n\x07granted\x18\x02 \x01(\x08\"\'\n\tRaftEntry\x12\x0c\n\x04term\x18\x01 \x01(\x03\x12\x0c\n\x04\x64\x61ta\x18\x02 \x01(\x0c\"\xc4\x01\n\nRaftAppend\x12\x0c\n\x04term\x18\x01 \x01(\x03\x12\x0e\n\x06leader\x18\x02 \x01(\x05\x12\x12\n\nprev_index\x18\x03 \x01(\x03\x12\x11\n\tprev_term\x18\x04 \x01(\x03\x12 \n\x07\x65ntries\x18\x05 \x03(\x0b\x32\x0f.mapb.RaftEntry\x12\x0e\n\x06\x63ommit\x18\x06 \x01(\x03\x12\x10\n\x08snapshot\x18\x07 \x01(\x0c\x12\x16\n\x0esnapshot_index\x18\x08 \x01(\x03\x12\x15\n\rsnapshot_term\x18\t \x01(\x03\">\n\x0fRaftAppendReply\x12\x0c\n\x04term\x18\x01 \x01(\x03\x12\x0f\n\x07success\x18\x02 \x01(\x08\x12\x0c\n\x04hint\x18\x03 \x01(\x03\x32\xc0\x06\n\rmanageService\x12%\n\x07\x63onnect\x12\x0b.mapb.Empty\x1a\r.mapb.CliInfo\x12,\n\x0c\x63hangeServer\x12\x0f.mapb.CliChange\x1a\x0b.mapb.Empty\x12\x33\n\x12\x63hangeServerRandom\x12\x0b.mapb.CliId\x1a\x10.mapb.ChangeInfo\x12&\n\ndisconnect\x12\x0b.mapb.CliId\x1a\x0b.mapb.Empty\x12)\n\x06online\x12\x10.mapb.SerRequest\x1a\r.mapb.SerInfo\x12%\n\x07offline\x12\r.mapb.SerInfo\x1a\x0b.mapb.Empty\x12#\n\x05ready\x12\r.mapb.SerInfo\x1a\x0b.mapb.Empty\x12\'\n\x08topology\x12\x0b.mapb.Empty\x1a\x0e.mapb.Topology\x12\x33\n\rwatchTopology\x12\x0b.mapb.Empty\x1a\x13.mapb.TopologyEvent0\x01\x12$\n\x03Get\x12\r.mapb.Request\x1a\x0e.mapb.Response\x12\x1f\n\x03Put\x12\x08.mapb.KV\x1a\x0e.mapb.Response\x12$\n\x03\x44\x65l\x12\r.mapb.Request\x1a\x0e.mapb.Response\x12,\n\tPutStream\x12\r.mapb.KVChunk\x1a\x0e.mapb.Response(\x01\x12)\n\x08PutBatch\x12\r.mapb.KVBatch\x1a\x0e.mapb.Response\x12!\n\x05stats\x12\x0b.mapb.Empty\x1a\x0b.mapb.Stats\x12\'\n\x05spans\x12\x11.mapb.SpanRequest\x1a\x0b.mapb.Spans\x12.\n\x07profile\x12\x14.mapb.ProfileRequest\x1a\r.mapb.Profile\x12/\n\x08raftVote\x12\x0e.mapb.RaftVote\x1a\x13.mapb.RaftVoteReply\x12\x35\n\nraftAppend\x12\x10.mapb.RaftAppend\x1a\x15.mapb.RaftAppendReplyB\x10Z\x0e../manageprotob\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -35,23 +35,53 @@ if not _descriptor._USE_C_DESCRIPTORS:
   _globals['_EMPTY']._serialized_start=20
   _globals['_EMPTY']._serialized_end=58
   _globals['_SERREQUEST']._serialized_start=60
-  _globals['_SERREQUEST']._serialized_end=98
-  _globals['_REQUEST']._serialized_start=100
-  _globals['_REQUEST']._serialized_end=157
-  _globals['_RESPONSE']._serialized_start=159
-  _globals['_RESPONSE']._serialized_end=215
-  _globals['_CLIINFO']._serialized_start=217
-  _globals['_CLIINFO']._serialized_end=299
-  _globals['_CLIID']._serialized_start=301
-  _globals['_CLIID']._serialized_end=324
-  _globals['_SERINFO']._serialized_start=326
-  _globals['_SERINFO']._serialized_end=385
-  _globals['_KV']._serialized_start=387
-  _globals['_KV']._serialized_end=438
-  _globals['_CLICHANGE']._serialized_start=440
-  _globals['_CLICHANGE']._serialized_end=480
-  _globals['_CHANGEINFO']._serialized_start=482
-  _globals['_CHANGEINFO']._serialized_end=538
-  _globals['_MANAGESERVICE']._serialized_start=541
-  _globals['_MANAGESERVICE']._serialized_end=925
+  _globals['_SERREQUEST']._serialized_end=134
+  _globals['_REQUEST']._serialized_start=136
+  _globals['_REQUEST']._serialized_end=193
+  _globals['_RESPONSE']._serialized_start=195
+  _globals['_RESPONSE']._serialized_end=251
+  _globals['_CLIINFO']._serialized_start=253
+  _globals['_CLIINFO']._serialized_end=335
+  _globals['_CLIID']._serialized_start=337
+  _globals['_CLIID']._serialized_end=360
+  _globals['_SERINFO']._serialized_start=362
+  _globals['_SERINFO']._serialized_end=421
+  _globals['_KV']._serialized_start=423
+  _globals['_KV']._serialized_end=474
+  _globals['_KVBATCH']._serialized_start=476
+  _globals['_KVBATCH']._serialized_end=527
+  _globals['_KVCHUNK']._serialized_start=529
+  _globals['_KVCHUNK']._serialized_end=598
+  _globals['_STATS']._serialized_start=600
+  _globals['_STATS']._serialized_end=641
+  _globals['_SPANREQUEST']._serialized_start=643
+  _globals['_SPANREQUEST']._serialized_end=704
+  _globals['_SPANS']._serialized_start=706
+  _globals['_SPANS']._serialized_end=727
+  _globals['_PROFILEREQUEST']._serialized_start=729
+  _globals['_PROFILEREQUEST']._serialized_end=807
+  _globals['_PROFILE']._serialized_start=809
+  _globals['_PROFILE']._serialized_end=876
+  _globals['_NODE']._serialized_start=878
+  _globals['_NODE']._serialized_end=946
+  _globals['_TOPOLOGY']._serialized_start=948
+  _globals['_TOPOLOGY']._serialized_end=1034
+  _globals['_TOPOLOGYEVENT']._serialized_start=1037
+  _globals['_TOPOLOGYEVENT']._serialized_end=1170
+  _globals['_CLICHANGE']._serialized_start=1172
+  _globals['_CLICHANGE']._serialized_end=1212
+  _globals['_CHANGEINFO']._serialized_start=1214
+  _globals['_CHANGEINFO']._serialized_end=1270
+  _globals['_RAFTVOTE']._serialized_start=1272
+  _globals['_RAFTVOTE']._serialized_end=1354
+  _globals['_RAFTVOTEREPLY']._serialized_start=1356
+  _globals['_RAFTVOTEREPLY']._serialized_end=1402
+  _globals['_RAFTENTRY']._serialized_start=1404
+  _globals['_RAFTENTRY']._serialized_end=1443
+  _globals['_RAFTAPPEND']._serialized_start=1446
+  _globals['_RAFTAPPEND']._serialized_end=1642
+  _globals['_RAFTAPPENDREPLY']._serialized_start=1644
+  _globals['_RAFTAPPENDREPLY']._serialized_end=1706
+  _globals['_MANAGESERVICE']._serialized_start=1709
+  _globals['_MANAGESERVICE']._serialized_end=2541
 # @@protoc_insertion_point(module_scope)
@@ -64,6 +64,21 @@ class manageServiceStub(object):
                 request_serializer=mapb__pb2.SerInfo.SerializeToString,
                 response_deserializer=mapb__pb2.Empty.FromString,
                 _registered_method=True)
+        self.ready = channel.unary_unary(
+                '/mapb.manageService/ready',
+                request_serializer=mapb__pb2.SerInfo.SerializeToString,
+                response_deserializer=mapb__pb2.Empty.FromString,
+                _registered_method=True)
+        self.topology = channel.unary_unary(
+                '/mapb.manageService/topology',
+                request_serializer=mapb__pb2.Empty.SerializeToString,
+                response_deserializer=mapb__pb2.Topology.FromString,
+                _registered_method=True)
+        self.watchTopology = channel.unary_stream(
+                '/mapb.manageService/watchTopology',
+                request_serializer=mapb__pb2.Empty.SerializeToString,
+                response_deserializer=mapb__pb2.TopologyEvent.FromString,
+                _registered_method=True)
         self.Get = channel.unary_unary(
                 '/mapb.manageService/Get',
                 request_serializer=mapb__pb2.Request.SerializeToString,
@@ -79,6 +94,41 @@ class manageServiceStub(object):
                 request_serializer=mapb__pb2.Request.SerializeToString,
                 response_deserializer=mapb__pb2.Response.FromString,
                 _registered_method=True)
+        self.PutStream = channel.stream_unary(
+                '/mapb.manageService/PutStream',
+                request_serializer=mapb__pb2.KVChunk.SerializeToString,
+                response_deserializer=mapb__pb2.Response.FromString,
+                _registered_method=True)
+        self.PutBatch = channel.unary_unary(
+                '/mapb.manageService/PutBatch',
+                request_serializer=mapb__pb2.KVBatch.SerializeToString,
+                response_deserializer=mapb__pb2.Response.FromString,
+                _registered_method=True)
+        self.stats = channel.unary_unary(
+                '/mapb.manageService/stats',
+                request_serializer=mapb__pb2.Empty.SerializeToString,
+                response_deserializer=mapb__pb2.Stats.FromString,
+                _registered_method=True)
+        self.spans = channel.unary_unary(
+                '/mapb.manageService/spans',
+                request_serializer=mapb__pb2.SpanRequest.SerializeToString,
+                response_deserializer=mapb__pb2.Spans.FromString,
+                _registered_method=True)
+        self.profile = channel.unary_unary(
+                '/mapb.manageService/profile',
+                request_serializer=mapb__pb2.ProfileRequest.SerializeToString,
+                response_deserializer=mapb__pb2.Profile.FromString,
+                _registered_method=True)
+        self.raftVote = channel.unary_unary(
+                '/mapb.manageService/raftVote',
+                request_serializer=mapb__pb2.RaftVote.SerializeToString,
+                response_deserializer=mapb__pb2.RaftVoteReply.FromString,
+                _registered_method=True)
+        self.raftAppend = channel.unary_unary(
+                '/mapb.manageService/raftAppend',
+                request_serializer=mapb__pb2.RaftAppend.SerializeToString,
+                response_deserializer=mapb__pb2.RaftAppendReply.FromString,
+                _registered_method=True)
 
 
 class manageServiceServicer(object):
@@ -120,6 +170,24 @@ class manageServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def ready(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def topology(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def watchTopology(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def Get(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
@@ -138,6 +206,48 @@ class manageServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def PutStream(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def PutBatch(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def stats(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def spans(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def profile(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def raftVote(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def raftAppend(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_manageServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -171,6 +281,21 @@ def add_manageServiceServicer_to_server(servicer, server):
                     request_deserializer=mapb__pb2.SerInfo.FromString,
                     response_serializer=mapb__pb2.Empty.SerializeToString,
             ),
+            'ready': grpc.unary_unary_rpc_method_handler(
+                    servicer.ready,
+                    request_deserializer=mapb__pb2.SerInfo.FromString,
+                    response_serializer=mapb__pb2.Empty.SerializeToString,
+            ),
+            'topology': grpc.unary_unary_rpc_method_handler(
+                    servicer.topology,
+                    request_deserializer=mapb__pb2.Empty.FromString,
+                    response_serializer=mapb__pb2.Topology.SerializeToString,
+            ),
+            'watchTopology': grpc.unary_stream_rpc_method_handler(
+                    servicer.watchTopology,
+                    request_deserializer=mapb__pb2.Empty.FromString,
+                    response_serializer=mapb__pb2.TopologyEvent.SerializeToString,
+            ),
             'Get': grpc.unary_unary_rpc_method_handler(
                     servicer.Get,
                     request_deserializer=mapb__pb2.Request.FromString,
@@ -186,6 +311,41 @@ def add_manageServiceServicer_to_server(servicer, server):
                     request_deserializer=mapb__pb2.Request.FromString,
                     response_serializer=mapb__pb2.Response.SerializeToString,
             ),
+            'PutStream': grpc.stream_unary_rpc_method_handler(
+                    servicer.PutStream,
+                    request_deserializer=mapb__pb2.KVChunk.FromString,
+                    response_serializer=mapb__pb2.Response.SerializeToString,
+            ),
+            'PutBatch': grpc.unary_unary_rpc_method_handler(
+                    servicer.PutBatch,
+                    request_deserializer=mapb__pb2.KVBatch.FromString,
+                    response_serializer=mapb__pb2.Response.SerializeToString,
+            ),
+            'stats': grpc.unary_unary_rpc_method_handler(
+                    servicer.stats,
+                    request_deserializer=mapb__pb2.Empty.FromString,
+                    response_serializer=mapb__pb2.Stats.SerializeToString,
+            ),
+            'spans': grpc.unary_unary_rpc_method_handler(
+                    servicer.spans,
+                    request_deserializer=mapb__pb2.SpanRequest.FromString,
+                    response_serializer=mapb__pb2.Spans.SerializeToString,
+            ),
+            'profile': grpc.unary_unary_rpc_method_handler(
+                    servicer.profile,
+                    request_deserializer=mapb__pb2.ProfileRequest.FromString,
+                    response_serializer=mapb__pb2.Profile.SerializeToString,
+            ),
+            'raftVote': grpc.unary_unary_rpc_method_handler(
+                    servicer.raftVote,
+                    request_deserializer=mapb__pb2.RaftVote.FromString,
+                    response_serializer=mapb__pb2.RaftVoteReply.SerializeToString,
+            ),
+            'raftAppend': grpc.unary_unary_rpc_method_handler(
+                    servicer.raftAppend,
+                    request_deserializer=mapb__pb2.RaftAppend.FromString,
+                    response_serializer=mapb__pb2.RaftAppendReply.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'mapb.manageService', rpc_method_handlers)
@@ -359,6 +519,87 @@ class manageService(object):
             metadata,
             _registered_method=True)
 
+    @staticmethod
+    def ready(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/mapb.manageService/ready',
+            mapb__pb2.SerInfo.SerializeToString,
+            mapb__pb2.Empty.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def topology(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/mapb.manageService/topology',
+            mapb__pb2.Empty.SerializeToString,
+            mapb__pb2.Topology.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def watchTopology(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/mapb.manageService/watchTopology',
+            mapb__pb2.Empty.SerializeToString,
+            mapb__pb2.TopologyEvent.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
     @staticmethod
     def Get(request,
             target,
@@ -439,3 +680,192 @@ class manageService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def PutStream(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(
+            request_iterator,
+            target,
+            '/mapb.manageService/PutStream',
+            mapb__pb2.KVChunk.SerializeToString,
+            mapb__pb2.Response.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def PutBatch(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/mapb.manageService/PutBatch',
+            mapb__pb2.KVBatch.SerializeToString,
+            mapb__pb2.Response.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def stats(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/mapb.manageService/stats',
+            mapb__pb2.Empty.SerializeToString,
+            mapb__pb2.Stats.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def spans(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/mapb.manageService/spans',
+            mapb__pb2.SpanRequest.SerializeToString,
+            mapb__pb2.Spans.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def profile(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/mapb.manageService/profile',
+            mapb__pb2.ProfileRequest.SerializeToString,
+            mapb__pb2.Profile.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def raftVote(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/mapb.manageService/raftVote',
+            mapb__pb2.RaftVote.SerializeToString,
+            mapb__pb2.RaftVoteReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def raftAppend(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/mapb.manageService/raftAppend',
+            mapb__pb2.RaftAppend.SerializeToString,
+            mapb__pb2.RaftAppendReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
@@ -24,7 +24,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nstpb.proto\x12\x04stpb\"8\n\tStRequest\x12\x0e\n\x06\x63li_id\x18\x01 \x01(\x05\x12\x0b\n\x03key\x18\x02 \x01(\t\x12\x0e\n\x06\x64\x65lete\x18\x03 \x01(\x08\"2\n\x04StKV\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\t\x12\x0e\n\x06\x63li_id\x18\x03 \x01(\x05\"7\n\x07StEmpty\x12\r\n\x05\x65mpty\x18\x01 \x01(\t\x12\r\n\x05\x65rrno\x18\x03 \x01(\x08\x12\x0e\n\x06\x65rrmes\x18\x04 \x01(\t\":\n\nStResponse\x12\r\n\x05value\x18\x01 \x01(\t\x12\r\n\x05\x65rrno\x18\x03 \x01(\x08\x12\x0e\n\x06\x65rrmes\x18\x04 \x01(\t2\x91\x03\n\x12storagementService\x12,\n\x07getdata\x12\x0f.stpb.StRequest\x1a\x10.stpb.StResponse\x12$\n\x07putdata\x12\n.stpb.StKV\x1a\r.stpb.StEmpty\x12)\n\x07\x64\x65ldata\x12\x0f.stpb.StRequest\x1a\r.stpb.StEmpty\x12.\n\tmaGetdata\x12\x0f.stpb.StRequest\x1a\x10.stpb.StResponse\x12&\n\tmaPutdata\x12\n.stpb.StKV\x1a\r.stpb.StEmpty\x12+\n\tmaDeldata\x12\x0f.stpb.StRequest\x1a\r.stpb.StEmpty\x12\'\n\x05\x61\x62ort\x12\x0f.stpb.StRequest\x1a\r.stpb.StEmpty\x12(\n\x06\x63ommit\x12\x0f.stpb.StRequest\x1a\r.stpb.StEmpty\x12$\n\x04live\x12\r.stpb.StEmpty\x1a\r.stpb.StEmptyB\x11Z\x0f../storageprotob\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nstpb.proto\x12\x04stpb\"x\n\tStRequest\x12\x0e\n\x06\x63li_id\x18\x01 \x01(\x05\x12\x0b\n\x03key\x18\x02 \x01(\t\x12\x0e\n\x06\x64\x65lete\x18\x03 \x01(\x08\x12\x11\n\tforwarded\x18\x04 \x01(\x08\x12\x0f\n\x07version\x18\x05 \x01(\x03\x12\x0e\n\x06\x65xpect\x18\x06 \x01(\x03\x12\n\n\x02tx\x18\x07 \x01(\t\"\x82\x01\n\x04StKV\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\t\x12\x0e\n\x06\x63li_id\x18\x03 \x01(\x05\x12\x11\n\tforwarded\x18\x04 \x01(\x08\x12\x0f\n\x07version\x18\x05 \x01(\x03\x12\x0e\n\x06\x65xpect\x18\x06 \x01(\x03\x12\x0e\n\x06\x61\x62sent\x18\x07 \x01(\x08\x12\n\n\x02tx\x18\x08 \x01(\t\"7\n\x07StEmpty\x12\r\n\x05\x65mpty\x18\x01 \x01(\t\x12\r\n\x05\x65rrno\x18\x03 \x01(\x08\x12\x0e\n\x06\x65rrmes\x18\x04 \x01(\t\"K\n\nStResponse\x12\r\n\x05value\x18\x01 \x01(\t\x12\r\n\x05\x65rrno\x18\x03 \x01(\x08\x12\x0e\n\x06\x65rrmes\x18\x04 \x01(\t\x12\x0f\n\x07version\x18\x05 \x01(\x03\"\x91\x01\n\x07StChunk\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\x0c\n\x04\x64\x61ta\x18\x02 \x01(\x0c\x12\x0e\n\x06\x63li_id\x18\x03 \x01(\x05\x12\x0c\n\x04size\x18\x04 \x01(\x03\x12\r\n\x05\x65rrno\x18\x05 \x01(\x08\x12\x0e\n\x06\x65rrmes\x18\x06 \x01(\t\x12\x11\n\tforwarded\x18\x07 \x01(\x08\x12\x0f\n\x07version\x18\x08 \x01(\x03\x12\n\n\x02tx\x18\t \x01(\t\"\x1f\n\x0eStStatsRequest\x12\r\n\x05local\x18\x01 \x01(\x08\"+\n\x07StStats\x12\x0c\n\x04json\x18\x01 \x01(\t\x12\x12\n\nprometheus\x18\x02 \x01(\t\"?\n\rStSpanRequest\x12\x10\n\x08trace_id\x18\x01 \x01(\t\x12\r\n\x05limit\x18\x02 \x01(\x05\x12\r\n\x05local\x18\x03 \x01(\x08\"\x17\n\x07StSpans\x12\x0c\n\x04json\x18\x01 \x01(\t\"_\n\x10StProfileRequest\x12\x0c\n\x04mode\x18\x01 \x01(\t\x12\x0f\n\x07seconds\x18\x02 \x01(\x01\x12\x10\n\x08interval\x18\x03 \x01(\x01\x12\x0b\n\x03top\x18\x04 \x01(\x05\x12\r\n\x05local\x18\x05 \x01(\x08\"E\n\tStProfile\x12\r\n\x05\x65rrno\x18\x01 \x01(\x08\x12\x0e\n\x06\x65rrmes\x18\x02 \x01(\t\x12\x0c\n\x04text\x18\x03 \x01(\t\x12\x0b\n\x03raw\x18\x04 \x01(\x0c\"Q\n\x07StBatch\x12\r\n\x05\x62\x61tch\x18\x01 \x01(\t\x12\x17\n\x03kvs\x18\x02 \x03(\x0b\x32\n.stpb.StKV\x12\r\n\x05local\x18\x03 \x01(\x08\x12\x0f\n\x07version\x18\x04 \x01(\x03\"T\n\nStDecision\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05\x62\x61tch\x18\x02 \x01(\t\x12\x0e\n\x06\x64\x65lete\x18\x03 \x01(\x08\x12\x0e\n\x06\x63ommit\x18\x04 \x01(\x08\x12\n\n\x02tx\x18\x05 \x01(\t\"?\n\tStResolve\x12#\n\tdecisions\x18\x01 \x03(\x0b\x32\x10.stpb.StDecision\x12\r\n\x05local\x18\x02 \x01(\x08\"S\n\tStKVBatch\x12\x17\n\x03kvs\x18\x01 \x03(\x0b\x32\n.stpb.StKV\x12\x0e\n\x06\x63li_id\x18\x02 \x01(\x05\x12\r\n\x05\x65rrno\x18\x03 \x01(\x08\x12\x0e\n\x06\x65rrmes\x18\x04 \x01(\t\"z\n\x0eStImportResult\x12\r\n\x05\x65rrno\x18\x01 \x01(\x08\x12\x0e\n\x06\x65rrmes\x18\x02 \x01(\t\x12\x10\n\x08imported\x18\x03 \x01(\x03\x12\x0e\n\x06\x66\x61iled\x18\x04 \x01(\x03\x12\'\n\x08\x66\x61ilures\x18\x05 \x03(\x0b\x32\x15.stpb.StImportFailure\"@\n\x0fStImportFailure\x12\x0f\n\x07primary\x18\x01 \x01(\x05\x12\x0c\n\x04keys\x18\x02 \x03(\t\x12\x0e\n\x06\x65rrmes\x18\x03 \x01(\t\"T\n\nStSnapshot\x12\n\n\x02id\x18\x01 \x01(\t\x12\r\n\x05local\x18\x02 \x01(\x08\x12\x0c\n\x04keys\x18\x03 \x01(\x03\x12\r\n\x05\x65rrno\x18\x04 \x01(\x08\x12\x0e\n\x06\x65rrmes\x18\x05 \x01(\t\"P\n\x0fStExportRequest\x12\x0e\n\x06\x63li_id\x18\x01 \x01(\x05\x12\x10\n\x08snapshot\x18\x02 \x01(\t\x12\x0c\n\x04part\x18\x03 \x01(\x05\x12\r\n\x05parts\x18\x04 \x01(\x05\"4\n\x13StInvalidateRequest\x12\x0e\n\x06\x63li_id\x18\x01 \x01(\x05\x12\r\n\x05local\x18\x02 \x01(\x08\"-\n\x0eStInvalidation\x12\x0c\n\x04keys\x18\x01 \x03(\t\x12\r\n\x05reset\x18\x02 \x01(\x08\"\\\n\x0eStWatchRequest\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\x0e\n\x06prefix\x18\x02 \x01(\x08\x12\x0e\n\x06\x63ursor\x18\x03 \x01(\t\x12\x0e\n\x06\x63li_id\x18\x04 \x01(\x05\x12\r\n\x05local\x18\x05 \x01(\x08\"u\n\x0cStWatchEvent\x12\x0b\n\x03seq\x18\x01 \x01(\x03\x12\n\n\x02op\x18\x02 \x01(\t\x12\x0b\n\x03key\x18\x03 \x01(\t\x12\r\n\x05value\x18\x04 \x01(\t\x12\x11\n\thas_value\x18\x05 \x01(\x08\x12\x0e\n\x06\x63ursor\x18\x06 \x01(\t\x12\r\n\x05reset\x18\x07 \x01(\x08\"5\n\x07StEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\x0c\n\x04\x64\x61ta\x18\x02 \x01(\x0c\x12\x0f\n\x07version\x18\x03 \x01(\x03\"^\n\tStEntries\x12\x1e\n\x07\x65ntries\x18\x01 \x03(\x0b\x32\r.stpb.StEntry\x12\r\n\x05local\x18\x02 \x01(\x08\x12\x11\n\toverwrite\x18\x03 \x01(\x08\x12\x0f\n\x07removed\x18\x04 \x03(\t\"\"\n\rStPullRequest\x12\x11\n\tserver_id\x18\x01 \x01(\x05\"~\n\x0fStMerkleRequest\x12\x0f\n\x07primary\x18\x01 \x01(\x05\x12\r\n\x05\x65poch\x18\x02 \x01(\x03\x12\r\n\x05nodes\x18\x03 \x03(\x05\x12\x0e\n\x06leaves\x18\x04 \x01(\x08\x12\r\n\x05shard\x18\x05 \x01(\x05\x12\x0e\n\x06shards\x18\x06 \x01(\x05\x12\r\n\x05local\x18\x07 \x01(\x08\"\'\n\x08StDigest\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\x0e\n\x06\x64igest\x18\x02 \x01(\x0c\"Z\n\x08StMerkle\x12\x0e\n\x06hashes\x18\x01 \x03(\x0c\x12\x1f\n\x07\x64igests\x18\x02 \x03(\x0b\x32\x0e.stpb.StDigest\x12\r\n\x05\x65rrno\x18\x03 \x01(\x08\x12\x0e\n\x06\x65rrmes\x18\x04 \x01(\t\")\n\x06StHint\x12\x11\n\tserver_id\x18\x01 \x01(\x05\x12\x0c\n\x04keys\x18\x02 \x03(\t\"5\n\x07StHints\x12\x1b\n\x05hints\x18\x01 \x03(\x0b\x32\x0c.stpb.StHint\x12\r\n\x05local\x18\x02 \x01(\x08\x32\x89\x0b\n\x12storagementService\x12,\n\x07getdata\x12\x0f.stpb.StRequest\x1a\x10.stpb.StResponse\x12$\n\x07putdata\x12\n.stpb.StKV\x1a\r.stpb.StEmpty\x12)\n\x07\x64\x65ldata\x12\x0f.stpb.StRequest\x1a\r.stpb.StEmpty\x12.\n\tmaGetdata\x12\x0f.stpb.StRequest\x1a\x10.stpb.StResponse\x12&\n\tmaPutdata\x12\n.stpb.StKV\x1a\r.stpb.StEmpty\x12+\n\tmaDeldata\x12\x0f.stpb.StRequest\x1a\r.stpb.StEmpty\x12\'\n\x05\x61\x62ort\x12\x0f.stpb.StRequest\x1a\r.stpb.StEmpty\x12(\n\x06\x63ommit\x12\x0f.stpb.StRequest\x1a\r.stpb.StEmpty\x12$\n\x04live\x12\r.stpb.StEmpty\x1a\r.stpb.StEmpty\x12+\n\tputstream\x12\r.stpb.StChunk\x1a\r.stpb.StEmpty(\x01\x12-\n\tgetstream\x12\x0f.stpb.StRequest\x1a\r.stpb.StChunk0\x01\x12-\n\x0bmaPutstream\x12\r.stpb.StChunk\x1a\r.stpb.StEmpty(\x01\x12,\n\x05stats\x12\x14.stpb.StStatsRequest\x1a\r.stpb.StStats\x12+\n\x05spans\x12\x13.stpb.StSpanRequest\x1a\r.stpb.StSpans\x12\x32\n\x07profile\x12\x16.stpb.StProfileRequest\x1a\x0f.stpb.StProfile\x12*\n\nmaPutbatch\x12\r.stpb.StBatch\x1a\r.stpb.StEmpty\x12+\n\x0b\x63ommitBatch\x12\r.stpb.StBatch\x1a\r.stpb.StEmpty\x12*\n\nabortBatch\x12\r.stpb.StBatch\x1a\r.stpb.StEmpty\x12(\n\x08putbatch\x12\r.stpb.StBatch\x1a\r.stpb.StEmpty\x12)\n\x07resolve\x12\x0f.stpb.StResolve\x1a\r.stpb.StEmpty\x12\x35\n\nimportdata\x12\x0f.stpb.StKVBatch\x1a\x14.stpb.StImportResult(\x01\x12.\n\x08snapshot\x12\x10.stpb.StSnapshot\x1a\x10.stpb.StSnapshot\x12/\n\x0c\x64ropSnapshot\x12\x10.stpb.StSnapshot\x1a\r.stpb.StEmpty\x12\x36\n\nexportdata\x12\x15.stpb.StExportRequest\x1a\x0f.stpb.StKVBatch0\x01\x12\x42\n\rinvalidations\x12\x19.stpb.StInvalidateRequest\x1a\x14.stpb.StInvalidation0\x01\x12\x33\n\x05watch\x12\x14.stpb.StWatchRequest\x1a\x12.stpb.StWatchEvent0\x01\x12\x32\n\x07install\x12\x0f.stpb.StEntries\x1a\x14.stpb.StImportResult(\x01\x12.\n\x04pull\x12\x13.stpb.StPullRequest\x1a\x0f.stpb.StEntries0\x01\x12/\n\x06merkle\x12\x15.stpb.StMerkleRequest\x1a\x0e.stpb.StMerkle\x12$\n\x04hint\x12\r.stpb.StHints\x1a\r.stpb.StEmptyB\x11Z\x0f../storageprotob\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -33,13 +33,67 @@ if not _descriptor._USE_C_DESCRIPTORS:
   _globals['DESCRIPTOR']._loaded_options = None
   _globals['DESCRIPTOR']._serialized_options = b'Z\017../storageproto'
   _globals['_STREQUEST']._serialized_start=20
-  _globals['_STREQUEST']._serialized_end=76
-  _globals['_STKV']._serialized_start=78
-  _globals['_STKV']._serialized_end=128
-  _globals['_STEMPTY']._serialized_start=130
-  _globals['_STEMPTY']._serialized_end=185
-  _globals['_STRESPONSE']._serialized_start=187
-  _globals['_STRESPONSE']._serialized_end=245
-  _globals['_STORAGEMENTSERVICE']._serialized_start=248
-  _globals['_STORAGEMENTSERVICE']._serialized_end=649
+  _globals['_STREQUEST']._serialized_end=140
+  _globals['_STKV']._serialized_start=143
+  _globals['_STKV']._serialized_end=273
+  _globals['_STEMPTY']._serialized_start=275
+  _globals['_STEMPTY']._serialized_end=330
+  _globals['_STRESPONSE']._serialized_start=332
+  _globals['_STRESPONSE']._serialized_end=407
+  _globals['_STCHUNK']._serialized_start=410
+  _globals['_STCHUNK']._serialized_end=555
+  _globals['_STSTATSREQUEST']._serialized_start=557
+  _globals['_STSTATSREQUEST']._serialized_end=588
+  _globals['_STSTATS']._serialized_start=590
+  _globals['_STSTATS']._serialized_end=633
+  _globals['_STSPANREQUEST']._serialized_start=635
+  _globals['_STSPANREQUEST']._serialized_end=698
+  _globals['_STSPANS']._serialized_start=700
+  _globals['_STSPANS']._serialized_end=723
+  _globals['_STPROFILEREQUEST']._serialized_start=725
+  _globals['_STPROFILEREQUEST']._serialized_end=820
+  _globals['_STPROFILE']._serialized_start=822
+  _globals['_STPROFILE']._serialized_end=891
+  _globals['_STBATCH']._serialized_start=893
+  _globals['_STBATCH']._serialized_end=974
+  _globals['_STDECISION']._serialized_start=976
+  _globals['_STDECISION']._serialized_end=1060
+  _globals['_STRESOLVE']._serialized_start=1062
+  _globals['_STRESOLVE']._serialized_end=1125
+  _globals['_STKVBATCH']._serialized_start=1127
+  _globals['_STKVBATCH']._serialized_end=1210
+  _globals['_STIMPORTRESULT']._serialized_start=1212
+  _globals['_STIMPORTRESULT']._serialized_end=1334
+  _globals['_STIMPORTFAILURE']._serialized_start=1336
+  _globals['_STIMPORTFAILURE']._serialized_end=1400
+  _globals['_STSNAPSHOT']._serialized_start=1402
+  _globals['_STSNAPSHOT']._serialized_end=1486
+  _globals['_STEXPORTREQUEST']._serialized_start=1488
+  _globals['_STEXPORTREQUEST']._serialized_end=1568
+  _globals['_STINVALIDATEREQUEST']._serialized_start=1570
+  _globals['_STINVALIDATEREQUEST']._serialized_end=1622
+  _globals['_STINVALIDATION']._serialized_start=1624
+  _globals['_STINVALIDATION']._serialized_end=1669
+  _globals['_STWATCHREQUEST']._serialized_start=1671
+  _globals['_STWATCHREQUEST']._serialized_end=1763
+  _globals['_STWATCHEVENT']._serialized_start=1765
+  _globals['_STWATCHEVENT']._serialized_end=1882
+  _globals['_STENTRY']._serialized_start=1884
+  _globals['_STENTRY']._serialized_end=1937
+  _globals['_STENTRIES']._serialized_start=1939
+  _globals['_STENTRIES']._serialized_end=2033
+  _globals['_STPULLREQUEST']._serialized_start=2035
+  _globals['_STPULLREQUEST']._serialized_end=2069
+  _globals['_STMERKLEREQUEST']._serialized_start=2071
+  _globals['_STMERKLEREQUEST']._serialized_end=2197
+  _globals['_STDIGEST']._serialized_start=2199
+  _globals['_STDIGEST']._serialized_end=2238
+  _globals['_STMERKLE']._serialized_start=2240
+  _globals['_STMERKLE']._serialized_end=2330
+  _globals['_STHINT']._serialized_start=2332
+  _globals['_STHINT']._serialized_end=2373
+  _globals['_STHINTS']._serialized_start=2375
+  _globals['_STHINTS']._serialized_end=2428
+  _globals['_STORAGEMENTSERVICE']._serialized_start=2431
+  _globals['_STORAGEMENTSERVICE']._serialized_end=3848
 # @@protoc_insertion_point(module_scope)
@@ -79,6 +79,111 @@ class storagementServiceStub(object):
                 request_serializer=stpb__pb2.StEmpty.SerializeToString,
                 response_deserializer=stpb__pb2.StEmpty.FromString,
                 _registered_method=True)
+        self.putstream = channel.stream_unary(
+                '/stpb.storagementService/putstream',
+                request_serializer=stpb__pb2.StChunk.SerializeToString,
+                response_deserializer=stpb__pb2.StEmpty.FromString,
+                _registered_method=True)
+        self.getstream = channel.unary_stream(
+                '/stpb.storagementService/getstream',
+                request_serializer=stpb__pb2.StRequest.SerializeToString,
+                response_deserializer=stpb__pb2.StChunk.FromString,
+                _registered_method=True)
+        self.maPutstream = channel.stream_unary(
+                '/stpb.storagementService/maPutstream',
+                request_serializer=stpb__pb2.StChunk.SerializeToString,
+                response_deserializer=stpb__pb2.StEmpty.FromString,
+                _registered_method=True)
+        self.stats = channel.unary_unary(
+                '/stpb.storagementService/stats',
+                request_serializer=stpb__pb2.StStatsRequest.SerializeToString,
+                response_deserializer=stpb__pb2.StStats.FromString,
+                _registered_method=True)
+        self.spans = channel.unary_unary(
+                '/stpb.storagementService/spans',
+                request_serializer=stpb__pb2.StSpanRequest.SerializeToString,
+                response_deserializer=stpb__pb2.StSpans.FromString,
+                _registered_method=True)
+        self.profile = channel.unary_unary(
+                '/stpb.storagementService/profile',
+                request_serializer=stpb__pb2.StProfileRequest.SerializeToString,
+                response_deserializer=stpb__pb2.StProfile.FromString,
+                _registered_method=True)
+        self.maPutbatch = channel.unary_unary(
+                '/stpb.storagementService/maPutbatch',
+                request_serializer=stpb__pb2.StBatch.SerializeToString,
+                response_deserializer=stpb__pb2.StEmpty.FromString,
+                _registered_method=True)
+        self.commitBatch = channel.unary_unary(
+                '/stpb.storagementService/commitBatch',
+                request_serializer=stpb__pb2.StBatch.SerializeToString,
+                response_deserializer=stpb__pb2.StEmpty.FromString,
+                _registered_method=True)
+        self.abortBatch = channel.unary_unary(
+                '/stpb.storagementService/abortBatch',
+                request_serializer=stpb__pb2.StBatch.SerializeToString,
+                response_deserializer=stpb__pb2.StEmpty.FromString,
+                _registered_method=True)
+        self.putbatch = channel.unary_unary(
+                '/stpb.storagementService/putbatch',
+                request_serializer=stpb__pb2.StBatch.SerializeToString,
+                response_deserializer=stpb__pb2.StEmpty.FromString,
+                _registered_method=True)
+        self.resolve = channel.unary_unary(
+                '/stpb.storagementService/resolve',
+                request_serializer=stpb__pb2.StResolve.SerializeToString,
+                response_deserializer=stpb__pb2.StEmpty.FromString,
+                _registered_method=True)
+        self.importdata = channel.stream_unary(
+                '/stpb.storagementService/importdata',
+                request_serializer=stpb__pb2.StKVBatch.SerializeToString,
+                response_deserializer=stpb__pb2.StImportResult.FromString,
+                _registered_method=True)
+        self.snapshot = channel.unary_unary(
+                '/stpb.storagementService/snapshot',
+                request_serializer=stpb__pb2.StSnapshot.SerializeToString,
+                response_deserializer=stpb__pb2.StSnapshot.FromString,
+                _registered_method=True)
+        self.dropSnapshot = channel.unary_unary(
+                '/stpb.storagementService/dropSnapshot',
+                request_serializer=stpb__pb2.StSnapshot.SerializeToString,
+                response_deserializer=stpb__pb2.StEmpty.FromString,
+                _registered_method=True)
+        self.exportdata = channel.unary_stream(
+                '/stpb.storagementService/exportdata',
+                request_serializer=stpb__pb2.StExportRequest.SerializeToString,
+                response_deserializer=stpb__pb2.StKVBatch.FromString,
+                _registered_method=True)
+        self.invalidations = channel.unary_stream(
+                '/stpb.storagementService/invalidations',
+                request_serializer=stpb__pb2.StInvalidateRequest.SerializeToString,
+                response_deserializer=stpb__pb2.StInvalidation.FromString,
+                _registered_method=True)
+        self.watch = channel.unary_stream(
+                '/stpb.storagementService/watch',
+                request_serializer=stpb__pb2.StWatchRequest.SerializeToString,
+                response_deserializer=stpb__pb2.StWatchEvent.FromString,
+                _registered_method=True)
+        self.install = channel.stream_unary(
+                '/stpb.storagementService/install',
+                request_serializer=stpb__pb2.StEntries.SerializeToString,
+                response_deserializer=stpb__pb2.StImportResult.FromString,
+                _registered_method=True)
+        self.pull = channel.unary_stream(
+                '/stpb.storagementService/pull',
+                request_serializer=stpb__pb2.StPullRequest.SerializeToString,
+                response_deserializer=stpb__pb2.StEntries.FromString,
+                _registered_method=True)
+        self.merkle = channel.unary_unary(
+                '/stpb.storagementService/merkle',
+                request_serializer=stpb__pb2.StMerkleRequest.SerializeToString,
+                response_deserializer=stpb__pb2.StMerkle.FromString,
+                _registered_method=True)
+        self.hint = channel.unary_unary(
+                '/stpb.storagementService/hint',
+                request_serializer=stpb__pb2.StHints.SerializeToString,
+                response_deserializer=stpb__pb2.StEmpty.FromString,
+                _registered_method=True)
 
 
 class storagementServiceServicer(object):
@@ -138,6 +243,132 @@ class storagementServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def putstream(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def getstream(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def maPutstream(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def stats(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def spans(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def profile(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def maPutbatch(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def commitBatch(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def abortBatch(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def putbatch(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def resolve(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def importdata(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def snapshot(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def dropSnapshot(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def exportdata(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def invalidations(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def watch(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def install(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def pull(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def merkle(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def hint(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_storagementServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -186,6 +417,111 @@ def add_storagementServiceServicer_to_server(servicer, server):
                     request_deserializer=stpb__pb2.StEmpty.FromString,
                     response_serializer=stpb__pb2.StEmpty.SerializeToString,
             ),
+            'putstream': grpc.stream_unary_rpc_method_handler(
+                    servicer.putstream,
+                    request_deserializer=stpb__pb2.StChunk.FromString,
+                    response_serializer=stpb__pb2.StEmpty.SerializeToString,
+            ),
+            'getstream': grpc.unary_stream_rpc_method_handler(
+                    servicer.getstream,
+                    request_deserializer=stpb__pb2.StRequest.FromString,
+                    response_serializer=stpb__pb2.StChunk.SerializeToString,
+            ),
+            'maPutstream': grpc.stream_unary_rpc_method_handler(
+                    servicer.maPutstream,
+                    request_deserializer=stpb__pb2.StChunk.FromString,
+                    response_serializer=stpb__pb2.StEmpty.SerializeToString,
+            ),
+            'stats': grpc.unary_unary_rpc_method_handler(
+                    servicer.stats,
+                    request_deserializer=stpb__pb2.StStatsRequest.FromString,
+                    response_serializer=stpb__pb2.StStats.SerializeToString,
+            ),
+            'spans': grpc.unary_unary_rpc_method_handler(
+                    servicer.spans,
+                    request_deserializer=stpb__pb2.StSpanRequest.FromString,
+                    response_serializer=stpb__pb2.StSpans.SerializeToString,
+            ),
+            'profile': grpc.unary_unary_rpc_method_handler(
+                    servicer.profile,
+                    request_deserializer=stpb__pb2.StProfileRequest.FromString,
+                    response_serializer=stpb__pb2.StProfile.SerializeToString,
+            ),
+            'maPutbatch': grpc.unary_unary_rpc_method_handler(
+                    servicer.maPutbatch,
+                    request_deserializer=stpb__pb2.StBatch.FromString,
+                    response_serializer=stpb__pb2.StEmpty.SerializeToString,
+            ),
+            'commitBatch': grpc.unary_unary_rpc_method_handler(
+                    servicer.commitBatch,
+                    request_deserializer=stpb__pb2.StBatch.FromString,
+                    response_serializer=stpb__pb2.StEmpty.SerializeToString,
+            ),
+            'abortBatch': grpc.unary_unary_rpc_method_handler(
+                    servicer.abortBatch,
+                    request_deserializer=stpb__pb2.StBatch.FromString,
+                    response_serializer=stpb__pb2.StEmpty.SerializeToString,
+            ),
+            'putbatch': grpc.unary_unary_rpc_method_handler(
+                    servicer.putbatch,
+                    request_deserializer=stpb__pb2.StBatch.FromString,
+                    response_serializer=stpb__pb2.StEmpty.SerializeToString,
+            ),
+            'resolve': grpc.unary_unary_rpc_method_handler(
+                    servicer.resolve,
+                    request_deserializer=stpb__pb2.StResolve.FromString,
+                    response_serializer=stpb__pb2.StEmpty.SerializeToString,
+            ),
+            'importdata': grpc.stream_unary_rpc_method_handler(
+                    servicer.importdata,
+                    request_deserializer=stpb__pb2.StKVBatch.FromString,
+                    response_serializer=stpb__pb2.StImportResult.SerializeToString,
+            ),
+            'snapshot': grpc.unary_unary_rpc_method_handler(
+                    servicer.snapshot,
+                    request_deserializer=stpb__pb2.StSnapshot.FromString,
+                    response_serializer=stpb__pb2.StSnapshot.SerializeToString,
+            ),
+            'dropSnapshot': grpc.unary_unary_rpc_method_handler(
+                    servicer.dropSnapshot,
+                    request_deserializer=stpb__pb2.StSnapshot.FromString,
+                    response_serializer=stpb__pb2.StEmpty.SerializeToString,
+            ),
+            'exportdata': grpc.unary_stream_rpc_method_handler(
+                    servicer.exportdata,
+                    request_deserializer=stpb__pb2.StExportRequest.FromString,
+                    response_serializer=stpb__pb2.StKVBatch.SerializeToString,
+            ),
+            'invalidations': grpc.unary_stream_rpc_method_handler(
+                    servicer.invalidations,
+                    request_deserializer=stpb__pb2.StInvalidateRequest.FromString,
+                    response_serializer=stpb__pb2.StInvalidation.SerializeToString,
+            ),
+            'watch': grpc.unary_stream_rpc_method_handler(
+                    servicer.watch,
+                    request_deserializer=stpb__pb2.StWatchRequest.FromString,
+                    response_serializer=stpb__pb2.StWatchEvent.SerializeToString,
+            ),
+            'install': grpc.stream_unary_rpc_method_handler(
+                    servicer.install,
+                    request_deserializer=stpb__pb2.StEntries.FromString,
+                    response_serializer=stpb__pb2.StImportResult.SerializeToString,
+            ),
+            'pull': grpc.unary_stream_rpc_method_handler(
+                    servicer.pull,
+                    request_deserializer=stpb__pb2.StPullRequest.FromString,
+                    response_serializer=stpb__pb2.StEntries.SerializeToString,
+            ),
+            'merkle': grpc.unary_unary_rpc_method_handler(
+                    servicer.merkle,
+                    request_deserializer=stpb__pb2.StMerkleRequest.FromString,
+                    response_serializer=stpb__pb2.StMerkle.SerializeToString,
+            ),
+            'hint': grpc.unary_unary_rpc_method_handler(
+                    servicer.hint,
+                    request_deserializer=stpb__pb2.StHints.FromString,
+                    response_serializer=stpb__pb2.StEmpty.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'stpb.storagementService', rpc_method_handlers)
@@ -439,3 +775,570 @@ class storagementService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def putstream(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(
+            request_iterator,
+            target,
+            '/stpb.storagementService/putstream',
+            stpb__pb2.StChunk.SerializeToString,
+            stpb__pb2.StEmpty.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def getstream(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/stpb.storagementService/getstream',
+            stpb__pb2.StRequest.SerializeToString,
+            stpb__pb2.StChunk.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def maPutstream(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(
+            request_iterator,
+            target,
+            '/stpb.storagementService/maPutstream',
+            stpb__pb2.StChunk.SerializeToString,
+            stpb__pb2.StEmpty.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def stats(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/stpb.storagementService/stats',
+            stpb__pb2.StStatsRequest.SerializeToString,
+            stpb__pb2.StStats.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def spans(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/stpb.storagementService/spans',
+            stpb__pb2.StSpanRequest.SerializeToString,
+            stpb__pb2.StSpans.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def profile(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/stpb.storagementService/profile',
+            stpb__pb2.StProfileRequest.SerializeToString,
+            stpb__pb2.StProfile.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def maPutbatch(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/stpb.storagementService/maPutbatch',
+            stpb__pb2.StBatch.SerializeToString,
+            stpb__pb2.StEmpty.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def commitBatch(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/stpb.storagementService/commitBatch',
+            stpb__pb2.StBatch.SerializeToString,
+            stpb__pb2.StEmpty.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def abortBatch(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/stpb.storagementService/abortBatch',
+            stpb__pb2.StBatch.SerializeToString,
+            stpb__pb2.StEmpty.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def putbatch(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/stpb.storagementService/putbatch',
+            stpb__pb2.StBatch.SerializeToString,
+            stpb__pb2.StEmpty.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def resolve(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/stpb.storagementService/resolve',
+            stpb__pb2.StResolve.SerializeToString,
+            stpb__pb2.StEmpty.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def importdata(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(
+            request_iterator,
+            target,
+            '/stpb.storagementService/importdata',
+            stpb__pb2.StKVBatch.SerializeToString,
+            stpb__pb2.StImportResult.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def snapshot(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/stpb.storagementService/snapshot',
+            stpb__pb2.StSnapshot.SerializeToString,
+            stpb__pb2.StSnapshot.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def dropSnapshot(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/stpb.storagementService/dropSnapshot',
+            stpb__pb2.StSnapshot.SerializeToString,
+            stpb__pb2.StEmpty.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def exportdata(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/stpb.storagementService/exportdata',
+            stpb__pb2.StExportRequest.SerializeToString,
+            stpb__pb2.StKVBatch.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def invalidations(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/stpb.storagementService/invalidations',
+            stpb__pb2.StInvalidateRequest.SerializeToString,
+            stpb__pb2.StInvalidation.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def watch(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/stpb.storagementService/watch',
+            stpb__pb2.StWatchRequest.SerializeToString,
+            stpb__pb2.StWatchEvent.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def install(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(
+            request_iterator,
+            target,
+            '/stpb.storagementService/install',
+            stpb__pb2.StEntries.SerializeToString,
+            stpb__pb2.StImportResult.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def pull(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/stpb.storagementService/pull',
+            stpb__pb2.StPullRequest.SerializeToString,
+            stpb__pb2.StEntries.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def merkle(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/stpb.storagementService/merkle',
+            stpb__pb2.StMerkleRequest.SerializeToString,
+            stpb__pb2.StMerkle.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def hint(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/stpb.storagementService/hint',
+            stpb__pb2.StHints.SerializeToString,
+            stpb__pb2.StEmpty.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
@@ -0,0 +1,237 @@
+﻿import asyncio
+import signal
+import tempfile
+import time
+
+import grpc
+
+from protos import mapb_pb2 as mapb
+from protos import mapb_pb2_grpc as mapb_grpc
+from protos import stpb_pb2 as stpb
+from protos import stpb_pb2_grpc as stpb_grpc
+from params import params
+from common.interceptors import AsyncHookInterceptor
+from common.pool import AsyncChannelPool
+from server.main import ManageService
+
+
+class AsyncManageService(mapb_grpc.manageServiceServicer):
+    """grpc.aio 版本的管理服务
+
+    节点与客户端信息仍保存在同步的 ManageService 中(心跳线程照常运行),
+    Get 向存储服务器的广播改为并发的异步 RPC, 写入交给键的主副本协调
+    """
+
+    def __init__(self, manage: ManageService):
+        self.manage = manage
+        self.logger = manage.logger
+        self.pool = AsyncChannelPool(manage.compression)
+
+    def _channel(self, target: str):
+        return self.pool.channel(target)
+
+    def _verified(self, server_id: int) -> bool:
+        if server_id not in self.manage.servermap:
+            self.logger.info("非法节点试图执行敏感操作, 已阻拦")
+            return False
+        return True
+
+    async def _call(self, sid: int, target: str, method: str, request):
+        """向单个存储服务器发起调用, 连接失败时响应为 None"""
+        start = time.perf_counter()
+        try:
+            async with self._channel(target) as ch:
+                client = stpb_grpc.storagementServiceStub(ch)
+                return sid, target, await getattr(client, method)(request, timeout=params.RPC_TIMEOUT)
+        except Exception as e:
+            self.logger.error(e)
+            return sid, target, None
+        finally:
+            self.manage._observe(sid, method, start)
+
+    # 节点注册、客户端连接等只修改内存状态, 直接复用同步实现
+    async def connect(self, request, context):
+        return self.manage.connect(request, context)
+
+    async def changeServer(self, request, context):
+        return self.manage.changeServer(request, context)
+
+    async def changeServerRandom(self, request, context):
+        return self.manage.changeServerRandom(request, context)
+
+    async def disconnect(self, request, context):
+        return self.manage.disconnect(request, context)
+
+    async def online(self, request, context):
+        return self.manage.online(request, context)
+
+    async def offline(self, request, context):
+        return self.manage.offline(request, context)
+
+    async def ready(self, request, context):
+        return self.manage.ready(request, context)
+
+    async def topology(self, request, context):
+        return self.manage.topology(request, context)
+
+    async def watchTopology(self, request, context):
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                pass
+
+        membership = self.manage.membership
+        membership.listeners.add(wake)
+        try:
+            snapshot = self.manage._topology_snapshot()
+            epoch = snapshot.epoch
+            yield snapshot
+            while True:
+                await wakeup.wait()
+                wakeup.clear()
+                for event in membership.since(epoch, timeout=0):
+                    epoch = event.epoch
+                    yield event
+        finally:
+            membership.listeners.discard(wake)
+
+    async def stats(self, request, context):
+        return self.manage.stats(request, context)
+
+    async def spans(self, request, context):
+        # 需要逐个询问存储服务器, 放到线程中执行
+        return await asyncio.to_thread(self.manage.spans, request, context)
+
+    async def profile(self, request, context):
+        return await asyncio.to_thread(self.manage.profile, request, context)
+
+    async def Get(self, request: mapb.Request, context) -> mapb.Response:
+        if not self._verified(request.server_id):
+            return mapb.Response(errno=False, errmes="节点未注册, 无权操作!")
+        ser_id = request.server_id
+        key = request.key
+        self.logger.info("存储服务器%s 请求键值%s", ser_id, key)
+        self.logger.info("正在从其他存储服务器收集键值%s", key)
+        calls = [self._call(sid, target, "maGetdata", stpb.StRequest(cli_id=0, key=key))
+                 for sid, target in self.manage._cluster().targets(key).items() if sid != ser_id]
+        values = []
+        for sid, _, resp in await asyncio.gather(*calls):
+            if resp is None:
+                continue
+            if not resp.errno:
+                self.logger.info("无法从存储服务器%s 获取键值%s ,%s", sid, key, resp.errmes)
+                continue
+            self.logger.info("存储服务器%s 响应了键值%s 请求", sid, key)
+            values.append(resp.value)
+        return self.manage._vote(key, values)
+
+    async def Put(self, request: mapb.KV, context) -> mapb.Response:
+        if not self._verified(request.server_id):
+            return mapb.Response(errno=False, errmes="节点未注册, 无权操作!")
+        key = request.key
+        self.logger.info("存储服务器%s 申请提交键值%s, 交给主副本协调", request.server_id, key)
+        resp = await self._route(key, "putdata", lambda: stpb.StKV(key=key, value=request.value))
+        if resp is None or not resp.errno:
+            self.logger.info("本次键值%s 提交无效", key)
+            return mapb.Response(errno=False, errmes=resp.errmes if resp is not None else "提交失败")
+        self.logger.info("本次键值%s 提交生效", key)
+        return mapb.Response(errno=True)
+
+    async def Del(self, request: mapb.Request, context) -> mapb.Response:
+        if not self._verified(request.server_id):
+            return mapb.Response(errno=False, errmes="节点未注册, 无权操作!")
+        key = request.key
+        self.logger.info("存储服务器%s 申请删除键值%s, 交给主副本协调", request.server_id, key)
+        resp = await self._route(key, "deldata", lambda: stpb.StRequest(key=key))
+        if resp is None or not resp.errno:
+            self.logger.info("本次键值%s 删除无效", key)
+            return mapb.Response(errno=False, errmes=resp.errmes if resp is not None else "删除失败")
+        self.logger.info("本次键值%s 删除生效", key)
+        return mapb.Response(errno=True)
+
+    async def PutStream(self, request_iterator, context) -> mapb.Response:
+        first = await anext(request_iterator, None)
+        if first is None:
+            return mapb.Response(errno=False, errmes="数据流为空")
+        if not self._verified(first.server_id):
+            return mapb.Response(errno=False, errmes="节点未注册, 无权操作!")
+        key = first.key
+        self.logger.info("存储服务器%s 申请分块提交键值%s, 共%s字节", first.server_id, key, first.size)
+        # 临时文件的读写放到线程中, 不阻塞事件循环
+        with await asyncio.to_thread(tempfile.TemporaryFile) as spool:
+            await asyncio.to_thread(spool.write, first.data)
+            async for chunk in request_iterator:
+                await asyncio.to_thread(spool.write, chunk.data)
+
+            async def chunks():
+                await asyncio.to_thread(spool.seek, 0)
+                yield stpb.StChunk(key=key, size=first.size, data=await asyncio.to_thread(spool.read, params.CHUNK_SIZE))
+                while data := await asyncio.to_thread(spool.read, params.CHUNK_SIZE):
+                    yield stpb.StChunk(data=data)
+
+            resp = await self._route(key, "putstream", chunks, timeout=params.STREAM_TIMEOUT)
+        if resp is None or not resp.errno:
+            self.logger.info("本次键值%s 分块提交无效", key)
+            return mapb.Response(errno=False, errmes=resp.errmes if resp is not None else "提交失败")
+        self.logger.info("本次键值%s 分块提交生效", key)
+        return mapb.Response(errno=True)
+
+    async def PutBatch(self, request: mapb.KVBatch, context) -> mapb.Response:
+        if not self._verified(request.server_id):
+            return mapb.Response(errno=False, errmes="节点未注册, 无权操作!")
+        self.logger.info("存储服务器%s 申请批量提交%s个键值", request.server_id, len(request.kvs))
+        batch = stpb.StKVBatch(kvs=[stpb.StKV(key=kv.key, value=kv.value) for kv in request.kvs])
+        nodes = self.manage._cluster().nodes
+        order = sorted(nodes, key=lambda sid: sid != request.server_id)
+        resp = await self._try([(sid, nodes[sid]) for sid in order], "importdata", lambda: iter([batch]),
+                               timeout=params.STREAM_TIMEOUT)
+        if resp is None or not resp.errno:
+            self.logger.info("批量提交%s个键值失败", len(request.kvs))
+            return mapb.Response(errno=False, errmes=resp.errmes if resp is not None else "批量提交失败")
+        self.logger.info("批量提交%s个键值生效", resp.imported)
+        return mapb.Response(errno=True)
+
+    async def _route(self, key: str, method: str, request, timeout: float = 3 * params.RPC_TIMEOUT):
+        """写入交给键的副本节点, 主副本在前, 规则同 ManageService._route"""
+        return await self._try(self.manage._cluster().targets(key).items(), method, request, timeout)
+
+    async def _try(self, targets, method: str, request, timeout: float):
+        """依次调用各存储服务器直到有节点响应, request 为返回新请求的函数; 全部不可达或调用出错时返回 None"""
+        for sid, target in targets:
+            start = time.perf_counter()
+            try:
+                async with self._channel(target) as ch:
+                    return await getattr(stpb_grpc.storagementServiceStub(ch), method)(request(), timeout=timeout)
+            except grpc.RpcError as e:
+                self.logger.error("存储服务器%s 调用%s 失败 %s", sid, method, e.details() or e.code().name)
+                if e.code() != grpc.StatusCode.UNAVAILABLE:
+                    return None
+            finally:
+                self.manage._observe(sid, method, start)
+        return None
+
+
+async def serve(manage: ManageService, address: str, compression: grpc.Compression | None = None, hooks=()):
+    """启动 grpc.aio 管理服务, 收到 SIGINT/SIGTERM 后返回"""
+    server = grpc.aio.server(compression=compression, interceptors=[AsyncHookInterceptor(*hooks)])
+    mapb_grpc.add_manageServiceServicer_to_server(AsyncManageService(manage), server)
+    server.add_insecure_port(address)
+    await server.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    manage.logger.info("开始进行服务(aio)")
+    try:
+        await stop.wait()
+    finally:
+        manage.logger.info("接收到中断信号, 退出服务")
+        await server.stop(0)
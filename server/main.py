@@ -1,33 +1,90 @@
-﻿import logging
+﻿import argparse
+import json
+import logging
 import random
+import signal
+import tempfile
 import time
 import grpc
 import threading
 
+from collections import deque
 from concurrent import futures
-from threading import Lock
+from threading import Condition
 
 from protos import mapb_pb2 as mapb
 from protos import mapb_pb2_grpc as mapb_grpc
 from protos import stpb_pb2 as stpb
 from protos import stpb_pb2_grpc as stpb_grpc
 from params import params
+from common.compress import grpc_compression
+from common.interceptors import HookInterceptor
+from common.logs import JsonFormatter, access_hook, parse_rates, setup_logger
+from common import profiling
+from common.metrics import REGISTRY, metrics_hook, serve_prometheus
+from common.placement import ClusterMap, majority
+from common import twopc
+from common.pool import ChannelPool
+from server.raft import LeaderInterceptor, NotLeader, RaftNode
+from common.streams import StreamLimit
+from common.tracing import TRACER, tracing_hook
 
 class SerNode:
-    def __init__(self, ip: str, port: str, sid: int):
+    def __init__(self, ip: str, port: str, sid: int, joining: bool = False):
         self.ip = ip
         self.port = port
         self.id = sid
+        self.joining = joining  # 引导中: 参与写入, 但还不分配给客户端
+
+def _node(ser: SerNode) -> mapb.Node:
+    return mapb.Node(server_id=ser.id, ip=ser.ip, port=ser.port, joining=ser.joining)
+
+class Membership:
+    """存储节点集合的版本号(epoch)与最近的变更, 节点上线、注销或因心跳失败被移除时 epoch 加一
+
+    每条变更都携带变更后的完整节点列表, 订阅者错过中间的变更也能得到正确的结果
+    """
+
+    def __init__(self, replicas: int = params.REPLICAS, maxlen: int = 256):
+        self.epoch = 0
+        self.replicas = replicas  # 与节点列表一起发布的放置规则
+        self.events: deque[mapb.TopologyEvent] = deque(maxlen=maxlen)
+        self.cond = Condition()  # 修改 servermap 时持有, 保证推送的节点列表与 epoch 对应
+        self.listeners: set = set()  # 发布变更后调用的回调, 供 aio 模式唤醒协程
+
+    def publish(self, change: str, node: SerNode, servermap: dict[int, SerNode]):
+        with self.cond:
+            self.epoch += 1
+            self.events.append(mapb.TopologyEvent(epoch=self.epoch, change=change, node=_node(node),
+                                                  nodes=[_node(n) for n in servermap.values()],
+                                                  replicas=self.replicas, vnodes=params.VNODES))
+            self.cond.notify_all()
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener()
+
+    def since(self, epoch: int, timeout: float | None = None) -> list[mapb.TopologyEvent]:
+        """返回 epoch 之后的变更, timeout 秒内没有变更时返回空列表"""
+        with self.cond:
+            if self.epoch <= epoch and timeout != 0:
+                self.cond.wait(timeout)
+            return [e for e in self.events if e.epoch > epoch]
 
 class ManageService(mapb_grpc.manageServiceServicer):
-    def __init__(self, logger: logging.Logger, interval_seconds: int = 10):
+    def __init__(self, logger: logging.Logger, interval_seconds: int = 10, compression: grpc.Compression | None = None,
+                 replicas: int = params.REPLICAS):
         self.servermap: dict[int, SerNode] = {}
         self.clientmap: dict[int, str] = {}
         self.APImap: dict[str, bool] = {}
         self.logger = logger
-        self.mu = Lock()
         self.interval = interval_seconds
+        self.compression = compression  # 广播到存储服务器时的gRPC消息压缩
+        self.pool = ChannelPool(compression)  # 到各存储服务器的连接
+        self.membership = Membership(replicas)
+        self.watchers = StreamLimit(params.MAX_TOPOLOGY_WATCHERS)  # watchTopology 订阅各占一个工作线程
+        self._map = ClusterMap()
         self._stop = False
+        self.raft: RaftNode | None = None  # 作为管理服务器组的成员运行时, 状态变更经 Raft 日志复制
 
         # 启动后台线程定时检测
         self.live_thread = threading.Thread(target=self._live_loop, daemon=True)
@@ -44,6 +101,9 @@ class ManageService(mapb_grpc.manageServiceServicer):
             return func(self, *args, **kwargs)
         return wrapper
     
+    def _channel(self, target: str):
+        return self.pool.channel(target)
+
     def _rand_id(self) -> int:
         # returns a positive 32-bit int
         return random.randint(1, 2**31-1)
@@ -61,217 +121,342 @@ class ManageService(mapb_grpc.manageServiceServicer):
         return cid
 
     def getServerInfo(self) -> tuple[str, str]:
-        if not self.servermap:
+        ready = [node for node in self.servermap.values() if not node.joining]
+        if not ready:
             raise RuntimeError("No servers available")
-        node = random.choice(list(self.servermap.values()))
+        node = random.choice(ready)
         return node.ip, node.port
 
+    def _has_ready(self) -> bool:
+        return any(not node.joining for node in self.servermap.values())
+
+    def join_group(self, node_id: int, members: dict[int, str], path: str):
+        """作为管理服务器组的成员运行: 节点与客户端信息写入 Raft 日志, 由 leader 处理请求, 状态保存在 path 下"""
+        self.raft = RaftNode(node_id, members, path, self._apply, self._snapshot, self._restore, self.logger)
+        self.raft.start()
+
+    def _propose(self, op: str, **args):
+        """修改节点与客户端信息, 返回 _apply 的结果; 管理服务器组中先写入多数成员的日志, 再由各成员按顺序应用"""
+        command = json.dumps({"op": op, **args}).encode()
+        if self.raft is None:
+            return self._apply(command)
+        return self.raft.propose(command)
+
+    def _apply(self, command: bytes) -> bool:
+        """应用一条状态变更, 在各成员上的结果必须相同; id 由 leader 事先分配, 冲突时返回 False"""
+        cmd = json.loads(command)
+        op = cmd["op"]
+        if op == "client":
+            self.clientmap[cmd["cid"]] = cmd["api"]
+            return True
+        if op == "disconnect":
+            self.clientmap.pop(cmd["cid"], None)
+            return True
+        with self.membership.cond:
+            node = self.servermap.get(cmd["sid"])
+            if op == "online":
+                if node is not None:
+                    return False
+                node = self.servermap[cmd["sid"]] = SerNode(cmd["ip"], cmd["port"], cmd["sid"], cmd["joining"])
+                if not node.joining:
+                    self.APImap[node.ip + node.port] = True
+            elif node is None:
+                return False
+            elif op == "ready":
+                if not node.joining:
+                    return True
+                node.joining = False
+                self.APImap[node.ip + node.port] = True
+            else:  # offline / removed
+                del self.servermap[node.id]
+                self.APImap.pop(node.ip + node.port, None)
+            self.membership.publish(op, node, self.servermap)
+        if op in ("offline", "removed"):
+            self.pool.discard(node.ip + node.port)
+        return True
+
+    def _snapshot(self) -> bytes:
+        with self.membership.cond:
+            return json.dumps({"epoch": self.membership.epoch,
+                               "servers": [[n.id, n.ip, n.port, n.joining] for n in self.servermap.values()],
+                               "clients": list(self.clientmap.items())}).encode()
+
+    def _restore(self, data: bytes):
+        state = json.loads(data)
+        with self.membership.cond:
+            self.servermap = {sid: SerNode(ip, port, sid, joining) for sid, ip, port, joining in state["servers"]}
+            self.APImap = {n.ip + n.port: True for n in self.servermap.values() if not n.joining}
+            self.clientmap = {cid: api for cid, api in state["clients"]}
+            self.membership.epoch = state["epoch"]
+            self.membership.events.clear()
+            self.membership.cond.notify_all()
+
+    def raftVote(self, request: mapb.RaftVote, context) -> mapb.RaftVoteReply:
+        if self.raft is None:
+            context.abort(grpc.StatusCode.UNIMPLEMENTED, "未作为管理服务器组运行")
+        return self.raft.vote(request)
+
+    def raftAppend(self, request: mapb.RaftAppend, context) -> mapb.RaftAppendReply:
+        if self.raft is None:
+            context.abort(grpc.StatusCode.UNIMPLEMENTED, "未作为管理服务器组运行")
+        return self.raft.append(request)
+
     def changeServer(self, request: mapb.CliChange, context) -> mapb.Empty:
         API = request.api 
         cli_id = request.cli_id
-        self.logger.info(f"客户端{cli_id} 试图更换服务器为{API}")
+        self.logger.info("客户端%s 试图更换服务器为%s", cli_id, API)
         if API not in self.APImap:
-            self.logger.info(f"无法为客户端{cli_id} 更换服务器为{API}, 保持连接{self.clientmap.get(cli_id)}")
+            self.logger.info("无法为客户端%s 更换服务器为%s, 保持连接%s", cli_id, API, self.clientmap.get(cli_id))
             return mapb.Empty(errno=False, errmes="不存在此存储服务器")
-        self.clientmap[cli_id] = API
-        self.logger.info(f"成功为客户端{cli_id} 更换连接服务器为{API}")
+        self._propose("client", cid=cli_id, api=API)
+        self.logger.info("成功为客户端%s 更换连接服务器为%s", cli_id, API)
         return mapb.Empty(errno=True)
 
     def changeServerRandom(self, request: mapb.CliId, context) -> mapb.ChangeInfo:
-        if len(self.servermap) == 0:
+        if not self._has_ready():
             self.logger.info("客户端试图更换连接, 但目前暂无键值存储服务器")
             return mapb.ChangeInfo(errno=False, errmes="连接失败, 目前暂无键值服务器")
         ip, port = self.getServerInfo()
         cli_id = request.cli_id
-        self.clientmap[cli_id] = ip + port
-        self.logger.info(f"成功为客户端{cli_id} 更换连接服务器为{ip+port}")
+        self._propose("client", cid=cli_id, api=ip + port)
+        self.logger.info("成功为客户端%s 更换连接服务器为%s", cli_id, ip+port)
         return mapb.ChangeInfo(api=ip+port, errno=True)
 
     def connect(self, request: mapb.Empty, context) -> mapb.CliInfo:
-        if len(self.servermap) == 0:
+        if not self._has_ready():
             self.logger.info("客户端试图连接, 但目前暂无键值存储服务器")
             return mapb.CliInfo(errno=False, errmes="连接失败, 目前暂无键值服务器")
         ip, port = self.getServerInfo()
         cid = self.getClientId()
-        self.clientmap[cid] = ip + port
-        self.logger.info(f"客户端连接{self.clientmap[cid]}, 为其分配id: {cid}")
+        self._propose("client", cid=cid, api=ip + port)
+        self.logger.info("客户端连接%s, 为其分配id: %s", ip + port, cid)
         return mapb.CliInfo(ip=ip, port=port, cli_id=cid, errno=True)
 
     def online(self, request: mapb.SerRequest, context) -> mapb.SerInfo:
         ip = request.ip
         port = request.port
-        sid = self.getServerId()
-        self.servermap[sid] = SerNode(ip=ip, port=port, sid=sid)
-        self.APImap[ip+port] = True
-        self.logger.info(f"存储服务器 {ip}{port} 注册 分配id为: {sid}")
+        sid = request.server_id
+        if sid:
+            # 重启的节点可能还没被心跳检查移除, 先注销旧的登记
+            if sid in self.servermap:
+                self._propose("offline", sid=sid)
+            if not self._propose("online", sid=sid, ip=ip, port=port, joining=request.joining):
+                return mapb.SerInfo(errno=False, errmes=f"id {sid} 已被占用")
+        else:
+            sid = self.getServerId()
+            while not self._propose("online", sid=sid, ip=ip, port=port, joining=request.joining):
+                sid = self.getServerId()
+        self.logger.info("存储服务器 %s%s 注册%s 分配id为: %s", ip, port, "(引导中)" if request.joining else "", sid)
         return mapb.SerInfo(server_id=sid, errno=True)
 
+    def ready(self, request: mapb.SerInfo, context) -> mapb.Empty:
+        """引导中的节点拉取完数据后调用, 之后才分配给客户端"""
+        if not self._propose("ready", sid=request.server_id):
+            return mapb.Empty(errno=False, errmes="节点未注册")
+        self.logger.info("存储服务器%s 引导完成, 开始接受客户端", request.server_id)
+        return mapb.Empty(errno=True)
+
     def offline(self, request: mapb.SerInfo, context) -> mapb.Empty:
         sid = request.server_id
         node = self.servermap.get(sid)
-        if node:
-            ip, port = node.ip, node.port
-            del self.servermap[sid]
-            self.APImap.pop(ip+port, None)
-            self.logger.info(f"存储服务器 {ip}{port} 注消")
+        if node and self._propose("offline", sid=sid):
+            self.logger.info("存储服务器 %s%s 注消", node.ip, node.port)
         return mapb.Empty(errno=True)
 
+    def topology(self, request: mapb.Empty, context) -> mapb.Topology:
+        """返回当前在线的存储服务器, 供客户端缓存后自行选择节点"""
+        with self.membership.cond:
+            return mapb.Topology(nodes=[_node(ser) for ser in self.servermap.values()], epoch=self.membership.epoch,
+                                 replicas=self.membership.replicas, vnodes=params.VNODES)
+
+    def _topology_snapshot(self) -> mapb.TopologyEvent:
+        topo = self.topology(mapb.Empty(), None)
+        return mapb.TopologyEvent(epoch=topo.epoch, change="snapshot", nodes=topo.nodes,
+                                  replicas=topo.replicas, vnodes=topo.vnodes)
+
+    def _cluster(self) -> ClusterMap:
+        """当前 epoch 的集群视图, 成员变更后重新构建哈希环"""
+        cluster = self._map
+        if cluster.epoch != self.membership.epoch:
+            cluster = self._map = ClusterMap.from_proto(self.topology(mapb.Empty(), None))
+        return cluster
+
+    def watchTopology(self, request: mapb.Empty, context):
+        """推送存储服务器的上线(online)、引导完成(ready)、注销(offline)与心跳失败移除(removed)
+
+        首条消息 change="snapshot" 为当前的完整节点列表, 之后每条变更都带有递增的 epoch 与变更后的节点列表
+        """
+        self.watchers.enter(context, "watchTopology")
+        try:
+            snapshot = self._topology_snapshot()
+            epoch = snapshot.epoch
+            yield snapshot
+            while context.is_active():
+                for event in self.membership.since(epoch, timeout=1.0):
+                    epoch = event.epoch
+                    yield event
+        finally:
+            self.watchers.release()
+
     @verify_node
     def Get(self, request: mapb.Request, context) -> mapb.Response:
         ser_id = request.server_id
         key = request.key
-        self.logger.info(f"存储服务器{ser_id} 请求键值{key}")
+        self.logger.info("存储服务器%s 请求键值%s", ser_id, key)
         values = []
-        self.logger.info(f"正在从其他存储服务器收集键值{key}")
-        for sid, ser in self.servermap.items():
+        self.logger.info("正在从其他存储服务器收集键值%s", key)
+        for sid, target in self._cluster().targets(key).items():
             if sid == ser_id:
                 continue
-            ip, port = ser.ip, ser.port
-            target = ip + port
-            self.logger.info(f"向存储服务器{sid} 请求键值{key}")
+            self.logger.info("向存储服务器%s 请求键值%s", sid, key)
             try:
-                with grpc.insecure_channel(target) as ch:
+                with self._channel(target) as ch:
                     client = stpb_grpc.storagementServiceStub(ch)
-                    resp = client.maGetdata(stpb.StRequest(cli_id=0, key=key))
+                    resp = client.maGetdata(stpb.StRequest(cli_id=0, key=key), timeout=params.RPC_TIMEOUT)
             except Exception as e:
                 self.logger.error(e)
                 continue
             if not resp.errno:
-                self.logger.info(f"无法从存储服务器{sid} 获取键值{key} ,{resp.errmes}")
+                self.logger.info("无法从存储服务器%s 获取键值%s ,%s", sid, key, resp.errmes)
                 continue
             else:
-                self.logger.info(f"存储服务器{sid} 响应了键值{key} 请求")
+                self.logger.info("存储服务器%s 响应了键值%s 请求", sid, key)
             values.append(resp.value)
-        maxnum = len(values)
-        if maxnum == 0:
+        return self._vote(key, values)
+
+    def _vote(self, key: str, values: list[str]) -> mapb.Response:
+        """多数表决, 超过半数的存储服务器返回相同值时才认为达成一致"""
+        if not values:
             return mapb.Response(errno=False, errmes=f"暂时缺少键值{key}")
-        self.logger.info(f"从存储服务器中共收集{maxnum}个键值{key},检测一致性")
-        count_map: dict[str, int] = {}
-        find_value = ""
-        cnt = 0
-        for v in values:
-            count_map[v] = count_map.get(v, 0) + 1
-            if count_map[v] > cnt:
-                find_value = v
-                cnt = count_map[v]
-        if cnt > maxnum // 2:
-            self.logger.info(f"键值{key} 达成一致")
-            return mapb.Response(value=find_value, errno=True)
-        self.logger.info(f"键值{key} 未能达成一致")
+        self.logger.info("从存储服务器中共收集%s个键值%s,检测一致性", len(values), key)
+        value, ok = majority(values)
+        if ok:
+            self.logger.info("键值%s 达成一致", key)
+            return mapb.Response(value=value, errno=True)
+        self.logger.info("键值%s 未能达成一致", key)
         return mapb.Response(errno=False, errmes=f"其他服务器对键值{key} 无法达成一致")
 
     @verify_node
     def Put(self, request: mapb.KV, context) -> mapb.Response:
-        self.mu.acquire()
-        try:
-            key = request.key
-            value = request.value
-            ser_id = request.server_id
-            self.logger.info(f"存储服务器{ser_id} 申请提交键值{key}")
-            hasprc: dict[int, str] = {}
-            flag = True
-            for sid, ser in self.servermap.items():
-                ip, port = ser.ip, ser.port
-                target = ip + port
-                self.logger.info(f"向存储服务器{sid} 广播键值{key} 提交")
-                try:
-                    with grpc.insecure_channel(target) as ch:
-                        client = stpb_grpc.storagementServiceStub(ch)
-                        resp = client.maPutdata(stpb.StKV(key=key, value=value))
-                except Exception as e:
-                    self.logger.error(e)
-                    continue
-                if not resp.errno:
-                    self.logger.info(f"存储服务器{sid} 拒绝写入键值{key}, {resp.errmes}")
-                    flag = False
-                else:
-                    self.logger.info(f"存储服务器{sid} 同意写入键值{key}, {resp.errmes}")
-                hasprc[sid] = target
-            if flag:
-                self.logger.info(f"存储服务器达成共识, 写入本次键值{key}")
-                for target in hasprc.values():
-                    try:
-                        with grpc.insecure_channel(target) as ch:
-                            client = stpb_grpc.storagementServiceStub(ch)
-                            client.commit(stpb.StRequest(key=key, delete=False))
-                    except Exception as e:
-                        self.logger.error(e)
-                        continue
-            else:
-                self.logger.info(f"存储服务器未达成共识, 拒绝写入键值{key}")
-                for target in hasprc.values():
-                    try:
-                        with grpc.insecure_channel(target) as ch:
-                            client = stpb_grpc.storagementServiceStub(ch)
-                            client.abort(stpb.StRequest(key=key, delete=False))
-                    except Exception as e:
-                        self.logger.error(e)
-                        continue
-                self.logger.info(f"本次键值{key} 提交无效")
-                return mapb.Response(errno=False, errmes="提交失败")
-            self.logger.info(f"本次键值{key} 提交生效")
-            return mapb.Response(errno=True)
-        finally:
-            self.mu.release()
+        key = request.key
+        self.logger.info("存储服务器%s 申请提交键值%s, 交给主副本协调", request.server_id, key)
+        resp = self._route(key, "putdata", lambda: stpb.StKV(key=request.key, value=request.value))
+        if resp is None or not resp.errno:
+            self.logger.info("本次键值%s 提交无效", key)
+            return mapb.Response(errno=False, errmes=resp.errmes if resp is not None else "提交失败")
+        self.logger.info("本次键值%s 提交生效", key)
+        return mapb.Response(errno=True)
 
     @verify_node
     def Del(self, request: mapb.Request, context) -> mapb.Response:
-        self.mu.acquire()
-        try:
-            key = request.key
-            ser_id = request.server_id
-            self.logger.info(f"存储服务器{ser_id} 申请删除键值{key}")
-            hasprc: dict[int, str] = {}
-            flag = True
-            for sid, ser in self.servermap.items():
-                ip, port = ser.ip, ser.port
-                target = ip + port
-                self.logger.info(f"向存储服务器{sid} 广播键值{key} 删除")
+        key = request.key
+        self.logger.info("存储服务器%s 申请删除键值%s, 交给主副本协调", request.server_id, key)
+        resp = self._route(key, "deldata", lambda: stpb.StRequest(key=key))
+        if resp is None or not resp.errno:
+            self.logger.info("本次键值%s 删除无效", key)
+            return mapb.Response(errno=False, errmes=resp.errmes if resp is not None else "删除失败")
+        self.logger.info("本次键值%s 删除生效", key)
+        return mapb.Response(errno=True)
+
+    def PutStream(self, request_iterator, context) -> mapb.Response:
+        first = next(request_iterator, None)
+        if first is None:
+            return mapb.Response(errno=False, errmes="数据流为空")
+        if first.server_id not in self.servermap:
+            self.logger.info("非法节点试图执行敏感操作, 已阻拦")
+            return mapb.Response(errno=False, errmes="节点未注册, 无权操作!")
+        key = first.key
+        self.logger.info("存储服务器%s 申请分块提交键值%s, 共%s字节", first.server_id, key, first.size)
+        # 先落到临时文件, 主副本不可达换下一个副本时可以重新读出, 避免在内存中保留整个值
+        with tempfile.TemporaryFile() as spool:
+            spool.write(first.data)
+            for chunk in request_iterator:
+                spool.write(chunk.data)
+
+            def chunks():
+                spool.seek(0)
+                yield stpb.StChunk(key=key, size=first.size, data=spool.read(params.CHUNK_SIZE))
+                for data in iter(lambda: spool.read(params.CHUNK_SIZE), b""):
+                    yield stpb.StChunk(data=data)
+
+            resp = self._route(key, "putstream", chunks, timeout=params.STREAM_TIMEOUT)
+        if resp is None or not resp.errno:
+            self.logger.info("本次键值%s 分块提交无效", key)
+            return mapb.Response(errno=False, errmes=resp.errmes if resp is not None else "提交失败")
+        self.logger.info("本次键值%s 分块提交生效", key)
+        return mapb.Response(errno=True)
+
+    @verify_node
+    def PutBatch(self, request: mapb.KVBatch, context) -> mapb.Response:
+        """批量写入: 交给存储服务器按主副本拆分导入, 同一主副本的键整批原子提交, 不同主副本之间可能部分成功"""
+        self.logger.info("存储服务器%s 申请批量提交%s个键值", request.server_id, len(request.kvs))
+        batch = stpb.StKVBatch(kvs=[stpb.StKV(key=kv.key, value=kv.value) for kv in request.kvs])
+        nodes = self._cluster().nodes
+        # 优先交给发起请求的存储服务器, 不可达时换其他节点
+        order = sorted(nodes, key=lambda sid: sid != request.server_id)
+        resp = self._try(((sid, nodes[sid]) for sid in order), "importdata", lambda: iter([batch]),
+                         timeout=params.STREAM_TIMEOUT)
+        if resp is None or not resp.errno:
+            self.logger.info("批量提交%s个键值失败", len(request.kvs))
+            return mapb.Response(errno=False, errmes=resp.errmes if resp is not None else "批量提交失败")
+        self.logger.info("批量提交%s个键值生效", resp.imported)
+        return mapb.Response(errno=True)
+
+    def _route(self, key: str, method: str, request, timeout: float = 3 * params.RPC_TIMEOUT):
+        """写入交给键的副本节点, 主副本在前; 由收到请求的节点按存储服务器的规则转发给主副本或自己协调两阶段提交
+
+        管理服务器不再协调写入, 同一个键的写入都经主副本的协调锁串行化; 主副本不可达时交给下一个副本
+        """
+        return self._try(self._cluster().targets(key).items(), method, request, timeout)
+
+    def _try(self, targets, method: str, request, timeout: float):
+        """依次调用各存储服务器直到有节点响应, request 为返回新请求的函数; 全部不可达或调用出错时返回 None"""
+        for sid, target in targets:
+            start = time.perf_counter()
+            try:
+                with self._channel(target) as ch:
+                    return getattr(stpb_grpc.storagementServiceStub(ch), method)(request(), timeout=timeout)
+            except grpc.RpcError as e:
+                self.logger.error("存储服务器%s 调用%s 失败 %s", sid, method, e.details() or e.code().name)
+                if e.code() != grpc.StatusCode.UNAVAILABLE:
+                    return None
+            finally:
+                self._observe(sid, method, start)
+        return None
+
+    def _observe(self, sid: int, method: str, start: float):
+        twopc.observe(sid, method, start)
+
+    def stats(self, request, context) -> mapb.Stats:
+        REGISTRY.gauge("storage_nodes", "已注册的存储服务器数").set(len(self.servermap))
+        REGISTRY.gauge("clients", "已连接的客户端数").set(len(self.clientmap))
+        return mapb.Stats(json=REGISTRY.to_json(), prometheus=REGISTRY.prometheus())
+
+    def spans(self, request: mapb.SpanRequest, context) -> mapb.Spans:
+        """返回本节点记录的 span, 指定 trace_id 时一并收集各存储服务器上属于该 trace 的 span"""
+        spans = TRACER.query(request.trace_id, request.limit)
+        if request.trace_id and not request.local:
+            for sid, ser in list(self.servermap.items()):
                 try:
-                    with grpc.insecure_channel(target) as ch:
+                    with self._channel(ser.ip + ser.port) as ch:
                         client = stpb_grpc.storagementServiceStub(ch)
-                        resp = client.maDeldata(stpb.StRequest(key=key))
+                        resp = client.spans(stpb.StSpanRequest(trace_id=request.trace_id), timeout=5)
                 except Exception as e:
-                    self.logger.error(e)
+                    self.logger.error("无法从存储服务器%s 获取span, %s", sid, e)
                     continue
-                if not resp.errno:
-                    self.logger.info(f"存储服务器{sid} 拒绝删除键值{key}, {resp.errmes}")
-                    flag = False
-                else:
-                    self.logger.info(f"存储服务器{sid} 同意删除键值{key}, {resp.errmes}")
-                hasprc[sid] = target
-            if flag:
-                self.logger.info(f"存储服务器达成共识,删除键值{key}")
-                for target in hasprc.values():
-                    try:
-                        with grpc.insecure_channel(target) as ch:
-                            client = stpb_grpc.storagementServiceStub(ch)
-                            client.commit(stpb.StRequest(key=key, delete=True))
-                    except Exception as e:
-                        self.logger.error(e)
-                        continue
-            else:
-                self.logger.info(f"存储服务器未达成共识, 拒绝删除键值{key}")
-                for target in hasprc.values():
-                    try:
-                        with grpc.insecure_channel(target) as ch:
-                            client = stpb_grpc.storagementServiceStub(ch)
-                            client.abort(stpb.StRequest(key=key, delete=True))
-                    except Exception as e:
-                        self.logger.error(e)
-                        continue
-                self.logger.info(f"本次键值{key} 删除无效")
-                return mapb.Response(errno=False, errmes="删除失败")
-            self.logger.info(f"本次键值{key} 删除生效")
-            return mapb.Response(errno=True)
-        finally:
-            self.mu.release()
+                spans.extend(json.loads(resp.json))
+        # 同一进程中的多个服务共用 TRACER 时会收到重复的 span
+        unique = {s["span_id"]: s for s in spans}
+        return mapb.Spans(json=json.dumps(sorted(unique.values(), key=lambda s: s["start"]), ensure_ascii=False))
+
+    def profile(self, request: mapb.ProfileRequest, context) -> mapb.Profile:
+        return profiling.handle(request, mapb.Profile)
 
     def disconnect(self, request: mapb.CliId, context) -> mapb.Empty:
         cid = request.cli_id
-        self.logger.info(f"客户端{cid} 申请退出连接")
-        self.clientmap.pop(cid, None)
-        self.logger.info(f"客户端{cid} 成功退出")
+        self.logger.info("客户端%s 申请退出连接", cid)
+        self._propose("disconnect", cid=cid)
+        self.logger.info("客户端%s 成功退出", cid)
         return mapb.Empty(errno=True)
     
     def _live_loop(self):
@@ -282,35 +467,87 @@ class ManageService(mapb_grpc.manageServiceServicer):
     def stop(self):
         self._stop = True
         self.live_thread.join()
+        if self.raft is not None:
+            self.raft.close()
 
     def check_all_storage_live(self):
+        if self.raft is not None and not self.raft.is_leader():
+            return  # 只由 leader 检测, 移除节点同样经过日志复制
         snapshot = self.servermap.copy()
         for sid, ser in snapshot.items():
                 ip, port = ser.ip, ser.port
                 target = ip + port
                 try:
-                    with grpc.insecure_channel(target) as ch:
+                    with self._channel(target) as ch:
                         client = stpb_grpc.storagementServiceStub(ch)
                         client.live(stpb.StEmpty(errno=True))
                 except Exception as e:
-                    self.logger.error(f"与存储服务器 {sid} ({target}) 心跳失败: {e}")
-                    self.logger.warning(f"移除失联存储服务器 {sid}")
-                    del self.servermap[sid]
-                    self.APImap.pop(target, None)
+                    self.logger.error("与存储服务器 %s (%s) 心跳失败: %s", sid, target, e)
+                    self.logger.warning("移除失联存储服务器 %s", sid)
+                    try:
+                        self._propose("removed", sid=sid)
+                    except (NotLeader, TimeoutError) as e:
+                        self.logger.error("移除存储服务器%s 失败, 已不是 leader 或未得到多数确认 %r", sid, e)
+                        return
             
 
 def serve():
-    logger = logging.getLogger("manage")
-    logger.setLevel(logging.INFO)
-    fh = logging.FileHandler("server/manage.log", mode='w', encoding='utf-8')
-    fh.setFormatter(logging.Formatter("[%(levelname)s] - %(message)s"))
-    logger.addHandler(fh)
-
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=16))
-    service = ManageService(logger)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--grpc-compression", choices=["none", "gzip", "deflate"], default=params.GRPC_COMPRESSION)
+    parser.add_argument("--aio", action="store_true", help="使用 grpc.aio 异步服务")
+    parser.add_argument("--log-sample", type=str, default=params.LOG_SAMPLE, help="按操作采样日志, 如 connect=0.1")
+    parser.add_argument("--access-log", action="store_true", help="额外输出 JSON 格式的访问日志 server/access.log")
+    parser.add_argument("--metrics-port", type=int, default=0, help="以 Prometheus 文本格式暴露 /metrics 的端口, 0 表示关闭")
+    parser.add_argument("--trace-sample", type=float, default=params.TRACE_SAMPLE, help="没有上游 trace 的请求按该比例开始追踪")
+    parser.add_argument("--trace-file", action="store_true", help="额外把 span 以 JSON 行写入 server/trace.log")
+    parser.add_argument("--replicas", type=int, default=params.REPLICAS, help="每个键保存的副本数, 0 表示每个存储节点保存全部键值")
+    parser.add_argument("--peers", type=str, default="",
+                        help="以管理服务器组运行: 逗号分隔的全部成员地址, 如 localhost:9999,localhost:9998,localhost:9997")
+    parser.add_argument("--id", type=int, default=1, help="本节点在 --peers 中的序号, 从 1 开始")
+    parser.add_argument("--raft-dir", type=str, default="", help="保存 Raft 日志与快照的目录, 默认 server/raft_<id>")
+    args = parser.parse_args()
+    peers = [p for p in args.peers.split(",") if p]
+    if peers and not 1 <= args.id <= len(peers):
+        parser.error("--id 超出 --peers 的范围")
+    if peers and args.aio:
+        parser.error("--peers 暂不支持与 --aio 同时使用")
+    address = peers[args.id - 1] if peers else params.MANAGER_IP + params.MANAGER_PORT
+    compression = grpc_compression(args.grpc_compression)
+
+    sample = parse_rates(args.log_sample)
+    logger = setup_logger("manage", "server/manage.log", sample=sample)
+    access = None
+    if args.access_log:
+        access = setup_logger("manage.access", "server/access.log", sample=sample, formatter=JsonFormatter())
+    sink = None
+    if args.trace_file:
+        sink = setup_logger("manage.trace", "server/trace.log", formatter=JsonFormatter())
+    TRACER.configure(sample=args.trace_sample, sink=sink)
+    hooks = [access_hook(access), metrics_hook(), profiling.cpu_hook(), tracing_hook("manage")]
+
+    service = ManageService(logger, compression=compression, replicas=args.replicas)
+    interceptors = [HookInterceptor(*hooks)]
+    if peers:
+        service.join_group(args.id, dict(enumerate(peers, 1)), args.raft_dir or f"server/raft_{args.id}")
+        interceptors.append(LeaderInterceptor(service.raft))
+    if args.metrics_port:
+        serve_prometheus(args.metrics_port, lambda: service.stats(None, None).prometheus)
+    if args.aio:
+        import asyncio
+        from server import aio
+        try:
+            asyncio.run(aio.serve(service, address, compression, hooks))
+        except KeyboardInterrupt:
+            logger.info("接收到中断信号, 退出服务")
+        return
+
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=16), compression=compression,
+                         interceptors=interceptors)
     mapb_grpc.add_manageServiceServicer_to_server(service, server)
-    server.add_insecure_port(params.MANAGER_IP + params.MANAGER_PORT)
+    server.add_insecure_port(address)
 
+    # SIGTERM 同样按中断处理, 确保退出前写出队列中的日志
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
     logger.info("开始进行服务")
     server.start()
     try:
@@ -318,6 +555,8 @@ def serve():
     except KeyboardInterrupt:
         logger.info("接收到中断信号, 退出服务")
         server.stop(0)
+        if service.raft is not None:
+            service.raft.close()
 
 
 if __name__ == '__main__':
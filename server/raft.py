@@ -0,0 +1,509 @@
+﻿import base64
+import json
+import os
+import random
+import threading
+import time
+from concurrent import futures
+
+import grpc
+
+from protos import mapb_pb2 as mapb
+from protos import mapb_pb2_grpc as mapb_grpc
+from params import params
+from common.interceptors import _rebuild
+from common.pool import LEADER_KEY
+
+FOLLOWER, CANDIDATE, LEADER = "follower", "candidate", "leader"
+
+
+class NotLeader(Exception):
+    """本节点不是 leader, leader 为给出的地址, 选举中时为空串"""
+
+    def __init__(self, leader: str):
+        super().__init__(leader)
+        self.leader = leader
+
+
+class RaftNode:
+    """管理服务器组的 Raft 复制日志
+
+    每条日志是一个状态变更命令, 多数成员写入后提交, 各成员按日志顺序调用 apply; 应用超过 snapshot_every 条后
+    用 snapshot 的结果替换已应用的日志, 落后太多的成员由 leader 直接发送快照, 通过 restore 恢复。
+    任期、投票与日志保存在 path 下, 重启后从快照与日志恢复; 当选后先追加一条空日志, 以提交之前任期的日志
+    """
+
+    def __init__(self, node_id: int, members: dict[int, str], path: str, apply, snapshot, restore, logger,
+                 heartbeat: float = params.RAFT_HEARTBEAT, election: float = params.RAFT_ELECTION_TIMEOUT,
+                 snapshot_every: int = params.RAFT_SNAPSHOT_EVERY):
+        self.id = node_id
+        self.members = dict(members)  # 成员 id -> 地址, 包括本节点
+        self.peers = [mid for mid in members if mid != node_id]
+        self.path = path
+        self.apply_fn, self.snapshot_fn, self.restore_fn = apply, snapshot, restore
+        self.logger = logger
+        self.heartbeat = heartbeat
+        self.election = election  # 选举超时在 [election, 2*election) 中随机
+        self.snapshot_every = snapshot_every
+        # 成员重启后要尽快重连, 不沿用 gRPC 默认最长 120 秒的重连退避
+        self.channels = {mid: grpc.insecure_channel(members[mid], options=[("grpc.max_reconnect_backoff_ms", 1000)])
+                         for mid in self.peers}
+        self.mu = threading.Condition()
+        self.apply_mu = threading.Lock()  # 应用日志与安装/生成快照互斥, 先于 mu 获取
+        self.term = 0
+        self.voted_for = 0
+        self.log: list[tuple[int, bytes]] = []  # base_index 之后的日志 (任期, 命令)
+        self.base_index = 0  # 快照包含的最后一条日志
+        self.base_term = 0
+        self.snapshot = b""
+        self.commit_index = 0
+        self.last_applied = 0
+        self.role = FOLLOWER
+        self.leader_id = 0
+        self.next_index: dict[int, int] = {}
+        self.match_index: dict[int, int] = {}
+        self.waiting: dict[int, tuple[int, object] | None] = {}  # propose 等待的日志 -> (任期, 应用结果)
+        self.deadline = self._next_deadline()
+        self.kick = threading.Event()  # 有新日志时立即复制, 不等下一次心跳
+        self.stop = threading.Event()
+        self.executor = futures.ThreadPoolExecutor(max_workers=max(len(self.peers), 1))
+        self.inflight: set[int] = set()  # 正在等待响应的 AppendEntries, 每个成员最多一个
+        self.threads: list[threading.Thread] = []
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    # 持久化
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _write(self, name: str, lines):
+        tmp = self._file(name) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        os.replace(tmp, self._file(name))
+
+    @staticmethod
+    def _line(index: int, term: int, data: bytes) -> str:
+        return json.dumps([index, term, base64.b64encode(data).decode()]) + "\n"
+
+    def _save_meta(self):
+        self._write("meta.json", [json.dumps({"term": self.term, "voted_for": self.voted_for})])
+
+    def _save_log(self):
+        self._write("log.jsonl", [self._line(self.base_index + i + 1, term, data)
+                                  for i, (term, data) in enumerate(self.log)])
+
+    def _append_log(self, start: int):
+        with open(self._file("log.jsonl"), "a", encoding="utf-8") as f:
+            f.writelines(self._line(self.base_index + i + 1, term, data)
+                         for i, (term, data) in enumerate(self.log[start:], start))
+
+    def _save_snapshot(self):
+        self._write("snapshot.json", [json.dumps({"index": self.base_index, "term": self.base_term,
+                                                  "data": base64.b64encode(self.snapshot).decode()})])
+
+    def _load(self):
+        try:
+            with open(self._file("meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            self.term, self.voted_for = meta["term"], meta["voted_for"]
+        except FileNotFoundError:
+            pass
+        try:
+            with open(self._file("snapshot.json"), encoding="utf-8") as f:
+                snap = json.load(f)
+            self.base_index, self.base_term = snap["index"], snap["term"]
+            self.snapshot = base64.b64decode(snap["data"])
+            self.restore_fn(self.snapshot)
+            self.commit_index = self.last_applied = self.base_index
+        except FileNotFoundError:
+            pass
+        try:
+            with open(self._file("log.jsonl"), encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    index, term, data = json.loads(line)
+                    if index > self.base_index:
+                        self.log.append((term, base64.b64decode(data)))
+        except FileNotFoundError:
+            pass
+        if self.base_index or self.log:
+            self.logger.info("从%s 恢复 Raft 状态: 任期%s, 快照至%s, 日志至%s",
+                             self.path, self.term, self.base_index, self._last_index())
+
+    # 日志索引, 调用方持有 self.mu
+
+    def _last_index(self) -> int:
+        return self.base_index + len(self.log)
+
+    def _term_at(self, index: int) -> int:
+        if index <= self.base_index:
+            return self.base_term
+        return self.log[index - self.base_index - 1][0]
+
+    def _next_deadline(self) -> float:
+        return time.monotonic() + self.election * (1 + random.random())
+
+    def _step_down(self, term: int):
+        if term > self.term:
+            self.term, self.voted_for = term, 0
+            self._save_meta()
+        if self.role != FOLLOWER:
+            self.logger.info("Raft 任期%s, 转为 follower", self.term)
+        self.role = FOLLOWER
+        self.deadline = self._next_deadline()
+        self.mu.notify_all()
+
+    # 对外接口
+
+    def is_leader(self) -> bool:
+        return self.role == LEADER
+
+    def leader(self) -> str:
+        """当前 leader 的地址, 未知时为空串"""
+        return self.members.get(self.leader_id, "")
+
+    def start(self):
+        for target, name in ((self._run, "raft"), (self._applier, "raft-apply")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def close(self):
+        self.stop.set()
+        self.kick.set()
+        with self.mu:
+            self.mu.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.executor.shutdown(wait=False)
+        for ch in self.channels.values():
+            ch.close()
+
+    def propose(self, data: bytes, timeout: float = params.RPC_TIMEOUT):
+        """追加一条命令并等待本节点应用, 返回 apply 的结果; 不是 leader 时抛出 NotLeader, 超时抛出 TimeoutError"""
+        with self.mu:
+            if self.role != LEADER:
+                raise NotLeader(self.leader())
+            term = self.term
+            self.log.append((term, data))
+            self._append_log(len(self.log) - 1)
+            index = self._last_index()
+            self.match_index[self.id] = index
+            self.waiting[index] = None
+            self._advance_commit()
+        self.kick.set()
+        deadline = time.monotonic() + timeout
+        with self.mu:
+            try:
+                while self.waiting[index] is None:
+                    if self.term != term or self.stop.is_set():
+                        raise NotLeader(self.leader())
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("等待多数管理节点确认超时")
+                    self.mu.wait(remaining)
+                entry_term, result = self.waiting[index]
+            finally:
+                self.waiting.pop(index, None)
+        if entry_term != term:
+            # 该位置被新 leader 的日志覆盖, 命令没有生效
+            raise NotLeader(self.leader())
+        return result
+
+    # 选举与复制
+
+    def _run(self):
+        while not self.stop.is_set():
+            with self.mu:
+                role, expired = self.role, time.monotonic() >= self.deadline
+            try:
+                if role == LEADER:
+                    self._replicate()
+                    self.kick.wait(self.heartbeat)
+                    self.kick.clear()
+                elif expired:
+                    self._elect()
+                else:
+                    self.stop.wait(self.heartbeat / 4)
+            except Exception as e:
+                self.logger.error("Raft 后台任务发生错误 %s", e)
+
+    def _stub(self, mid: int) -> mapb_grpc.manageServiceStub:
+        return mapb_grpc.manageServiceStub(self.channels[mid])
+
+    def _elect(self):
+        with self.mu:
+            self.term += 1
+            self.role = CANDIDATE
+            self.voted_for = self.id
+            self.leader_id = 0
+            self._save_meta()
+            self.deadline = self._next_deadline()
+            term = self.term
+            req = mapb.RaftVote(term=term, candidate=self.id, last_index=self._last_index(),
+                                last_term=self._term_at(self._last_index()))
+        self.logger.info("Raft 发起选举, 任期%s", term)
+
+        def ask(mid: int):
+            try:
+                return self._stub(mid).raftVote(req, timeout=self.election)
+            except grpc.RpcError:
+                return None
+
+        replies = list(self.executor.map(ask, self.peers))
+        with self.mu:
+            votes = 1
+            for reply in replies:
+                if reply is None:
+                    continue
+                if reply.term > self.term:
+                    self._step_down(reply.term)
+                    return
+                votes += reply.granted
+            if self.role == CANDIDATE and self.term == term and votes * 2 > len(self.members):
+                self._become_leader()
+
+    def _become_leader(self):
+        # 调用方持有 self.mu
+        self.role = LEADER
+        self.leader_id = self.id
+        self.log.append((self.term, b""))
+        self._append_log(len(self.log) - 1)
+        last = self._last_index()
+        self.next_index = {mid: last for mid in self.peers}
+        self.match_index = {mid: 0 for mid in self.peers}
+        self.match_index[self.id] = last
+        self._advance_commit()
+        self.logger.info("Raft 当选 leader, 任期%s", self.term)
+        self.kick.set()
+
+    def _replicate(self):
+        # 不等待响应, 不可达的成员不会推迟发给其他成员的心跳
+        with self.mu:
+            peers = [mid for mid in self.peers if mid not in self.inflight]
+            self.inflight.update(peers)
+        for mid in peers:
+            self.executor.submit(self._send, mid)
+
+    def _send(self, mid: int):
+        try:
+            self._append_to(mid)
+        finally:
+            with self.mu:
+                self.inflight.discard(mid)
+
+    def _append_to(self, mid: int):
+        with self.mu:
+            if self.role != LEADER:
+                return
+            term = self.term
+            nxt = self.next_index[mid]
+            if nxt <= self.base_index:
+                req = mapb.RaftAppend(term=term, leader=self.id, commit=self.commit_index, snapshot=self.snapshot,
+                                      snapshot_index=self.base_index, snapshot_term=self.base_term)
+                match = self.base_index
+            else:
+                prev = nxt - 1
+                entries = self.log[prev - self.base_index:prev - self.base_index + params.IMPORT_BATCH]
+                req = mapb.RaftAppend(term=term, leader=self.id, prev_index=prev, prev_term=self._term_at(prev),
+                                      commit=self.commit_index,
+                                      entries=[mapb.RaftEntry(term=t, data=d) for t, d in entries])
+                match = prev + len(entries)
+        try:
+            reply = self._stub(mid).raftAppend(req, timeout=self.election)
+        except grpc.RpcError:
+            return
+        with self.mu:
+            if reply.term > self.term:
+                self._step_down(reply.term)
+                return
+            if self.role != LEADER or self.term != term:
+                return
+            if reply.success:
+                self.match_index[mid] = max(self.match_index[mid], match)
+                self.next_index[mid] = self.match_index[mid] + 1
+                self._advance_commit()
+            else:
+                self.next_index[mid] = max(1, min(reply.hint, nxt - 1))
+                self.kick.set()
+
+    def _advance_commit(self):
+        # 调用方持有 self.mu; 只直接提交当前任期的日志
+        for index in range(self._last_index(), self.commit_index, -1):
+            if self._term_at(index) != self.term:
+                break
+            if sum(match >= index for match in self.match_index.values()) * 2 > len(self.members):
+                self.commit_index = index
+                self.mu.notify_all()
+                break
+
+    # 处理其他成员的请求
+
+    def vote(self, req: mapb.RaftVote) -> mapb.RaftVoteReply:
+        with self.mu:
+            if req.term > self.term:
+                self._step_down(req.term)
+            granted = False
+            last = self._last_index()
+            if (req.term == self.term and self.voted_for in (0, req.candidate)
+                    and (req.last_term, req.last_index) >= (self._term_at(last), last)):
+                self.voted_for = req.candidate
+                self._save_meta()
+                self.deadline = self._next_deadline()
+                granted = True
+            return mapb.RaftVoteReply(term=self.term, granted=granted)
+
+    def append(self, req: mapb.RaftAppend) -> mapb.RaftAppendReply:
+        with self.mu:
+            if req.term < self.term:
+                return mapb.RaftAppendReply(term=self.term, success=False)
+            if req.term > self.term or self.role != FOLLOWER:
+                self._step_down(req.term)
+            self.leader_id = req.leader
+            self.deadline = self._next_deadline()
+            if not req.snapshot:
+                return self._append_entries(req)
+        return self._install(req)
+
+    def _append_entries(self, req: mapb.RaftAppend) -> mapb.RaftAppendReply:
+        # 调用方持有 self.mu
+        last = self._last_index()
+        if req.prev_index > last:
+            return mapb.RaftAppendReply(term=self.term, success=False, hint=last + 1)
+        if req.prev_index > self.base_index and self._term_at(req.prev_index) != req.prev_term:
+            return mapb.RaftAppendReply(term=self.term, success=False, hint=req.prev_index)
+        start = None  # 第一条新写入的日志在 self.log 中的位置
+        for i, entry in enumerate(req.entries):
+            index = req.prev_index + 1 + i
+            if index <= self.base_index:
+                continue
+            if index <= self._last_index():
+                if self._term_at(index) == entry.term:
+                    continue
+                # 冲突: 删除该位置及之后的日志, 已提交的日志不会冲突
+                del self.log[index - self.base_index - 1:]
+                self._save_log()
+            if start is None:
+                start = len(self.log)
+            self.log.append((entry.term, entry.data))
+        if start is not None:
+            self._append_log(start)
+        commit = min(req.commit, req.prev_index + len(req.entries))
+        if commit > self.commit_index:
+            self.commit_index = commit
+            self.mu.notify_all()
+        return mapb.RaftAppendReply(term=self.term, success=True)
+
+    def _install(self, req: mapb.RaftAppend) -> mapb.RaftAppendReply:
+        with self.apply_mu:
+            with self.mu:
+                term = self.term
+                if req.snapshot_index <= self.last_applied:
+                    return mapb.RaftAppendReply(term=term, success=True)
+            self.restore_fn(req.snapshot)
+            with self.mu:
+                if req.snapshot_index <= self._last_index() and self._term_at(req.snapshot_index) == req.snapshot_term:
+                    self.log = self.log[req.snapshot_index - self.base_index:]
+                else:
+                    self.log = []
+                self.base_index, self.base_term = req.snapshot_index, req.snapshot_term
+                self.snapshot = req.snapshot
+                self.commit_index = max(self.commit_index, self.base_index)
+                self.last_applied = self.base_index
+                self._save_snapshot()
+                self._save_log()
+        self.logger.info("Raft 安装 leader 发来的快照, 包含日志至%s", req.snapshot_index)
+        return mapb.RaftAppendReply(term=term, success=True)
+
+    # 应用已提交的日志
+
+    def _applier(self):
+        while not self.stop.is_set():
+            with self.mu:
+                while self.last_applied >= self.commit_index and not self.stop.is_set():
+                    self.mu.wait(self.heartbeat)
+                if self.stop.is_set():
+                    return
+                first = self.last_applied + 1
+                entries = [(index, self.log[index - self.base_index - 1])
+                           for index in range(first, self.commit_index + 1)]
+            for index, (term, data) in entries:
+                with self.apply_mu:
+                    with self.mu:
+                        if index != self.last_applied + 1:
+                            break  # 期间安装了快照
+                    try:
+                        result = self.apply_fn(data) if data else None
+                    except Exception as e:
+                        self.logger.error("应用第%s条日志时发生错误 %s", index, e)
+                        result = None
+                    with self.mu:
+                        self.last_applied = index
+                        if index in self.waiting:
+                            self.waiting[index] = (term, result)
+                        self.mu.notify_all()
+            self._compact()
+
+    def _compact(self):
+        with self.apply_mu:
+            with self.mu:
+                if self.last_applied - self.base_index < self.snapshot_every:
+                    return
+                index, term = self.last_applied, self._term_at(self.last_applied)
+            data = self.snapshot_fn()
+            with self.mu:
+                self.log = self.log[index - self.base_index:]
+                self.base_index, self.base_term = index, term
+                self.snapshot = data
+                self._save_snapshot()
+                self._save_log()
+        self.logger.info("Raft 生成快照, 包含日志至%s", index)
+
+
+class LeaderInterceptor(grpc.ServerInterceptor):
+    """只由 leader 处理请求: 其余成员以 FAILED_PRECONDITION 拒绝, 并在 trailing metadata 中给出 leader 地址
+
+    Raft 自身的 RPC 与只读取本节点信息的 stats、spans、profile 不受限制
+    """
+
+    EXEMPT = {"raftVote", "raftAppend", "stats", "spans", "profile"}
+
+    def __init__(self, raft: RaftNode):
+        self.raft = raft
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None or handler_call_details.method.rsplit("/", 1)[-1] in self.EXEMPT:
+            return handler
+        raft = self.raft
+
+        def reject(context, e: NotLeader):
+            context.set_trailing_metadata(((LEADER_KEY, e.leader),))
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, "不是管理服务器组的 leader")
+
+        def wrap_unary(behavior, streaming_request):
+            def wrapper(request, context):
+                try:
+                    if not raft.is_leader():
+                        raise NotLeader(raft.leader())
+                    return behavior(request, context)
+                except NotLeader as e:
+                    reject(context, e)
+                except TimeoutError as e:
+                    context.abort(grpc.StatusCode.UNAVAILABLE, str(e))
+            return wrapper
+
+        def wrap_stream(behavior, streaming_request):
+            def wrapper(request, context):
+                try:
+                    if not raft.is_leader():
+                        raise NotLeader(raft.leader())
+                    yield from behavior(request, context)
+                except NotLeader as e:
+                    reject(context, e)
+            return wrapper
+
+        return _rebuild(handler, wrap_unary, wrap_stream)
@@ -0,0 +1,399 @@
+﻿import asyncio
+import signal
+import time
+from contextlib import asynccontextmanager
+
+import grpc
+
+from protos import stpb_pb2 as stpb
+from protos import stpb_pb2_grpc as stpb_grpc
+from params import params
+from common.interceptors import AsyncHookInterceptor
+from common import twopc
+from common.pool import AsyncChannelPool
+from storage.main import VERSION_CONFLICT, StoreService
+from storage.notify import Watcher
+
+
+def _blocking(request_iterator):
+    """把客户端流包装为同步迭代器, 供线程中的同步实现逐块向事件循环取数据, 不在内存中积累整个值"""
+    loop = asyncio.get_running_loop()
+
+    def chunks():
+        while (chunk := asyncio.run_coroutine_threadsafe(anext(request_iterator, None), loop).result()) is not None:
+            yield chunk
+    return chunks()
+
+
+class AsyncStoreService(stpb_grpc.storagementServiceServicer):
+    """grpc.aio 版本的存储服务
+
+    键值、锁与缓存仍由同步的 StoreService 管理, 本地读写放到线程中执行; 读取副本、转发给主副本
+    与两阶段提交的 fan-out 用 grpc.aio 并发调用, 等待其他节点时不占用工作线程
+    """
+
+    def __init__(self, store: StoreService):
+        self.store = store
+        self.logger = store.logger
+        self.pool = AsyncChannelPool(store.compression)
+
+    def _channel(self, target: str):
+        return self.pool.channel(target)
+
+    async def _fanout(self, targets: dict[int, str], method: str, request, timeout: float | None = None) -> dict:
+        """并发向各副本发起 grpc.aio 调用, 本节点调用本服务的方法; 失败的节点结果为 None, request 为字典时按节点取各自的请求"""
+        async def call(sid: int, target: str):
+            req = request[sid] if isinstance(request, dict) else request
+            start = time.perf_counter()
+            try:
+                if sid == self.store.id:
+                    return await getattr(self, method)(req, None)
+                async with self._channel(target) as ch:
+                    return await getattr(stpb_grpc.storagementServiceStub(ch), method)(
+                        req, timeout=timeout or params.RPC_TIMEOUT)
+            except Exception as e:
+                self.logger.error(e)
+                return None
+            finally:
+                twopc.observe(sid, method, start)
+
+        results = await asyncio.gather(*(call(sid, target) for sid, target in targets.items()))
+        return dict(zip(targets, results))
+
+    @asynccontextmanager
+    async def _coord_locks(self, keys):
+        """与同步实现共用按键的协调锁; 锁被占用时在线程中等待, 不阻塞事件循环"""
+        held = []
+        try:
+            for lock in self.store._coord_list(keys):
+                if not lock.acquire(blocking=False):
+                    waiter = asyncio.ensure_future(asyncio.to_thread(lock.acquire))
+                    try:
+                        await asyncio.shield(waiter)
+                    except asyncio.CancelledError:
+                        # 请求被取消时线程仍会拿到锁, 拿到后立即释放
+                        waiter.add_done_callback(lambda _, lock=lock: lock.release())
+                        raise
+                held.append(lock)
+            yield
+        finally:
+            for lock in reversed(held):
+                lock.release()
+
+    async def getdata(self, request, context):
+        key = request.key
+        owners = await asyncio.to_thread(self.store._owners, key)
+        if owners and self.store.id not in owners and not request.forwarded:
+            # 本节点不保存该键的副本, 转发给副本节点, 引导中的副本可能还没有数据
+            joining = self.store.cluster.get().joining
+            return await self._read_from({sid: t for sid, t in owners.items() if sid not in joining} or owners, request)
+        resp = await asyncio.to_thread(self.store._get_local, request)
+        if resp is not None:
+            return resp
+        self.logger.info("无键值%s ,向其他副本请求", key)
+        others = {sid: target for sid, target in owners.items() if sid != self.store.id}
+        resp = self.store._agree(key, await self._fanout(others, "maGetdata", stpb.StRequest(cli_id=0, key=key)))
+        if self.store.id not in owners:
+            return resp if resp.errno else stpb.StResponse(errno=False, errmes="未找到键值")
+        return await asyncio.to_thread(self.store._fill, request, resp)
+
+    async def _read_from(self, owners: dict[int, str], request) -> stpb.StResponse:
+        forwarded = stpb.StRequest(cli_id=request.cli_id, key=request.key, forwarded=True)
+        resp = stpb.StResponse(errno=False, errmes="未找到键值")
+        for sid, target in owners.items():
+            try:
+                async with self._channel(target) as ch:
+                    resp = await stpb_grpc.storagementServiceStub(ch).getdata(forwarded)
+            except grpc.RpcError as e:
+                self.logger.error("向副本%s 读取键值%s 失败 %s", sid, request.key, e.details() or e.code().name)
+                continue
+            if resp.errno or resp.errmes == "未找到键值":
+                return resp
+        return resp
+
+    async def _forward(self, owners: dict[int, str], method: str, request):
+        """写入交给键的主副本协调, 规则同 StoreService._forward"""
+        primary = next(iter(owners), self.store.id)
+        if primary == self.store.id or request.forwarded:
+            return None
+        forwarded = type(request)()
+        forwarded.CopyFrom(request)
+        forwarded.forwarded = True
+        self.logger.info("把键值%s 的写入转发给主副本%s", request.key, primary)
+        try:
+            async with self._channel(owners[primary]) as ch:
+                return await getattr(stpb_grpc.storagementServiceStub(ch), method)(
+                    forwarded, timeout=3 * params.RPC_TIMEOUT)
+        except grpc.RpcError as e:
+            if e.code() != grpc.StatusCode.UNAVAILABLE:
+                raise
+            self.logger.error("主副本%s 不可达, 由本节点协调键值%s 的写入", primary, request.key)
+            return None
+
+    async def _coordinate(self, tx: str, key: str, owners: dict[int, str], method: str, prepare,
+                          delete: bool) -> tuple[bool, str]:
+        """作为主副本协调事务 tx, 同 StoreService._coordinate; 日志落盘在线程中执行"""
+        store = self.store
+        op = "del" if delete else "put"
+        async with self._coord_locks([key]):
+            await asyncio.to_thread(store.txlog.begin, tx, owners, key=key, delete=delete)
+            with twopc.phase(op, "prepare", key):
+                results = await self._fanout(owners, method, prepare)
+            hasprc, flag, errmes = store._tally(results, owners, f"键值{key}")
+            phase = "commit" if flag else "abort"
+            twopc.rounds(op, phase)
+            await asyncio.to_thread(store.txlog.decide, tx, flag)
+            with twopc.phase(op, phase, key):
+                results = await self._fanout(hasprc, phase, stpb.StRequest(key=key, delete=delete, tx=tx))
+            if all(resp is not None for resp in results.values()):
+                await asyncio.to_thread(store.txlog.end, tx)
+            if flag and hasprc and len(hasprc) < len(owners):
+                await asyncio.to_thread(store._hand_off, {key: owners}, hasprc)
+        return flag, errmes
+
+    async def putdata(self, request, context):
+        key = request.key
+        self.logger.info("客户端%s 正在申请提交键值%s", request.cli_id, key)
+        owners = await asyncio.to_thread(self.store._owners, key)
+        if self.store.id not in self.store.cluster.map.nodes:
+            self.logger.info("本节点未注册, 拒绝写入键值%s", key)
+            return stpb.StEmpty(errno=False, errmes="提交失败")
+        resp = await self._forward(owners, "putdata", request)
+        if resp is not None:
+            return resp
+        tx = self.store._tx_id()
+        prepare = stpb.StKV(key=key, value=request.value, version=twopc.stamp(), expect=request.expect,
+                            absent=request.absent, tx=tx)
+        flag, errmes = await self._coordinate(tx, key, owners, "maPutdata", prepare, delete=False)
+        if not flag:
+            self.logger.info("向其他服务器提交键值%s 时发生错误", key)
+            return stpb.StEmpty(errno=False, errmes=errmes if errmes == VERSION_CONFLICT else "提交失败")
+        return stpb.StEmpty(errno=True)
+
+    async def deldata(self, request, context):
+        key = request.key
+        self.logger.info("客户端%s 正在申请删除键值%s", request.cli_id, key)
+        owners = await asyncio.to_thread(self.store._owners, key)
+        if self.store.id not in self.store.cluster.map.nodes:
+            self.logger.info("本节点未注册, 拒绝删除键值%s", key)
+            return stpb.StEmpty(errno=False, errmes="删除失败")
+        resp = await self._forward(owners, "deldata", request)
+        if resp is not None:
+            return resp
+        tx = self.store._tx_id()
+        prepare = stpb.StRequest(key=key, version=twopc.stamp(), expect=request.expect, tx=tx)
+        flag, errmes = await self._coordinate(tx, key, owners, "maDeldata", prepare, delete=True)
+        if not flag:
+            self.logger.info("向其他服务器删除键值%s 时发生错误", key)
+            return stpb.StEmpty(errno=False, errmes=errmes if errmes == VERSION_CONFLICT else "删除失败")
+        return stpb.StEmpty(errno=True)
+
+    # 分块写入需要先落到临时文件, 与主副本协调都在线程中完成
+    async def putstream(self, request_iterator, context):
+        return await asyncio.to_thread(self.store.putstream, _blocking(request_iterator), context)
+
+    async def getstream(self, request, context):
+        # 本地没有该键时同步实现从其他副本分块读取, 同样在线程中逐块执行
+        chunks = self.store.getstream(request, context)
+        while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+            yield chunk
+
+    async def maPutstream(self, request_iterator, context):
+        # 压缩与写文件都在线程中执行, 不阻塞事件循环
+        return await asyncio.to_thread(self.store.maPutstream, _blocking(request_iterator), context)
+
+    async def hint(self, request, context):
+        return await asyncio.to_thread(self.store.hint, request, context)
+
+    async def merkle(self, request, context):
+        return await asyncio.to_thread(self.store.merkle, request, context)
+
+    async def pull(self, request, context):
+        batches = self.store.pull(request, context)
+        while (batch := await asyncio.to_thread(next, batches, None)) is not None:
+            yield batch
+
+    async def install(self, request_iterator, context):
+        return await asyncio.to_thread(self.store.install, _blocking(request_iterator), context)
+
+    async def resolve(self, request, context):
+        return await asyncio.to_thread(self.store.resolve, request, context)
+
+    async def putbatch(self, request, context):
+        """作为批次中各键的主副本协调一轮两阶段提交, 同 StoreService.putbatch"""
+        store = self.store
+        batch, kvs, owners, targets, prepares = await asyncio.to_thread(store._plan_batch, request)
+        async with self._coord_locks(kvs):
+            await asyncio.to_thread(store.txlog.begin, batch, targets, batch=batch)
+            with twopc.phase("batch", "prepare", batch):
+                results = await self._fanout(targets, "maPutbatch", prepares)
+            hasprc, flag, errmes = store._tally(results, targets, f"写入批次{batch}")
+            if not hasprc:
+                flag, errmes = False, "所有副本都不可达"
+            phase = "commit" if flag else "abort"
+            twopc.rounds("batch", phase)
+            await asyncio.to_thread(store.txlog.decide, batch, flag)
+            with twopc.phase("batch", phase, batch):
+                results = await self._fanout(hasprc, "commitBatch" if flag else "abortBatch", stpb.StBatch(batch=batch))
+            if all(resp is not None for resp in results.values()):
+                await asyncio.to_thread(store.txlog.end, batch)
+            if flag and len(hasprc) < len(targets):
+                await asyncio.to_thread(store._hand_off, owners, hasprc)
+        if not flag:
+            self.logger.info("批次%s 提交无效", batch)
+            return stpb.StEmpty(errno=False, errmes=errmes or "批量提交失败")
+        self.logger.info("批次%s 提交生效", batch)
+        return stpb.StEmpty(errno=True)
+
+    async def importdata(self, request_iterator, context):
+        """按主副本拆分后由各主副本并发协调, 同 StoreService.importdata"""
+        store = self.store
+        imported = failed = 0
+        errmes = ""
+        failures = []
+        async for batch in request_iterator:
+            if not batch.kvs:
+                continue
+            targets, groups = await asyncio.to_thread(store._split_import, batch)
+            if store.id not in store.cluster.map.nodes:
+                self.logger.info("本节点未注册, 拒绝批量导入")
+                failed += len(batch.kvs)
+                errmes = "节点未注册, 无权操作!"
+                failures.append(stpb.StImportFailure(keys=[kv.key for kv in batch.kvs], errmes=errmes))
+                continue
+            results = await self._fanout(targets, "putbatch", groups, timeout=3 * params.RPC_TIMEOUT)
+            for sid, resp in results.items():
+                if resp is None:
+                    self.logger.error("主副本%s 不可达, 由本节点协调%s个键值", sid, len(groups[sid].kvs))
+                    resp = await self.putbatch(groups[sid], None)
+                if resp.errno:
+                    imported += len(groups[sid].kvs)
+                else:
+                    failed += len(groups[sid].kvs)
+                    errmes = resp.errmes
+                    failures.append(stpb.StImportFailure(primary=sid, keys=[kv.key for kv in groups[sid].kvs],
+                                                         errmes=resp.errmes))
+        self.logger.info("批量导入完成, 成功%s个, 失败%s个", imported, failed)
+        return stpb.StImportResult(errno=not failed, errmes=errmes, imported=imported, failed=failed,
+                                   failures=failures)
+
+    async def exportdata(self, request, context):
+        batches = self.store.exportdata(request, context)
+        while (batch := await asyncio.to_thread(next, batches, None)) is not None:
+            yield batch
+
+    async def invalidations(self, request, context):
+        # 有新消息时由发布线程唤醒, 等待期间不占用线程
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+
+        sub = self.store.notifier.subscribe(wake)
+        sub.push_reset()
+        self.logger.info("客户端%s 订阅缓存失效通知", request.cli_id)
+        try:
+            while True:
+                await wakeup.wait()
+                wakeup.clear()
+                while (msg := sub.get(timeout=0)) is not None:
+                    yield msg
+        finally:
+            self.store.notifier.unsubscribe(sub)
+            self.logger.info("客户端%s 取消订阅缓存失效通知", request.cli_id)
+
+    async def watch(self, request, context):
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                pass
+
+        self.store.changes.listeners.add(wake)
+        watcher = Watcher(self.store.changes, request)
+        self.logger.info("客户端%s watch %s%s", request.cli_id, request.key, "*" if request.prefix else "")
+        try:
+            yield watcher.start()
+            while True:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), 1.0)
+                except asyncio.TimeoutError:
+                    pass
+                wakeup.clear()
+                for event in watcher.poll(timeout=0):
+                    yield event
+        finally:
+            self.store.changes.listeners.discard(wake)
+
+    # 以下方法只访问本地状态, 但可能阻塞在独占锁上, 放到线程中执行
+    async def maGetdata(self, request, context):
+        return await asyncio.to_thread(self.store.maGetdata, request, context)
+
+    async def maPutdata(self, request, context):
+        return await asyncio.to_thread(self.store.maPutdata, request, context)
+
+    async def maDeldata(self, request, context):
+        return await asyncio.to_thread(self.store.maDeldata, request, context)
+
+    async def abort(self, request, context):
+        return await asyncio.to_thread(self.store.abort, request, context)
+
+    async def commit(self, request, context):
+        return await asyncio.to_thread(self.store.commit, request, context)
+
+    async def maPutbatch(self, request, context):
+        return await asyncio.to_thread(self.store.maPutbatch, request, context)
+
+    async def commitBatch(self, request, context):
+        return await asyncio.to_thread(self.store.commitBatch, request, context)
+
+    async def abortBatch(self, request, context):
+        return await asyncio.to_thread(self.store.abortBatch, request, context)
+
+    async def snapshot(self, request, context):
+        return await asyncio.to_thread(self.store.snapshot, request, context)
+
+    async def dropSnapshot(self, request, context):
+        return await asyncio.to_thread(self.store.dropSnapshot, request, context)
+
+    async def stats(self, request, context):
+        return self.store.stats(request, context)
+
+    async def spans(self, request, context):
+        return self.store.spans(request, context)
+
+    async def profile(self, request, context):
+        return await asyncio.to_thread(self.store.profile, request, context)
+
+    async def live(self, request, context):
+        return self.store.live(request, context)
+
+
+async def serve(store: StoreService, address: str, compression: grpc.Compression | None = None, hooks=()):
+    """启动 grpc.aio 存储服务, 收到 SIGINT/SIGTERM 后返回"""
+    server = grpc.aio.server(compression=compression, interceptors=[AsyncHookInterceptor(*hooks)])
+    stpb_grpc.add_storagementServiceServicer_to_server(AsyncStoreService(store), server)
+    server.add_insecure_port(address)
+    await server.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows 不支持 add_signal_handler, 由 KeyboardInterrupt 结束
+            pass
+    store.logger.info("开始进行服务(aio)")
+    try:
+        await stop.wait()
+    finally:
+        store.logger.info("接收到中断信号, 正在注销...")
+        await server.stop(0)
@@ -0,0 +1,133 @@
+﻿import hashlib
+import threading
+
+import grpc
+
+from protos import stpb_pb2 as stpb
+from protos import stpb_pb2_grpc as stpb_grpc
+from params import params
+from common.placement import ClusterMap
+
+
+def _md5(data: bytes) -> bytes:
+    return hashlib.md5(data).digest()
+
+
+class MerkleTree:
+    """按键名哈希把键分到 2**depth 个叶子的 Merkle 树
+
+    叶子的哈希为其中各键名与内容摘要按键名排序后的哈希, 内部节点为两个子节点哈希拼接后的哈希, 空子树的哈希为空串;
+    节点按堆的顺序编号, 根为 1, 节点 i 的子节点为 2i 与 2i+1, 叶子为 [2**depth, 2**(depth+1))
+    """
+
+    def __init__(self, digests: dict[str, bytes], depth: int = params.MERKLE_DEPTH):
+        self.width = 1 << depth
+        self.nodes = [b""] * (2 * self.width)
+        buckets: dict[int, list[str]] = {}
+        for key in digests:
+            buckets.setdefault(self.leaf(key), []).append(key)
+        for leaf, keys in buckets.items():
+            h = hashlib.md5()
+            for key in sorted(keys):
+                h.update(key.encode() + b"\0" + digests[key])
+            self.nodes[leaf] = h.digest()
+        for i in range(self.width - 1, 0, -1):
+            left, right = self.nodes[2 * i], self.nodes[2 * i + 1]
+            if left or right:
+                self.nodes[i] = _md5(left + right)
+
+    def leaf(self, key: str) -> int:
+        return self.width + int.from_bytes(_md5(key.encode())[:4], "big") % self.width
+
+    def valid(self, node: int) -> bool:
+        return 0 < node < len(self.nodes)
+
+
+class AntiEntropy:
+    """反熵: 后台定期与其他副本比较 Merkle 树, 只传输不一致的键
+
+    每个节点只为自己是主副本的键发起比较, 对每个同为副本的节点两边各自构建这部分键的 Merkle 树,
+    从根开始逐层只下探哈希不同的子树, 最后交换不同叶子中的键摘要。主副本协调了该键的所有写入, 以它的值为准:
+    修复期间持有该键的协调锁, 不会与正在进行的两阶段提交交错; 副本上遗留的未提交写入(错过了 commit/abort)一并清除
+    """
+
+    def __init__(self, store, interval: float = params.ANTI_ENTROPY_INTERVAL):
+        self.store = store
+        self.logger = store.logger
+        self.interval = interval
+        self.stop = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    def start(self):
+        if self.thread is None and self.interval > 0:
+            self.thread = threading.Thread(target=self._run, name="anti-entropy", daemon=True)
+            self.thread.start()
+
+    def close(self):
+        self.stop.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        while not self.stop.wait(self.interval):
+            try:
+                self.step()
+            except Exception as e:
+                self.logger.error("反熵比较时发生错误 %s", e)
+
+    def step(self) -> int:
+        """与每个副本节点比较一次, 返回修复的键数"""
+        store = self.store
+        cluster = store.cluster.refresh()
+        if store.id not in cluster.nodes or store.id in cluster.joining:
+            return 0
+        shard, shards = store._slice()
+        local = store._digests(cluster, store.id, None, shard, shards)
+        owners = {key: cluster.owners(key) for key in local}
+        repaired = 0
+        for sid, target in cluster.nodes.items():
+            if sid == store.id or sid in cluster.joining or self.stop.is_set():
+                continue
+            mine = {key: digest for key, digest in local.items() if sid in owners[key]}
+            try:
+                repaired += self._sync(sid, target, cluster, mine, shard, shards)
+            except grpc.RpcError as e:
+                self.logger.error("与节点%s 反熵比较失败 %s", sid, e.details() or e.code().name)
+        return repaired
+
+    def _sync(self, sid: int, target: str, cluster: ClusterMap, mine: dict[str, bytes], shard: int, shards: int) -> int:
+        stub = stpb_grpc.storagementServiceStub(self.store.pool.get(target))
+        tree = MerkleTree(mine)
+
+        def remote(nodes: list[int], leaves: bool = False) -> stpb.StMerkle:
+            resp = stub.merkle(stpb.StMerkleRequest(primary=self.store.id, epoch=cluster.epoch, nodes=nodes,
+                                                    leaves=leaves, shard=shard, shards=shards),
+                               timeout=params.RPC_TIMEOUT)
+            if not resp.errno:
+                raise RuntimeError(resp.errmes)
+            return resp
+
+        try:
+            diff = [1]
+            while diff and diff[0] < tree.width:
+                hashes = remote(diff).hashes
+                diff = [c for node, h in zip(diff, hashes) if h != tree.nodes[node] for c in (2 * node, 2 * node + 1)]
+            if diff:
+                diff = [node for node, h in zip(diff, remote(diff).hashes) if h != tree.nodes[node]]
+            if not diff:
+                return 0
+            theirs = {d.key: d.digest for d in remote(diff, leaves=True).digests}
+        except RuntimeError as e:
+            # 两边的集群视图不一致时跳过本轮, 等成员变更传播后再比较
+            self.logger.info("跳过与节点%s 的反熵比较: %s", sid, e)
+            return 0
+        leaves = set(diff)
+        keys = {key for key in mine if tree.leaf(key) in leaves} | set(theirs)
+        keys = sorted(key for key in keys if mine.get(key) != theirs.get(key))
+        if not keys:
+            return 0
+        self.logger.info("节点%s 有%s个键值与本节点不一致, 开始修复", sid, len(keys))
+        repaired = 0
+        for i in range(0, len(keys), params.IMPORT_BATCH):
+            repaired += len(self.store._repair(target, keys[i:i + params.IMPORT_BATCH]))
+        return repaired
@@ -0,0 +1,139 @@
+﻿import json
+import os
+import threading
+
+import grpc
+
+from protos import stpb_pb2 as stpb
+from protos import stpb_pb2_grpc as stpb_grpc
+from params import params
+from common.metrics import REGISTRY
+
+HINTS_STORED = REGISTRY.counter("hints_stored_total", "为暂时不可达的副本记录的提示数")
+HINTS_REPLAYED = REGISTRY.counter("hints_replayed_total", "副本恢复后补发的提示数")
+
+
+class HintedHandoff:
+    """提示移交: 记录没有参与已提交写入的副本与键, 副本恢复后批量补发
+
+    提示只记录键名, 补发时取本节点当前已提交的值(同一个键的多次写入只补发一次); 每个目标节点一个文件,
+    每行一个 JSON 编码的键名, 新提示追加写入, 补发后重写为剩余的提示。目标节点已被移出集群时丢弃它的提示
+    """
+
+    def __init__(self, store, interval: float = params.HINT_INTERVAL):
+        self.store = store
+        self.logger = store.logger
+        self.interval = interval
+        self.path = os.path.join(store.datapath, ".hints")
+        self.hints: dict[int, set[str]] = {}  # 目标节点 -> 键
+        self.mu = threading.Lock()
+        self.stop = threading.Event()
+        self.thread: threading.Thread | None = None
+        self._load()
+
+    def _file(self, sid: int) -> str:
+        return os.path.join(self.path, str(sid))
+
+    def _load(self):
+        if not os.path.isdir(self.path):
+            return
+        for name in os.listdir(self.path):
+            if not name.isdigit():
+                continue
+            with open(os.path.join(self.path, name), encoding="utf-8") as f:
+                self.hints[int(name)] = {json.loads(line) for line in f if line.strip()}
+
+    def add(self, sid: int, keys):
+        keys = list(keys)
+        if not keys:
+            return
+        with self.mu:
+            self.hints.setdefault(sid, set()).update(keys)
+            os.makedirs(self.path, exist_ok=True)
+            with open(self._file(sid), "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(key, ensure_ascii=False) + "\n" for key in keys)
+        HINTS_STORED.inc(len(keys))
+        self.logger.info("节点%s 暂时不可达, 记录%s个键的提示", sid, len(keys))
+
+    def pending(self) -> int:
+        with self.mu:
+            return sum(len(keys) for keys in self.hints.values())
+
+    def _save(self, sid: int):
+        # 调用方持有 self.mu
+        keys = self.hints.get(sid)
+        if not keys:
+            self.hints.pop(sid, None)
+            try:
+                os.remove(self._file(sid))
+            except FileNotFoundError:
+                pass
+            return
+        tmp = self._file(sid) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(key, ensure_ascii=False) + "\n" for key in keys)
+        os.replace(tmp, self._file(sid))
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="handoff", daemon=True)
+            self.thread.start()
+
+    def close(self):
+        self.stop.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        while not self.stop.wait(self.interval):
+            try:
+                self.step()
+            except Exception as e:
+                self.logger.error("补发提示时发生错误 %s", e)
+
+    def step(self) -> int:
+        """向已恢复的目标节点补发提示, 返回补发的键数"""
+        with self.mu:
+            targets = [sid for sid, keys in self.hints.items() if keys]
+        if not targets:
+            return 0
+        cluster = self.store.cluster.get()
+        replayed = 0
+        for sid in targets:
+            if self.stop.is_set():
+                break
+            if sid not in cluster.nodes:
+                with self.mu:
+                    dropped = len(self.hints.get(sid, ()))
+                    self.hints[sid] = set()
+                    self._save(sid)
+                self.logger.info("节点%s 已不在集群中, 丢弃%s个提示", sid, dropped)
+                continue
+            target = cluster.nodes[sid]
+            try:
+                stpb_grpc.storagementServiceStub(self.store.pool.get(target)).live(
+                    stpb.StEmpty(errno=True), timeout=params.RPC_TIMEOUT)
+            except grpc.RpcError:
+                continue
+            replayed += self._replay(sid, target)
+        return replayed
+
+    def _replay(self, sid: int, target: str) -> int:
+        with self.mu:
+            keys = sorted(self.hints.get(sid, ()))
+            self.hints[sid] = set()
+        done: set[str] = set()
+        try:
+            for i in range(0, len(keys), params.IMPORT_BATCH):
+                done.update(self.store._repair(target, keys[i:i + params.IMPORT_BATCH]))
+        except grpc.RpcError as e:
+            self.logger.error("向节点%s 补发提示失败 %s", sid, e.details() or e.code().name)
+        finally:
+            with self.mu:
+                # 补发期间新记录的提示保留, 未完成(失败或本节点正在准备写入)的键放回
+                self.hints.setdefault(sid, set()).update(key for key in keys if key not in done)
+                self._save(sid)
+        HINTS_REPLAYED.inc(len(done))
+        if done:
+            self.logger.info("节点%s 已恢复, 补发%s个键值", sid, len(done))
+        return len(done)
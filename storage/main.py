@@ -1,9 +1,21 @@
 ﻿import argparse
+import contextvars
+import hashlib
+import itertools
+import json
 import logging
 import os
 import random
+import shutil
 import signal
 import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from collections import namedtuple
+from contextlib import contextmanager
 from threading import Lock
 from concurrent import futures
 import grpc
@@ -13,6 +25,39 @@ from protos import mapb_pb2_grpc as mapb_grpc
 from protos import stpb_pb2 as stpb
 from protos import stpb_pb2_grpc as stpb_grpc
 from params import params
+from common.compress import ValueCodec, grpc_compression, parse_tiers
+from common.interceptors import HookInterceptor
+from common.logs import JsonFormatter, access_hook, close_logger, parse_rates, setup_logger
+from common import profiling
+from common.metrics import REGISTRY, metrics_hook, serve_prometheus
+from common.placement import ClusterView, majority
+from common.pool import ChannelPool
+from common.streams import StreamLimit
+from common import twopc
+from common.txlog import TxLog
+from common.tracing import TRACER, tracing_hook
+from storage.antientropy import AntiEntropy, MerkleTree
+from storage.handoff import HintedHandoff
+from storage.notify import ChangeLog, Notifier, Watcher
+from storage.rebalance import Rebalancer
+
+CACHE_HITS = REGISTRY.counter("cache_hits_total", "缓存命中次数")
+CACHE_MISSES = REGISTRY.counter("cache_misses_total", "缓存未命中次数")
+CACHE_EVICTIONS = REGISTRY.counter("cache_evictions_total", "缓存淘汰次数")
+LOCK_READ_REJECTED = REGISTRY.counter("lock_read_rejected_total", "键被独占导致共享锁获取失败的次数")
+LOCK_WRITE_CONTENDED = REGISTRY.counter("lock_write_contended_total", "申请独占锁时需要等待的次数")
+LOCK_WRITE_WAIT = REGISTRY.histogram("lock_write_wait_seconds", "申请独占锁的等待时间")
+# 分块上传的值可以是任意字节, 一元读取与导出只能返回 UTF-8 文本
+BINARY_VALUE = "该值不是 UTF-8 文本, 请使用 getstream 分块读取"
+# 条件写入在准备阶段检查的条件不满足
+VERSION_CONFLICT = "版本不匹配"
+# 同一个键已有其他事务的写入处于准备阶段, 提交或回滚前不接受新的准备
+PREPARE_BUSY = "键值正在被其他事务写入"
+# commit 的事务在本节点没有准备阶段的写入
+UNKNOWN_TX = "未找到事务的准备"
+
+# 准备阶段登记的写入: 所属事务、协调者分配的版本号、是否为删除
+Staged = namedtuple("Staged", "tx version delete")
 
 
 class Cache:
@@ -27,7 +72,7 @@ class Cache:
             self.timemap.pop(key, None)
             self.m.pop(key, None)
 
-    def add(self, key: str, value: str):
+    def add(self, key: str, value):
         with self.mu:
             # increase age for all keys
             for k in list(self.timemap.keys()):
@@ -50,6 +95,7 @@ class Cache:
             if maxk is not None:
                 self.timemap.pop(maxk, None)
                 self.m.pop(maxk, None)
+                CACHE_EVICTIONS.inc()
             self.timemap[key] = 0
             self.m[key] = value
 
@@ -58,7 +104,9 @@ class Cache:
             for k in list(self.timemap.keys()):
                 self.timemap[k] += 1
             if key in self.m:
+                CACHE_HITS.inc()
                 return self.m[key], True
+            CACHE_MISSES.inc()
             return "", False
 
 
@@ -99,174 +147,360 @@ class RWLock:
                 return True
             else:
                 # writer active; cannot acquire read
+                LOCK_READ_REJECTED.inc()
                 return False
 
     def acquire_write(self):
-        self._wlock.acquire()
+        if self._wlock.acquire(blocking=False):
+            return
+        LOCK_WRITE_CONTENDED.inc()
+        with LOCK_WRITE_WAIT.time():
+            self._wlock.acquire()
 
     def release_write(self):
         self._wlock.release()
 
 
 class StoreService(stpb_grpc.storagementServiceServicer):
-    def __init__(self, server_id: int, datapath: str, logger: logging.Logger, cache_num: int, manager_addr: str):
+    def __init__(self, server_id: int, datapath: str, logger: logging.Logger, cache_num: int, manager_addr: str,
+                 codec: ValueCodec | None = None, compression: grpc.Compression | None = None):
         self.id = server_id
-        self.mumap = {}  # key -> RWLock
-        self.tmpvalue = None  # record the value before commit
+        self.mumap = {}  # key -> RWLock, 写入已提交的数据文件时互斥
+        self.staged: dict[str, Staged] = {}  # key -> 准备阶段的写入, 新值在待提交文件中, 提交前读到的仍是已提交的版本
+        self.versions: dict[str, int] = {}  # key -> 已提交的版本号
+        self.batches: dict[str, list[str]] = {}  # 事务 id -> 准备阶段登记的键, 批次的事务 id 即批次 id
+        self.snap_mu = Lock()  # 修改 KVmap/staged 与建立快照互斥
         self.logger = logger
         self.datapath = datapath
         self.KVmap = {}  # key -> bool
         self.cache = Cache(cache_num)
         self.manager = manager_addr
+        self.codec = codec or ValueCodec()  # value <-> bytes on disk
+        self.compression = compression  # gRPC message compression to manager
+        self.pool = ChannelPool(compression)
+        self.notifier = Notifier()  # 提交/回滚的键名推送给订阅了失效通知的客户端
+        self.streams = StreamLimit(params.MAX_STREAMS)  # 订阅流各占一个工作线程, 超过上限时拒绝
+        self.incoming = {}  # key -> 准备阶段写入的新值, 提交时随变更事件推送给 watch
+        self.changes = ChangeLog()
+        self.cluster = ClusterView(manager_addr, self.pool, logger)  # 管理服务器发布的成员与放置规则
+        self.coord_mu = [Lock() for _ in range(64)]  # 作为主副本时按键串行化两阶段提交
+        self.fanout_pool = futures.ThreadPoolExecutor(max_workers=params.FANOUT_THREADS, thread_name_prefix="fanout")
+        self.rebalancer = Rebalancer(self)  # 成员变更后把键值迁移给新的副本节点
+        self.bootstrapping: set[str] | None = None  # 引导期间提交过的键, 不再写入快照中的旧值
+        self.digests: dict[str, bytes | None] = {}  # key -> 已提交内容的摘要, 反熵时按需计算, 键变更时失效
+        self.antientropy = AntiEntropy(self)  # 定期与其他副本比较 Merkle 树并修复不一致的键
+        self.handoff = HintedHandoff(self)  # 写入时不可达的副本恢复后补发
+        self.snapshots: dict[str, dict[str, int]] = {}  # 快照 id -> 建立时各键已提交的版本号
+        self.txlog = TxLog(self._txlog_path(), logger)  # 作为协调者时的两阶段提交决议
+        self._reload_staged()
+
+    def _txlog_path(self) -> str:
+        return os.path.join(self.datapath, ".txlog")
+
+    def _pending_dir(self) -> str:
+        return os.path.join(self.datapath, ".pending")
+
+    def _txdir(self, tx: str) -> str:
+        return os.path.join(self._pending_dir(), tx)
+
+    def _pending(self, key: str, tx: str) -> str:
+        """事务 tx 准备阶段写入新值的文件, 提交时 os.replace 为数据文件"""
+        os.makedirs(self._txdir(tx), exist_ok=True)
+        return os.path.join(self._txdir(tx), f"{key}")
+
+    def _staged_path(self, tx: str) -> str:
+        """事务 tx 在本节点的准备记录, 每行一个键的版本号与是否删除"""
+        return os.path.join(self._pending_dir(), f"{tx}.staged")
+
+    def _vote(self, tx: str, keys) -> None:
+        """回复准备成功之前把这些键的准备落盘, 重启后由 _reload_staged 恢复并等待协调者补发决议"""
+        with self.snap_mu:
+            records = [{"key": key, "version": held.version, "delete": held.delete}
+                       for key in keys if (held := self.staged.get(key)) is not None and held.tx == tx]
+        os.makedirs(self._pending_dir(), exist_ok=True)
+        with open(self._staged_path(tx), "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _drop_tx(self, tx: str):
+        shutil.rmtree(self._txdir(tx), ignore_errors=True)
+        try:
+            os.remove(self._staged_path(tx))
+        except FileNotFoundError:
+            pass
+
+    def _reload_staged(self):
+        """恢复上次退出时已回复准备成功、还没有收到决议的写入; 没有准备记录的待提交文件是没有完成的准备, 直接删除"""
+        try:
+            names = os.listdir(self._pending_dir())
+        except FileNotFoundError:
+            return
+        for tx in {name.removesuffix(".staged") for name in names}:
+            records: dict[str, Staged] = {}
+            try:
+                with open(self._staged_path(tx), encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            break  # 写到一半时崩溃的最后一行
+                        if record.get("abort"):
+                            records.pop(record["key"], None)
+                        else:
+                            records[record["key"]] = Staged(tx, record["version"], record["delete"])
+            except FileNotFoundError:
+                pass
+            for key, held in records.items():
+                # 没有待提交文件的写入已经提交过了
+                if held.delete or os.path.exists(os.path.join(self._txdir(tx), f"{key}")):
+                    self.staged[key] = held
+                    self.batches.setdefault(tx, []).append(key)
+            if tx not in self.batches:
+                self._drop_tx(tx)
+        if self.staged:
+            self.logger.info("恢复%s个事务准备阶段的%s个键值, 等待协调者的决议", len(self.batches), len(self.staged))
+
+    def _tx_id(self) -> str:
+        return f"{self.id}-{uuid.uuid4().hex}"
+
+    def _channel(self, target: str):
+        return self.pool.channel(target)
+
+    def _tmp(self, key: str) -> str:
+        tmpdir = os.path.join(self.datapath, ".tmp")
+        os.makedirs(tmpdir, exist_ok=True)
+        return os.path.join(tmpdir, f"{key}.{os.getpid()}.{threading.get_ident()}")
+
+    def _write(self, key: str, data: bytes, tx: str = ""):
+        """先写临时文件再 os.replace, 快照中硬链接的旧文件不会被改写; 指定 tx 时写到该事务的待提交文件"""
+        tmp = self._tmp(key)
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, self._pending(key, tx) if tx else os.path.join(self.datapath, f"{key}"))
 
     def getdata(self, request, context):
+        key = request.key
+        owners = self._owners(key)
+        if owners and self.id not in owners and not request.forwarded:
+            # 本节点不保存该键的副本, 转发给副本节点, 也不在本地缓存; 引导中的副本可能还没有数据
+            joining = self.cluster.get().joining
+            return self._read_from({sid: t for sid, t in owners.items() if sid not in joining} or owners, request)
+        resp = self._get_local(request)
+        if resp is not None:
+            return resp
+        self.logger.info("无键值%s ,向其他副本请求", key)
+        resp = self._collect(key, owners)
+        if self.id not in owners:
+            return resp if resp.errno else stpb.StResponse(errno=False, errmes="未找到键值")
+        return self._fill(request, resp)
+
+    def _owners(self, key: str) -> dict[int, str]:
+        """键的副本节点地址, 主副本在前; 本节点不在缓存的视图中时先重新拉取一次"""
+        cluster = self.cluster.get()
+        if self.id not in cluster.nodes:
+            cluster = self.cluster.refresh()
+        return cluster.targets(key)
+
+    def _collect(self, key: str, owners: dict[int, str]) -> stpb.StResponse:
+        """从其他副本收集键值并多数表决"""
+        others = {sid: target for sid, target in owners.items() if sid != self.id}
+        results = self._fanout(others, "maGetdata", stpb.StRequest(cli_id=0, key=key))
+        return self._agree(key, results)
+
+    def _agree(self, key: str, results: dict) -> stpb.StResponse:
+        values = [resp.value for resp in results.values() if resp is not None and resp.errno]
+        if not values:
+            return stpb.StResponse(errno=False, errmes=f"暂时缺少键值{key}")
+        value, ok = majority(values)
+        if not ok:
+            return stpb.StResponse(errno=False, errmes=f"其他服务器对键值{key} 无法达成一致")
+        return stpb.StResponse(value=value, errno=True)
+
+    def _read_from(self, owners: dict[int, str], request) -> stpb.StResponse:
+        forwarded = stpb.StRequest(cli_id=request.cli_id, key=request.key, forwarded=True)
+        resp = stpb.StResponse(errno=False, errmes="未找到键值")
+        for sid, target in owners.items():
+            try:
+                with self._channel(target) as ch:
+                    resp = stpb_grpc.storagementServiceStub(ch).getdata(forwarded)
+            except grpc.RpcError as e:
+                self.logger.error("向副本%s 读取键值%s 失败 %s", sid, request.key, e.details() or e.code().name)
+                continue
+            if resp.errno or resp.errmes == "未找到键值":
+                return resp
+        return resp
+
+    def _get_local(self, request):
+        """从缓存或本地已提交的版本读取键值, 本地没有该键时返回 None"""
         cli_id = request.cli_id
         key = request.key
-        self.logger.info(f"客户端{cli_id} 请求键值{key}")
+        self.logger.info("客户端%s 请求键值%s", cli_id, key)
 
-        value, ok = self.cache.get(key)
+        cached, ok = self.cache.get(key)
         if ok:
-            self.logger.info(f"缓存存在键值{key}")
-            self.logger.info(f"返回键值{key}")
-            return stpb.StResponse(value=value, errno=True)
-
-        self.logger.info("缓存中未找到键值 %s" % key)
-        if key in self.KVmap:
-            lock = self.mumap.get(key)
-            if not lock or not lock.try_acquire_read():
-                self.logger.info(f"客户端{cli_id} 尝试获取 {key}共享锁, 但目前该锁被独占")
-                return stpb.StResponse(errno=False, errmes="该值被另一进程占有")
-            self.logger.info(f"客户端{cli_id} 获取了 {key}共享锁")
-            try:
-                with open(os.path.join(self.datapath, f"{key}"), 'rb') as f:
-                    content = f.read()
-            except Exception as e:
-                self.logger.info(f"读取键值{key} 时发生错误{e},客户端{cli_id} 释放 {key}共享锁")
-                lock.release_read()
-                return stpb.StResponse(errno=False, errmes=str(e))
-            self.logger.info(f"成功读取键值{key}")
-            self.logger.info(f"缓存记录键值{key}")
-            self.cache.add(key, content.decode())
-            self.logger.info(f"返回键值{key} ,客户端{cli_id} 释放 {key}共享锁")
-            lock.release_read()
-            return stpb.StResponse(value=content.decode(), errno=True)
-        else:
-            self.logger.info(f"无键值{key} ,向其他服务器请求")
-            try:
-                with grpc.insecure_channel(self.manager) as ch:
-                    client = mapb_grpc.manageServiceStub(ch)
-                    resp = client.Get(mapb.Request(key=key, server_id=self.id))
-            except Exception as e:
-                self.logger.error(f"连接管理服务器错误 {e}")
-                raise
-            if not resp.errno:
-                self.logger.info(f"无法从其他服务器取得键值{key} {resp.errmes},告知客户端{cli_id}")
-                return stpb.StResponse(errno=False, errmes="未找到键值")
-            self.logger.info(f"成功从其他服务器请求键值{key}")
-            self.logger.info(f"缓存记录键值{key}")
-            self.cache.add(key, resp.value)
-            self.mumap[key] = RWLock()
-            self.logger.info(f"准备写入键值{key}")
-            self.logger.info(f"为客户端{cli_id} 申请 {key}独占锁")
-            self.mumap[key].acquire_write()
+            self.logger.info("缓存存在键值%s", key)
+            self.logger.info("返回键值%s", key)
+            return stpb.StResponse(value=cached[0], version=cached[1], errno=True)
+
+        self.logger.info("缓存中未找到键值 %s", key)
+        resp = self._read_committed(key)
+        if resp is not None:
+            self.logger.info("返回键值%s 的版本%s", key, resp.version)
+        return resp
+
+    def _open_committed(self, key: str):
+        """打开键已提交的最新版本, 返回 (文件, 版本号), 没有已提交的值时文件为 None
+
+        提交通过 os.replace 替换数据文件, 已打开的文件始终是打开时的版本, 读取不需要等待准备阶段的写入;
+        被替换的旧版本在最后一个读取者关闭后由文件系统回收
+        """
+        with self.snap_mu:
+            if key not in self.KVmap:
+                return None, 0
             try:
-                with open(os.path.join(self.datapath, f"{key}"), 'wb') as f:
-                    f.write(resp.value.encode())
-                self.logger.info(f"写入键值{key} 成功")
-            except Exception as e:
-                self.logger.info(f"写入键值{key} 失败: {e}")
-            finally:
-                self.logger.info(f"返回键值{key} ,客户端{cli_id} 释放 {key}独占锁")
-                self.mumap[key].release_write()
-            return stpb.StResponse(value=resp.value, errno=True)
+                return open(os.path.join(self.datapath, f"{key}"), 'rb'), self.versions.get(key, 0)
+            except FileNotFoundError:
+                return None, 0
+
+    def _read_committed(self, key: str):
+        """读取并缓存键已提交的最新版本, 没有已提交的值时返回 None"""
+        try:
+            f, version = self._open_committed(key)
+            if f is None:
+                return None
+            with f:
+                content = self.codec.decode(f.read()).decode()
+        except UnicodeDecodeError:
+            self.logger.info("键值%s 不是 UTF-8 文本", key)
+            return stpb.StResponse(errno=False, errmes=BINARY_VALUE)
+        except Exception as e:
+            self.logger.info("读取键值%s 时发生错误%s", key, e)
+            return stpb.StResponse(errno=False, errmes=str(e))
+        with self.snap_mu:
+            # 读取期间提交了新的版本时不缓存旧值
+            if key in self.KVmap and self.versions.get(key, 0) == version:
+                self.cache.add(key, (content, version))
+        return stpb.StResponse(value=content, version=version, errno=True)
+
+    def _fill(self, request, resp):
+        """缓存并落盘从其他服务器取得的键值, 返回给客户端的响应"""
+        cli_id = request.cli_id
+        key = request.key
+        if not resp.errno:
+            self.logger.info("无法从其他服务器取得键值%s %s,告知客户端%s", key, resp.errmes, cli_id)
+            return stpb.StResponse(errno=False, errmes="未找到键值")
+        self.logger.info("成功从其他服务器请求键值%s", key)
+        self.logger.info("缓存记录键值%s", key)
+        self.cache.add(key, (resp.value, resp.version))
+        lock = self.mumap.setdefault(key, RWLock())
+        self.logger.info("准备写入键值%s", key)
+        self.logger.info("为客户端%s 申请 %s独占锁", cli_id, key)
+        lock.acquire_write()
+        try:
+            self._write(key, self.codec.encode(resp.value.encode()))
+            self.logger.info("写入键值%s 成功", key)
+        except Exception as e:
+            self.logger.info("写入键值%s 失败: %s", key, e)
+        finally:
+            self.logger.info("返回键值%s ,客户端%s 释放 %s独占锁", key, cli_id, key)
+            lock.release_write()
+        return stpb.StResponse(value=resp.value, version=resp.version, errno=True)
 
     def maGetdata(self, request, context):
         key = request.key
-        self.logger.info(f"管理服务器 请求键值{key}")
-        value, ok = self.cache.get(key)
+        self.logger.info("管理服务器 请求键值%s", key)
+        cached, ok = self.cache.get(key)
         if ok:
-            self.logger.info(f"缓存存在键值{key}")
-            self.logger.info(f"返回键值{key}")
-            return stpb.StResponse(value=value, errno=True)
-        self.logger.info("缓存中未找到键值 %s" % key)
-        if key in self.KVmap:
-            lock = self.mumap.get(key)
-            if not lock or not lock.try_acquire_read():
-                self.logger.info(f"管理服务器尝试获取 {key}共享锁, 但目前该锁被独占")
-                return stpb.StResponse(errno=False, errmes="无法获取锁")
-            try:
-                with open(os.path.join(self.datapath, f"{key}"), 'rb') as f:
-                    content = f.read()
-            except Exception as e:
-                self.logger.info(f"读取键值{key} 时发生错误{e},管理服务器释放 {key}共享锁")
-                lock.release_read()
-                return stpb.StResponse(errno=False, errmes=str(e))
-            self.logger.info(f"成功读取键值{key} ,管理服务器释放 {key}共享锁")
-            lock.release_read()
-            return stpb.StResponse(value=content.decode(), errno=True)
-        self.logger.info(f"无键值{key} ,告知管理服务器")
+            self.logger.info("缓存存在键值%s", key)
+            self.logger.info("返回键值%s", key)
+            return stpb.StResponse(value=cached[0], version=cached[1], errno=True)
+        self.logger.info("缓存中未找到键值 %s", key)
+        resp = self._read_committed(key)
+        if resp is not None:
+            self.logger.info("返回键值%s 的版本%s", key, resp.version)
+            return resp
+        self.logger.info("无键值%s ,告知管理服务器", key)
         return stpb.StResponse(errno=False, errmes="服务器中无键值")
 
     def maPutdata(self, request, context):
         key = request.key
         value = request.value
-        self.cache.del_key(key)
-        if key not in self.KVmap:
-            self.KVmap[key] = True
-            self.mumap[key] = RWLock()
-            self.tmpvalue = None
-            self.logger.info(f"管理服务器正在申请 {key}独占锁")
-            self.mumap[key].acquire_write()
-            self.logger.info(f"管理服务器获取了 {key}独占锁")
-        else:
-            self.logger.info(f"管理服务器正在申请 {key}独占锁")
-            self.mumap[key].acquire_write()
-            self.logger.info(f"管理服务器获取了 {key}独占锁")
-            try:
-                with open(os.path.join(self.datapath, f"{key}"), 'rb') as f:
-                    content = f.read()
-                self.logger.info(f"记录原有键值{key} 成功")
-                self.tmpvalue = content
-            except Exception:
-                self.logger.info(f"记录原有键值{key} 失败")
-                self.tmpvalue = None
-            self.mumap[key].release_write()
-        self.logger.info(f"准备写入键值{key}")
+        if errmes := self._stage(key, request.tx, request.version, request.expect, request.absent):
+            return stpb.StEmpty(errno=False, errmes=errmes)
+        self.incoming[key] = value
+        self.logger.info("准备写入键值%s", key)
         try:
-            with open(os.path.join(self.datapath, f"{key}"), 'wb') as f:
-                f.write(value.encode())
+            self._write(key, self.codec.encode(value.encode()), request.tx)
         except Exception as e:
-            self.logger.info(f"写入键值{key} 失败,告知管理服务器: {e}")
+            self.logger.info("写入键值%s 失败,告知管理服务器: %s", key, e)
             return stpb.StEmpty(errno=False, errmes=str(e))
-        self.logger.info(f"写入键值{key} 成功,告知管理服务器")
+        self._vote(request.tx, [key])
+        self.logger.info("写入键值%s 成功,告知管理服务器", key)
         self.logger.info("等待管理服务器告知本次写入结果...")
         return stpb.StEmpty(errno=True)
 
+    def maPutstream(self, request_iterator, context):
+        first = next(request_iterator, None)
+        if first is None:
+            return stpb.StEmpty(errno=False, errmes="数据流为空")
+        key = first.key
+        if errmes := self._stage(key, first.tx, first.version):
+            return stpb.StEmpty(errno=False, errmes=errmes)
+        self.logger.info("准备分块写入键值%s, 共%s字节", key, first.size)
+        encoder = self.codec.encoder(first.size)
+        tmp = self._tmp(key)
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(encoder.update(first.data))
+                for chunk in request_iterator:
+                    f.write(encoder.update(chunk.data))
+                f.write(encoder.flush())
+            os.replace(tmp, self._pending(key, first.tx))
+        except Exception as e:
+            self.logger.info("分块写入键值%s 失败,告知管理服务器: %s", key, e)
+            return stpb.StEmpty(errno=False, errmes=str(e))
+        self._vote(first.tx, [key])
+        self.logger.info("分块写入键值%s 成功,告知管理服务器", key)
+        self.logger.info("等待管理服务器告知本次写入结果...")
+        return stpb.StEmpty(errno=True)
+
+    def _stage(self, key: str, tx: str, version: int, expect: int = 0, absent: bool = False,
+               delete: bool = False) -> str:
+        """为事务 tx 登记准备阶段的写入与本轮的版本号; 新值写到待提交文件, 提交前读取的仍是已提交的版本
+
+        同一个键同时只能有一个事务处于准备阶段: 主副本不可达时其他副本也可能协调同一个键, 两个协调者的准备
+        在这里互斥, 后到的被拒绝, 提交前的检查与提交之间不会插入其他写入。版本号由协调者分配, 没有分配或
+        不大于已提交的版本时顺延。条件写入在此检查: expect 非 0 时已提交的版本须等于 expect, absent 时键须不存在。
+        返回拒绝原因, 登记成功时为空字符串
+        """
+        if not tx:
+            return "缺少事务id"
+        with self.snap_mu:
+            held = self.staged.get(key)
+            if held is not None and held.tx != tx:
+                self.logger.info("键值%s 已由事务%s 准备写入, 拒绝事务%s", key, held.tx, tx)
+                # 条件写入读到的版本可能即将过期, 按版本冲突处理, 由调用方重新读取
+                return VERSION_CONFLICT if expect or absent else PREPARE_BUSY
+            current = self.versions.get(key, 0) if key in self.KVmap else None
+            if (absent and current is not None) or (expect and current != expect):
+                self.logger.info("键值%s 的版本为%s, 不满足写入条件", key, current)
+                return VERSION_CONFLICT
+            staged = Staged(tx, max(version or twopc.stamp(), self.versions.get(key, 0) + 1), delete)
+            self.staged[key] = staged
+            if held is None:
+                self.batches.setdefault(tx, []).append(key)
+        self.incoming.pop(key, None)
+        self.logger.info("事务%s 登记键值%s 的版本%s", tx, key, staged.version)
+        return ""
+
     def maDeldata(self, request, context):
         key = request.key
-        self.cache.del_key(key)
-        self.logger.info(f"准备删除键值{key}")
-        if key not in self.KVmap:
-            self.tmpvalue = None
-            self.logger.info(f"管理服务器正在申请 {key}独占锁")
-            self.mumap[key] = RWLock()
-            self.mumap[key].acquire_write()
-            self.logger.info(f"管理服务器获取了 {key}独占锁")
-            return stpb.StEmpty(errno=True)
-        else:
-            self.logger.info(f"管理服务器正在申请 {key}独占锁")
-            self.mumap[key].acquire_write()
-            self.logger.info(f"管理服务器获取了 {key}独占锁")
-            try:
-                with open(os.path.join(self.datapath, f"{key}"), 'rb') as f:
-                    content = f.read()
-                self.tmpvalue = content
-                self.logger.info(f"记录原有键值{key} 成功")
-            except Exception:
-                self.tmpvalue = None
-                self.logger.info(f"记录原有键值{key} 失败")
-        self.KVmap.pop(key, None)
-        self.logger.info(f"删除键值{key} 成功,告知管理服务器")
+        self.logger.info("准备删除键值%s", key)
+        if errmes := self._stage(key, request.tx, request.version, request.expect, delete=True):
+            return stpb.StEmpty(errno=False, errmes=errmes)
+        self._vote(request.tx, [key])
+        self.logger.info("删除键值%s 成功,告知管理服务器", key)
         self.logger.info("等待管理服务器告知本次删除结果...")
         return stpb.StEmpty(errno=True)
 
@@ -274,93 +508,890 @@ class StoreService(stpb_grpc.storagementServiceServicer):
         cli_id = request.cli_id
         key = request.key
         value = request.value
-        self.logger.info(f"客户端{cli_id} 正在申请提交键值{key}")
+        self.logger.info("客户端%s 正在申请提交键值%s", cli_id, key)
+        owners = self._owners(key)
+        if self.id not in self.cluster.map.nodes:
+            self.logger.info("本节点未注册, 拒绝写入键值%s", key)
+            return stpb.StEmpty(errno=False, errmes="提交失败")
+        resp = self._forward(owners, "putdata", request)
+        if resp is not None:
+            return resp
+        tx = self._tx_id()
+        prepare = stpb.StKV(key=key, value=value, version=twopc.stamp(), expect=request.expect, absent=request.absent,
+                            tx=tx)
+        flag, errmes = self._coordinate(tx, key, owners, "maPutdata", prepare, delete=False)
+        if not flag:
+            self.logger.info("向其他服务器提交键值%s 时发生错误", key)
+            return stpb.StEmpty(errno=False, errmes=errmes if errmes == VERSION_CONFLICT else "提交失败")
+        return stpb.StEmpty(errno=True)
+
+    def _forward(self, owners: dict[int, str], method: str, request):
+        """写入交给键的主副本协调, 本节点就是主副本、请求已被转发过或主副本不可达时返回 None 由本节点协调"""
+        primary = next(iter(owners), self.id)
+        if primary == self.id or request.forwarded:
+            return None
+        forwarded = type(request)()
+        forwarded.CopyFrom(request)
+        forwarded.forwarded = True
+        self.logger.info("把键值%s 的写入转发给主副本%s", request.key, primary)
         try:
-            with grpc.insecure_channel(self.manager) as ch:
-                client = mapb_grpc.manageServiceStub(ch)
-                resp = client.Put(mapb.KV(key=key, server_id=self.id, value=value))
-        except Exception as e:
-            self.logger.error(f"连接管理服务器错误 {e}")
-            raise
-        if not resp.errno:
-            self.logger.info(f"向其他服务器提交键值{key} 时发生错误 {resp.errmes}")
+            # 主副本协调一轮时, 准备、提交与记录提示都可能各等待一次不可达副本的超时
+            with self._channel(owners[primary]) as ch:
+                return getattr(stpb_grpc.storagementServiceStub(ch), method)(forwarded, timeout=3 * params.RPC_TIMEOUT)
+        except grpc.RpcError as e:
+            if e.code() != grpc.StatusCode.UNAVAILABLE:
+                raise
+            self.logger.error("主副本%s 不可达, 由本节点协调键值%s 的写入", primary, request.key)
+            return None
+
+    def _coordinate(self, tx: str, key: str, owners: dict[int, str], method: str, prepare,
+                    delete: bool) -> tuple[bool, str]:
+        """作为主副本协调事务 tx: 并行向各副本发送准备请求, 全部同意则提交, 否则回滚; 返回 (是否提交, 拒绝原因)
+
+        同一个键的写入都由主副本协调, 按键加锁即可代替管理服务器的全局锁; 主副本不可达时代为协调的副本与它之间
+        由参与者按键只接受一个事务的准备来互斥。不可达的副本不参与本轮
+        """
+        op = "del" if delete else "put"
+        with self._coord_locks([key]):
+            self.txlog.begin(tx, owners, key=key, delete=delete)
+            with twopc.phase(op, "prepare", key):
+                results = self._fanout(owners, method, prepare)
+            hasprc, flag, errmes = self._tally(results, owners, f"键值{key}")
+            phase = "commit" if flag else "abort"
+            twopc.rounds(op, phase)
+            self.txlog.decide(tx, flag)
+            with twopc.phase(op, phase, key):
+                results = self._fanout(hasprc, phase, stpb.StRequest(key=key, delete=delete, tx=tx))
+            if all(resp is not None for resp in results.values()):
+                self.txlog.end(tx)
+            if flag and hasprc and len(hasprc) < len(owners):
+                self._hand_off({key: owners}, hasprc)
+        return flag, errmes
+
+    def _tally(self, results: dict, targets: dict[int, str], what: str) -> tuple[dict[int, str], bool, str]:
+        """统计准备阶段的投票, 返回 (参与的副本, 是否全部同意, 拒绝原因); 不可达的副本不参与本轮"""
+        hasprc: dict[int, str] = {}
+        flag = True
+        errmes = ""
+        for sid, resp in results.items():
+            if resp is None:
+                continue
+            if not resp.errno:
+                self.logger.info("存储服务器%s 拒绝%s, %s", sid, what, resp.errmes)
+                flag, errmes = False, resp.errmes
+            hasprc[sid] = targets[sid]
+        return hasprc, flag, errmes
+
+    def _plan_batch(self, request):
+        """按放置规则把批次拆分给各副本, 返回 (批次 id, 键值, 各键的副本, 参与的节点地址, 各节点的准备请求)"""
+        batch = self._tx_id()
+        # 同一批次中重复的键只保留最后一个值
+        kvs = {kv.key: kv.value for kv in request.kvs}
+        owners = {key: self._owners(key) for key in kvs}
+        version = twopc.stamp()
+        targets: dict[int, str] = {}
+        prepares: dict[int, stpb.StBatch] = {}
+        for key, value in kvs.items():
+            for sid, target in owners[key].items():
+                targets[sid] = target
+                prepares.setdefault(sid, stpb.StBatch(batch=batch, version=version)).kvs.add(key=key, value=value)
+        self.logger.info("协调批次%s, 共%s个键值, %s个副本节点", batch, len(kvs), len(targets))
+        return batch, kvs, owners, targets, prepares
+
+    def putbatch(self, request, context):
+        """作为批次中各键的主副本协调一轮两阶段提交: 按放置规则拆分给各副本并行准备, 全部同意则整批提交, 否则整批回滚"""
+        batch, kvs, owners, targets, prepares = self._plan_batch(request)
+        with self._coord_locks(kvs):
+            self.txlog.begin(batch, targets, batch=batch)
+            with twopc.phase("batch", "prepare", batch):
+                results = self._fanout(targets, "maPutbatch", prepares)
+            hasprc, flag, errmes = self._tally(results, targets, f"写入批次{batch}")
+            if not hasprc:
+                flag, errmes = False, "所有副本都不可达"
+            phase = "commit" if flag else "abort"
+            twopc.rounds("batch", phase)
+            self.txlog.decide(batch, flag)
+            with twopc.phase("batch", phase, batch):
+                results = self._fanout(hasprc, "commitBatch" if flag else "abortBatch", stpb.StBatch(batch=batch))
+            if all(resp is not None for resp in results.values()):
+                self.txlog.end(batch)
+            if flag and len(hasprc) < len(targets):
+                self._hand_off(owners, hasprc)
+        if not flag:
+            self.logger.info("批次%s 提交无效", batch)
+            return stpb.StEmpty(errno=False, errmes=errmes or "批量提交失败")
+        self.logger.info("批次%s 提交生效", batch)
+        return stpb.StEmpty(errno=True)
+
+    def _hand_off(self, owners: dict[str, dict[int, str]], hasprc: dict[int, str]):
+        """没有参与本轮的副本由该键第一个参与的副本记录提示; 主副本不可达时由本节点协调, 本节点不一定保存这些键"""
+        plans: dict[int, dict[int, list[str]]] = {}  # 记录节点 -> 目标节点 -> 键
+        for key, targets in owners.items():
+            holder = next((sid for sid in targets if sid in hasprc), None)
+            if holder is None:
+                continue
+            for sid in targets:
+                if sid not in hasprc:
+                    plans.setdefault(holder, {}).setdefault(sid, []).append(key)
+        for holder, missing in plans.items():
+            if holder == self.id:
+                for sid, keys in missing.items():
+                    self.handoff.add(sid, keys)
+                continue
+            hints = stpb.StHints(hints=[stpb.StHint(server_id=sid, keys=keys) for sid, keys in missing.items()])
+            if self._fanout({holder: hasprc[holder]}, "hint", hints)[holder] is None:
+                self.logger.error("副本%s 未能记录%s个键的提示, 由反熵修复", holder,
+                                  sum(len(keys) for keys in missing.values()))
+
+    def _coord_index(self, key: str) -> int:
+        return zlib.crc32(key.encode()) % len(self.coord_mu)
+
+    def _coord_list(self, keys) -> list:
+        """这些键的协调锁, 按固定顺序排列, 多个键的批次之间不会死锁"""
+        return [self.coord_mu[i] for i in sorted({self._coord_index(key) for key in keys})]
+
+    @contextmanager
+    def _coord_locks(self, keys):
+        locks = self._coord_list(keys)
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def _fanout(self, targets: dict[int, str], method: str, request, timeout: float | None = None) -> dict:
+        """并行向各副本发起调用, 本节点直接在当前线程调用本地方法; 失败的节点结果为 None
+
+        request 为字典时按节点取各自的请求, 也可以是返回新请求的函数(流式调用)。远端调用在共用的线程池中执行,
+        本地方法可能再次 fan-out (如 importdata 调用本节点的 putbatch), 不放进线程池以免池中线程互相等待
+        """
+        def call(sid: int, target: str):
+            req = request[sid] if isinstance(request, dict) else request() if callable(request) else request
+            start = time.perf_counter()
+            try:
+                if sid == self.id:
+                    return getattr(self, method)(req, None)
+                wait = timeout or (params.STREAM_TIMEOUT if callable(request) else params.RPC_TIMEOUT)
+                with self._channel(target) as ch:
+                    return getattr(stpb_grpc.storagementServiceStub(ch), method)(req, timeout=wait)
+            except Exception as e:
+                self.logger.error(e)
+                return None
+            finally:
+                twopc.observe(sid, method, start)
+
+        remote = [sid for sid in targets if sid != self.id]
+        if len(remote) == len(targets) == 1:
+            return {sid: call(sid, target) for sid, target in targets.items()}
+        # 每个线程使用当前上下文的副本, 使节点调用仍挂在当前 span 下
+        jobs = {sid: self.fanout_pool.submit(contextvars.copy_context().run, call, sid, targets[sid]) for sid in remote}
+        results = {sid: call(sid, targets[sid]) for sid in targets if sid == self.id}
+        results.update((sid, job.result()) for sid, job in jobs.items())
+        return {sid: results[sid] for sid in targets}
+
+    def _resolve_fanout(self, targets: dict[int, str], method: str, request, timeout: float | None = None) -> dict:
+        """补发决议时按当前集群视图中的地址调用, 参与者重启后沿用 id, 地址可能已经变化"""
+        nodes = self.cluster.refresh().nodes
+        return self._fanout({sid: nodes.get(sid, target) for sid, target in targets.items()}, method, request, timeout)
+
+    def putstream(self, request_iterator, context):
+        first = next(request_iterator, None)
+        if first is None:
+            return stpb.StEmpty(errno=False, errmes="数据流为空")
+        cli_id = first.cli_id
+        key = first.key
+        self.logger.info("客户端%s 正在申请分块提交键值%s, 共%s字节", cli_id, key, first.size)
+        owners = self._owners(key)
+        if self.id not in self.cluster.map.nodes:
+            self.logger.info("本节点未注册, 拒绝写入键值%s", key)
             return stpb.StEmpty(errno=False, errmes="提交失败")
+        primary = next(iter(owners), self.id)
+        if primary != self.id and not first.forwarded:
+            self.logger.info("把键值%s 的分块写入转发给主副本%s", key, primary)
+            forwarded = stpb.StChunk()
+            forwarded.CopyFrom(first)
+            forwarded.forwarded = True
+            with self._channel(owners[primary]) as ch:
+                return stpb_grpc.storagementServiceStub(ch).putstream(
+                    itertools.chain([forwarded], request_iterator))
+        return self._coordinate_stream(key, first, request_iterator, owners)
+
+    def _coordinate_stream(self, key: str, first, request_iterator, owners: dict[int, str]):
+        # 先落到临时文件, 各副本并行准备时分别打开读取, 避免在内存中保留整个值
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(self._tmp(key))) as spool:
+            spool.write(first.data)
+            for chunk in request_iterator:
+                spool.write(chunk.data)
+            spool.flush()
+
+            version, tx = twopc.stamp(), self._tx_id()
+
+            def chunks():
+                with open(spool.name, 'rb') as f:
+                    yield stpb.StChunk(key=key, size=first.size, version=version, tx=tx, data=f.read(params.CHUNK_SIZE))
+                    for data in iter(lambda: f.read(params.CHUNK_SIZE), b""):
+                        yield stpb.StChunk(data=data)
+
+            flag, errmes = self._coordinate(tx, key, owners, "maPutstream", chunks, delete=False)
+        if not flag:
+            self.logger.info("向其他服务器分块提交键值%s 时发生错误", key)
+            return stpb.StEmpty(errno=False, errmes=errmes if errmes == VERSION_CONFLICT else "提交失败")
         return stpb.StEmpty(errno=True)
 
-    def deldata(self, request, context):
+    def getstream(self, request, context):
         cli_id = request.cli_id
         key = request.key
-        self.logger.info(f"客户端{cli_id} 正在申请删除键值{key}")
+        self.logger.info("客户端%s 请求分块读取键值%s", cli_id, key)
+        cached, ok = self.cache.get(key)
+        if ok:
+            data = cached[0].encode()
+            yield from self._chunks(key, len(data), [data], cached[1])
+            return
         try:
-            with grpc.insecure_channel(self.manager) as ch:
-                client = mapb_grpc.manageServiceStub(ch)
-                resp = client.Del(mapb.Request(key=key, server_id=self.id))
+            f, version = self._open_committed(key)
         except Exception as e:
-            self.logger.error(f"连接管理服务器错误 {e}")
-            raise
-        if not resp.errno:
-            self.logger.info(f"向其他服务器删除键值{key} 时发生错误 {resp.errmes}")
+            self.logger.info("分块读取键值%s 时发生错误%s", key, e)
+            yield stpb.StChunk(key=key, errno=False, errmes=str(e))
+            return
+        if f is None:
+            yield from self._stream_from(request)
+            return
+        try:
+            with f:
+                yield from self._chunks(key, 0, self._decoded(f), version)
+        except Exception as e:
+            self.logger.info("分块读取键值%s 时发生错误%s", key, e)
+            yield stpb.StChunk(key=key, errno=False, errmes=str(e))
+        self.logger.info("返回键值%s 的版本%s", key, version)
+
+    def _stream_from(self, request):
+        """本地没有该键时从其他副本分块读取并直接转给客户端, 不受一元消息 4MB 的限制, 也不在本节点缓存或落盘"""
+        key = request.key
+        if request.forwarded:
+            yield stpb.StChunk(key=key, errno=False, errmes="未找到键值")
+            return
+        forwarded = stpb.StRequest()
+        forwarded.CopyFrom(request)
+        forwarded.forwarded = True
+        # 取第一个有该键的副本, 不做多数表决
+        for sid, target in self._owners(key).items():
+            if sid == self.id:
+                continue
+            started = False
+            try:
+                chunks = stpb_grpc.storagementServiceStub(self.pool.get(target)).getstream(
+                    forwarded, timeout=params.STREAM_TIMEOUT)
+                for chunk in chunks:
+                    if not started and not chunk.errno:
+                        break
+                    started = True
+                    yield chunk
+            except grpc.RpcError as e:
+                self.logger.error("从存储服务器%s 分块读取键值%s 失败 %s", sid, key, e.code().name)
+                if started:
+                    yield stpb.StChunk(key=key, errno=False, errmes="分块读取中断")
+                    return
+                continue
+            if started:
+                return
+        self.logger.info("其他副本也没有键值%s", key)
+        yield stpb.StChunk(key=key, errno=False, errmes="未找到键值")
+
+    def _chunks(self, key: str, size: int, pieces, version: int = 0):
+        """把数据切分为不超过 CHUNK_SIZE 的块, 第一块携带键名与版本号"""
+        first = True
+        for piece in pieces:
+            for i in range(0, len(piece), params.CHUNK_SIZE):
+                yield stpb.StChunk(key=key if first else "", size=size, version=version if first else 0, errno=True,
+                                   data=piece[i:i + params.CHUNK_SIZE])
+                first = False
+        if first:
+            yield stpb.StChunk(key=key, size=size, version=version, errno=True)
+
+    def _decoded(self, f):
+        decoder = self.codec.decoder()
+        for raw in iter(lambda: f.read(params.CHUNK_SIZE), b""):
+            yield decoder.update(raw)
+        yield decoder.flush()
+
+    def deldata(self, request, context):
+        cli_id = request.cli_id
+        key = request.key
+        self.logger.info("客户端%s 正在申请删除键值%s", cli_id, key)
+        owners = self._owners(key)
+        if self.id not in self.cluster.map.nodes:
+            self.logger.info("本节点未注册, 拒绝删除键值%s", key)
             return stpb.StEmpty(errno=False, errmes="删除失败")
+        resp = self._forward(owners, "deldata", request)
+        if resp is not None:
+            return resp
+        tx = self._tx_id()
+        prepare = stpb.StRequest(key=key, version=twopc.stamp(), expect=request.expect, tx=tx)
+        flag, errmes = self._coordinate(tx, key, owners, "maDeldata", prepare, delete=True)
+        if not flag:
+            self.logger.info("向其他服务器删除键值%s 时发生错误", key)
+            return stpb.StEmpty(errno=False, errmes=errmes if errmes == VERSION_CONFLICT else "删除失败")
         return stpb.StEmpty(errno=True)
 
     def abort(self, request, context):
-        key = request.key
-        self.logger.info("抛弃本次结果")
-        self.logger.info("准备恢复原有记录")
-        if self.tmpvalue is not None:
-            self.KVmap[key] = True
-            try:
-                with open(os.path.join(self.datapath, f"{key}"), 'wb') as f:
-                    f.write(self.tmpvalue)
-                self.logger.info(f"重写入键值{key} 成功")
-                self.logger.info(f"{key}独占锁释放")
-                self.mumap[key].release_write()
-            except Exception:
-                self.logger.error("恢复原有记录失败")
-                self.logger.info(f"{key}独占锁释放")
-                self.mumap[key].release_write()
-            return stpb.StEmpty(errno=True)
-        else:
-            self.KVmap.pop(key, None)
-            try:
-                os.remove(os.path.join(self.datapath, f"{key}"))
-            except Exception:
-                self.logger.info(f"{key}删除失败")
-            self.logger.info(f"{key}独占锁释放")
-            self.mumap[key].release_write()
-            self.mumap.pop(key, None)
-        self.logger.info("恢复原有记录完成")
+        # 拒绝了准备的参与者同样会收到回滚, 没有该事务时直接返回
+        self.logger.info("回滚事务%s", request.tx)
+        self._end_tx(request.tx, False)
         return stpb.StEmpty(errno=True)
 
     def commit(self, request, context):
-        key = request.key
-        self.logger.info("提交本次结果")
-        self.logger.info(f"{key}独占锁释放")
-        if key in self.mumap:
+        self.logger.info("提交事务%s", request.tx)
+        if not self._end_tx(request.tx, True):
+            self.logger.info("没有事务%s 的准备, 拒绝提交键值%s", request.tx, request.key)
+            return stpb.StEmpty(errno=False, errmes=UNKNOWN_TX)
+        return stpb.StEmpty(errno=True)
+
+    def resolve(self, request, context):
+        """协调者重启后批量补发的决议; 只处理仍在准备阶段的事务, 已经提交或回滚过的决议忽略"""
+        committed = aborted = 0
+        for d in request.decisions:
+            if not self._end_tx(d.tx or d.batch, d.commit):
+                continue
+            committed += d.commit
+            aborted += not d.commit
+        self.logger.info("协调者补发决议%s条, 提交%s个, 回滚%s个", len(request.decisions), committed, aborted)
+        return stpb.StEmpty(errno=True)
+
+    def _end_tx(self, tx: str, commit: bool) -> bool:
+        """提交或回滚事务 tx 在本节点准备的全部键; 本节点没有该事务的准备时返回 False"""
+        with self.snap_mu:
+            keys = self.batches.pop(tx, None) if tx else None
+        if keys is None:
+            return False
+        for key in (keys if commit else reversed(keys)):
+            if commit:
+                self._commit_key(key, tx)
+            else:
+                self._abort_key(key, tx)
+        self._drop_tx(tx)
+        return True
+
+    def _abort_key(self, key: str, tx: str | None = None):
+        """回滚键在准备阶段的写入; tx 为 None 时回滚该键当前的准备 (反熵修复), 否则只回滚该事务的"""
+        with self.snap_mu:
+            held = self.staged.get(key)
+            if held is None or (tx is not None and held.tx != tx):
+                return
+            del self.staged[key]
+            keys = self.batches.get(held.tx)
+            emptied = keys is not None and keys == [key]
+            if emptied:
+                del self.batches[held.tx]
+            elif keys is not None:
+                keys.remove(key)
+        # 准备阶段的新值只在待提交文件中, 已提交的版本没有变化, 不需要恢复
+        self.incoming.pop(key, None)
+        try:
+            os.remove(os.path.join(self._txdir(held.tx), f"{key}"))
+        except FileNotFoundError:
+            pass
+        if emptied:
+            self._drop_tx(held.tx)
+        elif os.path.exists(self._staged_path(held.tx)):
+            with open(self._staged_path(held.tx), "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "abort": True}, ensure_ascii=False) + "\n")
+
+    def _commit_key(self, key: str, tx: str):
+        """把事务 tx 准备阶段的写入变为已提交的最新版本: 替换数据文件与更新版本号在同一临界区内, 读取者看到的文件与版本一致"""
+        lock = self.mumap.setdefault(key, RWLock())
+        lock.acquire_write()
+        try:
+            with self.snap_mu:
+                held = self.staged.get(key)
+                if held is None or held.tx != tx:
+                    self.logger.info("键值%s 没有事务%s 准备阶段的写入, 忽略提交", key, tx)
+                    return
+                del self.staged[key]
+                version, delete = held.version, held.delete
+                try:
+                    if delete:
+                        os.remove(os.path.join(self.datapath, f"{key}"))
+                    else:
+                        os.replace(os.path.join(self._txdir(tx), f"{key}"), os.path.join(self.datapath, f"{key}"))
+                except FileNotFoundError:
+                    self.logger.info("%s 的文件不存在", key)
+                if delete:
+                    self.KVmap.pop(key, None)
+                    self.versions.pop(key, None)
+                else:
+                    self.KVmap[key] = True
+                    self.versions[key] = version
+                self.cache.del_key(key)
+                self.digests.pop(key, None)
+                if self.bootstrapping is not None:
+                    self.bootstrapping.add(key)
+        finally:
+            lock.release_write()
+        if held.delete:
+            self.mumap.pop(key, None)
+        self.notifier.publish(key)
+        # 分块写入的值不保留在内存中, 事件只带键名(has_value=false)
+        value = self.incoming.pop(key, None)
+        self.changes.append("del" if held.delete else "put", key, None if held.delete else value)
+
+    def maPutbatch(self, request, context):
+        """批量写入的准备阶段: 逐个记录原值并写入新值, 任一键失败时由管理服务器整批回滚"""
+        # 同一批次中重复的键只保留最后一个值, 避免对同一个键两次申请独占锁
+        kvs = {kv.key: kv.value for kv in request.kvs}
+        self.logger.info("准备批量写入%s个键值, 批次%s", len(kvs), request.batch)
+        for key, value in kvs.items():
+            if errmes := self._stage(key, request.batch, request.version):
+                return stpb.StEmpty(errno=False, errmes=errmes)
+            self.incoming[key] = value
             try:
-                self.mumap[key].release_write()
-            except Exception:
-                pass
-            if request.delete:
+                self._write(key, self.codec.encode(value.encode()), request.batch)
+            except Exception as e:
+                self.logger.info("批量写入键值%s 失败,告知管理服务器: %s", key, e)
+                return stpb.StEmpty(errno=False, errmes=str(e))
+        self._vote(request.batch, kvs)
+        self.logger.info("批次%s 写入成功,等待管理服务器告知本次写入结果...", request.batch)
+        return stpb.StEmpty(errno=True)
+
+    def commitBatch(self, request, context):
+        self.logger.info("提交批次%s", request.batch)
+        if not self._end_tx(request.batch, True):
+            self.logger.info("没有批次%s 的准备, 拒绝提交", request.batch)
+            return stpb.StEmpty(errno=False, errmes=UNKNOWN_TX)
+        return stpb.StEmpty(errno=True)
+
+    def abortBatch(self, request, context):
+        self.logger.info("回滚批次%s", request.batch)
+        self._end_tx(request.batch, False)
+        return stpb.StEmpty(errno=True)
+
+    def importdata(self, request_iterator, context):
+        """批量导入: 客户端发来的每个 StKVBatch 按键的主副本拆分, 各主副本并行协调自己那部分的两阶段提交
+
+        哈希环即键到协调者的目录, 写入协调随存储节点数扩展, 不再集中在管理服务器
+        只有同一主副本的部分是原子的, 一个 StKVBatch 可能部分提交; 未提交的部分按主副本在 failures 中返回
+        """
+        imported = failed = 0
+        errmes = ""
+        failures = []
+        for batch in request_iterator:
+            if not batch.kvs:
+                continue
+            targets, groups = self._split_import(batch)
+            if self.id not in self.cluster.map.nodes:
+                self.logger.info("本节点未注册, 拒绝批量导入")
+                failed += len(batch.kvs)
+                errmes = "节点未注册, 无权操作!"
+                failures.append(stpb.StImportFailure(keys=[kv.key for kv in batch.kvs], errmes=errmes))
+                continue
+            # 主副本协调一轮时, 准备、提交与记录提示都可能各等待一次不可达副本的超时
+            results = self._fanout(targets, "putbatch", groups, timeout=3 * params.RPC_TIMEOUT)
+            for sid, resp in results.items():
+                if resp is None:
+                    self.logger.error("主副本%s 不可达, 由本节点协调%s个键值", sid, len(groups[sid].kvs))
+                    resp = self.putbatch(groups[sid], None)
+                if resp.errno:
+                    imported += len(groups[sid].kvs)
+                else:
+                    failed += len(groups[sid].kvs)
+                    errmes = resp.errmes
+                    failures.append(stpb.StImportFailure(primary=sid, keys=[kv.key for kv in groups[sid].kvs],
+                                                         errmes=resp.errmes))
+        self.logger.info("批量导入完成, 成功%s个, 失败%s个", imported, failed)
+        return stpb.StImportResult(errno=not failed, errmes=errmes, imported=imported, failed=failed,
+                                   failures=failures)
+
+    def _split_import(self, batch) -> tuple[dict[int, str], dict[int, stpb.StBatch]]:
+        """按键的主副本拆分一批导入的键值, 返回 (各主副本地址, 各主副本的批次)"""
+        targets: dict[int, str] = {}
+        groups: dict[int, stpb.StBatch] = {}
+        for kv in batch.kvs:
+            owners = self._owners(kv.key)
+            primary = next(iter(owners), self.id)
+            targets[primary] = owners.get(primary, "")
+            groups.setdefault(primary, stpb.StBatch()).kvs.append(kv)
+        return targets, groups
+
+    def _snapdir(self, snapshot: str) -> str:
+        return os.path.join(self.datapath, ".snapshots", snapshot)
+
+    def snapshot(self, request, context):
+        """为已提交的数据建立快照: 各键已提交的版本硬链接到快照目录, 准备阶段的新值不在数据文件中
+
+        数据文件只通过 os.replace 更新, 之后的写入与删除都不会影响快照中的内容
+        """
+        sid = request.id or uuid.uuid4().hex
+        path = self._snapdir(sid)
+        os.makedirs(path, exist_ok=True)
+        count = 0
+        versions = {}
+        with self.snap_mu:
+            for key in self.KVmap:
+                try:
+                    os.link(os.path.join(self.datapath, f"{key}"), os.path.join(path, f"{key}"))
+                except FileNotFoundError:
+                    continue
+                versions[key] = self.versions.get(key, 0)
+                count += 1
+        self.snapshots[sid] = versions
+        self.logger.info("建立快照%s, 共%s个键值", sid, count)
+        return stpb.StSnapshot(id=sid, keys=count, errno=True)
+
+    def dropSnapshot(self, request, context):
+        shutil.rmtree(self._snapdir(request.id), ignore_errors=True)
+        self.snapshots.pop(request.id, None)
+        self.logger.info("删除快照%s", request.id)
+        return stpb.StEmpty(errno=True)
+
+    def exportdata(self, request, context):
+        """按快照流式导出 crc32(key) % parts == part 的键值, 未指定快照时临时建立一个"""
+        sid = request.snapshot
+        if not sid:
+            sid = self.snapshot(stpb.StSnapshot(), context).id
+        path = self._snapdir(sid)
+        if not os.path.isdir(path):
+            yield stpb.StKVBatch(errno=False, errmes=f"快照{sid} 不存在")
+            return
+        parts = max(request.parts, 1)
+        self.logger.info("客户端%s 导出快照%s 的第%s/%s部分", request.cli_id, sid, request.part, parts)
+        try:
+            kvs, size = [], 0
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    key = entry.name
+                    if parts > 1 and zlib.crc32(key.encode()) % parts != request.part:
+                        continue
+                    with open(entry.path, 'rb') as f:
+                        raw = self.codec.decode(f.read())
+                    try:
+                        value = raw.decode()
+                    except UnicodeDecodeError:
+                        # 导出格式只能表示文本, 宁可整体失败也不静默丢掉键值
+                        self.logger.info("键值%s 不是 UTF-8 文本, 无法导出", key)
+                        yield stpb.StKVBatch(errno=False, errmes=f"键值{key} 不是 UTF-8 文本, 无法导出")
+                        return
+                    kvs.append(stpb.StKV(key=key, value=value))
+                    size += len(key) + len(value)
+                    if len(kvs) >= params.IMPORT_BATCH or size >= params.BATCH_BYTES:
+                        yield stpb.StKVBatch(kvs=kvs, errno=True)
+                        kvs, size = [], 0
+            if kvs:
+                yield stpb.StKVBatch(kvs=kvs, errno=True)
+        finally:
+            if not request.snapshot:
+                self.dropSnapshot(stpb.StSnapshot(id=sid), context)
+
+    def _committed(self, key: str) -> bytes | None:
+        """键已提交的落盘内容, 没有已提交的值时返回 None"""
+        f, _ = self._open_committed(key)
+        if f is None:
+            return None
+        with f:
+            return f.read()
+
+    def _install(self, key: str, data: bytes, overwrite: bool = False, version: int = 0) -> bool:
+        """写入迁移来的键值; 本地已有该键、正在写入或引导期间已提交过时保留本地的结果, 之后的写入都会经过本节点
+
+        overwrite 为反熵修复: 主副本持有该键的协调锁, 本地遗留的未提交写入已经过期, 回滚后以主副本的值覆盖
+        """
+        if overwrite and key in self.staged:
+            self.logger.info("键值%s 的未提交写入已过期, 回滚后修复", key)
+            self._abort_key(key)
+        lock = self.mumap.setdefault(key, RWLock())
+        lock.acquire_write()
+        try:
+            with self.snap_mu:
+                if not overwrite and (key in self.KVmap or key in self.staged or key in (self.bootstrapping or ())):
+                    return False
+                try:
+                    self._write(key, data)
+                except Exception as e:
+                    self.logger.info("写入迁移的键值%s 失败: %s", key, e)
+                    raise
+                self.KVmap[key] = True
+                self.versions[key] = version
+                self.digests.pop(key, None)
+                self.cache.del_key(key)
+        finally:
+            lock.release_write()
+        self.notifier.publish(key)
+        return True
+
+    def _drop(self, key: str):
+        """删除已迁移给其他节点的键值, 不是客户端的删除, 不产生变更事件"""
+        lock = self.mumap.get(key)
+        if lock is None:
+            return
+        lock.acquire_write()
+        try:
+            with self.snap_mu:
+                if key in self.staged or not self.KVmap.pop(key, None):
+                    return
+                self.versions.pop(key, None)
+                self.digests.pop(key, None)
+                self.cache.del_key(key)
                 try:
                     os.remove(os.path.join(self.datapath, f"{key}"))
+                except FileNotFoundError:
+                    pass
+        finally:
+            lock.release_write()
+        self.notifier.publish(key)
+
+    def _repair(self, target: str, keys: list[str]) -> list[str]:
+        """持有这些键的协调锁, 把本节点已提交的值覆盖到 target, 本节点没有的键让其删除; 返回已处理的键
+
+        本节点正在准备写入的键跳过, 由这一轮提交后再处理
+        """
+        with self._coord_locks(keys):
+            entries, removed = [], []
+            for key in keys:
+                if key in self.staged:
+                    continue
+                data = self._committed(key)
+                if data is None:
+                    removed.append(key)
+                else:
+                    entries.append(stpb.StEntry(key=key, data=data, version=self.versions.get(key, 0)))
+            if not entries and not removed:
+                return []
+            stub = stpb_grpc.storagementServiceStub(self.pool.get(target))
+            resp = stub.install(iter([stpb.StEntries(entries=entries, removed=removed, overwrite=True)]),
+                                timeout=params.STREAM_TIMEOUT)
+        self.logger.info("向%s 修复键值: 覆盖%s个, 删除%s个", target, resp.imported, len(removed))
+        return [entry.key for entry in entries] + removed
+
+    def install(self, request_iterator, context):
+        """接收其他节点迁移来的键值(落盘原始内容), 只写入本地没有的键; 反熵修复(overwrite)时覆盖并删除 removed 中的键"""
+        installed = failed = 0
+        for batch in request_iterator:
+            for entry in batch.entries:
+                try:
+                    installed += self._install(entry.key, entry.data, batch.overwrite, entry.version)
                 except Exception:
-                    self.logger.info(f"{key}删除失败")
-                self.mumap.pop(key, None)
+                    failed += 1
+            for key in batch.removed:
+                if key in self.staged:
+                    self._abort_key(key)
+                self._drop(key)
+        self.logger.info("接收迁移的键值, 写入%s个, 失败%s个", installed, failed)
+        return stpb.StImportResult(errno=not failed, imported=installed, failed=failed)
+
+    def pull(self, request, context):
+        """为引导中的节点 request.server_id 建立快照, 流式返回其作为副本应保存的键值(落盘原始内容)"""
+        cluster = self.cluster.refresh()
+        if request.server_id not in cluster.nodes:
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, f"节点{request.server_id} 不在集群视图中")
+        sid = self.snapshot(stpb.StSnapshot(), context).id
+        self.logger.info("节点%s 从快照%s 拉取键值", request.server_id, sid)
+        versions = self.snapshots.get(sid, {})
+        try:
+            entries, size = [], 0
+            with os.scandir(self._snapdir(sid)) as it:
+                for entry in it:
+                    if request.server_id not in cluster.owners(entry.name):
+                        continue
+                    with open(entry.path, 'rb') as f:
+                        data = f.read()
+                    entries.append(stpb.StEntry(key=entry.name, data=data, version=versions.get(entry.name, 0)))
+                    size += len(entry.name) + len(data)
+                    if len(entries) >= params.IMPORT_BATCH or size >= params.BATCH_BYTES:
+                        yield stpb.StEntries(entries=entries)
+                        entries, size = [], 0
+            if entries:
+                yield stpb.StEntries(entries=entries)
+        finally:
+            self.dropSnapshot(stpb.StSnapshot(id=sid), context)
+
+    def bootstrap(self, address: str) -> int:
+        """以引导模式(joining)注册后调用: 等本节点开始服务, 从每个已就绪的节点拉取快照中属于本节点的键值,
+        再通知管理服务器把本节点分配给客户端, 返回写入的键数
+
+        拉取期间本节点已是副本, 照常参与新的写入与删除, 这些键不会再被快照中的旧值覆盖
+        """
+        self.bootstrapping = set()
+        installed = 0
+        try:
+            stpb_grpc.storagementServiceStub(self.pool.get(address)).live(
+                stpb.StEmpty(errno=True), wait_for_ready=True, timeout=params.RPC_TIMEOUT)
+            cluster = self.cluster.refresh()
+            for sid, target in cluster.nodes.items():
+                if sid == self.id or sid in cluster.joining:
+                    continue
+                start = time.perf_counter()
+                try:
+                    stub = stpb_grpc.storagementServiceStub(self.pool.get(target))
+                    resp = self.install(stub.pull(stpb.StPullRequest(server_id=self.id),
+                                                  timeout=params.STREAM_TIMEOUT), context=None)
+                except grpc.RpcError as e:
+                    self.logger.error("从节点%s 拉取键值失败 %s", sid, e.details() or e.code().name)
+                    continue
+                installed += resp.imported
+                self.logger.info("从节点%s 拉取键值, 写入%s个, 耗时%.2fs", sid, resp.imported,
+                                 time.perf_counter() - start)
+        finally:
+            self.bootstrapping = None
+        with self._channel(self.manager) as ch:
+            mapb_grpc.manageServiceStub(ch).ready(mapb.SerInfo(server_id=self.id), timeout=params.RPC_TIMEOUT)
+        self.logger.info("引导完成, 共写入%s个键值", installed)
+        return installed
+
+    def hint(self, request, context):
+        """其他节点(管理服务器)协调的写入提交后, 没有参与的副本交给本节点记录提示"""
+        for hint in request.hints:
+            self.handoff.add(hint.server_id, hint.keys)
         return stpb.StEmpty(errno=True)
 
+    def _digest(self, key: str) -> bytes | None:
+        """键已提交内容的摘要, 第一次使用时读取文件计算, 之后直到该键变更前都使用缓存
+
+        摘要包含版本号, 内容相同而版本不同的副本同样会被修复; 准备阶段的键加上标记,
+        与没有这轮写入的副本不一致, 错过了 commit/abort 的键会被反熵发现
+        """
+        with self.snap_mu:
+            staged = key in self.staged
+            digest = None if staged else self.digests.setdefault(key, None)
+            version = self.versions.get(key, 0).to_bytes(8, "big")
+        if digest is not None:
+            return digest
+        # 计算期间该键变更会删除 None 占位, 不缓存过期的结果
+        data = self._committed(key)
+        if staged:
+            return hashlib.md5(b"\0staged" + version + (data or b"")).digest()
+        if data is None:
+            return None
+        digest = hashlib.md5(version + data).digest()
+        with self.snap_mu:
+            if key in self.digests and self.digests[key] is None:
+                self.digests[key] = digest
+        return digest
+
+    def _slice(self) -> tuple[int, int]:
+        """本进程保存的键的范围 (shard, shards), shards 为 0 表示全部键"""
+        return 0, 0
+
+    def _digests(self, cluster, primary: int, member: int | None, shard: int, shards: int) -> dict[str, bytes]:
+        """本进程保存的、主副本为 primary (且 member 为副本) 的键的摘要"""
+        digests = {}
+        for key in list(set(self.KVmap) | set(self.staged)):
+            if shards and zlib.crc32(key.encode()) % shards != shard:
+                continue
+            owners = cluster.owners(key)
+            if owners[:1] != [primary] or (member is not None and member not in owners):
+                continue
+            digest = self._digest(key)
+            if digest is not None:
+                digests[key] = digest
+        return digests
+
+    def _merkle_digests(self, request, cluster) -> dict[str, bytes] | None:
+        return self._digests(cluster, request.primary, self.id, request.shard, request.shards)
+
+    def merkle(self, request, context):
+        """反熵: 返回本节点上主副本为 request.primary 的键构成的 Merkle 树中请求位置的哈希, 或这些叶子中各键的摘要"""
+        cluster = self.cluster.get()
+        if cluster.epoch != request.epoch:
+            cluster = self.cluster.refresh()
+        if cluster.epoch != request.epoch:
+            return stpb.StMerkle(errno=False, errmes=f"集群视图 epoch {cluster.epoch} 与请求的 {request.epoch} 不一致")
+        digests = self._merkle_digests(request, cluster)
+        if digests is None:
+            return stpb.StMerkle(errno=False, errmes="无法汇总各 worker 的键摘要")
+        tree = MerkleTree(digests)
+        if not all(tree.valid(node) for node in request.nodes):
+            return stpb.StMerkle(errno=False, errmes="Merkle 树节点编号越界")
+        if request.leaves:
+            leaves = set(request.nodes)
+            return stpb.StMerkle(errno=True, digests=[stpb.StDigest(key=key, digest=digest)
+                                                     for key, digest in digests.items()
+                                                     if not leaves or tree.leaf(key) in leaves])
+        return stpb.StMerkle(errno=True, hashes=[tree.nodes[node] for node in request.nodes])
+
+    def invalidations(self, request, context):
+        """推送本节点提交或回滚的键名; 订阅建立后先推送一条 reset, 客户端收到后才开始使用近端缓存"""
+        self.streams.enter(context, "invalidations")
+        sub = self.notifier.subscribe()
+        sub.push_reset()
+        self.logger.info("客户端%s 订阅缓存失效通知", request.cli_id)
+        try:
+            while context.is_active():
+                msg = sub.get(timeout=1.0)
+                if msg is not None:
+                    yield msg
+        finally:
+            self.notifier.unsubscribe(sub)
+            self.streams.release()
+            self.logger.info("客户端%s 取消订阅缓存失效通知", request.cli_id)
+
+    def watch(self, request, context):
+        """按提交顺序推送匹配的写入与删除, request.cursor 为上次收到的 cursor 时从其后续传"""
+        self.streams.enter(context, "watch")
+        self.logger.info("客户端%s watch %s%s", request.cli_id, request.key, "*" if request.prefix else "")
+        try:
+            watcher = Watcher(self.changes, request)
+            yield watcher.start()
+            while context.is_active():
+                yield from watcher.poll(timeout=1.0)
+        finally:
+            self.streams.release()
+
+    def stats(self, request, context):
+        return stpb.StStats(json=REGISTRY.to_json(), prometheus=REGISTRY.prometheus())
+
+    def spans(self, request, context):
+        return stpb.StSpans(json=json.dumps(TRACER.query(request.trace_id, request.limit), ensure_ascii=False))
+
+    def profile(self, request, context):
+        return profiling.handle(request, stpb.StProfile)
+
     def live(self, request, context):
         self.logger.info("响应心跳请求,返回存活状态")
         return stpb.StEmpty(errno=True)
     
     def offline(self):
         try:
-            with grpc.insecure_channel(self.manager) as ch:
+            with self._channel(self.manager) as ch:
                 client = mapb_grpc.manageServiceStub(ch)
-                client.offline(mapb.SerInfo(server_id=self.id))
+                client.offline(mapb.SerInfo(server_id=self.id), timeout=params.RPC_TIMEOUT)
             self.logger.info("注销完毕")
         except Exception as e:
-            self.logger.error(f"发生错误{e},注销失败")
+            self.logger.error("发生错误%s,注销失败", e)
+        finally:
+            self.close()
+
+    def start(self):
+        """启动后台任务, 开始服务前调用; 先重新驱动上次退出时未完成的两阶段提交"""
+        self.txlog.start(self._resolve_fanout)
+        self.rebalancer.start()
+        self.antientropy.start()
+        self.handoff.start()
+
+    def close(self):
+        """停止后台任务与集群视图的拉取并关闭到其他节点的连接, 服务停止后调用"""
+        self.rebalancer.close()
+        self.antientropy.close()
+        self.handoff.close()
+        self.txlog.close()
+        self.fanout_pool.shutdown(wait=False)
+        self.cluster.close()
+        self.pool.close()
+
+
+def register(manager: str, ip: str, port: str, joining: bool = False, server_id: int = 0,
+             compression: grpc.Compression | None = None) -> mapb.SerInfo:
+    """向管理服务器注册本节点; server_id 非 0 时沿用该 id"""
+    pool = ChannelPool(compression)  # 管理服务器组时跟随 leader
+    try:
+        client = mapb_grpc.manageServiceStub(pool.get(manager))
+        return client.online(mapb.SerRequest(ip=ip, port=port, joining=joining, server_id=server_id))
+    finally:
+        pool.close()
+
+
+def storage_path(savepath: str, server_id: int) -> str:
+    """节点的数据目录, 只由 id 决定: 以同一 --id 重启时找回已提交的数据、决议日志与未完成的准备"""
+    return f"{savepath}/storage_{server_id}/"
 
 
 def main():
@@ -370,50 +1401,131 @@ def main():
     parser.add_argument("--clear", action="store_true", help="结束是否清除数据")
     parser.add_argument("--cache", type=int, default=5)
     parser.add_argument("--savepath", type=str, default="storage/")
+    parser.add_argument("--id", type=int, default=0,
+                        help="沿用的节点 id, 重启后使用同一数据目录并恢复未完成的两阶段提交; 0 表示由管理服务器分配")
+    parser.add_argument("--compress", type=str, default=params.VALUE_COMPRESSION,
+                        help="值压缩配置, 如 zlib:1024,lzma:1048576 (大小阈值单位为字节)")
+    parser.add_argument("--grpc-compression", choices=["none", "gzip", "deflate"], default=params.GRPC_COMPRESSION)
+    parser.add_argument("--aio", action="store_true", help="使用 grpc.aio 异步服务")
+    parser.add_argument("--workers", type=int, default=1, help="worker 进程数, 大于1时按键哈希分片到多个进程")
+    parser.add_argument("--log-sample", type=str, default=params.LOG_SAMPLE, help="按操作采样日志, 如 live=0.01,getdata=0.1")
+    parser.add_argument("--access-log", action="store_true", help="额外输出 JSON 格式的访问日志 access.log")
+    parser.add_argument("--metrics-port", type=int, default=0, help="以 Prometheus 文本格式暴露 /metrics 的端口, 0 表示关闭")
+    parser.add_argument("--trace-sample", type=float, default=params.TRACE_SAMPLE, help="没有上游 trace 的请求按该比例开始追踪")
+    parser.add_argument("--trace-file", action="store_true", help="额外把 span 以 JSON 行写入 trace.log")
+    parser.add_argument("--bootstrap", action="store_true",
+                        help="以引导模式加入: 先从已有节点拉取快照, 完成后才分配给客户端")
+    parser.add_argument("--manager", type=str, default=params.MANAGER_IP + params.MANAGER_PORT,
+                        help="管理服务器地址, 管理服务器组为逗号分隔的全部成员地址")
     args = parser.parse_args()
+    if args.workers > 1 and args.aio:
+        parser.error("--workers 暂不支持与 --aio 同时使用")
+    if args.workers > 1 and args.bootstrap:
+        parser.error("--bootstrap 暂不支持与 --workers 同时使用")
 
     ip = args.ip
     port = f":{args.port}" if not args.port.startswith(":") else args.port
 
-    target = params.MANAGER_IP + params.MANAGER_PORT
+    target = args.manager
+    codec = ValueCodec(parse_tiers(args.compress))
+    compression = grpc_compression(args.grpc_compression)
     try:
-        with grpc.insecure_channel(target) as ch:
-            client = mapb_grpc.manageServiceStub(ch)
-            info = client.online(mapb.SerRequest(ip=ip, port=port))
+        info = register(target, ip, port, args.bootstrap, args.id, compression)
     except Exception as e:
         print(e)
         raise SystemExit("无法连接管理服务器")
 
     if not info.errno:
         print(info.errmes)
+        if args.id:
+            raise SystemExit(1)
 
     server_id = info.server_id
-    datapath = f"{args.savepath}/storage_{server_id}/"
+    datapath = storage_path(args.savepath, server_id)
 
     os.makedirs(f"{datapath}", exist_ok=True)
-    logger = logging.getLogger("store")
-    logger.setLevel(logging.INFO)
-    fh = logging.FileHandler(f"{datapath}storage.log", mode='w', encoding='utf-8')
-    fh.setFormatter(logging.Formatter(f"[%(levelname)s] - %(message)s"))
-    logger.addHandler(fh)
-
-    service = StoreService(server_id, datapath, logger, args.cache, target)
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=16))
-    stpb_grpc.add_storagementServiceServicer_to_server(service, server)
-    server.add_insecure_port(ip + port)
+    sample = parse_rates(args.log_sample)
+    logger = setup_logger("store", f"{datapath}storage.log", sample=sample)
+    access = None
+    if args.access_log and args.workers <= 1:
+        access = setup_logger("store.access", f"{datapath}access.log", sample=sample, formatter=JsonFormatter())
+    sink = None
+    if args.trace_file and args.workers <= 1:
+        sink = setup_logger("store.trace", f"{datapath}trace.log", formatter=JsonFormatter())
+    TRACER.configure(sample=args.trace_sample, sink=sink)
+    hooks = [access_hook(access), metrics_hook(), profiling.cpu_hook(), tracing_hook(f"storage{server_id}")]
 
-    def handle_sig(signum, frame):
-        logger.info("接收到中断信号, 正在注销...")
+    service = StoreService(server_id, datapath, logger, args.cache, target, codec=codec, compression=compression)
+
+    def shutdown():
         if args.clear:
+            close_logger(logger)
+            if access is not None:
+                close_logger(access)
             try:
-                for handler in logger.handlers[:]:
-                    handler.close()      
-                    logger.removeHandler(handler)
-                import shutil
                 shutil.rmtree(datapath)
-            except Exception:
-                pass
+            except OSError as e:
+                # 日志文件已关闭, 清除失败只能输出到标准错误
+                print(f"清除数据目录{datapath} 失败: {e}", file=sys.stderr)
         service.offline()
+
+    if args.workers > 1:
+        from storage import shard
+        procs = shard.start_workers(args.workers, {
+            "server_id": server_id, "datapath": datapath, "address": ip + port, "manager": target,
+            "cache": args.cache, "compress": args.compress, "grpc_compression": args.grpc_compression,
+            "threads": 16, "log_sample": args.log_sample, "access_log": args.access_log,
+            "trace_sample": args.trace_sample, "trace_file": args.trace_file,
+        })
+
+        def stop_workers(signum, frame):
+            logger.info("接收到中断信号, 正在注销...")
+            for p in procs:
+                p.terminate()
+            for p in procs:
+                p.join()
+            shutdown()
+            sys.exit(0)
+
+        signal.signal(signal.SIGINT, stop_workers)
+        signal.signal(signal.SIGTERM, stop_workers)
+        if args.metrics_port:
+            peers = [shard.worker_address(datapath, i) for i in range(args.workers)]
+            serve_prometheus(args.metrics_port, lambda: shard.merged_stats(peers).prometheus())
+        logger.info("启动%s个分片worker进行服务", args.workers)
+        for p in procs:
+            p.join()
+        return
+
+    service.start()
+    if args.metrics_port:
+        serve_prometheus(args.metrics_port)
+    if args.bootstrap:
+        def bootstrap():
+            try:
+                service.bootstrap(ip + port)
+            except Exception as e:
+                logger.error("引导失败, 本节点不会分配给客户端: %s", e)
+        threading.Thread(target=bootstrap, name="bootstrap", daemon=True).start()
+
+    if args.aio:
+        import asyncio
+        from storage import aio
+        try:
+            asyncio.run(aio.serve(service, ip + port, compression, hooks))
+        except KeyboardInterrupt:
+            pass
+        shutdown()
+        return
+
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=16), compression=compression,
+                         interceptors=[HookInterceptor(*hooks)])
+    stpb_grpc.add_storagementServiceServicer_to_server(service, server)
+    server.add_insecure_port(ip + port)
+
+    def handle_sig(signum, frame):
+        logger.info("接收到中断信号, 正在注销...")
+        shutdown()
         server.stop(0)
         sys.exit(0)
 
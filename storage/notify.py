@@ -0,0 +1,172 @@
+﻿import itertools
+import os
+from collections import deque
+from threading import Condition, Lock
+
+from protos import stpb_pb2 as stpb
+from params import params
+
+
+class Subscription:
+    """一个订阅者的待推送键名, 积压超过 maxsize 时丢弃积压改为推送一次 reset(客户端清空整个缓存)"""
+
+    def __init__(self, maxsize: int, notify=None):
+        self.maxsize = maxsize
+        self.keys: deque[str] = deque()
+        self.reset = False
+        self.cond = Condition()
+        self.notify = notify  # 有新消息时的回调, aio 模式用它唤醒协程而不是占用线程等待
+
+    def push(self, key: str):
+        with self.cond:
+            if self.reset:
+                return
+            if len(self.keys) >= self.maxsize:
+                self.keys.clear()
+                self.reset = True
+            else:
+                self.keys.append(key)
+            self.cond.notify()
+        if self.notify is not None:
+            self.notify()
+
+    def push_reset(self):
+        with self.cond:
+            self.keys.clear()
+            self.reset = True
+            self.cond.notify()
+        if self.notify is not None:
+            self.notify()
+
+    def get(self, timeout: float | None = None, limit: int = 256) -> stpb.StInvalidation | None:
+        """取出至多 limit 个键合并为一条消息, timeout 秒内没有消息时返回 None"""
+        with self.cond:
+            if not self.keys and not self.reset and timeout != 0:
+                self.cond.wait(timeout)
+            if self.reset:
+                self.reset = False
+                return stpb.StInvalidation(reset=True)
+            if not self.keys:
+                return None
+            return stpb.StInvalidation(keys=[self.keys.popleft() for _ in range(min(limit, len(self.keys)))])
+
+
+class Notifier:
+    """把本节点提交或回滚的键名推送给所有订阅者"""
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.subs: set[Subscription] = set()
+        self.mu = Lock()
+
+    def subscribe(self, notify=None) -> Subscription:
+        sub = Subscription(self.maxsize, notify)
+        with self.mu:
+            self.subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self.mu:
+            self.subs.discard(sub)
+
+    def publish(self, key: str):
+        with self.mu:
+            if not self.subs:
+                return
+            subs = list(self.subs)
+        for sub in subs:
+            sub.push(key)
+
+
+class ChangeLog:
+    """已提交写入的环形日志, 按提交顺序编号, 供 watch 从断开处续传
+
+    cursor 形如 "日志ID:序号", 日志ID 在进程启动时随机生成, 节点重启后旧 cursor 不再有效
+    """
+
+    def __init__(self, capacity: int = params.WATCH_LOG):
+        self.id = os.urandom(4).hex()
+        self.seq = 0
+        self.events: deque[stpb.StWatchEvent] = deque(maxlen=capacity)
+        self.cond = Condition()
+        self.listeners: set = set()  # 追加事件后调用的回调, 供 aio 模式唤醒协程
+
+    def cursor(self, seq: int) -> str:
+        return f"{self.id}:{seq}"
+
+    def append(self, op: str, key: str, value: str | None = None):
+        with self.cond:
+            self.seq += 1
+            self.events.append(stpb.StWatchEvent(seq=self.seq, op=op, key=key, value=value or "",
+                                                 has_value=value is not None, cursor=self.cursor(self.seq)))
+            self.cond.notify_all()
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener()
+
+    def resume(self, cursor: str) -> tuple[int, bool]:
+        """返回续传起点 (序号, 是否需要重置); cursor 为空时从当前开始
+
+        cursor 属于其他日志或其后的事件已被覆盖时同样从当前开始, 并要求客户端重新读取全量状态
+        """
+        with self.cond:
+            if not cursor:
+                return self.seq, False
+            log_id, _, seq = cursor.partition(":")
+            if log_id != self.id or not seq.isdigit() or int(seq) > self.seq:
+                return self.seq, True
+            first = self.events[0].seq if self.events else self.seq + 1
+            if first > int(seq) + 1:
+                return self.seq, True
+            return int(seq), False
+
+    def since(self, seq: int, timeout: float | None = None) -> list[stpb.StWatchEvent] | None:
+        """返回序号大于 seq 的事件, timeout 秒内没有新事件时返回空列表, 所需事件已被覆盖时返回 None"""
+        with self.cond:
+            if self.seq <= seq and timeout != 0:
+                self.cond.wait(timeout)
+            if self.seq <= seq:
+                return []
+            first = self.events[0].seq if self.events else self.seq + 1
+            if first > seq + 1:
+                return None
+            return list(itertools.islice(self.events, seq + 1 - first, None))
+
+
+class Watcher:
+    """一个 watch 订阅的进度, 把 ChangeLog 中的事件过滤为要推送的消息
+
+    首条消息 op="start" 携带当前 cursor, reset=true 表示无法从请求的 cursor 续传; 一段时间没有匹配的事件时
+    推送 op="progress" 更新 cursor, 使很少变化的键不会因 cursor 过旧而在续传时被迫重置
+    """
+
+    def __init__(self, changes: ChangeLog, request):
+        self.changes = changes
+        self.key = request.key
+        self.prefix = request.prefix
+        self.seq, self.reset = changes.resume(request.cursor)
+        self.sent = self.seq
+
+    def match(self, key: str) -> bool:
+        return key.startswith(self.key) if self.prefix else key == self.key
+
+    def start(self) -> stpb.StWatchEvent:
+        return stpb.StWatchEvent(op="start", seq=self.seq, cursor=self.changes.cursor(self.seq), reset=self.reset)
+
+    def poll(self, timeout: float | None = None) -> list[stpb.StWatchEvent]:
+        events = self.changes.since(self.seq, timeout)
+        if events is None:
+            # 消费太慢, 所需事件已被覆盖
+            self.seq, _ = self.changes.resume("")
+            self.sent, self.reset = self.seq, True
+            return [self.start()]
+        out = []
+        for event in events:
+            self.seq = event.seq
+            if self.match(event.key):
+                self.sent = self.seq
+                out.append(event)
+        if not events and self.seq > self.sent:
+            self.sent = self.seq
+            out.append(stpb.StWatchEvent(op="progress", seq=self.seq, cursor=self.changes.cursor(self.seq)))
+        return out
@@ -0,0 +1,117 @@
+﻿import threading
+import time
+
+import grpc
+
+from protos import stpb_pb2 as stpb
+from protos import stpb_pb2_grpc as stpb_grpc
+from params import params
+from common.placement import ClusterMap
+
+
+class Rebalancer:
+    """成员变更后在后台把受影响的键推送给新增的副本节点
+
+    每隔 interval 秒拉取一次集群视图, epoch 变化时对本地每个键比较新旧副本集合:
+    新增的副本(加入的节点, 或节点被移除后接手的节点)由旧副本中仍在线的第一个节点推送, 其余副本不重复发送;
+    本节点不再是副本时同样推送自己的副本, 对方确认后删除本地文件。推送按 rate 字节/秒限速, 期间照常处理读写。
+    有节点在引导中时推迟迁移, 它会自己拉取快照; 引导完成后不再向它推送, 只删除不再保存的键
+    """
+
+    def __init__(self, store, interval: float = params.REBALANCE_INTERVAL, rate: int = params.REBALANCE_RATE):
+        self.store = store
+        self.logger = store.logger
+        self.interval = interval
+        self.rate = rate
+        self.last: ClusterMap | None = None  # 上一次完成迁移时的集群视图
+        self.bootstrapped: set[int] = set()  # 观察到处于引导中的节点, 已自行拉取了数据
+        self.stop = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="rebalance", daemon=True)
+            self.thread.start()
+
+    def close(self):
+        self.stop.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        while not self.stop.wait(self.interval):
+            try:
+                self.step()
+            except Exception as e:
+                self.logger.error("迁移键值时发生错误 %s", e)
+
+    def step(self) -> int:
+        """比较一次集群视图并完成需要的迁移, 返回推送的键数"""
+        cluster = self.store.cluster.refresh()
+        if cluster.joining and self.last is not None:
+            # 引导完成前不删除键, 引导中的节点可能还要从本节点拉取
+            self.bootstrapped |= cluster.joining
+            return 0
+        last, self.last = self.last, cluster
+        if last is None or cluster.epoch == last.epoch or self.store.id not in cluster.nodes:
+            return 0
+        skip, self.bootstrapped = self.bootstrapped, set()
+        plans: dict[int, list[str]] = {}  # 目标节点 -> 键
+        leaving: list[str] = []  # 本节点不再保存的键
+        for key in list(self.store.KVmap):
+            old, new = last.owners(key), cluster.owners(key)
+            added = [sid for sid in new if sid not in old and sid not in skip]
+            alive = [sid for sid in old if sid in cluster.nodes]
+            owner = self.store.id in new
+            if not owner:
+                leaving.append(key)
+            if added and (not owner or alive[:1] == [self.store.id]):
+                for sid in added:
+                    plans.setdefault(sid, []).append(key)
+        if not plans and not leaving:
+            return 0
+        self.logger.info("集群视图 epoch %s -> %s, 向%s个节点迁移键值", last.epoch, cluster.epoch, len(plans))
+        failed: set[str] = set()
+        pushed = 0
+        for sid, keys in plans.items():
+            if self.stop.is_set():
+                return pushed
+            if self._push(cluster.nodes[sid], keys):
+                pushed += len(keys)
+            else:
+                failed.update(keys)
+        for key in leaving:
+            if key not in failed:
+                self.store._drop(key)
+        return pushed
+
+    def _batches(self, keys: list[str]):
+        entries, size = [], 0
+        for key in keys:
+            data = self.store._committed(key)
+            if data is None:
+                continue
+            entries.append(stpb.StEntry(key=key, data=data, version=self.store.versions.get(key, 0)))
+            size += len(key) + len(data)
+            if len(entries) >= params.IMPORT_BATCH or size >= params.BATCH_BYTES:
+                yield stpb.StEntries(entries=entries)
+                self._throttle(size)
+                entries, size = [], 0
+        if entries:
+            yield stpb.StEntries(entries=entries)
+
+    def _throttle(self, size: int):
+        if self.rate > 0:
+            self.stop.wait(size / self.rate)
+
+    def _push(self, target: str, keys: list[str]) -> bool:
+        start = time.perf_counter()
+        try:
+            stub = stpb_grpc.storagementServiceStub(self.store.pool.get(target))
+            resp = stub.install(self._batches(keys), timeout=params.STREAM_TIMEOUT)
+        except grpc.RpcError as e:
+            self.logger.error("向%s 迁移%s个键值失败 %s", target, len(keys), e.code().name)
+            return False
+        self.logger.info("向%s 迁移%s个键值, 写入%s个, 耗时%.2fs", target, len(keys), resp.imported,
+                         time.perf_counter() - start)
+        return resp.errno
@@ -0,0 +1,501 @@
+﻿import itertools
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import uuid
+import zlib
+from concurrent import futures
+from threading import Lock
+
+import grpc
+
+from protos import stpb_pb2 as stpb
+from protos import stpb_pb2_grpc as stpb_grpc
+from params import params
+from common.compress import ValueCodec, grpc_compression, parse_tiers
+from common.interceptors import HookInterceptor
+from common.logs import JsonFormatter, access_hook, parse_rates, setup_logger
+from common import profiling
+from common.metrics import REGISTRY, Registry, metrics_hook
+from common.tracing import TRACER, tracing_hook
+from storage.main import StoreService
+
+
+def shard_of(key: str, nshards: int) -> int:
+    # 不能使用内置 hash(), 其结果在不同进程间不一致
+    return zlib.crc32(key.encode()) % nshards
+
+
+def _timeout(context, default: float) -> float:
+    """转发时沿用调用方剩余的截止时间, 不超过 default"""
+    remaining = context.time_remaining() if context is not None else None
+    return default if remaining is None else min(remaining, default)
+
+
+def _routed(name: str):
+    """按键名转发的一元调用: 本分片负责的键在本地处理, 否则转发给所属 worker"""
+    def handler(self, request, context):
+        owner = self.owner(request.key)
+        if owner == self.shard:
+            return getattr(StoreService, name)(self, request, context)
+        return getattr(self.peer(owner), name)(request, timeout=_timeout(context, params.RPC_TIMEOUT))
+    handler.__name__ = name
+    return handler
+
+
+def _routed_stream(name: str):
+    """按首个分块的键名转发的客户端流调用"""
+    def handler(self, request_iterator, context):
+        first = next(request_iterator, None)
+        if first is None:
+            return getattr(StoreService, name)(self, iter(()), context)
+        chunks = itertools.chain([first], request_iterator)
+        owner = self.owner(first.key)
+        if owner == self.shard:
+            return getattr(StoreService, name)(self, chunks, context)
+        return getattr(self.peer(owner), name)(chunks, timeout=_timeout(context, params.STREAM_TIMEOUT))
+    handler.__name__ = name
+    return handler
+
+
+class ShardedStoreService(StoreService):
+    """多进程模式下的一个 worker
+
+    每个 worker 只保存按键哈希分到本分片的键值, KVmap、锁与缓存都只属于本进程,
+    热路径上不需要跨进程加锁; 收到其他分片的键时通过内部地址转发给对应 worker
+    """
+
+    def __init__(self, *args, shard: int, peers: list[str], **kwargs):
+        self.shard = shard
+        self.peers = peers  # 下标为分片号, 值为该 worker 的内部地址
+        super().__init__(*args, **kwargs)
+        self._stubs: dict[int, stpb_grpc.storagementServiceStub] = {}
+        self._stub_mu = Lock()
+
+    def _txlog_path(self) -> str:
+        # 各 worker 共用数据目录, 决议日志每个 worker 一个
+        return os.path.join(self.datapath, f".txlog-{self.shard}")
+
+    def _pending_dir(self) -> str:
+        return os.path.join(self.datapath, f".pending-{self.shard}")
+
+    def owner(self, key: str) -> int:
+        return shard_of(key, len(self.peers))
+
+    def peer(self, shard: int) -> stpb_grpc.storagementServiceStub:
+        with self._stub_mu:
+            stub = self._stubs.get(shard)
+            if stub is None:
+                stub = stpb_grpc.storagementServiceStub(self.pool.get(self.peers[shard]))
+                self._stubs[shard] = stub
+            return stub
+
+    # 写入由键的主副本协调并按键加锁, 同一个键必须由同一个 worker 协调
+    getdata = _routed("getdata")
+    putdata = _routed("putdata")
+    deldata = _routed("deldata")
+    putstream = _routed_stream("putstream")
+    maGetdata = _routed("maGetdata")
+    maPutdata = _routed("maPutdata")
+    maDeldata = _routed("maDeldata")
+    abort = _routed("abort")
+    commit = _routed("commit")
+    maPutstream = _routed_stream("maPutstream")
+
+    def stats(self, request, context):
+        if request.local:
+            return StoreService.stats(self, request, context)
+        merged = Registry()
+        merged.load(REGISTRY.snapshot())
+        for i in range(len(self.peers)):
+            if i != self.shard:
+                merged.load(json.loads(self.peer(i).stats(stpb.StStatsRequest(local=True)).json))
+        return stpb.StStats(json=merged.to_json(), prometheus=merged.prometheus())
+
+    def spans(self, request, context):
+        if request.local:
+            return StoreService.spans(self, request, context)
+        spans = TRACER.query(request.trace_id)
+        local = stpb.StSpanRequest(trace_id=request.trace_id, local=True)
+        for i in range(len(self.peers)):
+            if i != self.shard:
+                spans.extend(json.loads(self.peer(i).spans(local).json))
+        spans.sort(key=lambda s: s["start"])
+        if request.limit > 0:
+            spans = spans[-request.limit:]
+        return stpb.StSpans(json=json.dumps(spans, ensure_ascii=False))
+
+    def profile(self, request, context):
+        """各 worker 同时采集, 合并后返回整个存储节点的结果"""
+        if request.local:
+            return StoreService.profile(self, request, context)
+        local = stpb.StProfileRequest(mode=request.mode, seconds=request.seconds, interval=request.interval,
+                                      top=request.top, local=True)
+        with futures.ThreadPoolExecutor(max_workers=len(self.peers)) as pool:
+            results = list(pool.map(lambda i: StoreService.profile(self, local, context) if i == self.shard
+                                    else self.peer(i).profile(local), range(len(self.peers))))
+        failed = [r.errmes for r in results if not r.errno]
+        if failed:
+            return stpb.StProfile(errno=False, errmes=failed[0])
+        if any(r.raw for r in results):
+            text = profiling.format_pstats(profiling.merge_pstats([r.raw for r in results]), request.top or 40)
+            return stpb.StProfile(errno=True, text=text)
+        return stpb.StProfile(errno=True, text=profiling.merge_collapsed([r.text for r in results]))
+
+    def _each(self, method: str, request, context) -> list:
+        """在所有 worker 上并行执行 method, request 需带 local 字段"""
+        local = type(request)()
+        local.CopyFrom(request)
+        local.local = True
+        with futures.ThreadPoolExecutor(max_workers=len(self.peers)) as pool:
+            return list(pool.map(lambda i: getattr(StoreService, method)(self, local, context) if i == self.shard
+                                 else getattr(self.peer(i), method)(local), range(len(self.peers))))
+
+    def maPutbatch(self, request, context):
+        """按键所属分片拆分批次, 各 worker 并行准备"""
+        if request.local:
+            return StoreService.maPutbatch(self, request, context)
+        groups: dict[int, list] = {}
+        for kv in request.kvs:
+            groups.setdefault(self.owner(kv.key), []).append(kv)
+
+        def prepare(shard: int, kvs: list):
+            batch = stpb.StBatch(batch=request.batch, kvs=kvs, local=True, version=request.version)
+            if shard == self.shard:
+                return StoreService.maPutbatch(self, batch, context)
+            return self.peer(shard).maPutbatch(batch)
+
+        with futures.ThreadPoolExecutor(max_workers=len(self.peers)) as pool:
+            results = list(pool.map(lambda item: prepare(*item), groups.items()))
+        failed = [r.errmes for r in results if not r.errno]
+        if failed:
+            return stpb.StEmpty(errno=False, errmes=failed[0])
+        return stpb.StEmpty(errno=True)
+
+    def putbatch(self, request, context):
+        """协调锁只属于本进程, 按键所属分片拆分后由各 worker 协调自己的键, 各部分分别原子提交"""
+        if request.local:
+            return StoreService.putbatch(self, request, context)
+        groups: dict[int, list] = {}
+        for kv in request.kvs:
+            groups.setdefault(self.owner(kv.key), []).append(kv)
+
+        def coordinate(shard: int, kvs: list):
+            batch = stpb.StBatch(kvs=kvs, local=True)
+            if shard == self.shard:
+                return StoreService.putbatch(self, batch, context)
+            return self.peer(shard).putbatch(batch, timeout=_timeout(context, 3 * params.RPC_TIMEOUT))
+
+        with futures.ThreadPoolExecutor(max_workers=len(self.peers)) as pool:
+            results = list(pool.map(lambda item: coordinate(*item), groups.items()))
+        failed = [r.errmes for r in results if not r.errno]
+        if failed:
+            return stpb.StEmpty(errno=False, errmes=failed[0])
+        return stpb.StEmpty(errno=True)
+
+    def resolve(self, request, context):
+        """键的决议转发给所属 worker, 批次分布在各 worker, 发给所有 worker"""
+        if request.local:
+            return StoreService.resolve(self, request, context)
+        groups = [stpb.StResolve(local=True) for _ in self.peers]
+        for d in request.decisions:
+            for shard in (range(len(self.peers)) if d.batch else [self.owner(d.key)]):
+                groups[shard].decisions.append(d)
+
+        def send(shard: int):
+            if shard == self.shard:
+                return StoreService.resolve(self, groups[shard], context)
+            return self.peer(shard).resolve(groups[shard], timeout=_timeout(context, params.RPC_TIMEOUT))
+
+        with futures.ThreadPoolExecutor(max_workers=len(self.peers)) as pool:
+            list(pool.map(send, [i for i, group in enumerate(groups) if group.decisions]))
+        return stpb.StEmpty(errno=True)
+
+    def commitBatch(self, request, context):
+        if request.local:
+            return StoreService.commitBatch(self, request, context)
+        # 批次只在持有其中键的 worker 上有准备, 所有 worker 都没有时才是未知的批次
+        results = self._each("commitBatch", request, context)
+        if not any(r.errno for r in results):
+            return stpb.StEmpty(errno=False, errmes=results[0].errmes)
+        return stpb.StEmpty(errno=True)
+
+    def abortBatch(self, request, context):
+        if request.local:
+            return StoreService.abortBatch(self, request, context)
+        self._each("abortBatch", request, context)
+        return stpb.StEmpty(errno=True)
+
+    def snapshot(self, request, context):
+        """各 worker 把自己分片的键值链接到同一个快照目录(各 worker 共用数据目录), 任一 worker 都能导出整个快照"""
+        if request.local:
+            return StoreService.snapshot(self, request, context)
+        request = stpb.StSnapshot(id=request.id or uuid.uuid4().hex)
+        results = self._each("snapshot", request, context)
+        return stpb.StSnapshot(id=request.id, keys=sum(r.keys for r in results), errno=True)
+
+    def invalidations(self, request, context):
+        """汇总所有 worker 的失效通知, 等各 worker 的订阅都建立后才推送首条 reset"""
+        if request.local:
+            yield from StoreService.invalidations(self, request, context)
+            return
+        self.streams.enter(context, "invalidations")
+        sub = self.notifier.subscribe()
+        local = stpb.StInvalidateRequest(cli_id=request.cli_id, local=True)
+        calls = [self.peer(i).invalidations(local) for i in range(len(self.peers)) if i != self.shard]
+        waiting = len(calls)
+        mu = Lock()
+
+        def pump(call):
+            nonlocal waiting
+            ready = False
+            try:
+                for msg in call:
+                    if msg.reset and not ready:
+                        ready = True
+                        with mu:
+                            waiting -= 1
+                            if not waiting:
+                                sub.push_reset()
+                    elif msg.reset:
+                        sub.push_reset()
+                    else:
+                        for key in msg.keys:
+                            sub.push(key)
+            except grpc.RpcError:
+                pass
+            # 某个 worker 的订阅中断后无法保证缓存一致, 结束整个订阅由客户端重新订阅
+            context.cancel()
+
+        if not calls:
+            sub.push_reset()
+        threads = [threading.Thread(target=pump, args=(call,), daemon=True) for call in calls]
+        for t in threads:
+            t.start()
+        try:
+            while context.is_active():
+                msg = sub.get(timeout=1.0)
+                if msg is not None:
+                    yield msg
+        finally:
+            self.notifier.unsubscribe(sub)
+            self.streams.release()
+            for call in calls:
+                call.cancel()
+
+    def watch(self, request, context):
+        """按键 watch 转发给所属 worker; 前缀 watch 合并所有 worker 的事件
+
+        合并后的 cursor 为各 worker 的 cursor 按分片号以逗号连接, seq 为事件所在 worker 的序号
+        """
+        if request.local:
+            yield from StoreService.watch(self, request, context)
+            return
+        self.streams.enter(context, "watch")
+        try:
+            yield from self._watch(request, context)
+        finally:
+            self.streams.release()
+
+    def _watch(self, request, context):
+        n = len(self.peers)
+        if not request.prefix:
+            call = self.peer(self.owner(request.key)).watch(stpb.StWatchRequest(
+                key=request.key, cursor=request.cursor, cli_id=request.cli_id, local=True))
+            try:
+                yield from call
+            except grpc.RpcError:
+                pass
+            finally:
+                call.cancel()
+            return
+        cursors = request.cursor.split(",") if request.cursor else [""] * n
+        reset = len(cursors) != n
+        if reset:
+            cursors = [""] * n
+        events = queue.Queue()
+        calls = [self.peer(i).watch(stpb.StWatchRequest(key=request.key, prefix=True, cursor=cursors[i],
+                                                        cli_id=request.cli_id, local=True)) for i in range(n)]
+
+        def pump(i, call):
+            try:
+                for event in call:
+                    events.put((i, event))
+            except grpc.RpcError:
+                pass
+            events.put((i, None))
+
+        for i, call in enumerate(calls):
+            threading.Thread(target=pump, args=(i, call), daemon=True).start()
+
+        def merged(event):
+            msg = stpb.StWatchEvent()
+            msg.CopyFrom(event)
+            msg.cursor = ",".join(cursors)
+            return msg
+
+        started = set()
+        pending = []  # 所有 worker 都开始推送前收到的事件
+        try:
+            while context.is_active():
+                try:
+                    i, event = events.get(timeout=1.0)
+                except queue.Empty:
+                    continue
+                if event is None:
+                    # 某个 worker 的流中断, 结束整个 watch 由客户端按 cursor 续传
+                    break
+                if len(started) < n:
+                    if event.op != "start":
+                        pending.append((i, event))
+                        continue
+                    started.add(i)
+                    cursors[i] = event.cursor
+                    reset = reset or event.reset
+                    if len(started) < n:
+                        continue
+                    yield merged(stpb.StWatchEvent(op="start", reset=reset))
+                    for j, e in pending:
+                        cursors[j] = e.cursor
+                        yield merged(e)
+                    pending.clear()
+                    continue
+                cursors[i] = event.cursor
+                yield merged(event)
+        finally:
+            for call in calls:
+                call.cancel()
+
+    def install(self, request_iterator, context):
+        """按键所属分片拆分迁移来的键值, 其他分片的键转发给对应 worker"""
+        installed = failed = 0
+        for batch in request_iterator:
+            if batch.local:
+                resp = StoreService.install(self, iter([batch]), context)
+                installed, failed = installed + resp.imported, failed + resp.failed
+                continue
+            groups: dict[int, stpb.StEntries] = {}
+            for entry in batch.entries:
+                groups.setdefault(self.owner(entry.key), stpb.StEntries()).entries.append(entry)
+            for key in batch.removed:
+                groups.setdefault(self.owner(key), stpb.StEntries()).removed.append(key)
+            for shard, part in groups.items():
+                part.local, part.overwrite = True, batch.overwrite
+                if shard == self.shard:
+                    resp = StoreService.install(self, iter([part]), context)
+                else:
+                    resp = self.peer(shard).install(iter([part]), timeout=_timeout(context, params.STREAM_TIMEOUT))
+                installed, failed = installed + resp.imported, failed + resp.failed
+        return stpb.StImportResult(errno=not failed, imported=installed, failed=failed)
+
+    def hint(self, request, context):
+        """提示按键所属分片交给对应 worker, 由协调该键写入的 worker 补发"""
+        if request.local:
+            return StoreService.hint(self, request, context)
+        groups: dict[int, stpb.StHints] = {}
+        for hint in request.hints:
+            for key in hint.keys:
+                part = groups.setdefault(self.owner(key), stpb.StHints(local=True))
+                if not part.hints or part.hints[-1].server_id != hint.server_id:
+                    part.hints.add(server_id=hint.server_id)
+                part.hints[-1].keys.append(key)
+        for shard, part in groups.items():
+            if shard == self.shard:
+                StoreService.hint(self, part, context)
+            else:
+                self.peer(shard).hint(part, timeout=_timeout(context, params.RPC_TIMEOUT))
+        return stpb.StEmpty(errno=True)
+
+    def _slice(self) -> tuple[int, int]:
+        return self.shard, len(self.peers)
+
+    def _merkle_digests(self, request, cluster):
+        """汇总各 worker 的键摘要, 对端比较的是整个节点的 Merkle 树"""
+        if request.local:
+            return StoreService._merkle_digests(self, request, cluster)
+        local = stpb.StMerkleRequest(primary=request.primary, epoch=request.epoch, leaves=True,
+                                     shard=request.shard, shards=request.shards, local=True)
+        digests = StoreService._merkle_digests(self, request, cluster)
+        for i in range(len(self.peers)):
+            if i == self.shard:
+                continue
+            resp = self.peer(i).merkle(local, timeout=params.RPC_TIMEOUT)
+            if not resp.errno:
+                return None
+            digests.update((d.key, d.digest) for d in resp.digests)
+        return digests
+
+    def getstream(self, request, context):
+        owner = self.owner(request.key)
+        if owner == self.shard:
+            yield from StoreService.getstream(self, request, context)
+        else:
+            yield from self.peer(owner).getstream(request, timeout=_timeout(context, params.STREAM_TIMEOUT))
+
+
+def merged_stats(peers: list[str]) -> Registry:
+    """汇总所有 worker 的指标, 供父进程暴露 /metrics"""
+    merged = Registry()
+    for address in peers:
+        try:
+            with grpc.insecure_channel(address) as ch:
+                resp = stpb_grpc.storagementServiceStub(ch).stats(stpb.StStatsRequest(local=True), timeout=5)
+            merged.load(json.loads(resp.json))
+        except grpc.RpcError:
+            continue
+    return merged
+
+
+def worker_address(datapath: str, shard: int) -> str:
+    return f"unix:{os.path.abspath(os.path.join(datapath, f'shard{shard}.sock'))}"
+
+
+def _worker_main(conf: dict):
+    # Ctrl-C 由父进程统一处理, worker 在收到父进程的 SIGTERM 时退出
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    datapath = conf["datapath"]
+    shard = conf["shard"]
+    sample = parse_rates(conf["log_sample"])
+    logger = setup_logger("store", f"{datapath}storage.{shard}.log", sample=sample)
+    access = None
+    if conf["access_log"]:
+        access = setup_logger("store.access", f"{datapath}access.{shard}.log", sample=sample, formatter=JsonFormatter())
+
+    sink = None
+    if conf["trace_file"]:
+        sink = setup_logger("store.trace", f"{datapath}trace.{shard}.log", formatter=JsonFormatter())
+    TRACER.configure(sample=conf["trace_sample"], sink=sink)
+
+    compression = grpc_compression(conf["grpc_compression"])
+    service = ShardedStoreService(conf["server_id"], datapath, logger, conf["cache"], conf["manager"],
+                                  codec=ValueCodec(parse_tiers(conf["compress"])), compression=compression,
+                                  shard=shard, peers=conf["peers"])
+    hooks = [access_hook(access), metrics_hook(), profiling.cpu_hook(), tracing_hook(f"storage{conf['server_id']}.{shard}")]
+    # gRPC 在 Linux 上默认开启 SO_REUSEPORT, 所有 worker 可以监听同一个对外端口
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=conf["threads"]), compression=compression,
+                         options=[("grpc.so_reuseport", 1)], interceptors=[HookInterceptor(*hooks)])
+    # worker 之间的转发使用单独的线程池: 对外线程全部阻塞在转发上时, 对端仍有线程处理转发来的请求, 不会互相等待
+    internal = grpc.server(futures.ThreadPoolExecutor(max_workers=conf["threads"]), compression=compression,
+                           interceptors=[HookInterceptor(*hooks)])
+    for s, address in ((server, conf["address"]), (internal, conf["peers"][shard])):
+        stpb_grpc.add_storagementServiceServicer_to_server(service, s)
+        s.add_insecure_port(address)
+        s.start()
+    service.start()
+    logger.info("分片worker%s 开始进行服务", shard)
+    server.wait_for_termination()
+
+
+def start_workers(workers: int, conf: dict) -> list[multiprocessing.Process]:
+    """以 spawn 方式启动 worker 进程(fork 与 gRPC 不兼容), conf 为各 worker 共用的配置"""
+    ctx = multiprocessing.get_context("spawn")
+    peers = [worker_address(conf["datapath"], i) for i in range(workers)]
+    procs = []
+    for shard in range(workers):
+        p = ctx.Process(target=_worker_main, args=(dict(conf, shard=shard, peers=peers),), daemon=True)
+        p.start()
+        procs.append(p)
+    return procs
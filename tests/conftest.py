@@ -12,7 +12,7 @@ from protos import stpb_pb2_grpc as stpb_grpc
 
 
 from server.main import ManageService
-from storage.main import StoreService
+from storage.main import StoreService, register, storage_path
 
 
 @pytest.fixture(scope="function")
@@ -83,10 +83,87 @@ def storage_server(manager_server):
         manager_stub.offline(mapb.SerInfo(server_id=sid))
         store_channel.close()
         server.stop(None).wait()
+        storage_service.close()
         for handler in logger.handlers[:]:
             handler.close()           
             logger.removeHandler(handler)
         import shutil
         shutil.rmtree(datapath)
     except Exception as e:
-        print(e, flush=True)
\ No newline at end of file
+        print(e, flush=True)
+
+
+class LocalNodes:
+    """在本进程中启动的管理服务器与存储节点, 都监听 localhost 上的空闲端口, 由 nodes fixture 统一停止"""
+
+    def __init__(self, datapath: str, logger: logging.Logger):
+        self.datapath = datapath
+        self.logger = logger
+        self.manage: ManageService | None = None
+        self.manager_api = "localhost:1"  # 没有启动管理服务器时的占位地址
+        self.servers: dict[int, grpc.Server] = {}  # server_id -> grpc.server, 管理服务器为 0
+        self.ports: dict[int, int] = {}
+        self.stores: list[StoreService] = []
+
+    def manager(self, interceptors=(), **kwargs) -> ManageService:
+        self.manage = ManageService(self.logger, interval_seconds=1, **kwargs)
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=4), interceptors=list(interceptors))
+        mapb_grpc.add_manageServiceServicer_to_server(self.manage, server)
+        self.manager_api = f"localhost:{server.add_insecure_port('localhost:0')}"
+        server.start()
+        self.servers[0] = server
+        return self.manage
+
+    def storage(self, server_id: int = 0, joining: bool = False, interceptors=(), logger=None) -> StoreService:
+        """启动一个存储节点; 启动了管理服务器时先注册, server_id 非 0 时沿用该 id 与它的数据目录"""
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=8), interceptors=list(interceptors))
+        port = server.add_insecure_port("localhost:0")
+        if self.manage is not None:
+            info = register(self.manager_api, "localhost", f":{port}", joining, server_id)
+            assert info.errno, info.errmes
+            server_id = info.server_id
+        datapath = storage_path(self.datapath, server_id or 1)
+        os.makedirs(datapath, exist_ok=True)
+        store = StoreService(server_id or 1, datapath, logger or self.logger, 5, self.manager_api)
+        stpb_grpc.add_storagementServiceServicer_to_server(store, server)
+        server.start()
+        self.servers[store.id], self.ports[store.id] = server, port
+        self.stores.append(store)
+        return store
+
+    def address(self, store: StoreService) -> str:
+        return f"localhost:{self.ports[store.id]}"
+
+    def stop(self, store: StoreService):
+        """停止节点的 gRPC 服务, 节点的状态保留, 之后可以用 serve 在原端口恢复"""
+        self.servers.pop(store.id).stop(None).wait()
+
+    def serve(self, store: StoreService):
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=8))
+        stpb_grpc.add_storagementServiceServicer_to_server(store, server)
+        server.add_insecure_port(self.address(store))
+        server.start()
+        self.servers[store.id] = server
+
+    def crash(self, store: StoreService):
+        """停止节点并丢弃内存中的状态, 只留下数据目录"""
+        self.stop(store)
+        self.stores.remove(store)
+        store.close()
+
+    def close(self):
+        for server in self.servers.values():
+            server.stop(None).wait()
+        for store in self.stores:
+            store.close()
+        if self.manage is not None:
+            self.manage.stop()
+
+
+@pytest.fixture(scope="function")
+def nodes(tmp_path, request):
+    logger = logging.getLogger(request.node.name)
+    logger.handlers.clear()
+    local = LocalNodes(str(tmp_path), logger)
+    yield local
+    local.close()
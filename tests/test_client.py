@@ -0,0 +1,327 @@
+﻿import asyncio
+import io
+import shutil
+import threading
+import time
+
+import grpc
+import pytest
+
+from protos import mapb_pb2 as mapb
+from client.aio import AsyncClient
+from client.cache import NearCache
+from client.main import Client, KeyNotFound, Unavailable, VersionConflict
+from client.retry import RetryPolicy
+from kvctl.bench import LocalCluster
+from protos import stpb_pb2 as stpb
+from protos import stpb_pb2_grpc as stpb_grpc
+from storage.main import VERSION_CONFLICT
+from storage.notify import ChangeLog
+from tests.utils import _start_shards
+
+
+def test_retry_backoff():
+    policy = RetryPolicy(initial=0.1, maximum=0.3, multiplier=2, jitter=0)
+    assert [policy.backoff(i) for i in range(4)] == [0.1, 0.2, 0.3, 0.3]
+    jittered = RetryPolicy(initial=0.1, jitter=0.2)
+    assert all(0.08 <= jittered.backoff(0) <= 0.12 for _ in range(50))
+
+def test_client_failover():
+    with LocalCluster(2) as cluster:
+        # 指定一个不可用的节点, 客户端应根据拓扑换到可用节点
+        with Client(cluster.manager_addr, target="localhost:1", retry=RetryPolicy(timeout=5)) as client:
+            client.connect()
+            client.put("a", "1")
+            assert client.target in cluster.storages
+            assert client.get("a") == "1"
+            assert sorted(client.nodes()) == sorted(cluster.storages)
+
+            data = bytes(range(256)) * 1000
+            client.put_stream("blob", io.BytesIO(data))
+            out = io.BytesIO()
+            assert client.get_stream("blob", out) == len(data) and out.getvalue() == data
+
+            other = client.use()
+            assert client.target == other
+            assert cluster.manage.clientmap[client.cli_id] == other
+            client.delete("a")
+            with pytest.raises(KeyNotFound):
+                client.get("a")
+
+        with Client(cluster.manager_addr, retry=RetryPolicy(timeout=1)) as client:
+            cluster.manage.servermap.clear()
+            start = time.monotonic()
+            with pytest.raises(Unavailable):
+                client.get("a")
+            assert time.monotonic() - start < 2
+
+def test_conditional_writes():
+    with LocalCluster(2) as cluster:
+        with Client(cluster.manager_addr) as client:
+            client.connect()
+            client.put_if_absent("n", "0")
+            with pytest.raises(VersionConflict):
+                client.put_if_absent("n", "1")
+            value, version = client.get_version("n")
+            client.put_if_version("n", "1", version)
+            with pytest.raises(VersionConflict):
+                client.put_if_version("n", "2", version)
+            assert client.get("n") == "1"
+
+            # 并发的读-改-写只靠条件写入保证不丢失更新
+            def increment(times):
+                with Client(cluster.manager_addr) as c:
+                    c.connect()
+                    for _ in range(times):
+                        while True:
+                            value, version = c.get_version("n")
+                            try:
+                                c.put_if_version("n", str(int(value) + 1), version)
+                                break
+                            except VersionConflict:
+                                pass
+
+            threads = [threading.Thread(target=increment, args=(10,)) for _ in range(3)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            value, version = client.get_version("n")
+            assert value == "31"
+            with pytest.raises(VersionConflict):
+                client.delete_if_version("n", version - 1)
+            client.delete_if_version("n", version)
+            with pytest.raises(KeyNotFound):
+                client.get("n")
+            with pytest.raises(VersionConflict):
+                client.delete_if_version("n", version)
+
+def test_conditional_writes_racing_coordinators():
+    with LocalCluster(2) as cluster:
+        with Client(cluster.manager_addr) as client:
+            client.connect()
+            client.put("race", "0")
+        # 主副本不可达时另一个副本代为协调: 两个节点各自协调同一个键的条件写入, 最多一个生效
+        channels = [grpc.insecure_channel(addr) for addr in cluster.storages]
+        stubs = [stpb_grpc.storagementServiceStub(ch) for ch in channels]
+        for round in range(20):
+            version = stubs[0].getdata(stpb.StRequest(key="race")).version
+            barrier = threading.Barrier(2)
+            results = [None, None]
+
+            def cas(i):
+                barrier.wait()
+                results[i] = stubs[i].putdata(stpb.StKV(key="race", value=f"{round}-{i}", expect=version,
+                                                        forwarded=True))
+
+            threads = [threading.Thread(target=cas, args=(i,)) for i in range(2)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            won = [i for i, resp in enumerate(results) if resp.errno]
+            assert len(won) <= 1
+            assert all(resp.errmes == VERSION_CONFLICT for resp in results if not resp.errno)
+            values = {store._committed("race") for store in cluster.stores}
+            assert len(values) == 1
+            if won:
+                assert stubs[1].getdata(stpb.StRequest(key="race", forwarded=True)).value == f"{round}-{won[0]}"
+        assert not any(store.staged for store in cluster.stores)
+        for ch in channels:
+            ch.close()
+
+def test_topology_push():
+    with LocalCluster(2) as cluster:
+        with Client(cluster.manager_addr, target=cluster.storages[0], retry=RetryPolicy(attempts=1),
+                    watch_topology=True) as client:
+            client.put("a", "1")
+            _eventually(lambda: client.topology.pushed)
+            assert sorted(client.nodes()) == sorted(cluster.storages)
+            # 节点注销后客户端在下一次调用前就换到其他节点
+            sid = next(sid for sid, ser in cluster.manage.servermap.items() if ser.ip + ser.port == cluster.storages[0])
+            cluster.manage.offline(mapb.SerInfo(server_id=sid), None)
+            _eventually(lambda: client.target == "")
+            assert client.nodes() == [cluster.storages[1]]
+            assert client.get("a") == "1"
+            assert client.target == cluster.storages[1]
+
+def test_async_client():
+    async def run(manager_addr):
+        async with AsyncClient(manager_addr) as client:
+            await client.connect()
+            await client.put("k", "v")
+            assert await client.get("k") == "v"
+            other = await client.use()
+            assert client.target == other
+            assert await client.get("k") == "v"
+            watch = client.watch("k")
+            events = watch.__aiter__()
+            first = asyncio.ensure_future(events.__anext__())
+            while not watch.cursor:
+                await asyncio.sleep(0.02)
+            await client.put("k", "w")
+            event = await asyncio.wait_for(first, 5)
+            assert (event.op, event.value) == ("put", "w")
+            await events.aclose()
+            await client.delete("k")
+            with pytest.raises(KeyNotFound):
+                await client.get("k")
+
+    with LocalCluster(2) as cluster:
+        asyncio.run(run(cluster.manager_addr))
+
+def _eventually(check, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not check():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+def test_near_cache_invalidation():
+    cache = NearCache(2)
+    cache.reset(active=True)
+    epoch = cache.epoch
+    cache.invalidate(["x"])
+    cache.fill("x", "stale", epoch)
+    assert cache.get("x") == ("", False)
+    for k in "abc":
+        cache.fill(k, k, cache.epoch)
+    assert cache.get("a") == ("", False) and cache.get("c") == ("c", True)
+
+    with LocalCluster(2) as cluster:
+        reader = Client(cluster.manager_addr, target=cluster.storages[0], near_cache=100)
+        writer = Client(cluster.manager_addr, target=cluster.storages[1])
+        with reader, writer:
+            writer.put("conf", "1")
+            assert reader.get("conf") == "1"
+            _eventually(lambda: reader.cache.active)
+            reader.get("conf")
+            hits = reader.cache.hits
+            assert reader.get("conf") == "1" and reader.cache.hits == hits + 1
+
+            writer.put("conf", "2")
+            _eventually(lambda: reader.get("conf") == "2")
+            writer.delete("conf")
+            _eventually(lambda: "conf" not in reader.cache.m)
+            with pytest.raises(KeyNotFound):
+                reader.get("conf")
+
+def test_sharded_invalidations(manager_server):
+    manager_stub, _, manager_api = manager_server
+    servers, services, peers, sid = _start_shards(manager_stub, manager_api, 2, "tests/shard_notify/")
+    try:
+        with Client(manager_api, target=peers[0], near_cache=10) as client:
+            keys = [f"key{i}" for i in range(6)]
+            for key in keys:
+                client.put(key, "old")
+            client.get(keys[0])
+            _eventually(lambda: client.cache.active)
+            for key in keys:
+                assert client.get(key) == "old"
+            with Client(manager_api, target=peers[1]) as writer:
+                for key in keys:
+                    writer.put(key, "new")
+            _eventually(lambda: all(client.get(key) == "new" for key in keys))
+        _eventually(lambda: not any(s.notifier.subs for s in services))
+    finally:
+        manager_stub.offline(mapb.SerInfo(server_id=sid))
+        for server in servers:
+            server.stop(None).wait()
+        for service in services:
+            service.close()
+        shutil.rmtree("tests/shard_notify/", ignore_errors=True)
+
+def _collect(watch):
+    events = []
+    thread = threading.Thread(target=lambda: events.extend(watch), daemon=True)
+    thread.start()
+    return events, thread
+
+def test_watch_resume():
+    log = ChangeLog(capacity=2)
+    for key in "abc":
+        log.append("put", key, key)
+    assert log.resume(log.cursor(0)) == (3, True)  # 第 1 条已被覆盖
+    assert log.resume(log.cursor(1)) == (1, False)
+    assert log.resume("other:1") == (3, True)
+    assert [e.key for e in log.since(2)] == ["c"] and log.since(0) is None
+
+    with LocalCluster(2) as cluster:
+        with Client(cluster.manager_addr, target=cluster.storages[0]) as reader, \
+                Client(cluster.manager_addr, target=cluster.storages[1]) as writer:
+            watch = reader.watch("user:", prefix=True)
+            events, thread = _collect(watch)
+            _eventually(lambda: watch.cursor)
+            writer.put("user:a", "1")
+            writer.put("other", "x")
+            writer.put_stream("user:b", io.BytesIO(b"blob"))
+            writer.delete("user:a")
+            _eventually(lambda: len(events) == 3)
+            assert [(e.op, e.key, e.value, e.has_value) for e in events] == [
+                ("put", "user:a", "1", True), ("put", "user:b", "", False), ("del", "user:a", "", False)]
+            assert events[0].seq < events[1].seq < events[2].seq
+
+            # 断开期间的写入在续传时补发
+            watch.cancel()
+            thread.join(5)
+            cursor = watch.cursor
+            writer.put("user:c", "3")
+            writer.put("user:d", "4")
+            resumed = reader.watch("user:", prefix=True, cursor=cursor)
+            events, thread = _collect(resumed)
+            _eventually(lambda: len(events) == 2)
+            assert [e.key for e in events] == ["user:c", "user:d"]
+            resumed.cancel()
+
+            # 换到另一个节点时 cursor 不再有效, 先收到 reset
+            other = reader.watch("user:c", cursor=cursor)
+            reader.use(cluster.storages[1])
+            events, thread = _collect(other)
+            _eventually(lambda: events)
+            assert events[0].reset
+            writer.put("user:c", "5")
+            _eventually(lambda: len(events) == 2)
+            assert events[1].value == "5"
+            other.cancel()
+            thread.join(5)
+
+def test_sharded_watch(manager_server):
+    manager_stub, _, manager_api = manager_server
+    servers, services, peers, sid = _start_shards(manager_stub, manager_api, 2, "tests/shard_watch/")
+    try:
+        keys = [f"key{i}" for i in range(6)]
+        assert len({services[0].owner(k) for k in keys}) == 2
+        with Client(manager_api, target=peers[0]) as client:
+            watch = client.watch("key", prefix=True)
+            events, thread = _collect(watch)
+            _eventually(lambda: watch.cursor)
+            assert len(watch.cursor.split(",")) == 2
+            for key in keys[:3]:
+                client.put(key, "1")
+            _eventually(lambda: len(events) == 3)
+            watch.cancel()
+            thread.join(5)
+            for key in keys[3:]:
+                client.put(key, "2")
+            resumed = client.watch("key", prefix=True, cursor=watch.cursor)
+            events, thread = _collect(resumed)
+            _eventually(lambda: len(events) == 3)
+            assert sorted(e.key for e in events) == keys[3:]
+            resumed.cancel()
+            thread.join(5)
+
+            single = client.watch(keys[0])
+            events, thread = _collect(single)
+            _eventually(lambda: single.cursor)
+            client.put(keys[1], "3")
+            client.put(keys[0], "3")
+            _eventually(lambda: events)
+            assert [(e.key, e.value) for e in events] == [(keys[0], "3")]
+            single.cancel()
+            thread.join(5)
+    finally:
+        manager_stub.offline(mapb.SerInfo(server_id=sid))
+        for server in servers:
+            server.stop(None).wait()
+        for service in services:
+            service.close()
+        shutil.rmtree("tests/shard_watch/", ignore_errors=True)
@@ -0,0 +1,51 @@
+﻿import os
+
+import pytest
+
+from protos import stpb_pb2 as stpb
+from common.compress import MAGIC, Codec, LzmaCodec, ValueCodec, ZlibCodec, parse_tiers
+
+def test_value_codec():
+    codec = ValueCodec([(16, ZlibCodec()), (4096, LzmaCodec())])
+    small = b"short"
+    assert codec.encode(small) == small
+
+    medium = b'{"name": "value"}' * 20
+    packed = codec.encode(medium)
+    assert packed.startswith(MAGIC + bytes([ZlibCodec.tag]))
+    assert codec.decode(packed) == medium
+
+    large = b'{"name": "value"}' * 1000
+    packed = codec.encode(large)
+    assert packed.startswith(MAGIC + bytes([LzmaCodec.tag]))
+    assert codec.decode(packed) == large
+
+    # 原值以 MAGIC 开头时仍能正确还原
+    tricky = MAGIC + b"\x01abc"
+    assert codec.decode(codec.encode(tricky)) == tricky
+
+    tiers = parse_tiers("zlib:1024,lzma:1048576")
+    assert [(t, c.name) for t, c in tiers] == [(1024, "zlib"), (1048576, "lzma")]
+    assert parse_tiers("") == []
+
+    # 未实现全部接口的 codec 无法实例化
+    class Partial(Codec):
+        def compress(self, data: bytes) -> bytes:
+            return data
+    with pytest.raises(TypeError):
+        Partial()
+
+def test_compressed_storage(storage_server):
+    storage_stub, storage_service, _, _ = storage_server
+    storage_service.codec = ValueCodec(parse_tiers("zlib:64"))
+    key = "jsonkey"
+    value = '{"field": "value", "list": [1, 2, 3]}' * 50
+
+    put_resp = storage_stub.putdata(stpb.StKV(cli_id=0, key=key, value=value))
+    assert put_resp.errno
+    size = os.path.getsize(os.path.join(storage_service.datapath, key))
+    assert size < len(value) // 5
+
+    storage_service.cache.del_key(key)
+    get_resp = storage_stub.getdata(stpb.StRequest(cli_id=0, key=key))
+    assert get_resp.errno and get_resp.value == value
@@ -0,0 +1,90 @@
+﻿import argparse
+import glob
+import io
+import os
+from collections import Counter
+
+import grpc
+
+from protos import stpb_pb2 as stpb
+from protos import stpb_pb2_grpc as stpb_grpc
+from kvctl import batch, bench, transfer
+
+
+def test_zipfian_distribution():
+    import random
+    rng = random.Random(1)
+    gen = bench.ZipfianGenerator(1000, scrambled=False)
+    counts = Counter(gen.next(rng) for _ in range(20000))
+    assert all(0 <= k < 1000 for k in counts)
+    # theta=0.99 时 0 号键约占 1/zeta(1000) ≈ 13%
+    assert 0.1 < counts[0] / 20000 < 0.17
+    assert counts[0] > counts[1] > counts[10]
+
+    scrambled = bench.ZipfianGenerator(1000)
+    hot = Counter(scrambled.next(rng) for _ in range(20000)).most_common(1)[0][0]
+    assert hot != 0
+
+def test_bench_local_cluster():
+    parser = argparse.ArgumentParser()
+    bench.add_arguments(parser)
+    args = parser.parse_args(["--local", "2", "--keys", "50", "--ops", "300", "--read", "0.8",
+                              "--delete", "0.05", "--concurrency", "4", "--value-size", "10-200", "--json"])
+    report = bench.run(args)
+    assert len(report["targets"]) == 2
+    # 写入期间键被独占, 并发读可能被拒绝, 这里只检查统计口径
+    assert report["total"]["count"] == 300
+    assert report["total"]["errors"] == sum(row["errors"] for row in report["ops"].values())
+    assert set(report["ops"]) <= {"read", "update", "delete"} and "read" in report["ops"]
+    row = report["total"]
+    assert row["p50_ms"] <= row["p99_ms"] <= row["p99.9_ms"] <= row["max_ms"] + 1e-6
+
+    args = parser.parse_args(["--local", "1", "--keys", "20", "--ops", "100", "--mode", "async",
+                              "--dist", "uniform", "--no-load"])
+    report = bench.run(args)
+    assert report["total"]["count"] == 100
+
+def test_batch_pipeline():
+    lines = ["# 注释", "put a 1", "put b hello world", "get a", "put a 2", "get a", "", "get b",
+             "del a", "get a", "bogus x", "get"]
+    expected = [
+        "2\tOK\tOK", "3\tOK\tOK", "4\tOK\t1", "5\tOK\tOK", "6\tOK\t2", "8\tOK\thello world",
+        "9\tOK\tOK", "10\tERR\t未找到键值", "11\tERR\t无效命令 bogus", "12\tERR\t不正确的参数个数",
+    ]
+    with bench.LocalCluster(2) as cluster:
+        for mode in ("pipeline", "thread"):
+            with grpc.insecure_channel(cluster.storages[0]) as ch:
+                out = io.StringIO()
+                total, failed = batch.run(lines, stpb_grpc.storagementServiceStub(ch), window=8, mode=mode, out=out)
+            assert out.getvalue().splitlines() == expected
+            assert (total, failed) == (10, 3)
+
+def test_import_reports_failed_groups():
+    class Stub:
+        def importdata(self, batches):
+            keys = [kv.key for b in batches for kv in b.kvs]
+            failure = stpb.StImportFailure(primary=7, keys=keys[1:], errmes="版本不匹配")
+            return stpb.StImportResult(errno=False, errmes="版本不匹配", imported=1, failed=len(keys) - 1,
+                                       failures=[failure])
+
+    imported, failed, errors = transfer.import_records([("a", "1"), ("b", "2"), ("c", "3")], Stub(), parallel=1)
+    assert (imported, failed) == (1, 2)
+    assert errors == ["主副本7 的 2 个键值未提交 (首个键 'b'): 版本不匹配"]
+
+def test_import_export_roundtrip():
+    records = {f"k{i:03d}": f"值 {i}, \"quoted\"\n" if i % 7 == 0 else f"v{i}" for i in range(120)}
+    with bench.LocalCluster(2) as cluster:
+        with grpc.insecure_channel(cluster.storages[0]) as ch:
+            imported, failed, errors = transfer.import_records(
+                list(records.items()) + [("k000", "last")], stpb_grpc.storagementServiceStub(ch), parallel=3, batch=16)
+        assert (imported, failed, errors) == (121, 0, [])
+        expected = dict(records, k000="last")
+        with grpc.insecure_channel(cluster.storages[1]) as ch:
+            stub = stpb_grpc.storagementServiceStub(ch)
+            for fmt in transfer.FORMATS:
+                buf = io.BytesIO() if fmt == "bin" else io.StringIO(newline="")
+                count = transfer.export_records(stub, transfer.Writer(buf, fmt), parallel=3)
+                assert count == len(expected)
+                buf.seek(0)
+                assert dict(transfer.read_records(buf, fmt)) == expected
+        assert not glob.glob(os.path.join(cluster.datapath, "*", ".snapshots", "*"))
@@ -0,0 +1,29 @@
+﻿import json
+
+import grpc
+
+from protos import stpb_pb2 as stpb
+from protos import stpb_pb2_grpc as stpb_grpc
+from common.interceptors import HookInterceptor
+from common.logs import JsonFormatter, access_hook, close_logger, setup_logger
+
+def test_sampled_async_logging(nodes, tmp_path):
+    logger = setup_logger("sampled", str(tmp_path / "storage.log"), sample={"live": 0.1})
+    access = setup_logger("sampled.access", str(tmp_path / "access.log"), formatter=JsonFormatter())
+    service = nodes.storage(interceptors=[HookInterceptor(access_hook(access))], logger=logger)
+    with grpc.insecure_channel(nodes.address(service)) as ch:
+        stub = stpb_grpc.storagementServiceStub(ch)
+        for _ in range(30):
+            assert stub.live(stpb.StEmpty()).errno
+        resp = stub.maGetdata(stpb.StRequest(key="nokey"))
+        assert not resp.errno
+    nodes.stop(service)
+    close_logger(logger)
+    close_logger(access)
+
+    lines = (tmp_path / "storage.log").read_text(encoding="utf-8").splitlines()
+    assert sum("心跳" in line for line in lines) == 3
+    assert any("nokey" in line for line in lines)
+    entries = [json.loads(line) for line in (tmp_path / "access.log").read_text(encoding="utf-8").splitlines()]
+    assert len(entries) == 31
+    assert entries[-1]["op"] == "maGetdata" and entries[-1]["key"] == "nokey" and not entries[-1]["ok"]
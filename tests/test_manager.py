@@ -1,8 +1,13 @@
 ﻿import logging
 import random
+import time
+
+import grpc
+import pytest
 
 from tests.utils import _start_storage
 from protos import mapb_pb2 as mapb
+from protos import stpb_pb2 as stpb
 from server.main import ManageService
 
 
@@ -64,4 +69,60 @@ def test_verify(manager_server):
     assert not resp.errno and resp.errmes == "节点未注册, 无权操作!"
 
     resp = manager_stub.Del(mapb.Request(server_id = fake_sid, key=key))
-    assert not resp.errno and resp.errmes == "节点未注册, 无权操作!"
\ No newline at end of file
+    assert not resp.errno and resp.errmes == "节点未注册, 无权操作!"
+
+def test_writes_routed_to_primary(manager_server, storage_server):
+    manager_stub, _, _ = manager_server
+    storage_stub, storage_service, _, _ = storage_server
+    sid = storage_service.id
+    # 管理服务器不协调写入, 交给键的主副本
+    assert manager_stub.Put(mapb.KV(server_id=sid, key="routed", value="v")).errno
+    assert storage_stub.getdata(stpb.StRequest(cli_id=0, key="routed")).value == "v"
+    batch = mapb.KVBatch(server_id=sid, kvs=[mapb.KV(key=f"rb{i}", value="b") for i in range(3)])
+    assert manager_stub.PutBatch(batch).errno
+    assert all(f"rb{i}" in storage_service.KVmap for i in range(3))
+    assert manager_stub.Del(mapb.Request(server_id=sid, key="routed")).errno
+    assert "routed" not in storage_service.KVmap
+    assert not storage_service.txlog.pending()
+
+def test_watch_topology(manager_server):
+    manager_stub, manage_service, _ = manager_server
+    stream = manager_stub.watchTopology(mapb.Empty())
+    snapshot = next(stream)
+    assert snapshot.change == "snapshot"
+    assert {n.server_id for n in snapshot.nodes} == set(manage_service.servermap)
+
+    # 未启动服务的节点在心跳检测时被移除
+    sid = manager_stub.online(mapb.SerRequest(ip="localhost", port=":1")).server_id
+    online = next(stream)
+    assert (online.change, online.node.server_id, online.epoch) == ("online", sid, snapshot.epoch + 1)
+    assert sid in {n.server_id for n in online.nodes}
+    manage_service.check_all_storage_live()
+    removed = next(stream)
+    assert (removed.change, removed.node.server_id, removed.epoch) == ("removed", sid, online.epoch + 1)
+    assert sid not in {n.server_id for n in removed.nodes}
+
+    sid = manager_stub.online(mapb.SerRequest(ip="localhost", port=":2")).server_id
+    manager_stub.offline(mapb.SerInfo(server_id=sid))
+    assert [(e.change, e.node.server_id) for e in (next(stream), next(stream))] == [("online", sid), ("offline", sid)]
+    assert manager_stub.topology(mapb.Empty()).epoch == removed.epoch + 2
+    stream.cancel()
+
+def test_watch_topology_limit(manager_server):
+    manager_stub, manage_service, _ = manager_server
+    manage_service.watchers.limit = 2
+    streams = [manager_stub.watchTopology(mapb.Empty()) for _ in range(2)]
+    assert all(next(s).change == "snapshot" for s in streams)
+    # 超过上限的订阅被拒绝, 普通请求仍有工作线程处理
+    with pytest.raises(grpc.RpcError) as err:
+        next(manager_stub.watchTopology(mapb.Empty()))
+    assert err.value.code() == grpc.StatusCode.RESOURCE_EXHAUSTED
+    assert manager_stub.topology(mapb.Empty(), timeout=5) is not None
+    streams[0].cancel()
+    deadline = time.monotonic() + 5
+    while manage_service.watchers.active > 1 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    stream = manager_stub.watchTopology(mapb.Empty())
+    assert next(stream).change == "snapshot"
+    for s in (stream, streams[1]):
+        s.cancel()
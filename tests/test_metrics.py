@@ -0,0 +1,101 @@
+﻿import json
+import time
+
+import grpc
+
+from protos import mapb_pb2 as mapb
+from protos import stpb_pb2 as stpb
+from protos import stpb_pb2_grpc as stpb_grpc
+from common import profiling
+from common.interceptors import HookInterceptor
+from common.metrics import Histogram, Registry, metrics_hook
+from common.profiling import cpu_hook, format_pstats, merge_collapsed, merge_pstats
+
+def test_histogram_percentiles():
+    h = Histogram()
+    for i in range(1, 10001):
+        h.observe(i / 1000)  # 1ms ~ 10s
+    assert h.count == 10000
+    for q in (0.5, 0.99, 0.999):
+        exact = q * 10
+        assert abs(h.percentile(q) - exact) / exact < 0.04
+    merged = Histogram()
+    merged.load(h.snapshot())
+    merged.load(h.snapshot())
+    assert merged.count == 20000 and merged.max == h.max
+    assert abs(merged.percentile(0.5) - h.percentile(0.5)) < 1e-9
+
+def test_twopc_metrics(manager_server, storage_server):
+    manager_stub, _, _ = manager_server
+    storage_stub, _, _, _ = storage_server
+    assert storage_stub.putdata(stpb.StKV(cli_id=0, key="metrickey", value="v")).errno
+    assert storage_stub.deldata(stpb.StRequest(cli_id=0, key="metrickey")).errno
+
+    stats = manager_stub.stats(mapb.Empty())
+    snapshot = json.loads(stats.json)
+    phases = {(s["labels"]["op"], s["labels"]["phase"]): s["count"] for s in snapshot["twopc_phase_seconds"]["series"]}
+    assert phases[("put", "prepare")] >= 1 and phases[("put", "commit")] >= 1
+    assert phases[("del", "prepare")] >= 1 and phases[("del", "commit")] >= 1
+    nodes = {s["labels"]["method"] for s in snapshot["node_rpc_seconds"]["series"]}
+    assert {"maPutdata", "maDeldata", "commit"} <= nodes
+    assert "twopc_rounds_total" in stats.prometheus
+
+def test_stats_rpc(nodes):
+    registry = Registry()
+    registry.counter("x_total", "测试", op="a").inc(2)
+    registry.histogram("y_seconds", op="a").observe(0.5)
+    text = registry.prometheus()
+    assert 'x_total{op="a"} 2' in text
+    assert 'y_seconds{op="a",quantile="0.5"}' in text and 'y_seconds_count{op="a"} 1' in text
+    registry.counter("z_total", "反斜杠\\换行\n", key='a"b\\c\nd').inc()
+    text = registry.prometheus()
+    assert 'z_total{key="a\\"b\\\\c\\nd"} 1' in text and "# HELP z_total 反斜杠\\\\换行\\n\n" in text
+
+    service = nodes.storage(interceptors=[HookInterceptor(metrics_hook())])
+    with grpc.insecure_channel(nodes.address(service)) as ch:
+        stub = stpb_grpc.storagementServiceStub(ch)
+        assert not stub.maGetdata(stpb.StRequest(key="nokey")).errno
+        stats = stub.stats(stpb.StStatsRequest())
+    snapshot = json.loads(stats.json)
+    errors = {s["labels"]["method"]: s["value"] for s in snapshot["rpc_errors_total"]["series"]}
+    assert errors["maGetdata"] >= 1
+    assert "cache_misses_total" in snapshot
+    assert 'rpc_latency_seconds{method="maGetdata",quantile="0.99"}' in stats.prometheus
+
+def test_profile_rpc(nodes):
+    service = nodes.storage(interceptors=[HookInterceptor(cpu_hook())])
+    with grpc.insecure_channel(nodes.address(service)) as ch:
+        stub = stpb_grpc.storagementServiceStub(ch)
+        future = stub.profile.future(stpb.StProfileRequest(mode="cprofile", seconds=0.5))
+        time.sleep(0.1)
+        for i in range(20):
+            stub.maGetdata(stpb.StRequest(key=f"k{i}"))
+        # 同一时间只允许一个分析任务
+        busy = stub.profile(stpb.StProfileRequest(mode="sample", seconds=0.1))
+        assert not busy.errno
+        resp = future.result()
+        assert resp.errno and "function calls" in resp.text
+        merged = merge_pstats([resp.raw, resp.raw])
+        calls = {func[2]: stat[1] for func, stat in merged.items()}
+        assert calls["maGetdata"] == 2 * 20
+        assert "function calls" in format_pstats(merged, top=5)
+
+        resp = stub.profile(stpb.StProfileRequest(mode="sample", seconds=0.2, interval=0.01))
+        assert resp.errno
+        stacks = [line.rpartition(" ") for line in resp.text.splitlines()]
+        assert stacks and all(stack and n.isdigit() for stack, _, n in stacks)
+        merged = merge_collapsed([resp.text, resp.text])
+        assert sum(int(line.rpartition(" ")[2]) for line in merged.splitlines()) == 2 * sum(int(n) for _, _, n in stacks)
+
+        assert not stub.profile(stpb.StProfileRequest(mode="perf")).errno
+        assert not stub.profile(stpb.StProfileRequest(mode="sample", seconds=-1)).errno
+        snapshot = json.loads(stub.stats(stpb.StStatsRequest()).json)
+        methods = {s["labels"]["method"] for s in snapshot["rpc_cpu_seconds_total"]["series"]}
+        assert "maGetdata" in methods
+
+def test_profile_seconds_clamped(monkeypatch):
+    monkeypatch.setattr(profiling, "MAX_SECONDS", 0.2)
+    start = time.monotonic()
+    resp = profiling.handle(stpb.StProfileRequest(mode="sample", seconds=1e9), stpb.StProfile)
+    assert resp.errno and time.monotonic() - start < 5
+    assert not profiling.handle(stpb.StProfileRequest(seconds=float("nan")), stpb.StProfile).errno
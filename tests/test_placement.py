@@ -0,0 +1,167 @@
+﻿import os
+import time
+
+import grpc
+
+from protos import mapb_pb2 as mapb
+from protos import stpb_pb2 as stpb
+from protos import stpb_pb2_grpc as stpb_grpc
+from common.placement import ClusterMap, majority
+
+def test_cluster_map():
+    full = ClusterMap({1: "a", 2: "b", 3: "c"}, epoch=1)
+    assert all(sorted(full.owners(f"k{i}")) == [1, 2, 3] for i in range(20))
+    two = ClusterMap({1: "a", 2: "b", 3: "c"}, epoch=1, replicas=2)
+    owners = {f"k{i}": two.owners(f"k{i}") for i in range(100)}
+    assert all(len(set(o)) == 2 for o in owners.values())
+    assert {o[0] for o in owners.values()} == {1, 2, 3}
+    # 一个节点下线只影响原本放在该节点上的键
+    before = ClusterMap({1: "a", 2: "b", 3: "c"}, replicas=1)
+    after = ClusterMap({1: "a", 2: "b"}, replicas=1)
+    assert all(after.owners(k) == before.owners(k) for k in owners if before.owners(k) != [3])
+    assert majority(["x", "x", "y"]) == ("x", True)
+    assert majority(["x", "y"])[1] is False
+
+def test_replica_routing(nodes):
+    manage = nodes.manager(replicas=2)
+    calls = []
+    # 数据路径不再经过管理服务器的 Put/Del/Get
+    for name in ("Put", "Del", "Get", "PutStream"):
+        setattr(manage, name, lambda *args, name=name: calls.append(name))
+    stores = [nodes.storage() for _ in range(3)]
+    apis = [nodes.address(store) for store in stores]
+    cluster = ClusterMap.from_proto(manage.topology(mapb.Empty(), None))
+    assert cluster.replicas == 2 and len(cluster.nodes) == 3
+
+    keys = [f"rk{i}" for i in range(12)]
+    with grpc.insecure_channel(apis[0]) as ch:
+        stub = stpb_grpc.storagementServiceStub(ch)
+        for key in keys:
+            assert stub.putdata(stpb.StKV(cli_id=0, key=key, value=key.upper())).errno
+    for key in keys:
+        assert {s.id for s in stores if key in s.KVmap} == set(cluster.owners(key))
+    for api in apis:
+        with grpc.insecure_channel(api) as ch:
+            stub = stpb_grpc.storagementServiceStub(ch)
+            assert all(stub.getdata(stpb.StRequest(cli_id=0, key=k)).value == k.upper() for k in keys)
+    with grpc.insecure_channel(apis[2]) as ch:
+        stub = stpb_grpc.storagementServiceStub(ch)
+        assert stub.deldata(stpb.StRequest(cli_id=0, key=keys[0])).errno
+        assert not stub.getdata(stpb.StRequest(cli_id=0, key=keys[0])).errno
+    assert not any(keys[0] in s.KVmap for s in stores)
+    assert calls == []
+
+def test_rebalance_on_join(nodes):
+    manage = nodes.manager(replicas=1)
+    first = nodes.storage()
+    keys = [f"rb{i}" for i in range(30)]
+    with grpc.insecure_channel(nodes.address(first)) as ch:
+        stub = stpb_grpc.storagementServiceStub(ch)
+        for key in keys:
+            assert stub.putdata(stpb.StKV(cli_id=0, key=key, value=key.upper())).errno
+    assert first.rebalancer.step() == 0  # 记录初始视图
+
+    second = nodes.storage()
+    moved = first.rebalancer.step()
+    cluster = ClusterMap.from_proto(manage.topology(mapb.Empty(), None))
+    owned = [k for k in keys if cluster.owners(k) == [second.id]]
+    assert moved == len(owned) > 0
+    # 迁移后每个键只在新的副本节点上, 读取不需要再向其他节点补全
+    for key in keys:
+        assert {s.id for s in nodes.stores if key in s.KVmap} == set(cluster.owners(key))
+    with grpc.insecure_channel(nodes.address(second)) as ch:
+        stub = stpb_grpc.storagementServiceStub(ch)
+        assert all(stub.getdata(stpb.StRequest(cli_id=0, key=k)).value == k.upper() for k in keys)
+    assert first.rebalancer.step() == 0
+
+def test_bootstrap_join(nodes):
+    manage = nodes.manager(replicas=1)
+    first = nodes.storage()
+    api = nodes.address(first)
+    keys = [f"bs{i}" for i in range(30)]
+    with grpc.insecure_channel(api) as ch:
+        stub = stpb_grpc.storagementServiceStub(ch)
+        for key in keys:
+            assert stub.putdata(stpb.StKV(cli_id=0, key=key, value=key.upper())).errno
+    assert first.rebalancer.step() == 0
+
+    second = nodes.storage(joining=True)
+    topo = manage.topology(mapb.Empty(), None)
+    assert [n.joining for n in topo.nodes if n.server_id == second.id] == [True]
+    # 引导中的节点不分配给客户端, 也不由其他节点推送
+    assert all(manage.connect(mapb.Empty(), None).port == api[len("localhost"):] for _ in range(10))
+    assert first.rebalancer.step() == 0
+    cluster = ClusterMap.from_proto(topo)
+    owned = [k for k in keys if cluster.owners(k) == [second.id]]
+    assert owned and all(k in first.KVmap for k in keys)
+    # 引导期间的新写入直接落到新节点, 不会被快照中的旧值覆盖
+    with grpc.insecure_channel(api) as ch:
+        assert stpb_grpc.storagementServiceStub(ch).putdata(stpb.StKV(cli_id=0, key=owned[0], value="new")).errno
+
+    assert second.bootstrap(nodes.address(second)) == len(owned) - 1
+    assert not manage.servermap[second.id].joining
+    assert manage.membership.events[-1].change == "ready"
+    assert first.rebalancer.step() == 0
+    for key in keys:
+        assert {s.id for s in nodes.stores if key in s.KVmap} == set(cluster.owners(key))
+    with grpc.insecure_channel(api) as ch:
+        stub = stpb_grpc.storagementServiceStub(ch)
+        assert stub.getdata(stpb.StRequest(cli_id=0, key=owned[0])).value == "new"
+        assert all(stub.getdata(stpb.StRequest(cli_id=0, key=k)).value == k.upper() for k in owned[1:])
+
+def test_anti_entropy(nodes):
+    nodes.manager()
+    first, second = nodes.storage(), nodes.storage()
+    keys = [f"ae{i}" for i in range(40)]
+    with grpc.insecure_channel(nodes.address(first)) as ch:
+        stub = stpb_grpc.storagementServiceStub(ch)
+        for key in keys:
+            assert stub.putdata(stpb.StKV(cli_id=0, key=key, value=key.upper())).errno
+    assert first.antientropy.step() == second.antientropy.step() == 0
+
+    # 第二个节点错过了提交、删除与一次回滚, 以主副本(第一个节点)的值为准
+    cluster = first.cluster.refresh()
+    mine = [k for k in keys if cluster.owners(k)[0] == first.id]
+    ghost = next(f"ghost{i}" for i in range(100) if cluster.owners(f"ghost{i}")[0] == first.id)
+    second._install(mine[0], first.codec.encode(b"stale"), overwrite=True)
+    second._drop(mine[1])
+    second._install(ghost, first.codec.encode(b"ghost"))
+    second.maPutdata(stpb.StKV(key=mine[2], value="uncommitted", tx="orphan"), None)
+    assert first.antientropy.step() == 4
+    assert second.antientropy.step() == 0
+    assert ghost not in second.KVmap and mine[2] not in second.staged
+    for key in keys:
+        assert second._committed(key) == first._committed(key)
+    assert first.antientropy.step() == 0
+
+def test_hinted_handoff(nodes):
+    manage = nodes.manager()
+    manage.check_all_storage_live = lambda: None  # 模拟短暂的网络中断, 心跳不移除节点
+    stores = [nodes.storage() for _ in range(3)]
+    first, _, down = stores
+    nodes.stop(down)
+
+    # 不可达的节点是部分键的主副本, 由收到写入的节点协调; 管理服务器的批量写入也交给存储节点按主副本导入
+    keys = [f"ho{i}" for i in range(20)]
+    with grpc.insecure_channel(nodes.address(first)) as ch:
+        stub = stpb_grpc.storagementServiceStub(ch)
+        for key in keys:
+            assert stub.putdata(stpb.StKV(cli_id=0, key=key, value=key.upper())).errno
+    batch = mapb.KVBatch(server_id=first.id, kvs=[mapb.KV(key=f"hb{i}", value="b") for i in range(5)])
+    assert manage.PutBatch(batch, None).errno
+    assert sum(s.handoff.pending() for s in stores) == 25
+    assert any(os.path.exists(s.handoff._file(down.id)) for s in stores)
+    assert not down.KVmap
+
+    # 节点恢复后沿用原端口
+    nodes.serve(down)
+    deadline = time.monotonic() + 10
+    while sum(s.handoff.pending() for s in stores) and time.monotonic() < deadline:
+        for s in stores:
+            s.handoff.step()
+        time.sleep(0.2)
+    assert sum(s.handoff.pending() for s in stores) == 0
+    assert not any(os.path.exists(s.handoff._file(down.id)) for s in stores)
+    for key in keys:
+        assert down._committed(key) == first._committed(key)
+    assert all(f"hb{i}" in down.KVmap for i in range(5))
@@ -0,0 +1,71 @@
+﻿import logging
+import socket
+import time
+from concurrent import futures
+
+import grpc
+
+from protos import mapb_pb2 as mapb
+from protos import mapb_pb2_grpc as mapb_grpc
+from common.pool import ChannelPool
+from server.main import ManageService
+from server.raft import LeaderInterceptor
+
+def test_manager_group(tmp_path):
+    ports = []
+    for _ in range(3):
+        with socket.socket() as sock:
+            sock.bind(("localhost", 0))
+            ports.append(sock.getsockname()[1])
+    members = {i: f"localhost:{port}" for i, port in enumerate(ports, 1)}
+    logger = logging.getLogger("manage")
+    services, servers = {}, {}
+
+    def start(mid: int):
+        service = ManageService(logger, interval_seconds=1)
+        service.check_all_storage_live = lambda: None
+        service.join_group(mid, members, str(tmp_path / f"raft_{mid}"))
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=8), interceptors=[LeaderInterceptor(service.raft)])
+        mapb_grpc.add_manageServiceServicer_to_server(service, server)
+        server.add_insecure_port(members[mid])
+        server.start()
+        services[mid], servers[mid] = service, server
+
+    def wait(predicate):
+        deadline = time.monotonic() + 10
+        while not predicate():
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+
+    def leader(mids):
+        wait(lambda: any(services[mid].raft.is_leader() for mid in mids))
+        return next(mid for mid in mids if services[mid].raft.is_leader())
+
+    pool = ChannelPool()
+    for mid in members:
+        start(mid)
+    try:
+        first = leader(list(members))
+        # 从第一个地址开始尝试, 非 leader 成员把请求重定向到 leader
+        stub = mapb_grpc.manageServiceStub(pool.get(",".join(members.values())))
+        sid = stub.online(mapb.SerRequest(ip="localhost", port=":50051")).server_id
+        wait(lambda: all(sid in service.servermap for service in services.values()))
+
+        # leader 停止后剩余成员选出新的 leader, 节点信息仍在
+        servers[first].stop(0).wait()
+        services[first].stop()
+        rest = [mid for mid in members if mid != first]
+        second = leader(rest)
+        assert sid in services[second].servermap
+        topo = stub.topology(mapb.Empty(), timeout=5)
+        assert [n.server_id for n in topo.nodes] == [sid]
+        assert stub.connect(mapb.Empty(), timeout=5).errno
+
+        # 重启的成员从磁盘上的日志恢复, 并追上停止期间的变更
+        start(first)
+        wait(lambda: len(services[first].clientmap) == 1 and sid in services[first].servermap)
+    finally:
+        pool.close()
+        for mid in members:
+            servers[mid].stop(0)
+            services[mid].stop()
@@ -1,6 +1,24 @@
-﻿from protos import stpb_pb2 as stpb
-from storage.main import Cache
-from tests.utils import _start_storage
+﻿import logging
+import os
+import shutil
+import time
+from concurrent import futures
+
+import grpc
+import pytest
+
+from protos import mapb_pb2 as mapb
+from protos import mapb_pb2_grpc as mapb_grpc
+from protos import stpb_pb2 as stpb
+from protos import stpb_pb2_grpc as stpb_grpc
+from client.main import Client
+from server.aio import AsyncManageService
+from server.main import ManageService
+from storage.aio import AsyncStoreService
+from storage.main import BINARY_VALUE, PREPARE_BUSY, UNKNOWN_TX, VERSION_CONFLICT, Cache, StoreService
+from storage.shard import ShardedStoreService, shard_of
+from common.compress import ValueCodec, parse_tiers
+from tests.utils import _AioLoop, _start_aio_server, _start_storage
 
 def test_cache():
     c = Cache(maxnum=3)
@@ -80,4 +98,384 @@ def test_get_predata(manager_server, storage_server):
     resp = new_node.getdata(stpb.StRequest(cli_id=0, key=key), None)
     assert resp.errno
     assert resp.value == "testvalue"
-    
+
+def test_stream_large_value(storage_server, monkeypatch):
+    storage_stub, storage_service, _, _ = storage_server
+    storage_service.codec = ValueCodec(parse_tiers("zlib:1024"))
+    key = "bigkey"
+    # 超过 gRPC 默认 4MB 消息上限
+    value = ("0123456789abcdef" * 1024 * 384).encode()
+
+    def chunks():
+        yield stpb.StChunk(cli_id=0, key=key, size=len(value), data=value[:1000])
+        for i in range(1000, len(value), 1 << 20):
+            yield stpb.StChunk(data=value[i:i + (1 << 20)])
+
+    put_resp = storage_stub.putstream(chunks())
+    assert put_resp.errno
+
+    received = list(storage_stub.getstream(stpb.StRequest(cli_id=0, key=key)))
+    assert len(received) > 1
+    assert all(c.errno for c in received)
+    assert received[0].key == key
+    assert b"".join(c.data for c in received) == value
+
+    resp = list(storage_stub.getstream(stpb.StRequest(cli_id=0, key="nokey")))
+    assert len(resp) == 1 and not resp[0].errno
+
+    # 准备阶段拒绝登记时分块写入同样返回版本冲突, 不写待提交文件
+    monkeypatch.setattr(storage_service, "_stage", lambda *args, **kwargs: VERSION_CONFLICT)
+    resp = storage_service.maPutstream(iter([stpb.StChunk(key="sk", size=1, data=b"x", tx="t1")]), None)
+    assert (resp.errno, resp.errmes) == (False, VERSION_CONFLICT)
+    assert not os.path.exists(storage_service._txdir("t1"))
+
+def test_binary_value_and_remote_stream(manager_server, storage_server):
+    manager_stub, _, manager_api = manager_server
+    storage_stub, _, _, _ = storage_server
+    key = "binkey"
+    # 不是 UTF-8 文本, 且超过 gRPC 默认 4MB 消息上限
+    value = bytes(range(256)) * (5 * 4096)
+
+    def chunks():
+        yield stpb.StChunk(cli_id=0, key=key, size=len(value), data=value[:1 << 20])
+        for i in range(1 << 20, len(value), 1 << 20):
+            yield stpb.StChunk(data=value[i:i + (1 << 20)])
+
+    assert storage_stub.putstream(chunks()).errno
+    resp = storage_stub.getdata(stpb.StRequest(cli_id=0, key=key))
+    assert not resp.errno and resp.errmes == BINARY_VALUE
+    # 本地没有该键的节点从其他副本分块读取, 不在本地缓存或落盘
+    new_node, _ = _start_storage(manager_stub, manager_api)
+    received = list(new_node.getstream(stpb.StRequest(cli_id=0, key=key), None))
+    assert all(c.errno for c in received)
+    assert b"".join(c.data for c in received) == value
+    assert key not in new_node.KVmap
+    resp = list(new_node.getstream(stpb.StRequest(cli_id=0, key="nokey"), None))
+    assert len(resp) == 1 and not resp[0].errno
+
+def test_stream_limit(storage_server):
+    storage_stub, service, _, _ = storage_server
+    service.streams.limit = 1
+    sub = storage_stub.invalidations(stpb.StInvalidateRequest(cli_id=1))
+    assert next(sub).reset
+    # 订阅数达到上限后新的订阅被拒绝, 写入仍有工作线程处理
+    with pytest.raises(grpc.RpcError) as err:
+        next(storage_stub.invalidations(stpb.StInvalidateRequest(cli_id=2)))
+    assert err.value.code() == grpc.StatusCode.RESOURCE_EXHAUSTED
+    assert storage_stub.putdata(stpb.StKV(cli_id=0, key="limited", value="v"), timeout=5).errno
+    # watch 与失效通知共用同一上限, 取消订阅后释放
+    with pytest.raises(grpc.RpcError) as err:
+        next(storage_stub.watch(stpb.StWatchRequest(key="limited")))
+    assert err.value.code() == grpc.StatusCode.RESOURCE_EXHAUSTED
+    sub.cancel()
+    deadline = time.monotonic() + 5
+    while service.streams.active and time.monotonic() < deadline:
+        time.sleep(0.05)
+    watch = storage_stub.watch(stpb.StWatchRequest(key="limited"))
+    assert next(watch).op == "start"
+    watch.cancel()
+
+def test_aio_mode():
+    logger = logging.getLogger("aio")
+    logger.handlers.clear()
+    loop = _AioLoop()
+    manage = ManageService(logger, interval_seconds=1)
+    servers = []
+    try:
+        server, manager_api = loop.run(_start_aio_server(AsyncManageService(manage), mapb_grpc.add_manageServiceServicer_to_server))
+        servers.append(server)
+        apis = []
+        for _ in range(2):
+            # 先注册再启动, 端口在注册时通过 online 传给管理服务器
+            store = StoreService(server_id=0, datapath="tests/aio_storage/", logger=logger, cache_num=5, manager_addr=manager_api)
+            server, api = loop.run(_start_aio_server(AsyncStoreService(store), stpb_grpc.add_storagementServiceServicer_to_server))
+            servers.append(server)
+            store.id = manage.online(mapb.SerRequest(ip="localhost", port=api[len("localhost"):]), None).server_id
+            store.datapath = f"tests/aio_storage/{store.id}/"
+            os.makedirs(store.datapath, exist_ok=True)
+            apis.append(api)
+
+        with grpc.insecure_channel(apis[0]) as ch0, grpc.insecure_channel(apis[1]) as ch1:
+            node0 = stpb_grpc.storagementServiceStub(ch0)
+            node1 = stpb_grpc.storagementServiceStub(ch1)
+            assert node0.putdata(stpb.StKV(cli_id=0, key="k", value="v")).errno
+            resp = node1.getdata(stpb.StRequest(cli_id=0, key="k"))
+            assert resp.errno and resp.value == "v"
+
+            value = b"x" * 200000
+            chunks = [stpb.StChunk(cli_id=0, key="big", size=len(value), data=value[:100000]),
+                      stpb.StChunk(data=value[100000:])]
+            assert node1.putstream(iter(chunks)).errno
+            got = b"".join(c.data for c in node0.getstream(stpb.StRequest(cli_id=0, key="big")))
+            assert got == value
+
+            assert node0.deldata(stpb.StRequest(cli_id=0, key="k")).errno
+            resp = node1.getdata(stpb.StRequest(cli_id=0, key="k"))
+            assert not resp.errno
+
+            # 管理服务器的写入交给键的主副本协调
+            with grpc.insecure_channel(manager_api) as ch:
+                manager_stub = mapb_grpc.manageServiceStub(ch)
+                assert manager_stub.Put(mapb.KV(server_id=store.id, key="mk", value="mv")).errno
+                chunk = mapb.KVChunk(server_id=store.id, key="ms", size=len(value), data=value)
+                assert manager_stub.PutStream(iter([chunk])).errno
+                batch = mapb.KVBatch(server_id=store.id, kvs=[mapb.KV(key="mb", value="b")])
+                assert manager_stub.PutBatch(batch).errno
+                assert manager_stub.Del(mapb.Request(server_id=store.id, key="mk")).errno
+            assert {"ms", "mb"} <= set(store.KVmap) and "mk" not in store.KVmap
+
+            # 批量导入按主副本拆分后并发协调
+            batches = [stpb.StKVBatch(kvs=[stpb.StKV(key=f"ai{b}{i}", value=str(i)) for i in range(10)]) for b in range(2)]
+            result = node0.importdata(iter(batches))
+            assert result.errno and result.imported == 20
+            assert all(node1.getdata(stpb.StRequest(cli_id=0, key=f"ai1{i}")).value == str(i) for i in range(10))
+            conflict = node1.putdata(stpb.StKV(cli_id=0, key="ai00", value="x", absent=True))
+            assert not conflict.errno and conflict.errmes == VERSION_CONFLICT
+
+            # aio 节点推送的失效通知使近端缓存看到另一节点上提交的写入
+            with Client(manager_api, target=apis[0], near_cache=10) as client:
+                client.put("n", "1")
+                deadline = time.monotonic() + 3
+                while not (client.get("n") == "1" and client.cache.active):
+                    assert time.monotonic() < deadline
+                    time.sleep(0.02)
+                assert node1.putdata(stpb.StKV(cli_id=0, key="n", value="2")).errno
+                while client.get("n") != "2":
+                    assert time.monotonic() < deadline
+                    time.sleep(0.02)
+
+            # watch 从 start 返回的 cursor 续传, 收到之后提交的写入
+            call = node0.watch(stpb.StWatchRequest(key="w"))
+            start = next(call)
+            call.cancel()
+            assert start.op == "start" and not start.reset
+            assert node1.putdata(stpb.StKV(cli_id=0, key="w", value="1")).errno
+            call = node0.watch(stpb.StWatchRequest(key="w", cursor=start.cursor))
+            event = next(e for e in call if e.op != "start")
+            call.cancel()
+            assert (event.op, event.key, event.value) == ("put", "w", "1")
+    finally:
+        for server in servers:
+            loop.run(server.stop(None))
+        loop.close()
+        manage.stop()
+        shutil.rmtree("tests/aio_storage/", ignore_errors=True)
+
+def test_sharded_workers(manager_server):
+    manager_stub, _, manager_api = manager_server
+    logger = logging.getLogger("shard")
+    logger.handlers.clear()
+    servers = [grpc.server(futures.ThreadPoolExecutor(max_workers=4)) for _ in range(2)]
+    peers = [f"localhost:{server.add_insecure_port('localhost:0')}" for server in servers]
+    # 只注册 worker0 的地址, 模拟多个 worker 共用一个对外端口
+    sid = manager_stub.online(mapb.SerRequest(ip="localhost", port=peers[0][len("localhost"):])).server_id
+    datapath = "tests/shard_storage/"
+    os.makedirs(datapath, exist_ok=True)
+    workers = []
+    for i, server in enumerate(servers):
+        worker = ShardedStoreService(sid, datapath, logger, 5, manager_api, shard=i, peers=peers)
+        stpb_grpc.add_storagementServiceServicer_to_server(worker, server)
+        server.start()
+        workers.append(worker)
+    try:
+        with grpc.insecure_channel(peers[0]) as ch:
+            stub = stpb_grpc.storagementServiceStub(ch)
+            keys = [f"key{i}" for i in range(20)]
+            for key in keys:
+                assert stub.putdata(stpb.StKV(cli_id=0, key=key, value=key.upper())).errno
+            for key in keys:
+                owner = shard_of(key, 2)
+                assert key in workers[owner].KVmap
+                assert key not in workers[1 - owner].KVmap
+                resp = stub.getdata(stpb.StRequest(cli_id=0, key=key))
+                assert resp.errno and resp.value == key.upper()
+            remote = next(key for key in keys if shard_of(key, 2) == 1)
+            got = b"".join(c.data for c in stub.getstream(stpb.StRequest(cli_id=0, key=remote)))
+            assert got == remote.upper().encode()
+    finally:
+        manager_stub.offline(mapb.SerInfo(server_id=sid))
+        for server in servers:
+            server.stop(None).wait()
+        for worker in workers:
+            worker.close()
+        shutil.rmtree(datapath, ignore_errors=True)
+
+def test_import_coordinated_by_primaries(nodes, monkeypatch):
+    manage = nodes.manager()
+    # 批量导入不再经过管理服务器协调
+    monkeypatch.setattr(manage, "PutBatch", lambda request, context: pytest.fail("PutBatch 不应被调用"))
+    coordinated: dict[int, list[str]] = {}
+    rejected: set[int] = set()
+    putbatch = StoreService.putbatch
+
+    def record(self, request, context):
+        if self.id in rejected:
+            return stpb.StEmpty(errno=False, errmes=VERSION_CONFLICT)
+        coordinated.setdefault(self.id, []).extend(kv.key for kv in request.kvs)
+        return putbatch(self, request, context)
+
+    monkeypatch.setattr(StoreService, "putbatch", record)
+    stores = [nodes.storage() for _ in range(2)]
+    first, second = stores
+    kvs = [stpb.StKV(key=f"pb{i}", value=str(i)) for i in range(40)]
+    with grpc.insecure_channel(nodes.address(first)) as ch:
+        resp = stpb_grpc.storagementServiceStub(ch).importdata(iter([stpb.StKVBatch(kvs=kvs)]))
+    assert resp.errno and resp.imported == 40
+    # 每个节点只协调自己是主副本的键, 两个副本都写入了全部键值
+    cluster = first.cluster.refresh()
+    for store in stores:
+        assert sorted(coordinated[store.id]) == sorted(kv.key for kv in kvs if cluster.owners(kv.key)[0] == store.id)
+    for store in stores:
+        assert all(store._committed(kv.key) == store.codec.encode(kv.value.encode()) for kv in kvs)
+        assert not store.batches and not store.staged
+    # 一个主副本失败时另一个主副本的部分照常提交, 失败的分组逐个返回
+    rejected.add(second.id)
+    kvs = [stpb.StKV(key=f"pb{i}", value="new") for i in range(40)]
+    with grpc.insecure_channel(nodes.address(first)) as ch:
+        resp = stpb_grpc.storagementServiceStub(ch).importdata(iter([stpb.StKVBatch(kvs=kvs)]))
+    mine = sorted(kv.key for kv in kvs if cluster.owners(kv.key)[0] == first.id)
+    assert not resp.errno and resp.imported == len(mine) and resp.failed == 40 - len(mine)
+    [failure] = resp.failures
+    assert failure.primary == second.id and failure.errmes == VERSION_CONFLICT
+    assert sorted(failure.keys) == sorted(set(kv.key for kv in kvs) - set(mine))
+    assert all(first._committed(key) == first.codec.encode(b"new") for key in mine)
+    assert all(first._committed(key) == first.codec.encode(key[2:].encode()) for key in failure.keys)
+
+def test_snapshot_and_batch_abort(storage_server):
+    stub, service, _, _ = storage_server
+    batch = stpb.StKVBatch(kvs=[stpb.StKV(key=f"s{i}", value=f"old{i}") for i in range(5)])
+    resp = stub.importdata(iter([batch]))
+    assert resp.errno and (resp.imported, resp.failed) == (5, 0)
+
+    snap = stub.snapshot(stpb.StSnapshot())
+    assert snap.errno and snap.keys == 5
+    assert stub.putdata(stpb.StKV(key="s0", value="new")).errno
+    assert stub.deldata(stpb.StRequest(key="s1")).errno
+    assert stub.putdata(stpb.StKV(key="s9", value="added")).errno
+    exported = {kv.key: kv.value for b in stub.exportdata(stpb.StExportRequest(snapshot=snap.id)) for kv in b.kvs}
+    assert exported == {f"s{i}": f"old{i}" for i in range(5)}
+    parts = [{kv.key for b in stub.exportdata(stpb.StExportRequest(snapshot=snap.id, part=p, parts=3)) for kv in b.kvs}
+             for p in range(3)]
+    assert set().union(*parts) == set(exported) and sum(map(len, parts)) == 5
+    stub.dropSnapshot(stpb.StSnapshot(id=snap.id))
+    assert not next(stub.exportdata(stpb.StExportRequest(snapshot=snap.id))).errno
+
+    # 准备阶段中的键不进入快照, 回滚后恢复原值、删除新键
+    assert service.maPutbatch(stpb.StBatch(batch="b1", kvs=[stpb.StKV(key="s2", value="x"),
+                                                            stpb.StKV(key="s7", value="y")]), None).errno
+    current = {kv.key: kv.value for b in stub.exportdata(stpb.StExportRequest()) for kv in b.kvs}
+    assert current["s2"] == "old2" and "s7" not in current and current["s0"] == "new"
+    service.abortBatch(stpb.StBatch(batch="b1"), None)
+    assert stub.getdata(stpb.StRequest(key="s2")).value == "old2"
+    assert "s7" not in service.KVmap and not service.staged
+
+def test_versioned_reads(storage_server):
+    stub, service, _, _ = storage_server
+    assert stub.putdata(stpb.StKV(key="mv", value="v1")).errno
+    first = stub.getdata(stpb.StRequest(key="mv"))
+    assert first.value == "v1" and first.version > 0
+
+    # 准备阶段的写入不影响读取: 仍读到已提交的版本, 不再返回锁冲突
+    service.cache.del_key("mv")
+    with open(os.path.join(service.datapath, "mv"), "rb") as old:
+        assert service.maPutdata(stpb.StKV(key="mv", value="v2", version=first.version + 10, tx="t2"), None).errno
+        assert service.maPutbatch(stpb.StBatch(batch="mvb", kvs=[stpb.StKV(key="mvnew", value="x")]), None).errno
+        resp = stub.getdata(stpb.StRequest(key="mv"))
+        assert (resp.errno, resp.value, resp.version) == (True, "v1", first.version)
+        chunks = list(stub.getstream(stpb.StRequest(key="mv")))
+        assert b"".join(c.data for c in chunks) == b"v1" and chunks[0].version == first.version
+        assert "mvnew" not in service.KVmap and service._committed("mv") is not None
+        assert service.commit(stpb.StRequest(key="mv", tx="t2"), None).errno
+        service.abortBatch(stpb.StBatch(batch="mvb"), None)
+        # 提交前打开的读取者仍读到旧版本, 旧文件在关闭后由文件系统回收
+        assert service.codec.decode(old.read()) == b"v1"
+    resp = stub.getdata(stpb.StRequest(key="mv"))
+    assert (resp.value, resp.version) == ("v2", first.version + 10)
+    assert "mvnew" not in service.KVmap and not service.staged
+    assert not os.listdir(service._pending_dir())
+
+    # 协调者分配的版本号不大于已提交的版本时顺延, 同一个键的版本严格递增
+    service.maPutdata(stpb.StKV(key="mv", value="v3", version=1, tx="t3"), None)
+    service.commit(stpb.StRequest(key="mv", tx="t3"), None)
+    assert stub.getdata(stpb.StRequest(key="mv")).version == first.version + 11
+    assert stub.deldata(stpb.StRequest(key="mv")).errno
+    assert "mv" not in service.versions
+
+    # 已回复准备成功的写入在重启后恢复, 还没有准备记录的待提交文件清除
+    service.maPutdata(stpb.StKV(key="left", value="x", version=7, tx="t4"), None)
+    service.maDeldata(stpb.StRequest(key="gone", version=8, tx="t5"), None)
+    service._write("half", b"x", "t6")
+    restarted = StoreService(service.id, service.datapath, service.logger, 5, "localhost:1")
+    assert restarted.staged == {"left": service.staged["left"], "gone": service.staged["gone"]}
+    assert restarted.batches == {"t4": ["left"], "t5": ["gone"]}
+    assert not os.path.exists(restarted._txdir("t6"))
+    assert restarted.commit(stpb.StRequest(key="left", tx="t4"), None).errno
+    assert restarted._committed("left") == restarted.codec.encode(b"x") and restarted.versions["left"] == 7
+    restarted.abort(stpb.StRequest(key="gone", tx="t5"), None)
+    assert not restarted.staged and not os.listdir(restarted._pending_dir())
+    restarted.close()
+    service.staged.clear()
+    service.batches.clear()
+
+def test_prepare_exclusion(storage_server):
+    _, service, _, _ = storage_server
+    # 两个协调者的事务准备同一个键: 后到的被拒绝, 它的回滚不影响先到的准备
+    assert service.maPutdata(stpb.StKV(key="px", value="a", tx="ta"), None).errno
+    resp = service.maPutdata(stpb.StKV(key="px", value="b", tx="tb"), None)
+    assert (resp.errno, resp.errmes) == (False, PREPARE_BUSY)
+    resp = service.maPutbatch(stpb.StBatch(batch="bb", kvs=[stpb.StKV(key="py", value="y"),
+                                                           stpb.StKV(key="px", value="b")]), None)
+    assert (resp.errno, resp.errmes) == (False, PREPARE_BUSY)
+    assert service.abort(stpb.StRequest(key="px", tx="tb"), None).errno
+    service.abortBatch(stpb.StBatch(batch="bb"), None)
+    assert service.staged["px"].tx == "ta" and "py" not in service.staged
+    # 条件写入遇到未完成的准备按版本冲突处理
+    resp = service.maPutdata(stpb.StKV(key="px", value="c", absent=True, tx="tc"), None)
+    assert (resp.errno, resp.errmes) == (False, VERSION_CONFLICT)
+
+    # 没有准备的事务不能提交
+    resp = service.commit(stpb.StRequest(key="px", tx="tb"), None)
+    assert (resp.errno, resp.errmes) == (False, UNKNOWN_TX)
+    assert not service.commitBatch(stpb.StBatch(batch="bb"), None).errno
+    assert service.commit(stpb.StRequest(key="px", tx="ta"), None).errno
+    assert service._committed("px") is not None and not service.staged and not service.batches
+    assert not os.listdir(service._pending_dir())
+
+def test_sharded_batch_import(manager_server):
+    manager_stub, _, manager_api = manager_server
+    logger = logging.getLogger("shard")
+    logger.handlers.clear()
+    servers = [grpc.server(futures.ThreadPoolExecutor(max_workers=4)) for _ in range(2)]
+    peers = [f"localhost:{server.add_insecure_port('localhost:0')}" for server in servers]
+    sid = manager_stub.online(mapb.SerRequest(ip="localhost", port=peers[0][len("localhost"):])).server_id
+    datapath = "tests/shard_batch/"
+    os.makedirs(datapath, exist_ok=True)
+    workers = []
+    for i, server in enumerate(servers):
+        worker = ShardedStoreService(sid, datapath, logger, 5, manager_api, shard=i, peers=peers)
+        stpb_grpc.add_storagementServiceServicer_to_server(worker, server)
+        server.start()
+        workers.append(worker)
+    try:
+        with grpc.insecure_channel(peers[1]) as ch:
+            stub = stpb_grpc.storagementServiceStub(ch)
+            kvs = [stpb.StKV(key=f"key{i}", value=str(i)) for i in range(30)]
+            assert stub.importdata(iter([stpb.StKVBatch(kvs=kvs[:20]), stpb.StKVBatch(kvs=kvs[20:])])).imported == 30
+            for kv in kvs:
+                assert kv.key in workers[shard_of(kv.key, 2)].KVmap
+            snap = stub.snapshot(stpb.StSnapshot())
+            assert snap.keys == 30
+        # 快照目录由各 worker 共用, 从任一 worker 都能导出全部键值
+        with grpc.insecure_channel(peers[0]) as ch:
+            stub = stpb_grpc.storagementServiceStub(ch)
+            exported = {kv.key: kv.value for b in stub.exportdata(stpb.StExportRequest(snapshot=snap.id)) for kv in b.kvs}
+            assert exported == {kv.key: kv.value for kv in kvs}
+            stub.dropSnapshot(stpb.StSnapshot(id=snap.id))
+        assert not any(w.batches or w.staged for w in workers)
+    finally:
+        manager_stub.offline(mapb.SerInfo(server_id=sid))
+        for server in servers:
+            server.stop(None).wait()
+        for worker in workers:
+            worker.close()
+        shutil.rmtree(datapath, ignore_errors=True)
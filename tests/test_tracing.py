@@ -0,0 +1,41 @@
+﻿import json
+
+import grpc
+
+from protos import mapb_pb2 as mapb
+from protos import mapb_pb2_grpc as mapb_grpc
+from protos import stpb_pb2 as stpb
+from protos import stpb_pb2_grpc as stpb_grpc
+from common.interceptors import HookInterceptor
+from common.tracing import TRACER, format_tree, traced_channel, tracing_hook
+
+def test_request_tracing(nodes):
+    nodes.manager(interceptors=[HookInterceptor(tracing_hook("manage"))])
+    stores = [nodes.storage(interceptors=[HookInterceptor(tracing_hook(f"storage{i}"))]) for i in range(2)]
+
+    with traced_channel(nodes.address(stores[0])) as ch:
+        stub = stpb_grpc.storagementServiceStub(ch)
+        # 未追踪的请求不记录 span
+        before = len(TRACER.query())
+        assert stub.live(stpb.StEmpty()).errno
+        assert len(TRACER.query()) == before
+        with TRACER.span("put", service="client") as root:
+            assert stub.putdata(stpb.StKV(cli_id=0, key="tk", value="tv")).errno
+
+    with grpc.insecure_channel(nodes.manager_api) as ch:
+        resp = mapb_grpc.manageServiceStub(ch).spans(mapb.SpanRequest(trace_id=root.trace_id))
+    spans = json.loads(resp.json)
+    assert all(s["trace_id"] == root.trace_id for s in spans)
+    names = [(s["service"], s["name"], s["tags"].get("kind", "")) for s in spans]
+    assert ("storage0", "putdata", "server") in names
+    # 写入由键的主副本直接协调, 不经过管理服务器; 主副本对本地副本直接调用
+    assert ("manage", "Put", "server") not in names
+    coordinator = next(service for service, name, _ in names if name == "prepare")
+    other = "storage1" if coordinator == "storage0" else "storage0"
+    assert (coordinator, "commit", "") in names
+    assert sum(n == (coordinator, "maPutdata", "client") for n in names) == 1
+    assert {(other, "maPutdata", "server"), (other, "commit", "server")} <= set(names)
+    # 每个 span 的父节点都在同一 trace 中
+    ids = {s["span_id"] for s in spans}
+    assert all(s["parent_id"] in ids for s in spans if s["span_id"] != root.span_id)
+    assert format_tree(spans).splitlines()[0].startswith("client put")
@@ -0,0 +1,75 @@
+﻿import os
+
+import pytest
+
+from protos import stpb_pb2 as stpb
+from common.txlog import TxLog
+from storage.main import storage_path
+
+def test_coordinator_log_recovery(nodes, tmp_path):
+    participant = nodes.storage(server_id=1)
+    target = nodes.address(participant)
+    # 参与者已准备好, 协调者在第二阶段前崩溃: tx1 已落盘提交决议, tx2 只有 begin, batch1 已决定回滚
+    for key, tx in (("tx1", "t1"), ("tx2", "t2")):
+        assert participant.maPutdata(stpb.StKV(key=key, value=key.upper(), tx=tx), None).errno
+    assert participant.maPutbatch(stpb.StBatch(batch="batch1", kvs=[stpb.StKV(key="tb", value="b")]), None).errno
+    path = os.path.join(storage_path(str(tmp_path), 2), ".txlog")
+    log = TxLog(path, nodes.logger)
+    log.begin("t1", {1: target}, key="tx1")
+    log.decide("t1", True)
+    log.begin("t2", {1: target}, key="tx2")
+    log.begin("batch1", {1: target}, batch="batch1")
+    log.decide("batch1", False)
+    log.begin("t3", {1: target}, key="done")
+    log.decide("t3", True)
+    log.end("t3")
+    log.close()
+
+    coordinator = nodes.storage(server_id=2)
+    assert sorted(tx["tx"] for tx in coordinator.txlog.pending()) == ["batch1", "t1", "t2"]
+    assert coordinator.txlog.recover(coordinator._fanout) == 3
+    assert not coordinator.txlog.pending()
+    assert participant._committed("tx1") == b"TX1"
+    assert "tx2" not in participant.KVmap and "tb" not in participant.KVmap
+    assert not participant.staged and not participant.batches
+    # 重启后不再重复驱动已完成的事务
+    coordinator.txlog.close()
+    assert not TxLog(path, nodes.logger).pending()
+
+def test_restart_coordinator_and_participant(nodes, monkeypatch):
+    manage = nodes.manager()
+    manage.check_all_storage_live = lambda: None  # 心跳不移除重启中的节点
+    # nodes.storage 与 main() 相同: 注册后由 id 决定数据目录, 以原 id 重启时换了端口也找回同一目录
+    coordinator, participant = nodes.storage(), nodes.storage()
+    cluster = coordinator.cluster.refresh()
+    key = next(f"rs{i}" for i in range(100) if cluster.owners(f"rs{i}")[0] == coordinator.id)
+
+    # 两个副本都已准备并落盘了提交决议, 协调者在发出第二阶段前崩溃
+    class Crash(Exception):
+        pass
+
+    fanout = coordinator._fanout
+
+    def crash_on_commit(targets, method, request, timeout=None):
+        if method == "commit":
+            raise Crash
+        return fanout(targets, method, request, timeout)
+
+    monkeypatch.setattr(coordinator, "_fanout", crash_on_commit)
+    with pytest.raises(Crash):
+        coordinator.putdata(stpb.StKV(key=key, value="after"), None)
+    [tx] = coordinator.txlog.pending()
+    assert tx["commit"] is True and participant.staged[key].tx == tx["tx"]
+    nodes.crash(participant)
+    nodes.crash(coordinator)
+
+    participant = nodes.storage(participant.id)
+    assert participant.staged[key].tx == tx["tx"] and key not in participant.KVmap
+    coordinator = nodes.storage(coordinator.id)
+    assert coordinator.staged[key].tx == tx["tx"]
+    coordinator.start()
+    assert not coordinator.txlog.pending()
+    for store in (coordinator, participant):
+        assert store._committed(key) == store.codec.encode(b"after")
+        assert not store.staged and not store.batches
+        assert not os.listdir(store._pending_dir())
@@ -1,4 +1,7 @@
-﻿import logging
+﻿import asyncio
+import logging
+import os
+import threading
 import grpc
 
 from concurrent import futures
@@ -17,4 +20,46 @@ def _start_storage(manager_stub, manager_api):
     stpb_grpc.add_storagementServiceServicer_to_server(storage_service, server)
     
     server.start()
-    return storage_service, f"localhost{port}"
\ No newline at end of file
+    return storage_service, f"localhost{port}"
+
+
+class _AioLoop:
+    """在后台线程中运行事件循环, 供同步测试启动 grpc.aio 服务"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+async def _start_aio_server(servicer, add_func):
+    server = grpc.aio.server()
+    add_func(servicer, server)
+    port = server.add_insecure_port("localhost:0")
+    await server.start()
+    return server, f"localhost:{port}"
+
+
+def _start_shards(manager_stub, manager_api, workers: int, datapath: str):
+    """启动 workers 个分片 worker, 只向管理服务器注册 worker0 的地址, 返回 (servers, services, peers, sid)"""
+    from storage.shard import ShardedStoreService
+    logger = logging.getLogger("shard")
+    logger.handlers.clear()
+    servers = [grpc.server(futures.ThreadPoolExecutor(max_workers=8)) for _ in range(workers)]
+    peers = [f"localhost:{server.add_insecure_port('localhost:0')}" for server in servers]
+    sid = manager_stub.online(mapb.SerRequest(ip="localhost", port=peers[0][len("localhost"):])).server_id
+    os.makedirs(datapath, exist_ok=True)
+    services = []
+    for i, server in enumerate(servers):
+        service = ShardedStoreService(sid, datapath, logger, 5, manager_api, shard=i, peers=peers)
+        stpb_grpc.add_storagementServiceServicer_to_server(service, server)
+        server.start()
+        services.append(service)
+    return servers, services, peers, sid